@@ -0,0 +1,188 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script converts many chemical mechanism files in FACSIMILE
+# format (.fac) in one go, each into its own model configuration
+# directory, using build/mech_converter.py on a pool of processes. The
+# reference RO2 list is read only once, and shared by all the
+# processes. The output of each conversion is printed once it has
+# finished, followed by a summary of the time taken and of any error
+# for each file.
+#
+# The manifest is a text file with one conversion per line: the path
+# to the .fac file, followed by the path to the model configuration
+# directory, separated by whitespace. Empty lines and lines starting
+# with # are ignored. Each model configuration directory can only be
+# listed once, so that no two processes write the same files.
+#
+# ARGUMENTS:
+# - path to the manifest file
+# - path to the MCM data files directory [default: mcm/]
+#
+# OPTIONS:
+# - --jobs N: number of processes [default: the number of CPUs]
+# - --force: regenerate the mechanism files even if they are up to date
+#   (see build/mech_converter.py)
+# - --no-optimise: do not optimise mechanism.f90 (see build/mech_converter.py)
+# - --renumber-species: number the species in the Reverse Cuthill-McKee
+#   order of the Jacobian matrix (see build/mech_converter.py)
+# ---------------------------------------------- #
+from __future__ import print_function
+import sys
+import os
+import argparse
+import multiprocessing
+from timeit import default_timer as timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+import mech_converter
+
+# The reference RO2 list, set once in each process of the pool by init_worker()
+RO2List_reference = None
+
+
+## ------------------------------------------------------------------ ##
+
+
+def read_manifest(manifest_filename):
+    """
+    This function reads a manifest file, and returns the conversions that it lists.
+
+    :param manifest_filename: string containing a relative or absolute reference to the manifest file.
+    :returns pairs: list of (input_file, mech_dir) pairs.
+    """
+    pairs = []
+    mech_dir_lines = dict()
+    with open(manifest_filename, 'r') as manifest_file:
+        for line_number, line in enumerate(manifest_file, 1):
+            items = line.split()
+            if not items or items[0].startswith('#'):
+                continue
+            assert len(items) == 2, 'Line ' + str(line_number) + ' of ' + manifest_filename + \
+              ' should hold the path to a .fac file and the path to a model configuration directory: ' + line.strip()
+            mech_dir = os.path.realpath(items[1])
+            assert mech_dir not in mech_dir_lines, 'Line ' + str(line_number) + ' of ' + manifest_filename + \
+              ' lists the same model configuration directory as line ' + str(mech_dir_lines.get(mech_dir)) + ': ' + items[1]
+            mech_dir_lines[mech_dir] = line_number
+            pairs.append((items[0], items[1]))
+    return pairs
+
+
+def init_worker(reference):
+    # Store the reference RO2 list in this process, so that it is sent to
+    # each process once, rather than with each conversion.
+    global RO2List_reference
+    RO2List_reference = reference
+
+
+def convert_one(args):
+    # Convert one .fac file with mech_converter.convert, and return
+    # (input_file, mech_dir, status, time taken, printed output, error message).
+    # The output of convert is captured, so that the outputs of the
+    # processes do not get mixed up. Any error is caught and reported
+    # rather than raised.
+    input_file, mech_dir, mcm_dir, force, optimise, renumber = args
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    error = None
+    start = timer()
+    try:
+        if mech_converter.convert(input_file, mech_dir, mcm_dir, force=force, RO2List_reference=RO2List_reference,
+                                  optimise=optimise, renumber=renumber):
+            status = 'converted'
+        else:
+            status = 'up to date'
+    except Exception as e:
+        status = 'FAILED'
+        error = type(e).__name__ + ': ' + str(e)
+    finally:
+        elapsed = timer() - start
+        output = sys.stdout.getvalue()
+        sys.stdout = stdout
+    return input_file, mech_dir, status, elapsed, output, error
+
+
+def convert_batch(pairs, mcm_dir, jobs=None, force=False, optimise=True, renumber=False):
+    """
+    This function converts each of the .fac files of pairs into its model configuration directory, using a pool of
+    processes, and prints the output of each conversion and a summary.
+
+    :param pairs: list of (input_file, mech_dir) pairs, as returned by read_manifest().
+    :param mcm_dir: string containing a relative or absolute reference to the directory housing the reference file peroxy-radicals_v3.3.1.
+    :param jobs: number of processes. If None (default), the number of CPUs is used. If 1, the conversions are done
+      in this process.
+    :param force, optimise, renumber: passed on to mech_converter.convert.
+    :returns: the number of failed conversions.
+    """
+    start = timer()
+    reference = mech_converter.read_ro2_reference(mcm_dir)
+    tasks = [(input_file, mech_dir, mcm_dir, force, optimise, renumber) for input_file, mech_dir in pairs]
+
+    pool = None
+    if jobs == 1:
+        init_worker(reference)
+        results = map(convert_one, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs, init_worker, (reference,))
+        results = pool.imap(convert_one, tasks)
+
+    summary = []
+    try:
+        for input_file, mech_dir, status, elapsed, output, error in results:
+            print('==> ' + input_file + ' -> ' + mech_dir)
+            print(output, end='')
+            if error is not None:
+                print(error)
+            summary.append((input_file, status, elapsed, error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    failures = len([item for item in summary if item[3] is not None])
+    print('')
+    print('Summary:')
+    for input_file, status, elapsed, error in summary:
+        print('%8.3f s  %-10s  ' % (elapsed, status) + input_file + ('' if error is None else '  (' + error + ')'))
+    print(str(len(summary)) + ' files, ' + str(failures) + ' failed, ' + '%.3f' % (timer() - start) + ' s in total')
+    return failures
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert many chemical mechanism files in FACSIMILE format (.fac) into a Fortran-compatible format, in parallel.')
+    parser.add_argument('manifest', help='path to the manifest file, holding one .fac file and model configuration directory per line')
+    parser.add_argument('mcm_dir', nargs='?', default='./mcm/', help='path to the MCM data files directory [default: ./mcm/]')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='number of processes [default: the number of CPUs]')
+    parser.add_argument('--force', action='store_true',
+                        help='regenerate the mechanism files even if the inputs have not changed since the last conversion')
+    parser.add_argument('--no-optimise', dest='optimise', action='store_false',
+                        help='translate each rate expression as it is, without removing repeated expressions and unused rate coefficients')
+    parser.add_argument('--renumber-species', dest='renumber', action='store_true',
+                        help='number the species in the Reverse Cuthill-McKee order of the Jacobian matrix, to reduce its bandwidths')
+    args = parser.parse_args()
+
+    # check the locations supplied exist
+    assert os.path.isfile(args.manifest), 'Failed to find file ' + args.manifest
+    assert os.path.exists(args.mcm_dir), 'Failed to find directory ' + args.mcm_dir
+    assert args.jobs is None or args.jobs > 0, 'The number of jobs must be positive'
+
+    if convert_batch(read_manifest(args.manifest), args.mcm_dir, jobs=args.jobs, force=args.force,
+                     optimise=args.optimise, renumber=args.renumber) > 0:
+        sys.exit(os.EX_DATAERR)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,12 @@
 #    - mechanism.f90
 #    By default, it is ./model/configuration/
 #
+#    The mechanism files and the shared library are regenerated only
+#    if the .fac file, the list of organic peroxy radicals or the
+#    DILUTE setting in environmentVariables.config have changed since
+#    the last build (see mechanism.hash). To force the regeneration,
+#    delete mechanism.hash or run build/mech_converter.py with --force.
+#
 # $3 is the directory of the MCM data files:
 #    - list of organic peroxy radicals (RO2)
 #    - parameters to calculate photolysis rates
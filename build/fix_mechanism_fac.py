@@ -11,109 +11,138 @@
 
 # This script contains functions to fix the contents of a chemical
 # mechanism file in FACSIMILE format (.fac ) by removing the incorrect
-# newline characters.
+# newline characters. The lines are fixed as they are read, so the
+# fixed contents can be used directly without rewriting the file.
 #
-# ARGUMENT:
+# ARGUMENTS:
 # - path to the .fac file
+# - optional path to write the fixed .fac file to (this can be the
+#   same as the first argument) [default: the file is not written]
 # ---------------------------------------------- #
 from __future__ import print_function
-from functools import reduce
 import sys
 import re
 
+# Each statement of a line, ending with a semicolon, followed by any remainder of the line after the last semicolon
+semicolon_regex = re.compile(r'[^;]*;|[^;]+')
+
 
 ## ------------------------------------------------------------------ ##
 
 
-def fix_fac_full_contents(filename):
-    # Given a filename, return the contents of the file, but with
-    # incorrect newline characters removed, and the affected lines
-    # concatenated correctly. This will probably fail if a line is
-    # REALLY long, stretching over two full lines, but should probably
-    # then give an error as output.
+def join_broken_lines(lines):
+    # Given an iterable of lines (without newline characters), yield
+    # the same lines, but with the lines of the 'Reaction definitions'
+    # section that have been broken by incorrect newline characters
+    # joined back together.
     #
-    # Using splitlines rather than readlines(), we take out the errant
-    # carriage returns, and for any line with such on it, we return to
-    # members of the list.
-    with open(filename, 'r') as file_open:
-        contents = file_open.read().splitlines()
-
-    # print contents
-    orig_contents_len = len(contents)
-    print(str(filename) + ': file read in ' + str(orig_contents_len) + ' items')
-    contents_count = 0
-
-    # This variable will hold the indices to be deleted once their contents have been concatenated onto the
-    # previous element.
-    to_delete = []
-
     # Firstly wait until we reach a line containing 'Reaction definitions'.
     # Then ignore comment lines. Then correct the lines which don't start with a % - they should be concatenated
-    # onto the previous entry
+    # onto the previous line. A line is only yielded once the next line has been read, so that we know that
+    # nothing else needs to be concatenated onto it.
+    #
+    # A line which follows a line that has itself been concatenated onto the previous one is dropped: this will
+    # probably happen if a line is REALLY long, stretching over two full lines, and the resulting reaction should
+    # then give an error further on.
     in_reaction_definition_section = False
-    for i in range(len(contents)):
-        if not in_reaction_definition_section:
-            # Check to see whether we are entering the 'Reaction definitions' section
-            if 'Reaction definitions.' in contents[i]:
-                in_reaction_definition_section = True
-        # Only do other checks if we've reached 'Reaction definitions' sections
+    previous_line = None
+    previous_line_was_corrected = False
+    for line in lines:
+        if in_reaction_definition_section and not re.match(r'\*', line) and not re.match(r'%', line):
+            if not previous_line_was_corrected:
+                previous_line += ' ' + line
+            previous_line_was_corrected = True
+            continue
+        # Check to see whether we are entering the 'Reaction definitions' section
+        if not in_reaction_definition_section and 'Reaction definitions.' in line:
+            in_reaction_definition_section = True
+        if previous_line is not None:
+            yield previous_line
+        previous_line = line
+        previous_line_was_corrected = False
+    if previous_line is not None:
+        yield previous_line
+
+
+def split_stacked_lines(lines):
+    # Given an iterable of lines (without newline characters), yield
+    # the same lines, but with any line after the header that holds
+    # two statements (i.e. that has been double-stacked) broken into
+    # two lines at the semicolon.
+    #
+    # The header section is everything up to the line containing
+    # 'Generic Rate Coefficients'. We don't want to parse that section - it often contains semicolons within the
+    # lines as well as at the end, which breaks all our logic.
+    #
+    # Any line containing more than 2 statements has more than one line broken running together. At this point,
+    # the file is too broken to easily fix manually - the user is asked to fix it and run again. This is only
+    # checked once all the lines have been read, and a RuntimeError reporting the line with the most statements
+    # is raised.
+    in_header = True
+    line_number = 0
+    error_line = None
+    error_line_length = 2
+    for line in lines:
+        line_number += 1
+        if in_header:
+            if re.search(r'Generic Rate Coefficients', line) is None:
+                yield line
+                continue
+            in_header = False
         else:
-            if re.match(r'\*', contents[i]):
-                pass
-            else:
-                if not re.match(r'%', contents[i]):
-                    # print 'fail'
-                    # print contents[i - 1], 'XX', contents[i], 'XX', contents[i + 1]
-                    contents[i - 1] += ' ' + contents[i]
-                    # print contents[i - 1]
-                    contents_count += 1
-                    to_delete.append(i)
-    print(str(contents_count) + ' corrections made - now removing old')
-
-    # Remove old elements which have now been concatenated onto previous
-    for i in reversed(to_delete):
-        del contents[i]
-    assert orig_contents_len == contents_count + len(contents), \
-        str(filename) + ': file is probably too messed up with carriage returns for this simple script to fix.'
-
-    # If there are any lines that have now been doubled-stacked, then break them into pieces.
-    # Find the end of the header section, because we don't want to parse that section anymore - it
-    # often contains semicolons within the lines as well as at the end, which breaks all our logic
-    end_of_header_index = [i for i, item in enumerate(contents) if re.search(r'Generic Rate Coefficients', item)]
-    assert len(end_of_header_index) == 1
-    end_of_header_index = end_of_header_index[0]
-
-    # Split non-header lines by semicolons, but we keep the semicolons this way.
-    interim_contents = [reduce(lambda acc, elem: acc[:-1] + [acc[-1] + elem] if elem == ";" else acc + [elem], re.split("(;)", element), []) for element in contents[end_of_header_index:]]
-
-    # Remove empty sub-strings
-    interim_contents = [[item for item in sublist if item] for sublist in interim_contents]
-
-    # Look for any lines containing more than 2 elements. These are lines where more than
-    # one line is broken running together. At this point, the file is too broken to
-    # easily fix manually - get the user to fix it and run again.
-    if max([len(line) for line in interim_contents]) > 2:
-        # Get index of line with error
-        error_line = ([len(line) for line in interim_contents]).index(max([len(line) for line in interim_contents])) + end_of_header_index + 1
-        exit('The inputted file is broken near to line ' + str(error_line) + ' in a way that this script cannot handle.' +
-             ' Please manually fix this error and re-run this script.')
-
-    # Reattach the header lines, and unwrap the list of lists in interim_contents
-    final_list = contents[:end_of_header_index] + [item for sublist in interim_contents for item in sublist]
-    return final_list
-
-
-def fix_fac_full_file(filename):
-    # Given a filename, overwrite the contents of the file with the same contents,
+            assert re.search(r'Generic Rate Coefficients', line) is None, \
+                "There is more than one line containing 'Generic Rate Coefficients'."
+
+        # Split the line by semicolons, but we keep the semicolons with the statement they end. Remove empty
+        # sub-strings.
+        statements = [item for item in semicolon_regex.findall(line) if item]
+        if len(statements) > error_line_length:
+            error_line = line_number
+            error_line_length = len(statements)
+        for statement in statements:
+            yield statement
+
+    assert not in_header, "There is no line containing 'Generic Rate Coefficients'."
+    if error_line is not None:
+        raise RuntimeError('The inputted file is broken near to line ' + str(error_line) +
+                           ' in a way that this script cannot handle. Please manually fix this error and re-run this script.')
+
+
+def fix_fac_lines(input_lines):
+    # Given an iterable of lines from a .fac file (e.g. an open file),
+    # yield the lines of the file, without newline characters, but with
+    # incorrect newline characters removed, and the affected lines
+    # concatenated correctly.
+    #
+    # Using splitlines rather than just stripping the newline, we take out the errant carriage returns, and for any
+    # line with such on it, we yield its separate parts.
+    lines = (item for line in input_lines for item in (line.splitlines() or ['']))
+    return split_stacked_lines(join_broken_lines(lines))
+
+
+def fix_fac_full_contents(filename):
+    # Given a filename, return the contents of the file as a list of
+    # lines, but with incorrect newline characters removed, and the
+    # affected lines concatenated correctly.
+    with open(filename, 'r') as file_open:
+        contents = list(fix_fac_lines(file_open))
+    print(str(filename) + ': file fixed into ' + str(len(contents)) + ' items')
+    return contents
+
+
+def fix_fac_full_file(filename, output_filename=None):
+    # Given a filename, write the contents of the file to output_filename,
     # but with incorrect newline characters removed, and the affected lines
-    # concatenated correctly. This will probably fail if a line is REALLY long,
-    # stretching over two full lines, but should probably then give an error as output.
-    # All the heavy lifting is done by fix_fac_contents - here we just provide a
-    # simple wrapper to write back to the same file.
+    # concatenated correctly. If output_filename is not given, the contents
+    # of filename are overwritten.
+    # All the heavy lifting is done by fix_fac_lines - here we just provide a
+    # simple wrapper to write back to a file.
+    if output_filename is None:
+        output_filename = filename
     print('Running fix_fac_file on ' + str(filename))
     contents = fix_fac_full_contents(filename)
     contents = [item + '\n' for item in contents]
-    with open(filename, 'w') as file_open:
+    with open(output_filename, 'w') as file_open:
         file_open.writelines(contents)
     return
 
@@ -122,14 +151,21 @@ def fix_fac_full_file(filename):
 
 
 def main():
-    # Pass argument from command line as path to file.
-    if len(sys.argv) > 1:
+    # Pass argument from command line as path to file. If a second
+    # argument is given, the fixed contents are written to it.
+    if len(sys.argv) > 2:
+        fix_fac_full_file(sys.argv[1], sys.argv[2])
+    elif len(sys.argv) > 1:
         fix_fac_full_contents(sys.argv[1])
     else:
         print('******************************')
-        print("Please pass a filename as argument. This script will then fix this file to remove incorrect newlines.")
+        print("Please pass a filename as argument. This script will then check this file for incorrect newlines.")
+        print("Pass a second filename as argument to write the fixed contents to it (this can be the same as the first).")
         print('******************************')
     return
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    except RuntimeError as e:
+        sys.exit(str(e))
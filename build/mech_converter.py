@@ -13,13 +13,22 @@
 # -----------------------------------------------------------------------------
 
 # This script converts a chemical mechanism file in FACSIMILE format
-# (.fac) into a Fortran-compatible format. The script generates five files in
+# (.fac) into a Fortran-compatible format. The script generates eight files in
 # the model configuration directory:
 # - mechanism.species
 # - mechanism.reac
 # - mechanism.prod
+# - mechanism.network (binary version of the three files above, see mech_network.py)
+# - mechanism.sparsity (sparsity pattern of the Jacobian matrix, see mech_jacobian.py)
 # - mechanism.ro2
 # - mechanism.f90
+# - mechanism.py (evaluation of the mechanism with numpy for a batch of
+#   conditions, see mech_numpy.py)
+#
+# The conversion can also be done from Python, without going through
+# any file: parse_fac() returns the parsed mechanism as a Mechanism
+# object, and the emit_* functions return the contents of each of the
+# files above.
 #
 # Acknowledgements: B. Nelson, M. Newland
 #
@@ -27,15 +36,55 @@
 # - path to the .fac file
 # - path to the model configuration directory [default: model/configuration/]
 # - path to the MCM data files directory [default: mcm/]
+#
+# OPTIONS:
+# - --force: regenerate the mechanism files even if the .fac file, the
+#   reference RO2 list and the DILUTE setting have not changed since the
+#   last conversion (recorded in mechanism.hash)
+# - --fix-input: overwrite the .fac file with its contents fixed of any
+#   errant newlines [default: the .fac file is fixed in memory only]
+# - --no-optimise: write each rate expression to mechanism.f90 as it is,
+#   instead of evaluating repeated expressions only once and removing
+#   the unused rate coefficients
+# - --renumber-species: number the species in the Reverse Cuthill-McKee
+#   order of the Jacobian matrix, which reduces its bandwidths (see
+#   mech_jacobian.py) [default: in the order of first appearance]
+# - --profile: print the wall time and the peak memory of each stage of
+#   the conversion, and the size of the mechanism and of the generated
+#   files (see mech_profile.py)
+# - --stats-json FILE: write the same information to the JSON file FILE
+# - --trace-memory: with --profile or --stats-json, also trace the peak
+#   memory allocated by each stage (much slower, see mech_profile.py)
 # ---------------------------------------------- #
 from __future__ import print_function
 import sys
 import re
 import os
+import argparse
+import hashlib
+from collections import namedtuple
 import fix_mechanism_fac
+import mech_network
+import mech_jacobian
+import mech_numpy
+import mech_profile
 
 reservedSpeciesList = ['N2', 'O2', 'M', 'RH', 'H2O', 'BLHEIGHT', 'DEC', 'JFAC', 'DILUTE', 'ROOF', 'ASA', 'RO2']
 reservedOtherList = ['EXP', 'TEMP', 'PRESS', 'LOG10', 'T', 'J']
+reservedWords = frozenset(reservedSpeciesList + reservedOtherList)
+
+# Sections of symbols and non-symbols in a rate expression, as used by tokenise_and_process
+nonsymbol_regex = re.compile(r'[^()\-+*@/ ]+')
+digits = frozenset('0123456789')
+
+# A reference to an element of the vector q in a rate expression processed by tokenise_and_process
+q_reference_regex = re.compile(r'\bq\(([0-9]+)\)')
+p_reference_regex = re.compile(r'\bp\(([0-9]+)\)')
+
+# The classes of rate expressions used by classify_rates, and the symbols that they depend on
+constant_rate, environment_rate, fast_rate = 0, 1, 2
+environment_symbols = frozenset(['TEMP', 'N2', 'O2', 'M', 'RH', 'H2O', 'BLHEIGHT', 'DEC', 'JFAC', 'DILUTE', 'ROOFOPEN', 'ASA'])
+function_symbols = frozenset(['EXP', 'LOG10'])
 
 
 ## ------------------------------------------------------------------ ##
@@ -57,92 +106,213 @@ def tokenise_and_process(input_string, variablesDict):
     assert isinstance(input_string, str), 'tokenise_and_process: input_string is not of type str: ' + str(input_string)
     assert isinstance(variablesDict, dict), 'tokenise_and_process: variablesDict is not of type dict: ' + str(variablesDict)
 
-    # Generate start and end points of sections of symbols and nonsymbols
-    symbol_regex = '[()\-+*@/ ]+'
-    nonsymbol_regex = '[^()\-+*@/ ]+'
-    list_of_symbol_starts = [m.start(0) for m in re.finditer(symbol_regex, input_string)]
-    list_of_symbol_ends = [m.end(0) for m in re.finditer(symbol_regex, input_string)]
-    list_of_nonsymbol_starts = [m.start(0) for m in re.finditer(nonsymbol_regex, input_string)]
-    list_of_nonsymbol_ends = [m.end(0) for m in re.finditer(nonsymbol_regex, input_string)]
-    new_rhs = ''
-
-    # Now that the symbol/non-symbol sections are identified, we need to create the new string by recombining otherwise
-    # sections in the right order, with some replaced by q(i) syntax.
-    #
-    # Recombine the lists in the right order, but replace the nonsymbols that aren't numbers, reserved words or reserved species
-    # (and thus must be new species/intermediate values) with q(i) notation.
-    #
-    # Loop while there are any substrings left
-    while list_of_symbol_starts != [] or list_of_nonsymbol_starts != []:
-        # We should use the next symbol if either
-        #    1) both lists are non-empty and the symbols list has a lower first element, or
-        #    2) only the symbols list has anything left in it
-        if ((list_of_symbol_starts != [] and list_of_nonsymbol_starts != []) and list_of_symbol_starts[0] < list_of_nonsymbol_starts[0]) \
-          or (list_of_symbol_starts != [] and list_of_nonsymbol_starts == []):
-            # add next symbol
-            # Print the substring as-is
-            new_rhs += input_string[list_of_symbol_starts[0]:list_of_symbol_ends[0]]
-            # Remove the indices of this substring from the lists
-            del list_of_symbol_starts[0]
-            del list_of_symbol_ends[0]
-        else: # This will execute if there are only non-symbols left, or if the non-symbols list has a lower first element.
-            # add next nonsymbol
-            # Get the substring of interest
-            varname = input_string[list_of_nonsymbol_starts[0]:list_of_nonsymbol_ends[0]]
-            # If it's not a number or a reserved word, it must be a variable, so substitute with the relevant element from q.
-            if not re.match('^[0-9]', varname) and varname not in reservedSpeciesList and varname not in reservedOtherList:
-                new_rhs += 'q(' + str(variablesDict[varname]) + ')'
-            # Otherwise, just print the substring as-is
-            else:
-                new_rhs += input_string[list_of_nonsymbol_starts[0]:list_of_nonsymbol_ends[0]]
-            # Remove the indices of this substring from the lists
-            del list_of_nonsymbol_starts[0]
-            del list_of_nonsymbol_ends[0]
+    # Find each section of non-symbols in a single pass, and replace those that aren't numbers, reserved words
+    # or reserved species (and thus must be new species/intermediate values) with q(i) notation. The sections of
+    # symbols in between are left as they are.
+    def replace_variable(match):
+        varname = match.group(0)
+        # If it's not a number or a reserved word, it must be a variable, so substitute with the relevant element from q.
+        if varname[0] not in digits and varname not in reservedWords:
+            return 'q(' + str(variablesDict[varname]) + ')'
+        # Otherwise, return the substring as-is
+        return varname
 
     # Return the reconstructed string
-    return new_rhs
+    return nonsymbol_regex.sub(replace_variable, input_string)
 
 
-def convert(input_file, mech_dir, mcm_dir):
+def read_dilute(mech_dir):
     """
-    This is the main function of this file. It takes as input a chemical mechanism file (.fac), and from it generates
-    5 files for use by AtChem2's Fortran code:
+    This function reads environmentVariables.config in mech_dir, and returns the value of DILUTE if it is in use,
+    or False if DILUTE is NOTUSED.
 
-    - 'Generic Rate Coefficients' and 'Complex reactions' go to mech_dir/mechanism.f90 with little more than formatting
-      changes - each line is replicated in full but with each named rate converted to an element in the vector q.
-    - The rates defined in 'Reaction definitions' also go to mech_dir/mechanism.f90 as elements of the vector p.
-    - The species involved as reactants (respectively products) in reactions in 'Reaction definitions' are split up into individual
-      species, and their species and reactions numbers go to mechanism.reac (respectively mechanism.prod). Combining
-      mechanism.reac, mechanism.prod and the last section of mech_dir/mechanism.f90 gives the original information
-      contained in 'Reaction definitions' but in the format that AtChem2 can parse.
-    - The numbers and names of all species encountered go to mechanism.species.
-    - The numbers and names of all RO2 species in 'Peroxy radicals' end up in mechanism.ro2.
+    :param mech_dir: string containing a relative or absolute reference to the directory holding environmentVariables.config.
+    :returns dilute: the string value of DILUTE, or False.
+    """
+    dilute = False
+    with open(mech_dir + '/environmentVariables.config') as env_var_file:
+        environmentVariables = env_var_file.readlines()
+        for x in environmentVariables:
+            x = x.split()
 
-    :param input_file: string containing a relative or absolute reference to the .fac file to be processed.
-    :param mech_dir: string containing a relative or absolute reference to the directory in which the function should
-      place mechanism.f90, and where the environmentVariables.config file should be read from.
-      This is normally model/configuration.
-    :param mech_dir: string containing a relative or absolute reference to the directory in which the function should
-      place mechanism.{prod,reac,ro2,species}. This is normally model/configuration/ for the given model.
+            try:
+                if x[1] == "DILUTE" and x[2] != "NOTUSED":
+                    dilute = x[2]
+
+            except IndexError:
+                continue
+    return dilute
+
+
+def mechanism_hash(input_file, mech_dir, mcm_dir, optimise=True, renumber=False, RO2List_reference=None):
+    """
+    This function returns a hash of everything that the output of convert() depends on: the contents of the .fac file,
+    the reference RO2 species, the DILUTE setting in environmentVariables.config, the optimise and renumber settings,
+    and the source of this script, of fix_mechanism_fac.py, of mech_network.py, of mech_jacobian.py and of
+    mech_numpy.py.
+
+    :param input_file: string containing a relative or absolute reference to the .fac file.
+    :param mech_dir: string containing a relative or absolute reference to the directory holding environmentVariables.config.
     :param mcm_dir: string containing a relative or absolute reference to the directory housing the reference file peroxy-radicals_v3.3.1.
-      This is normally mcm/
+    :param RO2List_reference: optional set of reference RO2 species, as returned by read_ro2_reference(mcm_dir). If None
+      (default), it is read from mcm_dir. The set is hashed rather than the file, so that the file does not need to be
+      read again when the set is shared by many conversions.
+    :returns: the hash as a string of hexadecimal digits.
+    """
+    if RO2List_reference is None:
+        RO2List_reference = read_ro2_reference(mcm_dir)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sha = hashlib.sha256()
+    sha.update(hashlib.sha256('\n'.join(sorted(RO2List_reference)).encode('utf-8')).digest())
+    for filename in [input_file,
+                     os.path.join(script_dir, 'mech_converter.py'),
+                     os.path.join(script_dir, 'fix_mechanism_fac.py'),
+                     os.path.join(script_dir, 'mech_network.py'),
+                     os.path.join(script_dir, 'mech_jacobian.py'),
+                     os.path.join(script_dir, 'mech_numpy.py')]:
+        with open(filename, 'rb') as hashed_file:
+            sha.update(hashlib.sha256(hashed_file.read()).digest())
+    sha.update(('DILUTE ' + str(read_dilute(mech_dir))).encode('utf-8'))
+    sha.update(('OPTIMISE ' + str(bool(optimise))).encode('utf-8'))
+    sha.update(('RENUMBER ' + str(bool(renumber))).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def is_up_to_date(input_file, mech_dir, mcm_dir, optimise=True, renumber=False, RO2List_reference=None):
     """
+    This function returns True if all of the files generated by convert() exist in mech_dir, and the hash recorded in
+    mech_dir/mechanism.hash matches the current inputs, i.e. if convert() would not change anything (see
+    mechanism_hash()).
+    """
+    for extension in ['species', 'reac', 'prod', 'network', 'sparsity', 'ro2', 'f90', 'py', 'hash']:
+        if not os.path.isfile(os.path.join(mech_dir, 'mechanism.' + extension)):
+            return False
+    with open(os.path.join(mech_dir, 'mechanism.hash'), 'r') as hash_file:
+        recorded_hash = hash_file.read().strip()
+    return recorded_hash == mechanism_hash(input_file, mech_dir, mcm_dir, optimise, renumber, RO2List_reference)
 
-    # Work out the values of directory and filename of input_file, and check their existence.
-    input_directory = os.path.dirname(os.path.abspath(input_file))
-    input_filename = os.path.basename(input_file)
-    assert os.path.isfile(os.path.join(input_directory, input_filename)), 'The input file ' + str(
-        os.path.join(input_directory, input_filename)) + ' does not exist.'
-    print(input_directory)
 
-    # Fix the input contents of any errant newlines
-    fix_mechanism_fac.fix_fac_full_file(os.path.join(input_directory, input_filename))
+def write_if_changed(filename, contents):
+    """
+    This function writes contents to filename, unless filename already holds exactly those contents. In that case
+    the file is left untouched, so that its modification time is unchanged and make does not rebuild anything that
+    depends on it.
 
-    # Read in the input file
-    print('Reading input file')
-    with open(os.path.join(input_directory, input_filename), 'r') as input_file:
-        s = input_file.readlines()
+    :param filename: string containing a relative or absolute reference to the file to write.
+    :param contents: string (or bytes, for a binary file) to write to the file.
+    :returns: True if the file was written, False otherwise.
+    """
+    mode = 'b' if isinstance(contents, bytes) else ''
+    if os.path.isfile(filename):
+        with open(filename, 'r' + mode) as existing_file:
+            if existing_file.read() == contents:
+                return False
+    with open(filename, 'w' + mode) as output_file:
+        output_file.write(contents)
+    return True
+
+
+# A named rate coefficient from the 'Generic Rate Coefficients' or 'Complex reactions' sections of a .fac file:
+# - name: the name of the coefficient
+# - expression: its value, converted to Fortran syntax
+# - line: the whole (cleaned) line, which is copied into a comment in mechanism.f90
+Coefficient = namedtuple('Coefficient', ['name', 'expression', 'line'])
+
+# A reaction from the 'Reaction definitions' section of a .fac file:
+# - rate: the rate of the reaction, converted to Fortran syntax
+# - reactants, products: lists of species names
+# - line: the original line, which is copied into a comment in mechanism.f90
+Reaction = namedtuple('Reaction', ['rate', 'reactants', 'products', 'line'])
+
+
+class Mechanism(object):
+    """
+    This class holds a chemical mechanism as returned by parse_fac(). The sections of the .fac file are kept as lists,
+    in the order of the file, so that the emit_* functions reproduce mechanism.f90 with its comments:
+
+    - coefficient_lines: 'Generic Rate Coefficients' and 'Complex reactions', as Coefficient tuples and comment strings.
+    - reaction_lines: 'Reaction definitions', as Reaction tuples and comment strings.
+    - ro2: list of the names of the RO2 species in 'Peroxy radicals'.
+
+    The comment strings are already in Fortran format, without newline characters. The rate expressions in
+    Coefficient.expression and Reaction.rate still refer to the coefficients by name: the names are replaced by
+    elements of the vector q by emit_f90().
+
+    - species_order: optional list of all the species names, in the order in which they are numbered (see
+      renumber_species()). If None (default), the species are numbered in the order that they are first encountered
+      in the reactions.
+
+    To prune or perturb a mechanism, edit these lists (e.g. using Reaction._replace()): the coefficients, reactions
+    and species properties below, and the numbering of the species, are always worked out from the current lists.
+    """
+
+    def __init__(self, coefficient_lines=None, reaction_lines=None, ro2=None, species_order=None):
+        self.coefficient_lines = coefficient_lines if coefficient_lines is not None else []
+        self.reaction_lines = reaction_lines if reaction_lines is not None else []
+        self.ro2 = ro2 if ro2 is not None else []
+        self.species_order = species_order
+
+    @property
+    def coefficients(self):
+        """The list of Coefficient tuples, in order, without the comments."""
+        return [x for x in self.coefficient_lines if isinstance(x, Coefficient)]
+
+    @property
+    def reactions(self):
+        """The list of Reaction tuples, in order, without the comments."""
+        return [x for x in self.reaction_lines if isinstance(x, Reaction)]
+
+    @property
+    def species(self):
+        """The list of species names, numbered (from 1) in the order of species_order if it is set, or otherwise in the
+        order that they are first encountered in the reactions."""
+        if self.species_order is not None:
+            return list(self.species_order)
+        return species_numbering(self.reactions)[0]
+
+    def __repr__(self):
+        return '<Mechanism: ' + str(len(self.coefficients)) + ' coefficients, ' + str(len(self.reactions)) + \
+          ' reactions, ' + str(len(self.ro2)) + ' RO2>'
+
+
+def species_numbering(reactions):
+    """
+    This function numbers the species of a list of reactions, in the order that they are first encountered.
+
+    :param reactions: list of Reaction tuples.
+    :returns (speciesList, speciesNumbers): speciesList holds the species names in order, while speciesNumbers maps each
+      species name to its (1-based) position in speciesList, so that looking up a known species does not require a
+      linear scan of speciesList.
+    """
+    speciesList = []
+    speciesNumbers = dict()
+    for reaction in reactions:
+        for x in reaction.reactants + reaction.products:
+            if x not in speciesNumbers:
+                speciesList.append(x)
+                speciesNumbers[x] = len(speciesList)
+    return speciesList, speciesNumbers
 
+
+def split_fac_sections(text):
+    """
+    This function splits the contents of a .fac file into its sections, after fixing any errant newlines (see
+    fix_mechanism_fac.py). Each line of a section keeps its newline character, and the header of each section is the
+    first line of the section.
+
+    :param text: the contents of the .fac file, either as a string, or as an iterable of lines (e.g. an open file).
+    :returns sections: list of five lists of lines: everything up to 'Generic Rate Coefficients' (ignored by
+      parse_fac()), 'Generic Rate Coefficients', 'Complex reactions', 'Peroxy radicals' and 'Reaction definitions'.
+    """
+    if hasattr(text, 'splitlines'):
+        text = text.splitlines(True)
+    return _split_fixed_lines(fix_mechanism_fac.fix_fac_lines(text))
+
+
+def _split_fixed_lines(lines):
+    # Split the lines of a .fac file, already fixed of any errant newlines and without newline characters, into the
+    # sections of split_fac_sections().
+    #
     # split the lines into the following sections:
     # - Ignore everything up to Generic Rate Coefficients
     # - Generic Rate Coefficients
@@ -151,92 +321,79 @@ def convert(input_file, mech_dir, mcm_dir):
     # - Reaction definitions
     section_headers_indices = [0, 1, 2, 3]
     section_headers = ['Generic Rate Coefficients', 'Complex reactions', 'Peroxy radicals', 'Reaction definitions']
-    generic_rate_coefficients = []
-    complex_reactions = []
-    peroxy_radicals = []
-    reaction_definitions = []
+    sections = [[], [], [], [], []]
 
     section = 0
-    for line in s:
+    for line in lines:
+        line += '\n'
         for header_index in section_headers_indices:
             if section_headers[header_index] in line:
                 section += 1
-        if section == 1:
-            generic_rate_coefficients.append(line)
-        elif section == 2:
-            complex_reactions.append(line)
-        elif section == 3:
-            peroxy_radicals.append(line)
-        elif section == 4:
-            reaction_definitions.append(line)
-        else:
-            assert section == 0, "Error, section is not in [0,4]"
+        assert section in [0, 1, 2, 3, 4], "Error, section is not in [0,4]"
+        sections[section].append(line)
+    return sections
 
 
+def parse_fac(text, profiler=None):
+    """
+    This function parses the contents of a chemical mechanism file in FACSIMILE format (.fac). It does not read or
+    write any other file, nor print anything, so it can be called many times from the same process. Any errant
+    newlines in the contents are fixed first (see fix_mechanism_fac.py): a RuntimeError is raised if the contents are
+    too broken to be fixed.
+
+    :param text: the contents of the .fac file, either as a string, or as an iterable of lines (e.g. an open file).
+    :param profiler: optional mech_profile.StageProfiler, which records each stage of the parsing.
+    :returns mechanism: a Mechanism holding the rate coefficients, the reactions and the RO2 species.
+    """
+    if profiler is None:
+        profiler = mech_profile.NullProfiler()
+    if hasattr(text, 'splitlines'):
+        text = text.splitlines(True)
+    with profiler.stage('fix-up'):
+        lines = list(fix_mechanism_fac.fix_fac_lines(text))
+    with profiler.stage('section split'):
+        generic_rate_coefficients, complex_reactions, peroxy_radicals, reaction_definitions = \
+          _split_fixed_lines(lines)[1:]
+        del lines
+    with profiler.stage('coefficient processing'):
+        mechanism = Mechanism()
+        _parse_ro2(peroxy_radicals, mechanism)
+        _parse_coefficients(generic_rate_coefficients + complex_reactions, mechanism)
+    with profiler.stage('reaction processing'):
+        _parse_reactions(reaction_definitions, mechanism)
+    return mechanism
+
+
+def _parse_ro2(peroxy_radicals, mechanism):
+    # Add the RO2 species of the lines of the 'Peroxy radicals' section to mechanism.ro2.
+    #
     # Convert peroxy_radicals to a list of strings, each of the RO2 species from 'Peroxy radicals'
-    ro2List = []
     for item in peroxy_radicals:
         if not re.match('\*', item):
             # We have an equals sign on the first line. Handle this by splitting against =, then taking the last element of the
             # resulting list, which will either be the right-hand side of the first line, or the whole of any other line.
             # Similarly, the final line will end with a colon. Handle in a similar way.
             # Then split by +. Append each item to ro2_input: multiple appends use 'extend'
-            ro2List.extend([elem.strip() for elem in item.split('=')[-1].split(';')[0].strip().split('+')])
+            mechanism.ro2.extend([elem.strip() for elem in item.split('=')[-1].split(';')[0].strip().split('+')])
     # Remove empty strings
-    ro2List = list(filter(None, ro2List))
-
-
-    # Read in the reference RO2 species from the peroxy-radicals_v3.3.1 file
-    with open(os.path.join(mcm_dir, 'peroxy-radicals_v3.3.1'), 'r') as RO2List_file:
-        RO2List_reference = [r.rstrip() for r in RO2List_file.readlines()]
-
-    # Check each of the RO2s from 'Peroxy radicals' are in the reference RO2 list. If not print a warning at the top of
-    # mechanism.f90 for each errant species.
-    # TODO: This will break the exected format when mechanism.f90 is replaced by a parsable format.
-    print('looping over inputted RO2s')
-
-    with open(os.path.join(mech_dir, 'mechanism.f90'), 'w') as mech_rates_file:
-        mech_rates_file.write("""! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py
-""")
-        for ro2_species in [element for  element in ro2List if element not in RO2List_reference]:
-            print(' ****** Warning: ' + ro2_species + ' NOT found in the reference RO2 list ****** ')
-            mech_rates_file.write('! ' + ro2_species +
-                                  ' is not in the MCM list of RO2 species. Should it be in the RO2 sum?\n')
+    mechanism.ro2 = list(filter(None, mechanism.ro2))
 
-    # Identify whether dilution is in use
-    dilute = False
-    with open(mech_dir + '/environmentVariables.config') as env_var_file:
-        environmentVariables = env_var_file.readlines()
-        for x in environmentVariables:
-            x = x.split()
 
-            try:
-                if x[1] == "DILUTE" and x[2] != "NOTUSED":
-                    dilute = x[2]
-
-            except IndexError:
-                continue
-
-    # Initialise list, dictionary and a counter.
-    mechanism_rates_coeff_list = []
-    variablesDict = dict()
-    reactionNumber = 0
+def _parse_coefficients(lines, mechanism):
+    # Add the lines of the 'Generic Rate Coefficients' and 'Complex reactions' sections to mechanism.coefficient_lines.
+    #
     # Process sections 1 and 2
     # - copy comment lines across
-    # - other lines are reformatted to be Fortran syntax, then its contents edited to convert individual
-    #   rate names to elements in a vector q.
-    for line in generic_rate_coefficients + complex_reactions:
+    # - other lines are reformatted to be Fortran syntax, and split into the name and the value of the coefficient.
+    for line in lines:
         # Check for comments (beginning with a !), or blank lines
         if (re.match('!', line) is not None) or (line.isspace()):
-            mechanism_rates_coeff_list.append(line)
+            mechanism.coefficient_lines.append(line[:-1])
         # Check for lines starting with either ; or *, and write these as comments
         elif (re.match(';', line) is not None) or (re.match('[*]', line) is not None):
-            mechanism_rates_coeff_list.append('!' + line)
+            mechanism.coefficient_lines.append('!' + line[:-1])
         # Otherwise assume all remaining lines are in the correct format, and so process them
         else:
-            # reactionNumber keeps track of the line we are processing
-            reactionNumber += 1
-
             # This matches anything like @-dd.d and replaces with **(-dd.d). This uses (?<=@) as a lookbehind assertion,
             # then matches - and any combination of digits and decimal points. This replaces the negative number by its
             # bracketed version.
@@ -270,159 +427,381 @@ def convert(input_file, mech_dir, mcm_dir):
             [lhs, rhs] = re.split('=', cleaned_line)
 
             # Strip each.
-            variable_name = lhs.strip()
-            value = rhs.strip()
-
-            # TODO: check for duplicates
-            variablesDict[variable_name] = reactionNumber
-
-            # Replace any variables declared here with references to q, with each new variable assigned
-            # to a new element of q.
-            new_rhs = tokenise_and_process(value, variablesDict)
-
-            # Save the resulting string to mechanism_rates_coeff_list
-            mechanism_rates_coeff_list.append('q('+str(variablesDict[variable_name]) + ') = ' + new_rhs + '  !' + cleaned_line + '\n')
+            mechanism.coefficient_lines.append(Coefficient(lhs.strip(), rhs.strip(), cleaned_line))
 
-    # Save the number of such equations to be output to mechanism.{prod,reac}
-    numberOfGenericComplex = reactionNumber
 
-
-    # Initialise a few variables
-    speciesList = []
-    rateConstants = []
-    reactionNumber = 0
-    # Process 'Reaction definitions'. We process this before 'Peroxy radicals' because that relies on our
-    # SpeciesList generated here.
+def _parse_reactions(lines, mechanism):
+    # Add the lines of the 'Reaction definitions' section to mechanism.reaction_lines.
+    #
+    # Process 'Reaction definitions'.
     # - copy comment lines across
     # - other lines are split into their consituent parts:
-    #   - rateConstants are the reaction rates; these are processed via reformatting and tokenisation to use the vector q where needed.
-    #   - the reactants and products of each species are collected up, numbered as necessary, and their placements output to mechanism.{prod,reac,species}
-    mech_reac_list = []
-    mech_prod_list = []
-    # Loop over all lines in the reaction_definitions section of the input file
-    for line in reaction_definitions:
+    #   - the reaction rates are reformatted to be Fortran syntax.
+    #   - the reactants and products of each reaction are split up into individual species.
+    for line in lines:
 
         # Check for comments (beginning with a !), or blank lines
         if (re.match('!', line) is not None) or (line.isspace()):
-            rateConstants.append(line)
+            mechanism.reaction_lines.append(line[:-1])
         # Check for lines starting with either ; or *, and write these as comments
         elif (re.match(';', line) is not None) or (re.match('[*]', line) is not None):
-            rateConstants.append('!' + line)
+            mechanism.reaction_lines.append('!' + line[:-1])
         # Otherwise assume all remaining lines are in the correct format, and so process them
         else:
-            # reactionNumber keeps track of the line we are processing
-            reactionNumber += 1
-
             # strip whitespace, ; and %
-            line = line.strip().strip('%;').strip()
+            cleaned_line = line.strip().strip('%;').strip()
 
             # split by the semi-colon : lhs is reaction rate, rhs is reaction equation
-            [lhs, rhs] = re.split(':', line)
+            [lhs, rhs] = re.split(':', cleaned_line)
 
-            # Add reaction rate to rateConstants
-            rateConstants.append(lhs)
+            # This matches anything like @-dd.d and replaces with **(-dd.d). This uses (?<=@) as a lookbehind assertion,
+            # then matches - and any combination of digits and decimal points. This replaces the negative number by its
+            # bracketed version.
+            rate = re.sub('(?<=@)-[0-9.]*', '(\g<0>)', lhs)
+            # Now convert all @ to ** etc.
+            rate = rate.replace('@', '**')
+            rate = rate.replace('<', '(')
+            rate = rate.replace('>', ')')
+            # Replace any float-type numbers (xxx.xxxE+xx) with double-type - (xxx.xxxD+xx)
+            rate = re.sub(r'(?P<single>[0-9]+\.[0-9]+)[eE]',
+                          '\g<single>D',
+                          rate)
 
             # Process the reaction: split by = into reactants and products
             [reactantsList, productsList] = re.split('=', rhs)
 
             # Process each of reactants and products by splitting by +. Strip each at this stage.
-            reactants = [item.strip() for item in re.split('[+]', reactantsList)]
-            products = [item.strip() for item in re.split('[+]', productsList)]
-
-            # Ignore empty reactantsList
-            if not reactantsList.strip() == '':
-                # Compare each reactant against known species.
-                reactantNums = []
-                for x in reactants:
-                    # If the reactant is a known species then add its number to reactantNums
-                    if x in speciesList:
-                        reactantNums.append(speciesList.index(x)+1)
-                    else:
-                        # Reactant x is not a known species.
-                        # Add reactant to speciesList, and add this number to
-                        # reactantNums to record this reaction.
-                        speciesList.append(x)
-                        reactantNums.append(len(speciesList))
-
-                # Write the reactants to mech_reac_list
-                mech_reac_list.extend([str(reactionNumber) + ' ' + str(z) + '\n' for z in reactantNums])
-
-            # Ignore empty productsList
-            if not productsList.strip() == '':
-                # Compare each product against known species.
-                productNums = []
-                for x in products:
-                    # If the reactant is a known species then add its number to reactantNums
-                    if x in speciesList:
-                        productNums.append(speciesList.index(x)+1)
-                    else:
-                        # Product x is not a known species.
-                        # Add product to speciesList, add this number to
-                        # productNums to record this reaction.
-                        speciesList.append(x)
-                        productNums.append(len(speciesList))
-
-                # Write the products to mechanism.prod
-                mech_prod_list.extend([str(reactionNumber) + ' ' + str(z) + '\n' for z in productNums])
-
-    # Write out species for reactions to implement DILUTE factor if it's not NOTUSED.
+            # Ignore empty reactantsList and productsList
+            reactants = [item.strip() for item in re.split('[+]', reactantsList)] if reactantsList.strip() else []
+            products = [item.strip() for item in re.split('[+]', productsList)] if productsList.strip() else []
+
+            mechanism.reaction_lines.append(Reaction(rate, reactants, products, line[:-1]))
+
+
+def read_ro2_reference(mcm_dir):
+    """
+    This function reads the reference RO2 species from the peroxy-radicals_v3.3.1 file in mcm_dir.
+
+    :param mcm_dir: string containing a relative or absolute reference to the directory housing the reference file peroxy-radicals_v3.3.1.
+    :returns: set of the names of the reference RO2 species.
+    """
+    with open(os.path.join(mcm_dir, 'peroxy-radicals_v3.3.1'), 'r') as RO2List_file:
+        return set(r.rstrip() for r in RO2List_file.readlines())
+
+
+def unknown_ro2(mechanism, RO2List_reference):
+    """
+    This function returns the list of RO2 species from 'Peroxy radicals' that are not in the reference RO2 list.
+    """
+    return [element for element in mechanism.ro2 if element not in RO2List_reference]
+
+
+# The reaction network of a mechanism, as written to mechanism.species, mechanism.reac and mechanism.prod:
+# - species: list of the species names, numbered (from 1) in this order (see Mechanism.species)
+# - numberOfReactions: the number of reactions, including the extra reactions of the DILUTE factor
+# - reactantPairs, productPairs: the reactants and products of each reaction, as lists of (reactionNumber,
+#   speciesNumber) pairs
+Network = namedtuple('Network', ['species', 'numberOfReactions', 'reactantPairs', 'productPairs'])
+
+
+def reaction_network(mechanism, dilute=False):
+    """
+    This function works out the reaction network of a mechanism: the numbering of its species, and the reactants and
+    products of each reaction. The emit_* functions work it out themselves unless it is given to them, so that
+    convert() only works it out once.
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :returns network: a Network tuple.
+    """
+    speciesList = mechanism.species
+    speciesNumbers = dict(zip(speciesList, range(1, len(speciesList) + 1)))
+    reactantPairs = []
+    productPairs = []
+    reactionNumber = 0
+    for reaction in mechanism.reactions:
+        reactionNumber += 1
+        reactantPairs.extend([(reactionNumber, speciesNumbers[x]) for x in reaction.reactants])
+        productPairs.extend([(reactionNumber, speciesNumbers[x]) for x in reaction.products])
     if dilute:
         for spec in speciesList:
             reactionNumber += 1
-            mech_reac_list.append(str(reactionNumber) + ' ' + str(speciesList.index(spec) + 1) + '\n')
+            reactantPairs.append((reactionNumber, speciesNumbers[spec]))
+    return Network(speciesList, reactionNumber, reactantPairs, productPairs)
+
+
+def _reac_prod_contents(mechanism, dilute, reactants, network):
+    # Return the contents of mechanism.reac (if reactants) or mechanism.prod (otherwise)
+    if network is None:
+        network = reaction_network(mechanism, dilute)
+    # Output number of species and number of reactions, followed by all other lines
+    header = str(len(network.species)) + ' ' + str(network.numberOfReactions) + ' ' + \
+      str(len(mechanism.coefficients)) + ' numberOfSpecies numberOfReactions numberOfGenericComplex\n'
+    pairs = network.reactantPairs if reactants else network.productPairs
+    return header + ''.join([str(r) + ' ' + str(z) + '\n' for r, z in pairs])
+
+
+def emit_reac(mechanism, dilute=False, network=None):
+    """
+    This function returns the contents of mechanism.reac: the species and reaction numbers of the reactants of each reaction.
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :param network: optional reaction network of mechanism with dilute, as returned by reaction_network().
+    """
+    return _reac_prod_contents(mechanism, dilute, True, network)
+
+
+def emit_prod(mechanism, dilute=False, network=None):
+    """
+    This function returns the contents of mechanism.prod: the species and reaction numbers of the products of each reaction.
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :param network: optional reaction network of mechanism with dilute, as returned by reaction_network().
+    """
+    return _reac_prod_contents(mechanism, dilute, False, network)
+
+
+def emit_species(mechanism, network=None):
+    """
+    This function returns the contents of mechanism.species: the numbers and names of all species.
+    """
+    speciesList = network.species if network is not None else mechanism.species
+    return ''.join([str(i) + ' ' + str(x) + '\n' for i, x in zip(range(1, len(speciesList) + 1), speciesList)])
+
+
+def emit_network(mechanism, dilute, reac_contents, prod_contents, network=None):
+    """
+    This function returns the contents of mechanism.network as bytes: the contents of mechanism.reac, mechanism.prod and
+    mechanism.species in binary form (see mech_network.py).
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :param reac_contents: the contents of mechanism.reac, as returned by emit_reac(), whose size is recorded in
+      mechanism.network.
+    :param prod_contents: the contents of mechanism.prod, as returned by emit_prod().
+    :param network: optional reaction network of mechanism with dilute, as returned by reaction_network().
+    """
+    if network is None:
+        network = reaction_network(mechanism, dilute)
+    return mech_network.network_contents(len(mechanism.coefficients), network.numberOfReactions, network.reactantPairs,
+                                         network.productPairs, network.species, len(reac_contents), len(prod_contents))
+
+
+def _jacobian_pattern(mechanism, dilute, network=None):
+    # Return the sparsity pattern of the Jacobian matrix (see mech_jacobian.jacobian_pattern())
+    if network is None:
+        network = reaction_network(mechanism, dilute)
+    return mech_jacobian.jacobian_pattern(len(network.species), network.reactantPairs, network.productPairs)
+
+
+def _jacobian_subroutine(mechanism, dilute, network=None):
+    # Return the Fortran subroutine jacobian, which calculates the nonzero elements of the Jacobian matrix in the order
+    # of mechanism.sparsity (see mech_jacobian.jacobian_subroutine()). The reaction rates p are taken as constants, so
+    # the derivatives of the rates which depend on RO2 with respect to the concentrations of the RO2 species are left
+    # out.
+    if network is None:
+        network = reaction_network(mechanism, dilute)
+    columns = mech_jacobian.jacobian_pattern(len(network.species), network.reactantPairs, network.productPairs)
+    return mech_jacobian.jacobian_subroutine(columns, network.numberOfReactions, network.reactantPairs,
+                                             network.productPairs)
+
+
+def emit_sparsity(mechanism, dilute=False, network=None):
+    """
+    This function returns the contents of mechanism.sparsity: the sparsity pattern of the Jacobian matrix, and its
+    statistics (see mech_jacobian.py).
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :param network: optional reaction network of mechanism with dilute, as returned by reaction_network().
+    """
+    columns = _jacobian_pattern(mechanism, dilute, network)
+    return mech_jacobian.sparsity_contents(columns, mech_jacobian.reverse_cuthill_mckee(columns))
+
 
-    with open(os.path.join(mech_dir, 'mechanism.prod'), 'w') as prod_file:
-        # Output number of species and number of reactions
-        prod_file.write(str(len(speciesList)) + ' ' + str(reactionNumber) + ' ' + str(numberOfGenericComplex) + ' numberOfSpecies numberOfReactions numberOfGenericComplex\n')
-        # Write all other lines
-        for line in mech_prod_list:
-            prod_file.write(line)
+def renumber_species(mechanism, dilute=False):
+    """
+    This function sets the species_order of mechanism to the Reverse Cuthill-McKee ordering of the sparsity pattern of
+    its Jacobian matrix, which reduces the bandwidths of the matrix (see mech_jacobian.py).
+
+    :param mechanism: a Mechanism, as returned by parse_fac(). It is modified in place.
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :returns mechanism: the same Mechanism.
+    """
+    speciesList = mechanism.species
+    columns = _jacobian_pattern(mechanism, dilute)
+    mechanism.species_order = [speciesList[i] for i in mech_jacobian.reverse_cuthill_mckee(columns)]
+    return mechanism
 
-    with open(os.path.join(mech_dir, 'mechanism.reac'), 'w') as reac_file:
-        # Output number of species and number of reactions
-        reac_file.write(str(len(speciesList)) + ' ' + str(reactionNumber) + ' ' + str(numberOfGenericComplex) + ' numberOfSpecies numberOfReactions numberOfGenericComplex\n')
-        # Write all other lines
-        for line in mech_reac_list:
-            reac_file.write(line)
 
-    # Write speciesList to mechanism.species, indexed by (1 to len(speciesList))
-    with open(os.path.join(mech_dir, 'mechanism.species'), 'w') as species_file:
-        for i, x in zip(range(1, len(speciesList) + 1), speciesList):
-            species_file.write(str(i) + ' ' + str(x) + '\n')
+def optimise_rates(coefficientLines, rateLines):
+    """
+    This function optimises the assignments of update_p() in mechanism.f90, without changing the values that it computes:
+
+    - each reaction rate expression which has already been used by a previous reaction is not evaluated again: the
+      value of the previous reaction is copied instead, i.e. p(k) = p(i).
+    - the rate coefficients (elements of q) which are not used, directly or through other rate coefficients, by any
+      reaction rate are removed.
+
+    :param coefficientLines: list of the lines of the Generic Rate Coefficients and Complex reactions, each either a
+      comment string or a (number, rhs, comment) tuple for the assignment q(number) = rhs.
+    :param rateLines: list of the lines of the Reaction definitions, each either a comment string or a (number, rhs,
+      comment) tuple for the assignment p(number) = rhs.
+    :returns (coefficientLines, rateLines): the optimised lists, in the same format.
+    """
+    # Replace each repeated rate expression by a copy of the first reaction that uses it. Whitespace is ignored
+    # when comparing the expressions.
+    firstRateNumbers = dict()
+    optimisedRateLines = []
+    for x in rateLines:
+        if isinstance(x, tuple):
+            number, rhs, comment = x
+            key = ''.join(rhs.split())
+            if key in firstRateNumbers:
+                x = (number, 'p(' + str(firstRateNumbers[key]) + ')', comment)
+            else:
+                firstRateNumbers[key] = number
+        optimisedRateLines.append(x)
+
+    # Follow the references to q from the reaction rates, and from the rate coefficients that these use, to find
+    # all the rate coefficients that are needed.
+    coefficientDefinitions = dict((x[0], x[1]) for x in coefficientLines if isinstance(x, tuple))
+    usedCoefficients = set()
+    toVisit = [int(n) for x in optimisedRateLines if isinstance(x, tuple) for n in q_reference_regex.findall(x[1])]
+    while toVisit:
+        n = toVisit.pop()
+        if n not in usedCoefficients:
+            usedCoefficients.add(n)
+            toVisit.extend([int(m) for m in q_reference_regex.findall(coefficientDefinitions.get(n, ''))])
+    optimisedCoefficientLines = [x for x in coefficientLines if not isinstance(x, tuple) or x[0] in usedCoefficients]
+
+    return optimisedCoefficientLines, optimisedRateLines
+
+
+def classify_rates(coefficientLines, rateLines):
+    """
+    This function sorts the assignments of q and p in the format of optimise_rates() by what they depend on:
+
+    - constant_rate: numbers only, and other constant rate coefficients or reaction rates.
+    - environment_rate: the environment variables (environment_symbols), and other rate coefficients or reaction rates
+      which are constant or depend only on the environment variables.
+    - fast_rate: the photolysis rates J, RO2, or anything else.
+
+    :returns (coefficientClasses, rateClasses): dictionaries mapping the number of each element of q (respectively p)
+      to its class.
+    """
+    def classify(rhs):
+        rateClass = constant_rate
+        for symbol in nonsymbol_regex.findall(rhs):
+            symbol = symbol.upper()
+            if symbol[0] in digits or symbol in ['Q', 'P'] or symbol in function_symbols:
+                continue
+            elif symbol in environment_symbols:
+                rateClass = max(rateClass, environment_rate)
+            else:
+                rateClass = fast_rate
+        for n in q_reference_regex.findall(rhs):
+            rateClass = max(rateClass, coefficientClasses.get(int(n), fast_rate))
+        for n in p_reference_regex.findall(rhs):
+            rateClass = max(rateClass, rateClasses.get(int(n), fast_rate))
+        return rateClass
+
+    coefficientClasses = dict()
+    for x in coefficientLines:
+        if isinstance(x, tuple):
+            coefficientClasses[x[0]] = classify(x[1])
+    rateClasses = dict()
+    for x in rateLines:
+        if isinstance(x, tuple):
+            rateClasses[x[0]] = classify(x[1])
+    return coefficientClasses, rateClasses
+
+
+def _rate_lines(mechanism):
+    # Return the lines of the Generic Rate Coefficients and Complex reactions, and of the Reaction definitions, in the
+    # format of optimise_rates(), with each named rate coefficient converted to an element in the vector q.
+    # This tokenises every rate expression, so convert() only calls it once, for both emit_f90() and emit_numpy().
+    #
+    # Initialise list, dictionary and a counter.
+    # Each element of coefficientLines (and rateLines below) is either a comment line, or a (number, rhs, comment)
+    # tuple holding an assignment to q (respectively p).
+    coefficientLines = []
+    variablesDict = dict()
+    coefficientNumber = 0
+    for x in mechanism.coefficient_lines:
+        if not isinstance(x, Coefficient):
+            coefficientLines.append(x)
+        else:
+            # coefficientNumber keeps track of the line we are processing
+            coefficientNumber += 1
+
+            # TODO: check for duplicates
+            variablesDict[x.name] = coefficientNumber
 
+            # Replace any variables declared here with references to q, with each new variable assigned
+            # to a new element of q.
+            coefficientLines.append((variablesDict[x.name], tokenise_and_process(x.expression, variablesDict), x.line))
 
-    # Write out rate coefficients
     i = 0
-    mech_rates_list = []
-    for rate_counter, x in zip(range(len(s)), rateConstants):
-        if (re.match('!', x) is not None) | (x.isspace()):
-            mech_rates_list.append(str(x))
+    rateLines = []
+    for x in mechanism.reaction_lines:
+        if not isinstance(x, Reaction):
+            rateLines.append(x)
         else:
-            # This matches anything like @-dd.d and replaces with **(-dd.d). This uses (?<=@) as a lookbehind assertion,
-            # then matches - and any combination of digits and decimal points. This replaces the negative number by its
-            # bracketed version.
             i += 1
-            string = re.sub('(?<=@)-[0-9.]*', '(\g<0>)', x)
-            # Now convert all @ to ** etc.
-            string = string.replace('@', '**')
-            string = string.replace('<', '(')
-            string = string.replace('>', ')')
-            # Replace any float-type numbers (xxx.xxxE+xx) with double-type - (xxx.xxxD+xx)
-            string = re.sub(r'(?P<single>[0-9]+\.[0-9]+)[eE]',
-                           '\g<single>D',
-                           string)
-            mech_rates_list.append('p(' + str(i) + ') = ' + \
-              tokenise_and_process(string, variablesDict) + '  !' + reaction_definitions[rate_counter])
+            rateLines.append((i, tokenise_and_process(x.rate, variablesDict), x.line))
 
-    # Write out further reactions to implement DILUTE factor if it's not NOTUSED.
-    if dilute:
-        for _ in speciesList:
-            i += 1
+    return coefficientLines, rateLines
+
+
+def emit_f90(mechanism, dilute=False, RO2List_reference=None, optimise=True, network=None, rate_lines=None):
+    """
+    This function returns the contents of mechanism.f90: the rate coefficients (the vector q) and the reaction rates (the
+    vector p), with each named rate coefficient converted to an element in the vector q.
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :param RO2List_reference: optional set of reference RO2 species (see read_ro2_reference()). Each RO2 from 'Peroxy
+      radicals' which is not in this set is flagged with a comment at the top of the file.
+    :param optimise: if True (default), repeated rate expressions are evaluated only once and unused rate coefficients
+      are removed (see optimise_rates()). The assignments are then split between the subroutines init_p, update_env_p
+      and update_fast_p according to what they depend on (see classify_rates()), so that the Fortran code only needs to
+      calculate again the rates whose inputs have changed; update_p calls all three. If False, each line of the .fac
+      file is translated as it is, into update_p only.
+    :param network: optional reaction network of mechanism with dilute, as returned by reaction_network().
+    :param rate_lines: optional (coefficientLines, rateLines) of mechanism, before optimisation, in the format of
+      optimise_rates(). If None (default), they are worked out from mechanism.
+
+    In either case, the subroutine jacobian calculates the analytic Jacobian matrix (see _jacobian_subroutine()).
+    """
+    mech_f90_contents = ["""! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py
+"""]
+    if RO2List_reference is not None:
+        for ro2_species in unknown_ro2(mechanism, RO2List_reference):
+            mech_f90_contents.append('! ' + ro2_species +
+                                     ' is not in the MCM list of RO2 species. Should it be in the RO2 sum?\n')
+
+    if network is None:
+        network = reaction_network(mechanism, dilute)
+    coefficientLines, rateLines = rate_lines if rate_lines is not None else _rate_lines(mechanism)
+    # The numbers of the further reactions which implement the DILUTE factor, if it's not NOTUSED
+    diluteNumbers = range(len(mechanism.reactions) + 1, network.numberOfReactions + 1)
+
+    if not optimise:
+        # Write out rate coefficients
+        mechanism_rates_coeff_list = [x + '\n' if not isinstance(x, tuple) else
+                                      'q(' + str(x[0]) + ') = ' + x[1] + '  !' + x[2] + '\n' for x in coefficientLines]
+        mech_rates_list = [x + '\n' if not isinstance(x, tuple) else
+                           'p(' + str(x[0]) + ') = ' + x[1] + '  !' + x[2] + '\n' for x in rateLines]
+
+        # Write out further reactions to implement DILUTE factor if it's not NOTUSED.
+        for i in diluteNumbers:
             mech_rates_list.append('p(' + str(i) + ') = DILUTE ! DILUTE\n')
 
-    # Combine mechanism rates and RO2 sum files
-    with open(os.path.join(mech_dir, 'mechanism.f90'), 'a') as mech_rates_coeff_file:
-        mech_rates_coeff_file.write("""
+        # Combine mechanism rates and RO2 sum files
+        mech_f90_contents.append("""
 module mechanism_mod
     use, intrinsic :: iso_c_binding
     implicit none
@@ -436,58 +815,335 @@ contains
         real(c_double), intent(in) :: TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J(*), RO2
         """)
         # Write out Generic Rate Coefficients and Complex reactions
-        for item in mechanism_rates_coeff_list:
-            mech_rates_coeff_file.write(item)
+        mech_f90_contents.extend(mechanism_rates_coeff_list)
         # Write out Reaction definitions
-        for r in mech_rates_list:
-            mech_rates_coeff_file.write(r)
-        mech_rates_coeff_file.write("""
+        mech_f90_contents.extend(mech_rates_list)
+        mech_f90_contents.append("""
     end subroutine update_p
-end module mechanism_mod
 """)
+        mech_f90_contents.append(_jacobian_subroutine(mechanism, dilute, network))
+        mech_f90_contents.append("""end module mechanism_mod
+""")
+        return ''.join(mech_f90_contents)
+
+    # Optimise, and sort the assignments into the subroutines init_p, update_env_p and update_fast_p, according to
+    # what they depend on (see classify_rates()). The order of the assignments is kept within each subroutine.
+    # update_p calls the three subroutines in turn.
+    coefficientLines, rateLines = optimise_rates(coefficientLines, rateLines)
+    coefficientClasses, rateClasses = classify_rates(coefficientLines, rateLines)
+    statements = [[], [], []]
+    for x in coefficientLines:
+        if isinstance(x, tuple):
+            statements[coefficientClasses[x[0]]].append('q(' + str(x[0]) + ') = ' + x[1] + '  !' + x[2] + '\n')
+    for x in rateLines:
+        if isinstance(x, tuple):
+            statements[rateClasses[x[0]]].append('p(' + str(x[0]) + ') = ' + x[1] + '  !' + x[2] + '\n')
 
+    # Write out further reactions to implement DILUTE factor if it's not NOTUSED.
+    for i in diluteNumbers:
+        statements[environment_rate].append('p(' + str(i) + ') = DILUTE ! DILUTE\n')
 
-    # Finally, now that we have the full species list, we can output the RO2s to mechanism.ro2
-    # loop over RO2 and write the necessary line to mechanism.ro2, using the species number of the RO2
-    print('adding RO2 to ' + mech_dir + '/mechanism.ro2')
-    with open(os.path.join(mech_dir, 'mechanism.ro2'), 'w') as ro2_file:
-        ro2_file.write("""! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py
+    arguments = 'p, q, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J, RO2'
+    declarations = """        real(c_double), intent(inout) :: p(*), q(*)
+        real(c_double), intent(in) :: TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J(*), RO2
+"""
+    mech_f90_contents.append("""
+module mechanism_mod
+    use, intrinsic :: iso_c_binding
+    implicit none
+
+    integer, parameter :: DP = selected_real_kind( p = 15, r = 307 )
+
+contains
+
+    ! Calculate all the rate coefficients q and the reaction rates p.
+    subroutine update_p(""" + arguments + """) bind(c,name='update_p')
+""" + declarations + """
+        call init_p(""" + arguments + """)
+        call update_env_p(""" + arguments + """)
+        call update_fast_p(""" + arguments + """)
+    end subroutine update_p
+""")
+    for subroutine_name, description, subroutine_statements in zip(
+            ['init_p', 'update_env_p', 'update_fast_p'],
+            ['which are constant. They only need to be calculated once.',
+             'which depend only on the environment variables. They only need to be\n    ! calculated again when the environment variables change.',
+             'which depend on the photolysis rates J or on RO2. They need to be\n    ! calculated at each call.'],
+            statements):
+        mech_f90_contents.append("""
+    ! Calculate the rate coefficients q and the reaction rates p """ + description + """
+    subroutine """ + subroutine_name + "(" + arguments + ") bind(c,name='" + subroutine_name + """')
+""" + declarations + """
 """)
+        mech_f90_contents.extend(subroutine_statements)
+        mech_f90_contents.append("""
+    end subroutine """ + subroutine_name + """
+""")
+    mech_f90_contents.append(_jacobian_subroutine(mechanism, dilute, network))
+    mech_f90_contents.append("""end module mechanism_mod
+""")
+    return ''.join(mech_f90_contents)
 
-        for ro2List_i in ro2List:
-            for speciesNumber, y in zip(range(1, len(speciesList) + 1), speciesList):
-                if ro2List_i.strip() == y.strip():
-                    ro2_file.write(str(speciesNumber) + ' !' + ro2List_i.strip() + '\n')
-                    # Exit loop early if species found
-                    break
-            # This code only executes if the break is NOT called, i.e. if the loop runs to completion without the RO2 being
-            # found in the species list
-            else:
-                error_message = ''.join([
-                  ' ****** ',
-                  'Error: RO2 species "',
-                  str(ro2List_i.strip()),
-                  '" NOT found in the mechanism. Please check the RO2 section',
-                  ' of your mechanism file for incorrect species names!',
-                  ' ******'])
-                raise RuntimeError(error_message)
+
+def _ro2_numbers(mechanism, network):
+    # Return the species number of each RO2 from 'Peroxy radicals', with its (stripped) name, as a list of
+    # (speciesNumber, name) tuples. A RuntimeError is raised if an RO2 is not found in the species of the mechanism.
+    #
+    # Map each (stripped) species name to its species number, keeping the first occurrence of each name.
+    speciesList = network.species if network is not None else mechanism.species
+    ro2SpeciesNumbers = dict()
+    for speciesNumber, y in zip(range(1, len(speciesList) + 1), speciesList):
+        ro2SpeciesNumbers.setdefault(y.strip(), speciesNumber)
+
+    # loop over RO2 and find the species number of each RO2
+    ro2Numbers = []
+    for ro2List_i in mechanism.ro2:
+        if ro2List_i.strip() in ro2SpeciesNumbers:
+            ro2Numbers.append((ro2SpeciesNumbers[ro2List_i.strip()], ro2List_i.strip()))
+        # This code only executes if the RO2 is not found in the species list
+        else:
+            error_message = ''.join([
+              ' ****** ',
+              'Error: RO2 species "',
+              str(ro2List_i.strip()),
+              '" NOT found in the mechanism. Please check the RO2 section',
+              ' of your mechanism file for incorrect species names!',
+              ' ******'])
+            raise RuntimeError(error_message)
+    return ro2Numbers
+
+
+def emit_ro2(mechanism, network=None):
+    """
+    This function returns the contents of mechanism.ro2: the species number of each RO2 from 'Peroxy radicals'.
+    A RuntimeError is raised if an RO2 is not found in the species of the mechanism.
+    """
+    mech_ro2_contents = ["""! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py
+"""]
+    mech_ro2_contents.extend([str(number) + ' !' + name + '\n' for number, name in _ro2_numbers(mechanism, network)])
+    return ''.join(mech_ro2_contents)
+
+
+def emit_numpy(mechanism, dilute=False, optimise=True, network=None, rate_lines=None):
+    """
+    This function returns the contents of mechanism.py: a Python module which calculates the rate coefficients, the
+    reaction rates and the rates of change of the species with numpy, for a batch of conditions at once (see
+    mech_numpy.py). A RuntimeError is raised if an RO2 is not found in the species of the mechanism.
+
+    :param mechanism: a Mechanism, as returned by parse_fac().
+    :param dilute: if True, an extra reaction is added for each species to implement the DILUTE factor (see read_dilute()).
+    :param optimise: if True (default), repeated rate expressions are evaluated only once and unused rate coefficients
+      are removed, as in mechanism.f90 (see optimise_rates()).
+    :param network: optional reaction network of mechanism with dilute, as returned by reaction_network().
+    :param rate_lines: optional (coefficientLines, rateLines) of mechanism, before optimisation, in the format of
+      optimise_rates(). If None (default), they are worked out from mechanism.
+    """
+    if network is None:
+        network = reaction_network(mechanism, dilute)
+    coefficientLines, rateLines = rate_lines if rate_lines is not None else _rate_lines(mechanism)
+    if optimise:
+        coefficientLines, rateLines = optimise_rates(coefficientLines, rateLines)
+    numberOfReactions = network.numberOfReactions
+    assignments = [('q',) + x for x in coefficientLines if isinstance(x, tuple)] + \
+                  [('p',) + x for x in rateLines if isinstance(x, tuple)]
+    # Add the further reactions which implement the DILUTE factor
+    assignments.extend([('p', i, 'DILUTE', 'DILUTE') for i in range(len(mechanism.reactions) + 1, numberOfReactions + 1)])
+    return mech_numpy.module_contents(network.species, [number for number, _ in _ro2_numbers(mechanism, network)],
+                                      len(mechanism.coefficients), numberOfReactions, network.reactantPairs,
+                                      network.productPairs, assignments)
+
+
+def convert(input_file, mech_dir, mcm_dir, force=False, fix_input=False, RO2List_reference=None, optimise=True,
+            renumber=False, profiler=None):
+    """
+    This is the main function of this file. It takes as input a chemical mechanism file (.fac), and from it generates
+    7 files for use by AtChem2's Fortran code:
+
+    - 'Generic Rate Coefficients' and 'Complex reactions' go to mech_dir/mechanism.f90 with little more than formatting
+      changes - each line is replicated in full but with each named rate converted to an element in the vector q.
+    - The rates defined in 'Reaction definitions' also go to mech_dir/mechanism.f90 as elements of the vector p.
+    - The species involved as reactants (respectively products) in reactions in 'Reaction definitions' are split up into individual
+      species, and their species and reactions numbers go to mechanism.reac (respectively mechanism.prod). Combining
+      mechanism.reac, mechanism.prod and the last section of mech_dir/mechanism.f90 gives the original information
+      contained in 'Reaction definitions' but in the format that AtChem2 can parse.
+    - The numbers and names of all species encountered go to mechanism.species.
+    - The contents of mechanism.reac, mechanism.prod and mechanism.species also go to mechanism.network in binary
+      form (see mech_network.py).
+    - The sparsity pattern of the Jacobian matrix, and its bandwidths, go to mechanism.sparsity (see mech_jacobian.py).
+    - The numbers and names of all RO2 species in 'Peroxy radicals' end up in mechanism.ro2.
+
+    In addition, mechanism.py evaluates the rates of mechanism.f90, and the rates of change of the species, with numpy
+    for a batch of conditions (see mech_numpy.py).
+
+    :param input_file: string containing a relative or absolute reference to the .fac file to be processed.
+    :param mech_dir: string containing a relative or absolute reference to the directory in which the function should
+      place mechanism.f90, and where the environmentVariables.config file should be read from.
+      This is normally model/configuration.
+    :param mech_dir: string containing a relative or absolute reference to the directory in which the function should
+      place mechanism.{prod,reac,ro2,species}. This is normally model/configuration/ for the given model.
+    :param mcm_dir: string containing a relative or absolute reference to the directory housing the reference file peroxy-radicals_v3.3.1.
+      This is normally mcm/
+    :param force: if False (default), the conversion is skipped when mech_dir/mechanism.hash shows that the .fac file,
+      the reference RO2 list and the DILUTE setting have not changed since the last conversion. If True, the conversion
+      is always done. In either case, generated files whose contents have not changed are not rewritten.
+    :param fix_input: if True, the input file is overwritten with its contents fixed of any errant newlines (see
+      fix_mechanism_fac.py). If False (default), the input file is left untouched and the contents are fixed in memory.
+    :param RO2List_reference: optional set of reference RO2 species, as returned by read_ro2_reference(mcm_dir). If None
+      (default), it is read from mcm_dir. This allows the reference to be read once when converting many files.
+    :param optimise: if True (default), mechanism.f90 is optimised (see optimise_rates()).
+    :param renumber: if True, the species are numbered in the Reverse Cuthill-McKee order of the Jacobian matrix (see
+      renumber_species()). If False (default), they are numbered in the order that they are first encountered.
+    :param profiler: optional mech_profile.StageProfiler, which records the wall time and the peak memory of each stage
+      of the conversion, and the size of the mechanism and of the generated files.
+    :returns: True if the conversion was done, False if it was skipped.
+    """
+    if profiler is None:
+        profiler = mech_profile.NullProfiler()
+    profiler.record(inputFile=os.path.abspath(input_file), optimise=optimise, renumber=renumber)
+
+    # Work out the values of directory and filename of input_file, and check their existence.
+    input_directory = os.path.dirname(os.path.abspath(input_file))
+    input_filename = os.path.basename(input_file)
+    assert os.path.isfile(os.path.join(input_directory, input_filename)), 'The input file ' + str(
+        os.path.join(input_directory, input_filename)) + ' does not exist.'
+    print(input_directory)
+
+    # If requested, overwrite the input file with its contents fixed of any errant newlines. This is done before the
+    # check below, so that the input file is fixed even if the mechanism files are up to date
+    if fix_input:
+        fix_mechanism_fac.fix_fac_full_file(os.path.join(input_directory, input_filename))
+
+    # Read in the reference RO2 species from the peroxy-radicals_v3.3.1 file, unless they have been given
+    if RO2List_reference is None:
+        RO2List_reference = read_ro2_reference(mcm_dir)
+
+    # Skip the conversion if nothing has changed since the last one
+    if not force and is_up_to_date(os.path.join(input_directory, input_filename), mech_dir, mcm_dir, optimise, renumber,
+                                   RO2List_reference):
+        print('Mechanism files in ' + mech_dir + ' are up to date - skipping conversion (use --force to override)')
+        profiler.record(converted=False)
+        return False
+
+    # Read in and parse the input file, fixing the contents of any errant newlines as the lines are read
+    print('Reading input file')
+    with open(os.path.join(input_directory, input_filename), 'r') as fac_file:
+        mechanism = parse_fac(fac_file, profiler)
+
+    with profiler.stage('RO2 check'):
+        # Check each of the RO2s from 'Peroxy radicals' are in the reference RO2 list. If not print a warning, which
+        # is also written at the top of mechanism.f90 for each errant species.
+        # TODO: This will break the exected format when mechanism.f90 is replaced by a parsable format.
+        print('looping over inputted RO2s')
+        unknownRO2 = unknown_ro2(mechanism, RO2List_reference)
+        for ro2_species in unknownRO2:
+            print(' ****** Warning: ' + ro2_species + ' NOT found in the reference RO2 list ****** ')
+
+    # Identify whether dilution is in use
+    dilute = read_dilute(mech_dir)
+
+    # If requested, renumber the species to reduce the bandwidths of the Jacobian matrix
+    if renumber:
+        print('renumbering species in Reverse Cuthill-McKee order')
+        with profiler.stage('species renumbering'):
+            renumber_species(mechanism, dilute)
+
+    # Number the species, and work out the reactants and products of each reaction, once for all the files
+    with profiler.stage('reaction network'):
+        network = reaction_network(mechanism, dilute)
+
+    # Convert the named rate coefficients in the rate expressions to elements of q, once for both mechanism.f90 and
+    # mechanism.py
+    with profiler.stage('rate tokenisation'):
+        rateLines = _rate_lines(mechanism)
+
+    # Generate and write each file, recording its size
+    fileSizes = dict()
+
+    def emit(filename, emit_function, *args):
+        with profiler.stage('file emission: ' + filename):
+            contents = emit_function(mechanism, *args)
+            write_if_changed(os.path.join(mech_dir, filename), contents)
+        fileSizes[filename] = len(contents)
+        return contents
+
+    mech_f90_contents = emit('mechanism.f90', emit_f90, dilute, RO2List_reference, optimise, network, rateLines)
+    mech_prod_contents = emit('mechanism.prod', emit_prod, dilute, network)
+    mech_reac_contents = emit('mechanism.reac', emit_reac, dilute, network)
+    emit('mechanism.species', emit_species, network)
+    emit('mechanism.network', emit_network, dilute, mech_reac_contents, mech_prod_contents, network)
+
+    # Work out the sparsity pattern of the Jacobian matrix, and print its statistics
+    with profiler.stage('file emission: mechanism.sparsity'):
+        columns = _jacobian_pattern(mechanism, dilute, network)
+        rcmOrder = mech_jacobian.reverse_cuthill_mckee(columns)
+        jacobianStatistics = mech_jacobian.pattern_statistics(columns, rcmOrder)
+        for line in mech_jacobian.statistics_lines(jacobianStatistics):
+            print(line)
+        mech_sparsity_contents = mech_jacobian.sparsity_contents(columns, rcmOrder)
+        write_if_changed(os.path.join(mech_dir, 'mechanism.sparsity'), mech_sparsity_contents)
+    fileSizes['mechanism.sparsity'] = len(mech_sparsity_contents)
+
+    # Finally, output the RO2s to mechanism.ro2
+    print('adding RO2 to ' + mech_dir + '/mechanism.ro2')
+    emit('mechanism.ro2', emit_ro2, network)
+
+    # Write the evaluation of the mechanism with numpy
+    emit('mechanism.py', emit_numpy, dilute, optimise, network, rateLines)
+
+    # Record the size of the mechanism and of the generated files
+    reactions = mechanism.reactions
+    coefficients = mechanism.coefficients
+    profiler.record(converted=True,
+                    dilute=dilute,
+                    numberOfCoefficients=len(coefficients),
+                    numberOfReactions=len(reactions),
+                    numberOfSpecies=len(network.species),
+                    numberOfRO2=len(mechanism.ro2),
+                    numberOfUnknownRO2=len(unknownRO2),
+                    numberOfReactantTerms=sum(len(x.reactants) for x in reactions),
+                    numberOfProductTerms=sum(len(x.products) for x in reactions),
+                    rateExpressionCharacters=sum(len(x.expression) for x in coefficients) +
+                    sum(len(x.rate) for x in reactions),
+                    mechanismF90Lines=mech_f90_contents.count('\n'),
+                    fileSizes=fileSizes,
+                    jacobian=jacobianStatistics)
+
+    # Record the inputs of this conversion, so that the next call can skip it if they have not changed.
+    write_if_changed(os.path.join(mech_dir, 'mechanism.hash'),
+                     mechanism_hash(os.path.join(input_directory, input_filename), mech_dir, mcm_dir, optimise,
+                                    renumber, RO2List_reference) + '\n')
+    return True
 
 
 ## ------------------------------------------------------------------ ##
 
 
 def main():
-    assert len(sys.argv) > 1, 'Please enter a filename as argument, pointing to the chemical mechanism file (.fac ):'
-    input_filename = sys.argv[1]
-    # mech_dir defaults to '.' if not given
-    if len(sys.argv) <= 2:
-        mech_dir = './model/configuration/'
-    else:
-        mech_dir = sys.argv[2]
-    if len(sys.argv) <= 3:
-        mcm_dir = './mcm/'
-    else:
-        mcm_dir = sys.argv[3]
+    parser = argparse.ArgumentParser(description='Convert a chemical mechanism file in FACSIMILE format (.fac) into a Fortran-compatible format.')
+    parser.add_argument('input_filename', nargs='?', help='path to the .fac file')
+    parser.add_argument('mech_dir', nargs='?', default='./model/configuration/',
+                        help='path to the model configuration directory [default: ./model/configuration/]')
+    parser.add_argument('mcm_dir', nargs='?', default='./mcm/', help='path to the MCM data files directory [default: ./mcm/]')
+    parser.add_argument('--force', action='store_true',
+                        help='regenerate the mechanism files even if the inputs have not changed since the last conversion')
+    parser.add_argument('--fix-input', action='store_true',
+                        help='overwrite the .fac file with its contents fixed of any errant newlines')
+    parser.add_argument('--no-optimise', dest='optimise', action='store_false',
+                        help='translate each rate expression as it is, without removing repeated expressions and unused rate coefficients')
+    parser.add_argument('--renumber-species', dest='renumber', action='store_true',
+                        help='number the species in the Reverse Cuthill-McKee order of the Jacobian matrix, to reduce its bandwidths')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the wall time and the peak memory of each stage of the conversion, and the size of the mechanism')
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help='write the wall time and the peak memory of each stage, and the size of the mechanism, to this JSON file')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='with --profile or --stats-json, also trace the peak memory allocated by each stage (much slower)')
+    args = parser.parse_args()
+
+    assert args.input_filename is not None, 'Please enter a filename as argument, pointing to the chemical mechanism file (.fac ):'
+    input_filename = args.input_filename
+    mech_dir = args.mech_dir
+    mcm_dir = args.mcm_dir
 
     # check the locations supplied exist
     assert os.path.isfile(input_filename), 'Failed to find file ' + input_filename
@@ -495,7 +1151,15 @@ def main():
     assert os.path.exists(mcm_dir), 'Failed to find directory ' + mcm_dir
 
     # call conversion function
-    convert(input_filename, mech_dir, mcm_dir)
+    profiler = mech_profile.StageProfiler(args.trace_memory) if args.profile or args.stats_json else None
+    convert(input_filename, mech_dir, mcm_dir, force=args.force, fix_input=args.fix_input, optimise=args.optimise,
+            renumber=args.renumber, profiler=profiler)
+
+    if args.profile:
+        for line in profiler.report_lines():
+            print(line)
+    if args.stats_json:
+        profiler.write_json(args.stats_json)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,375 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script contains functions to work out the sparsity pattern of
+# the Jacobian matrix of a reaction network, from the reactants and
+# products of each reaction (as in mechanism.reac and mechanism.prod),
+# and to write it to mechanism.sparsity. This file is written by
+# build/mech_converter.py.
+#
+# The Jacobian matrix element (i, j) is the derivative of the rate of
+# change of species i with respect to the concentration of species j.
+# It is nonzero if species j is a reactant of a reaction in which
+# species i is a reactant or a product. The diagonal elements are
+# always included, as the solver needs them.
+#
+# The bandwidths of the matrix determine the cost of the banded
+# preconditioner of the solver (see solver.parameters). They depend on
+# the numbering of the species, so they are also given after reordering
+# the species with the Reverse Cuthill-McKee (RCM) algorithm, which
+# reduces the bandwidths. The species can be renumbered in this order
+# with the option --renumber-species of build/mech_converter.py.
+#
+# The Jacobian matrix itself is calculated by the subroutine jacobian
+# of mechanism.f90, which is written by jacobian_subroutine(). It is
+# used by the solver if requested in solver.parameters.
+#
+# ARGUMENT:
+# - path to the model configuration directory holding mechanism.reac
+#   and mechanism.prod [default: model/configuration/]
+# ---------------------------------------------- #
+from __future__ import print_function
+import sys
+import os
+
+
+## ------------------------------------------------------------------ ##
+
+
+def jacobian_pattern(numberOfSpecies, reactantPairs, productPairs):
+    """
+    This function returns the sparsity pattern of the Jacobian matrix.
+
+    :param numberOfSpecies: the number of species.
+    :param reactantPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.reac, counting from 1.
+    :param productPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.prod, counting from 1.
+    :returns columns: list holding, for each species j (counting from 0), the set of the species i (counting from 0)
+      such that the Jacobian matrix element (i, j) is nonzero.
+    """
+    reactants = dict()
+    species = dict()
+    for reactionNumber, speciesNumber in reactantPairs:
+        reactants.setdefault(reactionNumber, set()).add(speciesNumber - 1)
+        species.setdefault(reactionNumber, set()).add(speciesNumber - 1)
+    for reactionNumber, speciesNumber in productPairs:
+        species.setdefault(reactionNumber, set()).add(speciesNumber - 1)
+
+    columns = [set([j]) for j in range(numberOfSpecies)]
+    for reactionNumber, reactionReactants in reactants.items():
+        for j in reactionReactants:
+            columns[j].update(species[reactionNumber])
+    return columns
+
+
+def bandwidths(columns, order=None):
+    """
+    This function returns the lower and upper bandwidths of a sparsity pattern, i.e. the largest distances below and
+    above the diagonal of its nonzero elements.
+
+    :param columns: sparsity pattern, as returned by jacobian_pattern().
+    :param order: optional list of the species (counting from 0) in the order in which they are numbered. By default,
+      the species are numbered as in columns.
+    :returns (lower, upper): the lower and upper bandwidths.
+    """
+    position = list(range(len(columns)))
+    if order is not None:
+        for newNumber, oldNumber in enumerate(order):
+            position[oldNumber] = newNumber
+    lower = 0
+    upper = 0
+    for j, rows in enumerate(columns):
+        for i in rows:
+            lower = max(lower, position[i] - position[j])
+            upper = max(upper, position[j] - position[i])
+    return lower, upper
+
+
+def _level_structure(adjacency, root, degree):
+    # Return the breadth-first ordering of the connected component of root,
+    # visiting the neighbours of each node in order of increasing degree,
+    # the list of the nodes of the last level, and the number of levels.
+    ordering = [root]
+    level = [root]
+    depth = 1
+    visited = set([root])
+    while True:
+        nextLevel = []
+        for node in level:
+            neighbours = sorted([x for x in adjacency[node] if x not in visited], key=lambda x: (degree[x], x))
+            visited.update(neighbours)
+            nextLevel.extend(neighbours)
+        if not nextLevel:
+            return ordering, level, depth
+        ordering.extend(nextLevel)
+        level = nextLevel
+        depth += 1
+
+
+def reverse_cuthill_mckee(columns):
+    """
+    This function returns the Reverse Cuthill-McKee ordering of the species of a sparsity pattern. The ordering is
+    worked out on the symmetric pattern (i.e. the union of the pattern and its transpose). Each connected component is
+    started from a pseudo-peripheral node, found as in George and Liu (1979).
+
+    :param columns: sparsity pattern, as returned by jacobian_pattern().
+    :returns order: list of the species (counting from 0) in their new order.
+    """
+    numberOfSpecies = len(columns)
+    adjacency = [set() for _ in range(numberOfSpecies)]
+    for j, rows in enumerate(columns):
+        for i in rows:
+            if i != j:
+                adjacency[i].add(j)
+                adjacency[j].add(i)
+    degree = [len(x) for x in adjacency]
+
+    order = []
+    visited = [False] * numberOfSpecies
+    for start in sorted(range(numberOfSpecies), key=lambda x: (degree[x], x)):
+        if visited[start]:
+            continue
+        # Find a pseudo-peripheral node: move to a node of minimum degree in the last level, as long as this
+        # increases the number of levels
+        ordering, lastLevel, depth = _level_structure(adjacency, start, degree)
+        while True:
+            candidate = min(lastLevel, key=lambda x: (degree[x], x))
+            candidateOrdering, candidateLastLevel, candidateDepth = _level_structure(adjacency, candidate, degree)
+            if candidateDepth <= depth:
+                break
+            ordering, lastLevel, depth = candidateOrdering, candidateLastLevel, candidateDepth
+        for node in ordering:
+            visited[node] = True
+        order.extend(ordering)
+    order.reverse()
+    return order
+
+
+def sparsity_contents(columns, rcmOrder):
+    """
+    This function returns the contents of mechanism.sparsity: a header of comment lines with the statistics of the
+    pattern, a line with the number of species and of nonzeros, and the pattern in Compressed Sparse Column (CSC)
+    format, counting from 1: the column pointers (number of species + 1 lines) and the row indices (number of nonzeros
+    lines), one per line. The row indices of the nonzeros of column j are those between the column pointers j and j+1
+    (excluded).
+
+    :param columns: sparsity pattern, as returned by jacobian_pattern().
+    :param rcmOrder: the Reverse Cuthill-McKee ordering, as returned by reverse_cuthill_mckee().
+    """
+    statistics = pattern_statistics(columns, rcmOrder)
+    colPointers = [1]
+    rowIndices = []
+    for rows in columns:
+        rowIndices.extend([i + 1 for i in sorted(rows)])
+        colPointers.append(len(rowIndices) + 1)
+
+    contents = ["""! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py
+! Jacobian sparsity pattern in Compressed Sparse Column format, counting from 1
+"""]
+    contents.extend(['! ' + line + '\n' for line in statistics_lines(statistics)])
+    contents.append(str(len(columns)) + ' ' + str(len(rowIndices)) + ' numberOfSpecies numberOfNonZeros\n')
+    contents.extend([str(x) + '\n' for x in colPointers])
+    contents.extend([str(x) + '\n' for x in rowIndices])
+    return ''.join(contents)
+
+
+def pattern_statistics(columns, rcmOrder):
+    """
+    This function returns a dictionary holding the statistics of a sparsity pattern: 'numberOfSpecies',
+    'numberOfNonZeros', 'lowerBandwidth', 'upperBandwidth', 'rcmLowerBandwidth' and 'rcmUpperBandwidth'.
+    """
+    lower, upper = bandwidths(columns)
+    rcmLower, rcmUpper = bandwidths(columns, rcmOrder)
+    return {'numberOfSpecies': len(columns),
+            'numberOfNonZeros': sum([len(rows) for rows in columns]),
+            'lowerBandwidth': lower,
+            'upperBandwidth': upper,
+            'rcmLowerBandwidth': rcmLower,
+            'rcmUpperBandwidth': rcmUpper}
+
+
+def statistics_lines(statistics):
+    # Return the statistics of pattern_statistics() as a list of lines of text.
+    density = 100.0 * statistics['numberOfNonZeros'] / max(statistics['numberOfSpecies'] ** 2, 1)
+    return ['Number of species: ' + str(statistics['numberOfSpecies']),
+            'Number of nonzeros: ' + str(statistics['numberOfNonZeros']) + ' (' + '%.2f' % density + '%)',
+            'Lower and upper bandwidths: ' + str(statistics['lowerBandwidth']) + ' ' + str(statistics['upperBandwidth']),
+            'Lower and upper bandwidths with the Reverse Cuthill-McKee species order: ' +
+            str(statistics['rcmLowerBandwidth']) + ' ' + str(statistics['rcmUpperBandwidth'])]
+
+
+def jacobian_terms(columns, reactantPairs, productPairs):
+    """
+    This function returns the terms which add up to the nonzero elements of the Jacobian matrix, in the order of
+    sparsity_contents(). The rate of each reaction is p times the product of the concentrations of its reactants, so
+    that its derivative with respect to a reactant present m times is m times p times the product of the
+    concentrations of the other reactants (i.e. of all the reactants but one occurrence of that reactant), without any
+    division. The derivative of the rate with respect to each distinct reactant is calculated once, and added to the
+    elements of the Jacobian matrix of each species of the reaction, times its net stoichiometric coefficient.
+
+    :param columns: sparsity pattern, as returned by jacobian_pattern().
+    :param reactantPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.reac, counting from 1.
+    :param productPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.prod, counting from 1.
+    :returns (derivatives, terms): derivatives is a list of (reactionNumber, speciesNumber) pairs, one for each distinct
+      reactant of each reaction, and terms is a list holding, for each derivative, the list of the (position,
+      coefficient) pairs of the elements of the Jacobian matrix that it is added to: the position counts from 1 in
+      the order of sparsity_contents(), and the coefficient is a nonzero integer.
+    """
+    # Position of each nonzero element (i, j) in jac, counting from 1
+    position = dict()
+    for j, rows in enumerate(columns):
+        for i in sorted(rows):
+            position[(i, j)] = len(position) + 1
+
+    # Number of times each species is a reactant, and net stoichiometric coefficient of each species, in each reaction
+    reactants = dict()
+    stoichiometry = dict()
+    for reactionNumber, speciesNumber in reactantPairs:
+        counts = reactants.setdefault(reactionNumber, dict())
+        counts[speciesNumber] = counts.get(speciesNumber, 0) + 1
+        coefficients = stoichiometry.setdefault(reactionNumber, dict())
+        coefficients[speciesNumber] = coefficients.get(speciesNumber, 0) - 1
+    for reactionNumber, speciesNumber in productPairs:
+        coefficients = stoichiometry.setdefault(reactionNumber, dict())
+        coefficients[speciesNumber] = coefficients.get(speciesNumber, 0) + 1
+
+    derivatives = []
+    terms = []
+    for reactionNumber in sorted(reactants):
+        counts = reactants[reactionNumber]
+        for j in sorted(counts):
+            derivativeTerms = [(position[(i - 1, j - 1)], counts[j] * stoichiometry[reactionNumber][i])
+                               for i in sorted(stoichiometry[reactionNumber]) if stoichiometry[reactionNumber][i] != 0]
+            if derivativeTerms:
+                derivatives.append((reactionNumber, j))
+                terms.append(derivativeTerms)
+    return derivatives, terms
+
+
+def _data_statements(name, values, valuesPerLine=20):
+    # Return the Fortran DATA statements which set the integer array name to values, as a list of lines, with at most
+    # valuesPerLine values on each line.
+    statements = []
+    for first in range(0, len(values), valuesPerLine):
+        chunk = values[first:first + valuesPerLine]
+        statements.append('        data ' + name + '(' + str(first + 1) + ':' + str(first + len(chunk)) + ') / ' +
+                          ', '.join([str(x) for x in chunk]) + ' /\n')
+    return statements
+
+
+def jacobian_subroutine(columns, numberOfReactions, reactantPairs, productPairs):
+    """
+    This function returns the Fortran subroutine jacobian, which calculates the nonzero elements of the Jacobian matrix
+    in the array jac, in the order of sparsity_contents(), from the reaction rates p and the species concentrations y.
+
+    The terms of jacobian_terms() are written as integer arrays, which are set by DATA statements and used by a loop,
+    rather than as one statement for each term, so that the subroutine stays quick to compile for large mechanisms.
+
+    The reaction rates p are taken as constants: the derivatives of the rates which depend on RO2 (the sum of the
+    concentrations of the RO2 species) with respect to the concentrations of the RO2 species are left out.
+
+    :param columns: sparsity pattern, as returned by jacobian_pattern().
+    :param numberOfReactions: the number of reactions, as in mechanism.reac.
+    :param reactantPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.reac, counting from 1.
+    :param productPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.prod, counting from 1.
+    :returns: the subroutine as a string.
+    """
+    numberOfNonZeros = sum([len(rows) for rows in columns])
+    derivatives, terms = jacobian_terms(columns, reactantPairs, productPairs)
+
+    # The reactants of each reaction, in Compressed Sparse Row format: the species numbers of the reactants of reaction r
+    # (with repetitions) are those of reactantSpecies between the pointers r and r+1 (excluded)
+    reactantSpecies = [[] for _ in range(numberOfReactions)]
+    for reactionNumber, speciesNumber in reactantPairs:
+        reactantSpecies[reactionNumber - 1].append(speciesNumber)
+    reactantPointers = [1]
+    for x in reactantSpecies:
+        reactantPointers.append(reactantPointers[-1] + len(x))
+    reactantSpecies = [x for species in reactantSpecies for x in species]
+
+    # The terms of each derivative, in the same format
+    termPointers = [1]
+    for x in terms:
+        termPointers.append(termPointers[-1] + len(x))
+    terms = [x for derivativeTerms in terms for x in derivativeTerms]
+
+    arrays = [('reactantPointers', reactantPointers),
+              ('reactantSpecies', reactantSpecies),
+              ('derivativeReactions', [r for r, _ in derivatives]),
+              ('derivativeSpecies', [j for _, j in derivatives]),
+              ('termPointers', termPointers),
+              ('termPositions', [position for position, _ in terms]),
+              ('termCoefficients', [coefficient for _, coefficient in terms])]
+
+    contents = ["""
+    ! Calculate the nonzero elements of the Jacobian matrix from the reaction rates p and the species concentrations y,
+    ! in the order of the Compressed Sparse Column format of mechanism.sparsity. For each derivative d, the derivative
+    ! of the rate of reaction derivativeReactions(d) with respect to the concentration of species derivativeSpecies(d)
+    ! (i.e. p times the concentrations of all the reactants but one occurrence of this species) is added to the
+    ! elements termPositions(k) of jac, times termCoefficients(k), for k between termPointers(d) and termPointers(d+1)
+    ! (excluded). The derivatives of p itself (e.g. through RO2) are left out.
+    subroutine jacobian(p, y, jac) bind(c,name='jacobian')
+        real(c_double), intent(in) :: p(*), y(*)
+        real(c_double), intent(inout) :: jac(*)
+"""]
+    for name, values in arrays:
+        contents.append('        integer, save :: ' + name + '(' + str(len(values)) + ')\n')
+    contents.append("""        real(c_double) :: derivative
+        integer :: d, k, l
+        logical :: skipped
+""")
+    for name, values in arrays:
+        contents.extend(_data_statements(name, values))
+    contents.append("""
+        jac(1:""" + str(numberOfNonZeros) + """) = 0.0_c_double
+        do d = 1, """ + str(len(derivatives)) + """
+            derivative = p(derivativeReactions(d))
+            skipped = .false.
+            do l = reactantPointers(derivativeReactions(d)), reactantPointers(derivativeReactions(d) + 1) - 1
+                if ( reactantSpecies(l) == derivativeSpecies(d) .and. .not. skipped ) then
+                    skipped = .true.
+                else
+                    derivative = derivative * y(reactantSpecies(l))
+                end if
+            end do
+            do k = termPointers(d), termPointers(d + 1) - 1
+                jac(termPositions(k)) = jac(termPositions(k)) + termCoefficients(k) * derivative
+            end do
+        end do
+    end subroutine jacobian
+""")
+    return ''.join(contents)
+
+
+def read_pairs(filename):
+    # Read mechanism.reac or mechanism.prod, and return the number of
+    # species and the list of (reactionNumber, speciesNumber) pairs.
+    with open(filename, 'r') as pairs_file:
+        numberOfSpecies = int(pairs_file.readline().split()[0])
+        pairs = [tuple(int(x) for x in line.split()) for line in pairs_file if line.strip()]
+    return numberOfSpecies, pairs
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    # Pass argument from command line as path to the directory holding
+    # mechanism.reac and mechanism.prod, and print the statistics of the
+    # sparsity pattern of the Jacobian matrix.
+    mech_dir = sys.argv[1] if len(sys.argv) > 1 else './model/configuration/'
+    numberOfSpecies, reactantPairs = read_pairs(os.path.join(mech_dir, 'mechanism.reac'))
+    _, productPairs = read_pairs(os.path.join(mech_dir, 'mechanism.prod'))
+    columns = jacobian_pattern(numberOfSpecies, reactantPairs, productPairs)
+    for line in statistics_lines(pattern_statistics(columns, reverse_cuthill_mckee(columns))):
+        print(line)
+
+if __name__ == '__main__':
+    main()
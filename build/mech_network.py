@@ -0,0 +1,180 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script contains functions to write and read mechanism.network,
+# a binary version of the reaction network held in mechanism.reac,
+# mechanism.prod and mechanism.species. mechanism.network is written
+# by build/mech_converter.py, and it can be read without any parsing
+# by the Fortran code (see readReactions() in src/inputFunctions.f90)
+# and by Python, e.g. to build stoichiometry matrices.
+#
+# mechanism.network is a sequence of little-endian 32-bit integers,
+# followed by the species names:
+# - header: format version (2), number of species, number of reactions,
+#   number of generic and complex rate coefficients, number of
+#   reactant entries, number of product entries, number of bytes of
+#   species names, sizes in bytes of mechanism.reac and mechanism.prod
+# - reactant index pointers (number of reactions + 1 values)
+# - reactant species indices (number of reactant entries)
+# - product index pointers (number of reactions + 1 values)
+# - product species indices (number of product entries)
+# - length in bytes of each species name (number of species)
+# - species names, concatenated, in ASCII
+#
+# The reactants (products) of reaction i (counting from 0) have species
+# indices indices[indptr[i]:indptr[i+1]], counting from 0: i.e. the
+# arrays are in the Compressed Sparse Row (CSR) format, with the
+# reactions as rows and the species as columns.
+#
+# The Fortran code only uses mechanism.network if it matches
+# mechanism.reac and mechanism.prod: the numbers of species and
+# reactions must be those in the first line of mechanism.reac, and the
+# sizes of the two text files must be those recorded in the header.
+# Otherwise (e.g. if the text files have been regenerated or edited
+# since mechanism.network was written, or if mechanism.network is
+# truncated), the text files are read instead.
+#
+# ARGUMENT:
+# - path to the model configuration directory holding mechanism.network
+# ---------------------------------------------- #
+from __future__ import print_function
+import sys
+import os
+import array
+
+network_format_version = 2
+header_length = 9
+
+
+## ------------------------------------------------------------------ ##
+
+
+def _int32_array(values):
+    # Return values as an array of 32-bit integers, in little-endian byte order.
+    int32_array = array.array('i', values)
+    assert int32_array.itemsize == 4, 'mech_network: the C int type is not 32-bit on this platform.'
+    if sys.byteorder == 'big':
+        int32_array.byteswap()
+    return int32_array
+
+
+def _csr_arrays(pairs, numberOfReactions):
+    # Given a list of (reactionNumber, speciesNumber) pairs, both counting from 1 and sorted by reaction number,
+    # return the CSR index pointers and species indices, both counting from 0.
+    indptr = [0] * (numberOfReactions + 1)
+    for reactionNumber, _ in pairs:
+        indptr[reactionNumber] += 1
+    for i in range(numberOfReactions):
+        indptr[i + 1] += indptr[i]
+    indices = [speciesNumber - 1 for _, speciesNumber in pairs]
+    return indptr, indices
+
+
+def network_contents(numberOfGenericComplex, numberOfReactions, reactantPairs, productPairs, speciesList, reacBytes,
+                     prodBytes):
+    """
+    This function returns the contents of mechanism.network as bytes.
+
+    :param numberOfGenericComplex: the number of generic and complex rate coefficients.
+    :param numberOfReactions: the number of reactions, including any DILUTE reactions.
+    :param reactantPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.reac.
+    :param productPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.prod.
+    :param speciesList: list of species names, as in mechanism.species.
+    :param reacBytes: size in bytes of the mechanism.reac written with mechanism.network.
+    :param prodBytes: size in bytes of the mechanism.prod written with mechanism.network.
+    :returns: bytes holding the binary network.
+    """
+    reacIndptr, reacIndices = _csr_arrays(reactantPairs, numberOfReactions)
+    prodIndptr, prodIndices = _csr_arrays(productPairs, numberOfReactions)
+    names = [name.encode('ascii') for name in speciesList]
+    header = [network_format_version, len(speciesList), numberOfReactions, numberOfGenericComplex,
+              len(reacIndices), len(prodIndices), sum(len(name) for name in names), reacBytes, prodBytes]
+
+    contents = _int32_array(header + reacIndptr + reacIndices + prodIndptr + prodIndices + [len(name) for name in names])
+    # array.tobytes() is called tostring() in Python v2
+    contents = contents.tobytes() if hasattr(contents, 'tobytes') else contents.tostring()
+    return contents + b''.join(names)
+
+
+def load_network(mech_dir):
+    """
+    This function reads mech_dir/mechanism.network. The index arrays are memory-mapped NumPy arrays, so that even
+    large networks are loaded without parsing or copying.
+
+    :param mech_dir: string containing a relative or absolute reference to the directory holding mechanism.network.
+    :returns: a dictionary holding 'numberOfSpecies', 'numberOfReactions', 'numberOfGenericComplex' (integers),
+      'reacIndptr', 'reacIndices', 'prodIndptr', 'prodIndices' (int32 arrays in CSR format, counting from 0), and
+      'species' (list of species names).
+    """
+    import numpy as np
+
+    filename = os.path.join(mech_dir, 'mechanism.network')
+    header = np.fromfile(filename, dtype='<i4', count=header_length)
+    assert header.size == header_length and header[0] == network_format_version, \
+        'load_network: ' + filename + ' is not a mechanism.network file of version ' + str(network_format_version)
+    numberOfSpecies, numberOfReactions, numberOfGenericComplex, nnzReac, nnzProd, nameBytes = [int(x) for x in header[1:7]]
+
+    network = {'numberOfSpecies': numberOfSpecies,
+               'numberOfReactions': numberOfReactions,
+               'numberOfGenericComplex': numberOfGenericComplex}
+    offset = 4 * header_length
+    for name, length in [('reacIndptr', numberOfReactions + 1), ('reacIndices', nnzReac),
+                         ('prodIndptr', numberOfReactions + 1), ('prodIndices', nnzProd),
+                         ('nameLengths', numberOfSpecies)]:
+        network[name] = np.memmap(filename, dtype='<i4', mode='r', offset=offset, shape=(length,)) if length > 0 \
+            else np.zeros(0, dtype='<i4')
+        offset += 4 * length
+
+    with open(filename, 'rb') as network_file:
+        network_file.seek(offset)
+        names = network_file.read(nameBytes).decode('ascii')
+    network['species'] = []
+    start = 0
+    for length in network.pop('nameLengths'):
+        network['species'].append(names[start:start + length])
+        start += length
+    return network
+
+
+def stoichiometry_matrices(network):
+    """
+    This function returns the reactant and product stoichiometry matrices of a network read by load_network, as
+    scipy.sparse CSR matrices with one row per reaction and one column per species. Repeated species in a reaction
+    (e.g. 'OH + OH') are summed.
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    # The index arrays are copied, as the memory-mapped arrays are read-only
+    shape = (network['numberOfReactions'], network['numberOfSpecies'])
+    reactants = csr_matrix((np.ones(len(network['reacIndices'])), np.array(network['reacIndices']),
+                            np.array(network['reacIndptr'])), shape=shape)
+    products = csr_matrix((np.ones(len(network['prodIndices'])), np.array(network['prodIndices']),
+                           np.array(network['prodIndptr'])), shape=shape)
+    reactants.sum_duplicates()
+    products.sum_duplicates()
+    return reactants, products
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    # Pass argument from command line as path to the directory holding mechanism.network,
+    # and print a summary of the network.
+    mech_dir = sys.argv[1] if len(sys.argv) > 1 else './model/configuration/'
+    network = load_network(mech_dir)
+    print(os.path.join(mech_dir, 'mechanism.network') + ': ' + str(network['numberOfSpecies']) + ' species, ' +
+          str(network['numberOfReactions']) + ' reactions, ' + str(len(network['reacIndices'])) + ' reactant entries, ' +
+          str(len(network['prodIndices'])) + ' product entries')
+
+if __name__ == '__main__':
+    main()
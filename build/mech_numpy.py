@@ -0,0 +1,288 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script contains the functions which write mechanism.py, a
+# Python module which evaluates the chemical mechanism with numpy, in
+# the same way as mechanism.f90 and the Fortran code, but for a whole
+# batch of conditions at once. mechanism.py is written by
+# build/mech_converter.py next to mechanism.f90, and it needs numpy,
+# but not the rest of AtChem2.
+#
+# mechanism.py holds:
+# - the size of the mechanism (numberOfSpecies, numberOfReactions,
+#   numberOfGenericComplex, maxPhotolysisNumber) and speciesNames, in
+#   the order of mechanism.species.
+# - the stoichiometry, as index arrays counting from 0: the reaction
+#   and the species of each reactant term (reactantReactions,
+#   reactantSpecies) and of each product term (productReactions,
+#   productSpecies), as in mechanism.reac and mechanism.prod, and the
+#   species of each RO2 (ro2Species), as in mechanism.ro2.
+# - rate_coefficients(TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC,
+#   DILUTE, ROOFOPEN, ASA, J, RO2): the rate coefficients q and p, as
+#   calculated by update_p() in mechanism.f90. Each argument is either
+#   a number or an array of conditions, and J is an array of shape
+#   (maxPhotolysisNumber, ...), in which J[i - 1] is the photolysis
+#   rate J(i). The arguments are broadcast together into the shape of
+#   the batch, and q and p are arrays of shape (numberOfGenericComplex,
+#   batch...) and (numberOfReactions, batch...). The rate coefficients
+#   which are not used by any reaction are left to zero.
+# - ro2_sum(y): the sum of the concentrations of the RO2 species.
+# - reaction_rates(p, y): the rate of each reaction, i.e. p times the
+#   concentrations of its reactants, where y is an array of shape
+#   (numberOfSpecies, batch...).
+# - production_loss(r): the production and loss rates of each species,
+#   summed over the reactions. A species which appears n times in a
+#   reaction is counted n times, as in the Fortran code. The sums are
+#   taken as sparse matrix products if scipy is available, which is
+#   several times faster for a large mechanism, and with numpy only
+#   otherwise.
+# - tendencies(y, TEMP, ..., J): the rate of change of each species,
+#   with RO2 calculated from y, as done by the solver. The constrained
+#   and constant species are not treated differently. The conditions
+#   are taken in chunks, so that a large batch of conditions does not
+#   need the rates of all the reactions in memory at once.
+#
+# For example, for 10000 temperatures at once:
+#   import mechanism
+#   TEMP = np.linspace(250.0, 320.0, 10000)
+#   q, p = mechanism.rate_coefficients(TEMP, N2, O2, M, -1.0, H2O, -1.0, DEC, 1.0, -1.0, 1.0, -1.0, J, RO2)
+#
+# Each rate expression is translated from its Fortran form in
+# mechanism.f90 into one numpy statement, so that the cost of the
+# Python interpreter is paid once per expression and not once per
+# condition.
+# ---------------------------------------------- #
+from __future__ import print_function
+import re
+import struct
+
+# The environment variables passed to update_p() in mechanism.f90, in order
+environment_arguments = ['TEMP', 'N2', 'O2', 'M', 'RH', 'H2O', 'BLHEIGHT', 'DEC', 'JFAC', 'DILUTE', 'ROOFOPEN', 'ASA']
+
+# The functions which can be used in the rate expressions, and their numpy equivalents
+numpy_functions = {'EXP': 'np.exp', 'LOG10': 'np.log10'}
+
+# The sections of a Fortran rate expression: references to an element of q, p or J, names, and numbers (which may
+# have a D exponent or a _DP suffix)
+expression_token_regex = re.compile(r'(?P<array>\b[qpJ])\((?P<index>[0-9]+)\)'
+                                    r'|(?P<name>[A-Za-z_][A-Za-z0-9_]*)'
+                                    r'|(?P<number>(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[dDeE][+-]?[0-9]+)?)(?P<kind>_DP)?')
+
+module_functions = '''
+
+def _batch_shape(*arrays):
+    # Return the shape of the batch, broadcast from the shapes of the arrays without their first axis.
+    return np.broadcast(*[np.broadcast_to(0.0, x.shape[1:]) for x in arrays]).shape
+
+
+def _expand(x, shape):
+    # Return a view of the array x, of shape (n, batch...), broadcast to the shape (n,) + shape.
+    return np.broadcast_to(x.reshape(x.shape[:1] + (1,) * (len(shape) - x.ndim + 1) + x.shape[1:]),
+                           x.shape[:1] + shape)
+
+
+def _term_layers(reactions, species):
+    # Split the reactant terms into layers, in which each reaction appears at most once, so that the reaction rates
+    # can be multiplied by the concentrations of the reactants with one operation per layer.
+    order = np.argsort(reactions, kind='mergesort')
+    reactions = reactions[order]
+    species = species[order]
+    starts = np.flatnonzero(np.r_[True, reactions[1:] != reactions[:-1]]) if reactions.size else reactions
+    occurrence = np.arange(reactions.size) - np.repeat(starts, np.diff(np.r_[starts, reactions.size]))
+    return [(reactions[occurrence == k], species[occurrence == k])
+            for k in range(occurrence.max() + 1 if occurrence.size else 0)]
+
+
+def _term_sums(reactions, species):
+    # Return the matrix of the number of terms of each species in each reaction, if scipy is available, so that the
+    # sums over the terms of each species are taken as a sparse matrix product. Otherwise, return the reactions of the
+    # terms sorted by species, the start of the terms of each species in this order, and the species, so that the sums
+    # are taken with np.add.reduceat().
+    if sparse is not None:
+        return sparse.csr_matrix((np.ones(species.size), (species, reactions)),
+                                 shape=(numberOfSpecies, numberOfReactions))
+    order = np.argsort(species, kind='mergesort')
+    sortedSpecies = species[order]
+    starts = np.flatnonzero(np.r_[True, sortedSpecies[1:] != sortedSpecies[:-1]]) if species.size else species
+    return reactions[order], starts, sortedSpecies[starts]
+
+
+_reactantLayers = _term_layers(reactantReactions, reactantSpecies)
+_reactantSums = _term_sums(reactantReactions, reactantSpecies)
+_productSums = _term_sums(productReactions, productSpecies)
+
+
+def ro2_sum(y):
+    """Return the sum of the concentrations y (of shape (numberOfSpecies, batch...)) of the RO2 species."""
+    return np.asarray(y, dtype=float)[ro2Species].sum(axis=0)
+
+
+def reaction_rates(p, y):
+    """
+    Return the rates of the reactions, of shape (numberOfReactions, batch...): the rate coefficients p times the
+    concentrations y (of shape (numberOfSpecies, batch...)) of their reactants.
+    """
+    p = np.asarray(p, dtype=float)
+    y = np.asarray(y, dtype=float)
+    shape = _batch_shape(p, y)
+    r = np.array(_expand(p, shape))
+    y = _expand(y, shape)
+    for reactions, species in _reactantLayers:
+        r[reactions] *= y[species]
+    return r
+
+
+def _sum_terms(r, sums):
+    # Sum the reaction rates r over the terms of each species.
+    if sparse is not None:
+        return np.asarray(sums.dot(r.reshape((numberOfReactions, -1)))).reshape((numberOfSpecies,) + r.shape[1:])
+    reactions, starts, species = sums
+    total = np.zeros((numberOfSpecies,) + r.shape[1:])
+    if starts.size:
+        total[species] = np.add.reduceat(r[reactions], starts, axis=0)
+    return total
+
+
+def production_loss(r):
+    """
+    Return the production and loss rates of each species, of shape (numberOfSpecies, batch...), from the reaction
+    rates r.
+    """
+    r = np.asarray(r, dtype=float)
+    return _sum_terms(r, _productSums), _sum_terms(r, _reactantSums)
+
+
+def tendencies(y, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J, chunk_size=None):
+    """
+    Return the rate of change of each species, of shape (numberOfSpecies, batch...), at the concentrations y, with RO2
+    calculated from y. The conditions are taken chunk_size at a time, so that the rates of all the reactions are not
+    held in memory for the whole batch [default: about 2**23 rates at a time].
+    """
+    y = np.asarray(y, dtype=float)
+    J = np.asarray(J, dtype=float)
+    conditions = [TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA]
+    shape = np.broadcast(*(conditions + [np.broadcast_to(0.0, y.shape[1:]), np.broadcast_to(0.0, J.shape[1:])])).shape
+    size = int(np.prod(shape))
+    conditions = [np.broadcast_to(x, shape).reshape(size) for x in conditions]
+    y = _expand(y, shape).reshape((numberOfSpecies, size))
+    J = _expand(J, shape).reshape((J.shape[0], size))
+    if chunk_size is None:
+        chunk_size = max(2 ** 23 // max(numberOfReactions, 1), 1)
+    dy = np.empty((numberOfSpecies, size))
+    for start in range(0, size, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        _, p = rate_coefficients(*([x[chunk] for x in conditions] + [J[:, chunk], ro2_sum(y[:, chunk])]))
+        production, loss = production_loss(reaction_rates(p, y[:, chunk]))
+        dy[:, chunk] = production - loss
+    return dy.reshape((numberOfSpecies,) + shape)
+'''
+
+
+## ------------------------------------------------------------------ ##
+
+
+def numpy_expression(expression):
+    """
+    This function translates a rate expression of mechanism.f90 into a numpy expression: q(i), p(i) and J(i) become
+    q[i - 1], p[i - 1] and J[i - 1], the functions become the numpy functions, and the Fortran numbers become Python
+    numbers. As in Fortran, a real number without a D exponent or the _DP kind is single precision, so it is rounded
+    to single precision. A RuntimeError is raised if the expression uses a name which is not an argument of update_p().
+
+    :param expression: the right-hand side of an assignment to q or p in mechanism.f90.
+    :returns: the numpy expression, as a string.
+    """
+    def replace_token(match):
+        if match.group('array') is not None:
+            return match.group('array') + '[' + str(int(match.group('index')) - 1) + ']'
+        name = match.group('name')
+        if name is not None:
+            if name in numpy_functions:
+                return numpy_functions[name]
+            if name in environment_arguments or name == 'RO2':
+                return name
+            raise RuntimeError('Error: the rate expression "' + expression + '" uses ' + name +
+                               ', which is not available in mechanism.f90.')
+        number = match.group('number')
+        if match.group('kind') is None and not re.search('[dD]', number) and re.search('[.eE]', number):
+            return repr(struct.unpack('f', struct.pack('f', float(number)))[0])
+        return re.sub('[dD]', 'e', number)
+
+    return expression_token_regex.sub(replace_token, expression)
+
+
+def _index_array(values):
+    # Return the Python source of a numpy array of indices.
+    return 'np.array([' + ', '.join(str(x) for x in values) + '], dtype=np.intp)'
+
+
+def module_contents(speciesList, ro2Numbers, numberOfGenericComplex, numberOfReactions, reactantPairs, productPairs,
+                    assignments):
+    """
+    This function returns the contents of mechanism.py.
+
+    :param speciesList: list of the species names, in order.
+    :param ro2Numbers: list of the species numbers of the RO2 species, as in mechanism.ro2, counting from 1.
+    :param numberOfGenericComplex: number of the generic and complex rate coefficients, i.e. the size of q.
+    :param numberOfReactions: number of reactions, i.e. the size of p.
+    :param reactantPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.reac, counting from 1.
+    :param productPairs: list of (reactionNumber, speciesNumber) pairs, as in mechanism.prod, counting from 1.
+    :param assignments: list of the assignments to q and p in order, each a (variable, number, rhs, comment) tuple
+      for the assignment variable(number) = rhs, where variable is 'q' or 'p' and rhs is in Fortran syntax.
+    """
+    statements = []
+    maxPhotolysisNumber = 0
+    for variable, number, rhs, comment in assignments:
+        maxPhotolysisNumber = max([maxPhotolysisNumber] + [int(n) for n in re.findall(r'\bJ\(([0-9]+)\)', rhs)])
+        statements.append('    ' + variable + '[' + str(number - 1) + '] = ' + numpy_expression(rhs).strip() + '  # ' +
+                          comment.strip() + '\n')
+
+    contents = ["""# Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py
+# Evaluation of the chemical mechanism with numpy, for a batch of conditions at once (see build/mech_numpy.py)
+from __future__ import division
+import numpy as np
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+numberOfSpecies = """ + str(len(speciesList)) + """
+numberOfReactions = """ + str(numberOfReactions) + """
+numberOfGenericComplex = """ + str(numberOfGenericComplex) + """
+maxPhotolysisNumber = """ + str(maxPhotolysisNumber) + """
+
+speciesNames = [""" + ', '.join(repr(str(x)) for x in speciesList) + """]
+
+# Species of the RO2, and reactions and species of the reactant and product terms, counting from 0
+ro2Species = """ + _index_array([n - 1 for n in ro2Numbers]) + """
+reactantReactions = """ + _index_array([r - 1 for r, _ in reactantPairs]) + """
+reactantSpecies = """ + _index_array([s - 1 for _, s in reactantPairs]) + """
+productReactions = """ + _index_array([r - 1 for r, _ in productPairs]) + """
+productSpecies = """ + _index_array([s - 1 for _, s in productPairs]) + """
+
+environmentArguments = """ + repr(environment_arguments) + """
+
+
+def rate_coefficients(""" + ', '.join(environment_arguments) + """, J, RO2):
+    \"\"\"
+    Return the rate coefficients q and p, of shape (numberOfGenericComplex, batch...) and (numberOfReactions,
+    batch...), for the conditions given as numbers or arrays, broadcast together into the shape of the batch. J is an
+    array of shape (maxPhotolysisNumber, batch...), in which J[i - 1] is the photolysis rate J(i).
+    \"\"\"
+    J = np.asarray(J, dtype=float)
+    shape = np.broadcast(""" + ', '.join(environment_arguments) + """, RO2, np.broadcast_to(0.0, J.shape[1:])).shape
+    q = np.zeros((numberOfGenericComplex,) + shape)
+    p = np.zeros((numberOfReactions,) + shape)
+"""]
+    contents.extend(statements)
+    contents.append("""    return q, p
+""")
+    contents.append(module_functions)
+    return ''.join(contents)
@@ -0,0 +1,151 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script contains the profiler used by build/mech_converter.py
+# with the options --profile and --stats-json. It records the wall
+# time and the peak memory of each stage of the conversion, together
+# with the size of the mechanism and of the generated files, and
+# writes them to a JSON file, so that they can be tracked over time.
+#
+# The memory is measured in two ways. The peak resident memory of the
+# process is recorded at the end of each stage, which costs nothing:
+# it only grows, so a stage which uses more memory than all the stages
+# before it shows up as an increase. Optionally, the peak memory of
+# each stage is also traced with the tracemalloc module: this is the
+# largest amount of memory allocated by Python during the stage, over
+# what was already allocated when it started. Tracing the memory slows
+# the conversion down several times, so the wall times are only
+# meaningful without it. tracemalloc is not available in Python 2.
+# ---------------------------------------------- #
+from __future__ import print_function
+import sys
+import json
+import platform
+from contextlib import contextmanager
+from timeit import default_timer as timer
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Version of the layout of the JSON file, to be increased when it changes
+stats_format_version = 1
+
+
+## ------------------------------------------------------------------ ##
+
+
+class NullProfiler(object):
+    """
+    A profiler which records nothing, used when profiling is not requested.
+    """
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def record(self, **metrics):
+        pass
+
+
+class StageProfiler(NullProfiler):
+    """
+    This class records the wall time and the peak memory of the stages of a conversion, and the metrics of the
+    mechanism.
+
+    - stages: list of dictionaries, one for each stage in order, with the keys 'name', 'time' (in seconds),
+      'maxResidentMemory' (peak resident memory of the process at the end of the stage, in bytes) and 'peakMemory'
+      (peak memory allocated during the stage, in bytes, if traced).
+    - metrics: dictionary of the metrics recorded with record().
+
+    :param trace_memory: if True, the peak memory of each stage is traced with tracemalloc, which is much slower. If
+      False (default), or if tracemalloc is not available, 'peakMemory' is None.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.stages = []
+        self.metrics = dict()
+        self.start_time = timer()
+
+    @contextmanager
+    def stage(self, name):
+        """Record the wall time and the memory of the code run in the with statement as the stage name."""
+        tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        start = timer()
+        try:
+            yield
+        finally:
+            elapsed = timer() - start
+            peakMemory = None
+            if tracing:
+                peakMemory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.stages.append({'name': name, 'time': elapsed, 'maxResidentMemory': max_resident_memory(),
+                                'peakMemory': peakMemory})
+
+    def record(self, **metrics):
+        """Record the given metrics, e.g. profiler.record(numberOfReactions=10)."""
+        self.metrics.update(metrics)
+
+    def as_dict(self):
+        """Return all that has been recorded as a dictionary, which can be written to JSON."""
+        return {'formatVersion': stats_format_version,
+                'python': platform.python_version(),
+                'totalTime': timer() - self.start_time,
+                'maxResidentMemory': max_resident_memory(),
+                'stages': self.stages,
+                'metrics': self.metrics}
+
+    def write_json(self, filename):
+        """Write all that has been recorded to the JSON file filename."""
+        with open(filename, 'w') as json_file:
+            json.dump(self.as_dict(), json_file, indent=2, sort_keys=True)
+            json_file.write('\n')
+
+    def report_lines(self):
+        """Return the stages and the metrics as a list of lines of text, for printing."""
+        def megabytes(x):
+            return '-' if x is None else '%.1f' % (x / 1024.0 ** 2)
+        lines = ['%-40s %10s %14s %14s' % ('Stage', 'Time (s)', 'Max RSS (MB)', 'Peak mem (MB)')]
+        for stage in self.stages:
+            lines.append('%-40s %10.3f %14s %14s' % (stage['name'], stage['time'], megabytes(stage['maxResidentMemory']),
+                                                     megabytes(stage['peakMemory'])))
+        lines.append('%-40s %10.3f' % ('Total', timer() - self.start_time))
+        for name in sorted(self.metrics):
+            lines.append(name + ': ' + str(self.metrics[name]))
+        return lines
+
+
+def max_resident_memory():
+    """
+    This function returns the peak resident memory of the process so far, in bytes, or None if it is not available.
+    """
+    # On Linux, ru_maxrss keeps the peak of the process before it called exec (e.g. of the Python process which
+    # started this one), so the peak of the current memory map (VmHWM) is read instead, if available
+    try:
+        with open('/proc/self/status', 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except EnvironmentError:
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes on Linux
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
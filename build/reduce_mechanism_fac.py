@@ -0,0 +1,385 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script reduces a chemical mechanism file in FACSIMILE format
+# (.fac) to the reactions that are needed to calculate the species
+# listed in outputSpecies.config and outputRates.config, starting from
+# the species listed in initialConcentrations.config,
+# speciesConstrained.config and speciesConstant.config, and writes the
+# reduced mechanism to a new .fac file, which can then be converted by
+# build/mech_converter.py.
+#
+# The species listed in outputSpecies.config, outputRates.config,
+# speciesConstrained.config and speciesConstant.config must be species
+# of the model, otherwise AtChem2 stops. These required species, and
+# all the reactions in which they are a reactant or a product, are
+# always kept. If a required species is not in the mechanism at all,
+# the script stops with an error.
+#
+# The reduction is done on the species-reaction graph, in two passes:
+# - forward: a reaction can take place only if all of its reactants
+#   are either initialised or produced by reactions that can take
+#   place. The other reactions, and the species that they alone
+#   produce, stay at zero concentration and are removed, unless they
+#   involve a required species (their rate is then zero).
+# - backward: the remaining reactions that produce or consume a
+#   required species are kept, and so are the reactions that produce
+#   or consume any of their reactants, and so on. If the rate of a
+#   kept reaction depends on RO2, all the RO2 species are kept as well.
+# The concentrations of the output species, and the rates of the
+# reactions in which they appear, are therefore the same with the
+# reduced mechanism as with the full mechanism. The reactions are
+# numbered differently, though, so the reaction numbers in
+# productionRates.output and lossRates.output change.
+#
+# The generic and complex rate coefficients that are not used by any
+# of the kept reactions are removed, and so are the species that are
+# no longer in the mechanism from the RO2 list and from the list of
+# species in the header. A report of the removed reactions, species,
+# rate coefficients and RO2 species is printed.
+#
+# ARGUMENTS:
+# - path to the .fac file
+# - path to the reduced .fac file
+# - path to the model configuration directory [default: model/configuration/]
+# ---------------------------------------------- #
+from __future__ import print_function
+import re
+import os
+import sys
+import argparse
+import mech_converter
+
+# The names in a rate expression: any coefficient referred to by a rate must be one of these
+name_regex = re.compile(r'\b[A-Za-z_][A-Za-z0-9_]*')
+
+# The number of names on each line of the lists of species written to the reduced .fac file
+names_per_line = 12
+
+
+## ------------------------------------------------------------------ ##
+
+
+def read_species_config(filename):
+    """
+    This function reads the species names from the first column of a configuration file, e.g.
+    initialConcentrations.config or outputSpecies.config. A missing file lists no species.
+
+    :param filename: string containing a relative or absolute reference to the configuration file.
+    :returns: list of the species names.
+    """
+    if not os.path.isfile(filename):
+        return []
+    with open(filename, 'r') as config_file:
+        return [line.split()[0] for line in config_file if line.strip()]
+
+
+def _is_fac_statement(line):
+    # Return True if the line of a .fac file is a statement (a rate coefficient, the RO2 list or a reaction), and False
+    # if it is a comment or a blank line, in the same way as parse_fac().
+    return not (line.isspace() or re.match('[!;*]', line) is not None)
+
+
+def possible_reactions(reactions, precursors):
+    """
+    This function finds the reactions that can take place, i.e. the reactions of which all the reactants are either
+    precursors, or produced by reactions that can take place. Each species is visited once, so that the time taken is
+    proportional to the number of reactant and product entries.
+
+    :param reactions: list of Reaction tuples.
+    :param precursors: iterable of the names of the species with a non-zero concentration at the start of the run.
+    :returns (possible, available): possible is a list of booleans, one for each reaction, while available is the set
+      of the species that are precursors, or products of the possible reactions.
+    """
+    # For each species, the reactions of which it is a reactant, and for each reaction, the number of its (distinct)
+    # reactants that are not available yet
+    consumers = dict()
+    missing = []
+    for i, reaction in enumerate(reactions):
+        reactants = set(reaction.reactants)
+        missing.append(len(reactants))
+        for x in reactants:
+            consumers.setdefault(x, []).append(i)
+
+    possible = [False] * len(reactions)
+    available = set()
+    pending = list(precursors)
+    # The reactions without reactants (e.g. emissions) can always take place
+    for i, reaction in enumerate(reactions):
+        if missing[i] == 0:
+            possible[i] = True
+            pending.extend(reaction.products)
+    while pending:
+        x = pending.pop()
+        if x in available:
+            continue
+        available.add(x)
+        for i in consumers.get(x, []):
+            missing[i] -= 1
+            if missing[i] == 0:
+                possible[i] = True
+                pending.extend(reactions[i].products)
+    return possible, available
+
+
+def _ro2_coefficients(coefficients):
+    # Return the set of the names of the rate coefficients which depend on RO2, directly or through other
+    # coefficients. Each coefficient is defined before it is used, so one pass is enough.
+    ro2Names = set(['RO2'])
+    for coefficient in coefficients:
+        if not ro2Names.isdisjoint(name_regex.findall(coefficient.expression)):
+            ro2Names.add(coefficient.name)
+    return ro2Names
+
+
+def needed_reactions(mechanism, possible, available, required):
+    """
+    This function finds the reactions that are needed to calculate the concentrations of the required species: all
+    the reactions that produce or consume a required species, and the possible reactions that produce or consume any
+    of the reactants of a needed possible reaction. If the rate of a needed possible reaction depends on RO2, all the
+    available RO2 species are needed as well. The reactions of the required species that cannot take place are kept
+    so that the species stay in the mechanism, but their rate is zero, so nothing else is needed for them.
+
+    :param mechanism: a Mechanism, as returned by mech_converter.parse_fac().
+    :param possible: list of booleans, one for each reaction, as returned by possible_reactions().
+    :param available: set of the available species, as returned by possible_reactions().
+    :param required: iterable of the names of the required species.
+    :returns: list of booleans, one for each reaction, True if the reaction is needed.
+    """
+    reactions = mechanism.reactions
+    ro2Names = _ro2_coefficients(mechanism.coefficients)
+    required = set(required)
+
+    # For each species, the possible reactions of which it is a reactant or a product
+    involved = dict()
+    for i, reaction in enumerate(reactions):
+        if possible[i]:
+            for x in set(reaction.reactants + reaction.products):
+                involved.setdefault(x, []).append(i)
+
+    needed = [False] * len(reactions)
+    for i, reaction in enumerate(reactions):
+        if not possible[i] and not required.isdisjoint(reaction.reactants + reaction.products):
+            needed[i] = True
+    neededSpecies = set(required)
+    pending = list(neededSpecies)
+    ro2Needed = False
+    while pending:
+        x = pending.pop()
+        for i in involved.get(x, []):
+            if needed[i]:
+                continue
+            needed[i] = True
+            newSpecies = list(reactions[i].reactants)
+            if not ro2Needed and not ro2Names.isdisjoint(name_regex.findall(reactions[i].rate)):
+                ro2Needed = True
+                newSpecies.extend([y for y in mechanism.ro2 if y in available])
+            for y in newSpecies:
+                if y not in neededSpecies:
+                    neededSpecies.add(y)
+                    pending.append(y)
+    return needed
+
+
+def needed_coefficients(coefficients, reactions):
+    """
+    This function finds the generic and complex rate coefficients that are used by the rates of the given reactions,
+    either directly or through other coefficients.
+
+    :param coefficients: list of Coefficient tuples, in the order of the .fac file.
+    :param reactions: list of the Reaction tuples that are kept.
+    :returns: list of booleans, one for each coefficient, True if the coefficient is used.
+    """
+    usedNames = set()
+    for reaction in reactions:
+        usedNames.update(name_regex.findall(reaction.rate))
+    # Each coefficient is defined before it is used, so going backwards one pass is enough
+    used = [False] * len(coefficients)
+    for i in reversed(range(len(coefficients))):
+        if coefficients[i].name in usedNames:
+            used[i] = True
+            usedNames.update(name_regex.findall(coefficients[i].expression))
+    return used
+
+
+def _name_list_lines(names, first, separator, last):
+    # Return the lines of a list of names, with names_per_line names on each line, as written in the .fac files.
+    lines = []
+    for start in range(0, max(len(names), 1), names_per_line):
+        lines.append(separator.join(names[start:start + names_per_line]))
+    lines[0] = first + lines[0]
+    lines[-1] += last
+    return [line.rstrip() + '\n' for line in lines]
+
+
+def reduced_fac_contents(sections, keptCoefficients, keptReactions, speciesList, ro2):
+    """
+    This function returns the contents of the reduced .fac file. All the comments are kept, while the removed rate
+    coefficients and reactions are left out, and the list of species in the header and the RO2 list are replaced.
+
+    :param sections: the sections of the .fac file, as returned by mech_converter.split_fac_sections().
+    :param keptCoefficients: list of booleans, one for each rate coefficient, True if the coefficient is kept.
+    :param keptReactions: list of booleans, one for each reaction, True if the reaction is kept.
+    :param speciesList: list of the species of the reduced mechanism.
+    :param ro2: list of the RO2 species of the reduced mechanism.
+    :returns: the contents of the reduced .fac file, as a string.
+    """
+    header, generic_rate_coefficients, complex_reactions, peroxy_radicals, reaction_definitions = sections
+    lines = []
+
+    # Replace the list of species after VARIABLE, up to the semicolon, if there is one: the species are kept in the
+    # same order, and any species that is not in the list is added at the end
+    variableNames = []
+    in_variable_list = False
+    for line in header:
+        if line.startswith('VARIABLE'):
+            in_variable_list = True
+            lines.append(None)
+        if not in_variable_list:
+            lines.append(line)
+            continue
+        variableNames.extend(line.replace('VARIABLE', '', 1).split(';')[0].split())
+        if ';' in line:
+            in_variable_list = False
+    if variableNames:
+        keptSpecies = set(speciesList)
+        listedNames = set(variableNames)
+        names = [x for x in variableNames if x in keptSpecies] + [x for x in speciesList if x not in listedNames]
+        position = lines.index(None)
+        lines[position:position + 1] = ['VARIABLE\n'] + _name_list_lines(names, '', ' ', ' ;')
+
+    i = 0
+    for line in generic_rate_coefficients + complex_reactions:
+        if _is_fac_statement(line):
+            if keptCoefficients[i]:
+                lines.append(line)
+            i += 1
+        else:
+            lines.append(line)
+
+    # Replace the RO2 list with the new one, where the old one starts
+    ro2_written = False
+    for line in peroxy_radicals:
+        if re.match(r'\*', line) or line.isspace():
+            lines.append(line)
+        elif not ro2_written:
+            lines.extend(_name_list_lines(ro2, 'RO2 = ', ' + ', ' ;'))
+            ro2_written = True
+
+    i = 0
+    for line in reaction_definitions:
+        if _is_fac_statement(line):
+            if keptReactions[i]:
+                lines.append(line)
+            i += 1
+        else:
+            lines.append(line)
+    return ''.join(lines)
+
+
+def _report_names(title, names):
+    # Print the number of names and the names themselves, names_per_line to a line.
+    print(title + ': ' + str(len(names)))
+    for start in range(0, len(names), names_per_line):
+        print('  ' + ' '.join(names[start:start + names_per_line]))
+
+
+def reduce_mechanism(input_file, output_file, config_dir):
+    """
+    This function reduces a .fac file to the reactions needed to calculate the output species, writes the reduced
+    .fac file and prints a report of what has been removed. A RuntimeError is raised if a species of
+    outputSpecies.config, outputRates.config, speciesConstrained.config or speciesConstant.config is not in the
+    mechanism.
+
+    :param input_file: string containing a relative or absolute reference to the .fac file.
+    :param output_file: string containing a relative or absolute reference to the reduced .fac file.
+    :param config_dir: string containing a relative or absolute reference to the model configuration directory.
+    """
+    with open(input_file, 'r') as fac_file:
+        sections = mech_converter.split_fac_sections(fac_file)
+    mechanism = mech_converter.parse_fac(sum(sections, []))
+    reactions = mechanism.reactions
+    coefficients = mechanism.coefficients
+
+    precursors = []
+    for filename in ['initialConcentrations.config', 'speciesConstrained.config', 'speciesConstant.config']:
+        precursors.extend(read_species_config(os.path.join(config_dir, filename)))
+    outputs = []
+    for filename in ['outputSpecies.config', 'outputRates.config']:
+        outputs.extend(read_species_config(os.path.join(config_dir, filename)))
+    # The constrained and constant species must be in the reduced mechanism too, even if no output depends on them
+    required = list(outputs)
+    for filename in ['speciesConstrained.config', 'speciesConstant.config']:
+        required.extend(read_species_config(os.path.join(config_dir, filename)))
+    print('Precursors: ' + ' '.join(sorted(set(precursors))))
+    print('Output species: ' + ' '.join(sorted(set(outputs))))
+
+    speciesList = mechanism.species
+    missing = sorted(set(required) - set(speciesList))
+    if missing:
+        raise RuntimeError('These species of the model configuration in ' + config_dir + ' are not species of the '
+                           'mechanism ' + input_file + ': ' + ' '.join(missing))
+
+    possible, available = possible_reactions(reactions, precursors)
+    keptReactions = needed_reactions(mechanism, possible, available, required)
+    keptCoefficients = needed_coefficients(coefficients, [x for x, kept in zip(reactions, keptReactions) if kept])
+
+    keptSpeciesList = mech_converter.species_numbering([x for x, kept in zip(reactions, keptReactions) if kept])[0]
+    keptSpecies = set(keptSpeciesList)
+    ro2 = [x for x in mechanism.ro2 if x in keptSpecies]
+
+    with open(output_file, 'w') as reduced_file:
+        reduced_file.write(reduced_fac_contents(sections, keptCoefficients, keptReactions, keptSpeciesList, ro2))
+
+    # Report what has been removed, and why
+    print('Reactions: ' + str(sum(keptReactions)) + ' of ' + str(len(reactions)) + ' kept')
+    impossibleRemoved = [x for x, isPossible, kept in zip(reactions, possible, keptReactions) if not (isPossible or kept)]
+    impossibleKept = [x for x, isPossible, kept in zip(reactions, possible, keptReactions) if kept and not isPossible]
+    notNeeded = [x for x, isPossible, kept in zip(reactions, possible, keptReactions) if isPossible and not kept]
+    for title, listed in [('Reactions that cannot take place', impossibleRemoved),
+                          ('Reactions that cannot take place, kept for the required species', impossibleKept),
+                          ('Reactions not needed for the output species', notNeeded)]:
+        print(title + ': ' + str(len(listed)))
+        for reaction in listed:
+            print('  ' + reaction.line.strip())
+    print('Species: ' + str(len(keptSpeciesList)) + ' of ' + str(len(speciesList)) + ' kept')
+    _report_names('Species that are never produced',
+                  [x for x in speciesList if x not in available and x not in keptSpecies])
+    _report_names('Species not needed for the output species',
+                  [x for x in speciesList if x in available and x not in keptSpecies])
+    _report_names('Rate coefficients removed', [x.name for x, kept in zip(coefficients, keptCoefficients) if not kept])
+    _report_names('RO2 species removed', [x for x in mechanism.ro2 if x not in keptSpecies])
+    print('Reduced mechanism written to ' + output_file)
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reduce a chemical mechanism file in FACSIMILE format (.fac) to the reactions needed to calculate the output species.')
+    parser.add_argument('input_filename', help='path to the .fac file')
+    parser.add_argument('output_filename', help='path to the reduced .fac file')
+    parser.add_argument('config_dir', nargs='?', default='./model/configuration/',
+                        help='path to the model configuration directory [default: ./model/configuration/]')
+    args = parser.parse_args()
+
+    # check the locations supplied exist
+    assert os.path.isfile(args.input_filename), 'Failed to find file ' + args.input_filename
+    assert os.path.exists(args.config_dir), 'Failed to find directory ' + args.config_dir
+
+    try:
+        reduce_mechanism(args.input_filename, args.output_filename, args.config_dir)
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -40,7 +40,7 @@ PROGRAM ATCHEM2
   use config_functions_mod
   use output_functions_mod
   use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec
-  use solver_functions_mod, only : jfy, proc
+  use solver_functions_mod, only : jfy, proc, proc_init, proc_env, proc_fast, proc_jac
   implicit none
 
   ! interface to linux API
@@ -105,7 +105,7 @@ PROGRAM ATCHEM2
 
   type(c_ptr) :: handle
   character(len=maxFilepathLength) :: library
-  type(c_funptr) :: proc_addr
+  type(c_funptr) :: proc_addr, proc_init_addr, proc_env_addr, proc_fast_addr, proc_jac_addr
   integer :: closure
   integer(c_int), parameter :: rtld_lazy=1 ! value extracted from the C header file
   integer(c_int), parameter :: rtld_now=2 ! value extracted from the C header file
@@ -185,6 +185,18 @@ PROGRAM ATCHEM2
   end if
   call c_f_procpointer( proc_addr, proc )
 
+  ! If the shared library also provides the rates split by what they
+  ! depend on (see build/mech_converter.py), use them, so that the
+  ! rates are only calculated when their inputs have changed
+  proc_init_addr = dlsym( handle, "init_p"//c_null_char )
+  proc_env_addr = dlsym( handle, "update_env_p"//c_null_char )
+  proc_fast_addr = dlsym( handle, "update_fast_p"//c_null_char )
+  if ( c_associated( proc_init_addr ) .and. c_associated( proc_env_addr ) .and. c_associated( proc_fast_addr ) ) then
+    call c_f_procpointer( proc_init_addr, proc_init )
+    call c_f_procpointer( proc_env_addr, proc_env )
+    call c_f_procpointer( proc_fast_addr, proc_fast )
+  end if
+
   write (*, '(A)') '-----------------------'
   write (*, '(A)') ' Species and reactions'
   write (*, '(A)') '-----------------------'
@@ -255,6 +267,19 @@ PROGRAM ATCHEM2
   call set_solver_parameters( getParametersFromFile( trim( configuration_dir ) // "/solver.parameters" ) )
   write (*,*)
 
+  ! If requested, load the analytic Jacobian matrix from the shared
+  ! library, and its sparsity pattern
+  if ( useAnalyticJacobian .eqv. .true. ) then
+    proc_jac_addr = dlsym( handle, "jacobian"//c_null_char )
+    if ( .not. c_associated( proc_jac_addr ) ) then
+      write(*,*) 'Unable to load the procedure jacobian - please run build/mech_converter.py again'
+      stop
+    end if
+    call c_f_procpointer( proc_jac_addr, proc_jac )
+    call readJacobianSparsity()
+    write (*,*)
+  end if
+
   ! Read in and set model parameters
   call set_model_parameters( getParametersFromFile( trim( configuration_dir ) //  "/model.parameters" ) )
   write (*,*)
@@ -413,6 +438,21 @@ PROGRAM ATCHEM2
     stop
   end if
 
+  ! USE THE ANALYTIC JACOBIAN MATRIX IF REQUESTED: FCVDJAC() for the
+  ! dense solver, FCVJTIMES() for the SPGMR solvers
+  if ( useAnalyticJacobian .eqv. .true. ) then
+    if ( solverType == 3 ) then
+      call FCVDENSESETJAC( 1, ier )
+    else
+      call FCVSPILSSETJAC( 1, ier )
+    end if
+    if ( ier /= 0 ) then
+      write (stderr,*) ' SUNDIALS_ERROR: setting the Jacobian matrix returned ier = ', ier
+      call FCVFREE()
+      stop
+    end if
+  end if
+
   ! *****************************************************************
   ! RUN MODEL
   ! *****************************************************************
@@ -624,3 +664,104 @@ subroutine FCVFUN( t, y, ydot, ipar, rpar, ier )
 end subroutine FCVFUN
 
 ! ******************************************************************** !
+
+
+! -------------------------------------------------------- !
+! Fortran routine for the product of the Jacobian matrix with the
+! vector v, used by the SPGMR solvers when the analytic Jacobian
+! matrix is requested in solver.parameters. The Jacobian matrix is
+! calculated for all the species; the constrained species are not
+! part of the system, so their rows and columns are left out.
+subroutine FCVJTIMES( v, fjv, t, y, fy, h, ipar, rpar, work, ier )
+  use types_mod
+  use constraints_mod, only : getNumberOfConstrainedSpecies, getConstrainedConcs, getConstrainedSpecies
+  use reaction_structure_mod, only : jacColPointers, jacRowIndices
+  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec
+  use solver_functions_mod, only : analytic_jacobian, jacValues
+  implicit none
+
+  real(kind=DP), intent(in) :: v(*), t, y(*), fy(*), h, rpar(*), work(*)
+  real(kind=DP), intent(out) :: fjv(*)
+  integer(kind=NPI), intent(in) :: ipar(*)
+  integer(kind=IntErr), intent(out) :: ier
+  integer(kind=NPI) :: numConSpec, np, numReac, i, j
+  real(kind=DP), allocatable :: z(:), zv(:), zfjv(:), zeros(:)
+
+  numConSpec = getNumberOfConstrainedSpecies()
+  np = ipar(1) + numConSpec
+  numReac = ipar(2)
+  allocate (z(np), zv(np), zfjv(np), zeros(numConSpec))
+  zeros(:) = 0.0_DP
+
+  ! The concentrations of the constrained species were set by the call
+  ! to FCVFUN() for the same t and y
+  call addConstrainedSpeciesToProbSpec( y, getConstrainedConcs(), getConstrainedSpecies(), z )
+  call analytic_jacobian( numReac, t, z )
+
+  call addConstrainedSpeciesToProbSpec( v, zeros, getConstrainedSpecies(), zv )
+  zfjv(:) = 0.0_DP
+  do j = 1, np
+    do i = jacColPointers(j), jacColPointers(j + 1) - 1
+      zfjv(jacRowIndices(i)) = zfjv(jacRowIndices(i)) + jacValues(i) * zv(j)
+    end do
+  end do
+  call removeConstrainedSpeciesFromProbSpec( zfjv, getConstrainedSpecies(), fjv )
+
+  deallocate (z, zv, zfjv, zeros)
+  ier = 0
+
+  return
+end subroutine FCVJTIMES
+
+! -------------------------------------------------------- !
+! Fortran routine for the dense Jacobian matrix, used by the dense
+! solver when the analytic Jacobian matrix is requested in
+! solver.parameters. As in FCVJTIMES(), the rows and columns of the
+! constrained species are left out.
+subroutine FCVDJAC( neq, t, y, fy, djac, h, ipar, rpar, wk1, wk2, wk3, ier )
+  use types_mod
+  use constraints_mod, only : getNumberOfConstrainedSpecies, getConstrainedConcs, getConstrainedSpecies
+  use reaction_structure_mod, only : jacColPointers, jacRowIndices
+  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec
+  use solver_functions_mod, only : analytic_jacobian, jacValues
+  implicit none
+
+  integer(kind=NPI), intent(in) :: neq
+  real(kind=DP), intent(in) :: t, y(*), fy(*), h, rpar(*), wk1(*), wk2(*), wk3(*)
+  real(kind=DP), intent(out) :: djac(neq,*)
+  integer(kind=NPI), intent(in) :: ipar(*)
+  integer(kind=IntErr), intent(out) :: ier
+  integer(kind=NPI) :: numConSpec, np, numReac, i, j, column
+  real(kind=DP), allocatable :: z(:), zcolumn(:)
+  logical, allocatable :: constrained(:)
+
+  numConSpec = getNumberOfConstrainedSpecies()
+  np = ipar(1) + numConSpec
+  numReac = ipar(2)
+  allocate (z(np), zcolumn(np), constrained(np))
+  constrained(:) = .false.
+  constrained(getConstrainedSpecies()) = .true.
+
+  call addConstrainedSpeciesToProbSpec( y, getConstrainedConcs(), getConstrainedSpecies(), z )
+  call analytic_jacobian( numReac, t, z )
+
+  ! Expand each column of an unconstrained species, and remove the
+  ! rows of the constrained species
+  column = 0
+  do j = 1, np
+    if ( constrained(j) .eqv. .true. ) cycle
+    column = column + 1
+    zcolumn(:) = 0.0_DP
+    do i = jacColPointers(j), jacColPointers(j + 1) - 1
+      zcolumn(jacRowIndices(i)) = jacValues(i)
+    end do
+    call removeConstrainedSpeciesFromProbSpec( zcolumn, getConstrainedSpecies(), djac(:, column) )
+  end do
+
+  deallocate (z, zcolumn, constrained)
+  ier = 0
+
+  return
+end subroutine FCVDJAC
+
+! ******************************************************************** !
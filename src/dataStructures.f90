@@ -468,6 +468,11 @@ module reaction_structure_mod
 
   integer(kind=NPI), allocatable :: clhs(:,:), crhs(:,:)
   real(kind=DP), allocatable :: clcoeff(:), crcoeff(:)
+  ! Sparsity pattern of the Jacobian matrix in Compressed Sparse
+  ! Column format, counting from 1 (see build/mech_jacobian.py): the
+  ! row numbers of the nonzero elements of column j are
+  ! jacRowIndices(jacColPointers(j):jacColPointers(j+1)-1)
+  integer(kind=NPI), allocatable :: jacColPointers(:), jacRowIndices(:)
 
 end module reaction_structure_mod
 
@@ -57,6 +57,11 @@ contains
   ! outputs lhs_size and rhs_size, which hold the number of lines in
   ! model/configuration/mechanism.(reac/prod), excluding the first line
   ! and last line
+  !
+  ! If mechanism.network exists (generated by build/mech_converter.py)
+  ! and matches mechanism.reac and mechanism.prod, the same data is
+  ! read from it in binary form instead, which avoids parsing the text
+  ! files.
   subroutine readReactions()
     use types_mod
     use directories_mod, only : configuration_dir
@@ -65,6 +70,14 @@ contains
     integer(kind=NPI) :: lhs_size, rhs_size
     integer(kind=NPI) :: k, l, count
     integer(kind=IntErr) :: ierr
+    logical :: network_exists, network_read
+
+    inquire(file=trim( configuration_dir ) // '/mechanism.network', exist=network_exists)
+    if ( network_exists ) then
+      call readReactionsFromNetwork( trim( configuration_dir ), network_read )
+      if ( network_read ) return
+      write (*, '(A)') ' mechanism.network does not match mechanism.reac and mechanism.prod, so it is not used.'
+    end if
 
     call inquire_or_abort( trim( configuration_dir ) // '/mechanism.reac', 'getReactantAndProductListSizes()')
     lhs_size = count_lines_in_file( trim( configuration_dir ) // '/mechanism.reac', skip_first_line_in=.true. )
@@ -120,6 +133,155 @@ contains
     return
   end subroutine readReactions
 
+  ! -----------------------------------------------------------------
+  ! Read the reactants and products of each reaction from the binary
+  ! file mechanism.network in directory (see build/mech_network.py for
+  ! the format), and fill clhs, crhs, clcoeff and crcoeff as
+  ! readReactions() does. The reactants and products are held in
+  ! Compressed Sparse Row format, with species indices counting from 0.
+  ! If the file is not in the expected format, does not match
+  ! mechanism.reac and mechanism.prod, or cannot be read in full,
+  ! network_read is set to .false. and nothing is allocated, so that
+  ! the text files can be read instead.
+  subroutine readReactionsFromNetwork( directory, network_read )
+    use types_mod
+    use species_mod, only : getNumberOfSpecies, getNumberOfReactions
+    use reaction_structure_mod
+
+    character(len=*), intent(in) :: directory
+    logical, intent(out) :: network_read
+    integer(kind=QI) :: header(9)
+    integer(kind=QI), allocatable :: reacIndptr(:), reacIndices(:), prodIndptr(:), prodIndices(:)
+    integer(kind=NPI) :: lhs_size, rhs_size, numSpec, numReac, reacBytes, prodBytes
+    integer(kind=NPI) :: i, k, count
+    integer(kind=IntErr) :: ierr
+    logical :: network_matches
+
+    network_read = .false.
+    open (10, file=directory // '/mechanism.network', status='old', access='stream', form='unformatted', &
+          iostat=ierr)
+    if ( ierr /= 0 ) return
+    read (10, iostat=ierr) header
+    if ( ierr /= 0 ) then
+      close (10, status='keep')
+      return
+    end if
+    ! header(1) contains the format version, which also guards against a
+    ! file written with a different byte order. The numbers of species
+    ! and reactions must be those of mechanism.reac (already read by
+    ! readNumberOfSpeciesAndReactions()), and header(8) and header(9)
+    ! must be the sizes of mechanism.reac and mechanism.prod: otherwise,
+    ! the text files have been regenerated or edited since the file was
+    ! written. There is no standard way to compare the modification
+    ! times of the files in Fortran.
+    inquire(file=directory // '/mechanism.reac', size=reacBytes)
+    inquire(file=directory // '/mechanism.prod', size=prodBytes)
+    numSpec = getNumberOfSpecies()
+    numReac = getNumberOfReactions()
+    network_matches = ( header(1) == 2 ) .and. ( header(2) == numSpec ) .and. ( header(3) == numReac ) .and. &
+                      ( header(5) >= 0 ) .and. ( header(6) >= 0 ) .and. &
+                      ( header(8) == reacBytes ) .and. ( header(9) == prodBytes )
+    if ( .not. network_matches ) then
+      close (10, status='keep')
+      return
+    end if
+    lhs_size = header(5)
+    rhs_size = header(6)
+
+    ! indices(indptr(i)+1:indptr(i+1)) contains the species numbers
+    ! (counting from 0) of the reactants (products) of reaction i. The
+    ! arrays are checked before anything is allocated, so that the text
+    ! files can be read instead of a truncated or corrupted file.
+    allocate (reacIndptr(numReac + 1), reacIndices(lhs_size), prodIndptr(numReac + 1), prodIndices(rhs_size))
+    read (10, iostat=ierr) reacIndptr, reacIndices
+    if ( ierr == 0 ) read (10, iostat=ierr) prodIndptr, prodIndices
+    close (10, status='keep')
+    if ( ierr /= 0 ) return
+    network_matches = ( reacIndptr(1) == 0 ) .and. ( reacIndptr(numReac + 1) == lhs_size ) .and. &
+                      all( reacIndptr(2:) >= reacIndptr(:numReac) ) .and. &
+                      all( reacIndices >= 0 .and. reacIndices < numSpec ) .and. &
+                      ( prodIndptr(1) == 0 ) .and. ( prodIndptr(numReac + 1) == rhs_size ) .and. &
+                      all( prodIndptr(2:) >= prodIndptr(:numReac) ) .and. &
+                      all( prodIndices >= 0 .and. prodIndices < numSpec )
+    if ( .not. network_matches ) return
+
+    allocate (clhs(2, lhs_size), crhs(2, rhs_size), clcoeff(lhs_size), crcoeff(rhs_size))
+
+    write (*, '(A, I0)') ' Size of lhs = ', lhs_size
+    write (*, '(A, I0)') ' Size of rhs = ', rhs_size
+    write (*,*)
+    write (*, '(A)') ' Reading reactants (lhs) from mechanism.network...'
+    count = 0
+    do i = 1, numReac
+      do k = reacIndptr(i) + 1, reacIndptr(i + 1)
+        count = count + 1
+        clhs(1, count) = i
+        clhs(2, count) = reacIndices(k) + 1
+        clcoeff(count) = 1.0_DP
+      end do
+    end do
+
+    write (*, '(A)') ' Reading products (rhs) from mechanism.network...'
+    count = 0
+    do i = 1, numReac
+      do k = prodIndptr(i) + 1, prodIndptr(i + 1)
+        count = count + 1
+        crhs(1, count) = i
+        crhs(2, count) = prodIndices(k) + 1
+        crcoeff(count) = 1.0_DP
+      end do
+    end do
+    deallocate (reacIndptr, reacIndices, prodIndptr, prodIndices)
+
+    write (*, '(A)') ' Finished reading lhs and rhs data.'
+    network_read = .true.
+
+    return
+  end subroutine readReactionsFromNetwork
+
+  ! -----------------------------------------------------------------
+  ! Read the sparsity pattern of the Jacobian matrix from
+  ! mechanism.sparsity (generated by build/mech_converter.py, see
+  ! build/mech_jacobian.py for the format), and fill jacColPointers
+  ! and jacRowIndices. The comment lines at the top of the file are
+  ! skipped.
+  subroutine readJacobianSparsity()
+    use types_mod
+    use directories_mod, only : configuration_dir
+    use storage_mod, only : maxFilepathLength
+    use species_mod, only : getNumberOfSpecies
+    use reaction_structure_mod, only : jacColPointers, jacRowIndices
+
+    character(len=maxFilepathLength) :: fileLocation, line
+    integer(kind=NPI) :: numSpec, numNonZeros
+    integer(kind=IntErr) :: ierr
+
+    write (*, '(A)') ' Reading sparsity pattern of the Jacobian matrix from mechanism.sparsity...'
+    fileLocation = trim( configuration_dir ) // '/mechanism.sparsity'
+    call inquire_or_abort( fileLocation, 'readJacobianSparsity()')
+    open (10, file=fileLocation, status='old') ! input file
+    line = '!'
+    ierr = 0
+    do while ( ( line(1:1) == '!' ) .and. ( ierr == 0 ) )
+      read (10, '(A)', iostat=ierr) line
+    end do
+    if ( ierr /= 0 ) then
+      stop 'readJacobianSparsity(): error reading file'
+    end if
+    read (line,*) numSpec, numNonZeros
+    if ( numSpec /= getNumberOfSpecies() ) then
+      stop 'readJacobianSparsity(): the number of species in mechanism.sparsity does not match mechanism.reac'
+    end if
+    allocate (jacColPointers(numSpec + 1), jacRowIndices(numNonZeros))
+    read (10,*) jacColPointers
+    read (10,*) jacRowIndices
+    close (10, status='keep')
+    write (*, '(A, I0)') ' Number of nonzero elements of the Jacobian matrix = ', numNonZeros
+    write (*, '(A)') ' Finished reading sparsity pattern of the Jacobian matrix.'
+
+    return
+  end subroutine readJacobianSparsity
+
   ! -----------------------------------------------------------------
   ! Read in all species names and numbers from mechanism.species
   function readSpecies() result ( speciesName )
@@ -37,6 +37,7 @@ module solver_params_mod
   integer(kind=NPI) :: maxNumInternalSteps
   integer(kind=SI) :: solverType
   integer(kind=NPI) :: preconBandUpper, preconBandLower
+  logical :: useAnalyticJacobian
   character(len=30) :: solverTypeName(3)
 
 contains
@@ -47,7 +48,7 @@ contains
   subroutine set_solver_parameters( input_parameters )
     use types_mod
 
-    real(kind=DP) :: input_parameters(*)
+    real(kind=DP) :: input_parameters(:)
 
     write (*, '(A)') ' Reading solver parameters from file...'
     solverTypeName(1) = 'SPGMR'
@@ -83,6 +84,16 @@ contains
     ! is retained as an approximation of the Jacobian.
     preconBandUpper = nint( input_parameters(8), NPI )
     preconBandLower = nint( input_parameters(9), NPI )
+    ! Used to choose how the solver gets the Jacobian matrix:
+    ! 0: by finite differences of the rate equations
+    ! 1: from the subroutine jacobian in mechanism.f90, using the
+    !    sparsity pattern in mechanism.sparsity
+    ! This parameter is optional, for compatibility with older
+    ! solver.parameters files, and is 0 if it is missing.
+    useAnalyticJacobian = .false.
+    if ( size( input_parameters ) >= 10 ) then
+      useAnalyticJacobian = ( nint( input_parameters(10), SI ) == 1_SI )
+    end if
 
     ! float format
     100 format (A18, 1P E11.3)
@@ -99,6 +110,9 @@ contains
     write (*, 200) 'preconBandUpper: ', preconBandUpper
     write (*, 200) 'preconBandLower: ', preconBandLower
     write (*, '(A18, A)') 'solverType: ', adjustl( solverTypeName(solverType) )
+    if ( useAnalyticJacobian .eqv. .true. ) then
+      write (*, '(A18, A)') 'Jacobian: ', 'analytic'
+    end if
     write (*, '(A)') ' ------------------'
     write (*,*)
     write (*, '(A)') ' Finished reading solver parameters from file.'
@@ -19,6 +19,7 @@
 ! and manipulate the rate information towards solving the system.
 ! ******************************************************************** !
 module solver_functions_mod
+  use types_mod, only : DP
   implicit none
 
   ! Define interface of call-back routine.
@@ -30,7 +31,37 @@ module solver_functions_mod
     end subroutine called_proc
   end interface
 
+  ! Define interface of the routine calculating the Jacobian matrix.
+  abstract interface
+    subroutine jacobian_proc( p, y, jac ) bind ( c )
+      use, intrinsic :: iso_c_binding
+      real(c_double), intent(in) :: p(*), y(*)
+      real(c_double), intent(inout) :: jac(*)
+    end subroutine jacobian_proc
+  end interface
+
   procedure(called_proc), pointer :: proc
+  ! Optional procedures calculating separately the rates which are
+  ! constant, which depend only on the environment variables, and
+  ! which depend on the photolysis rates or RO2. If they are not
+  ! associated, proc is used to calculate all the rates at each call.
+  procedure(called_proc), pointer :: proc_init => null(), proc_env => null(), proc_fast => null()
+
+  ! Rates and rate coefficients kept between calls to mechanism_rates()
+  ! when proc_fast is associated, and the values of the environment
+  ! variables that they were last calculated with
+  real(kind=DP), allocatable :: savedP(:), savedQ(:)
+  real(kind=DP) :: savedEnvValues(12)
+
+  ! Optional procedure calculating the analytic Jacobian matrix. It is
+  ! associated only if this is requested in solver.parameters.
+  procedure(jacobian_proc), pointer :: proc_jac => null()
+
+  ! Nonzero elements of the Jacobian matrix, in the order of
+  ! jacRowIndices, and the time and concentrations that they were last
+  ! calculated with (see analytic_jacobian())
+  real(kind=DP), allocatable :: jacValues(:), jacY(:)
+  real(kind=DP) :: jacT
 
 contains
 
@@ -104,7 +135,7 @@ contains
   ! subroutine to calculate the Jacobian matrix of the system
   subroutine jfy( nr, y, t )
     use types_mod
-    use reaction_structure_mod ! access crhs, clhs, clcoeff, crcoeff
+    use reaction_structure_mod ! access crhs, clhs, clcoeff, crcoeff, jacColPointers, jacRowIndices
 
     integer(kind=NPI), intent(in) :: nr
     real(kind=DP), intent(in) :: y(:), t
@@ -134,27 +165,42 @@ contains
     ! set jacobian matrix to zero
     fy(:,:) = 0.0_DP
 
-    ! call routine to get reaction rates in array p. Each element of p
-    ! corresponds to a single reaction
-    call mechanism_rates( t, y, p )
-
-    do j = 1, size( y )
-      r(1:nr) = 0.0_DP
-      do i = 1, size( clhs, 2 )
-        if ( clhs(2, i) == j ) then
-          r(clhs(1, i)) = p(clhs(1, i))
-        end if
+    if ( associated( proc_jac ) ) then
+      ! Use the analytic Jacobian matrix, and expand it from its
+      ! Compressed Sparse Column format
+      call analytic_jacobian( nr, t, y )
+      do j = 1, size( y )
+        do i = jacColPointers(j), jacColPointers(j + 1) - 1
+          fy(jacRowIndices(i), j) = jacValues(i)
+        end do
       end do
-      do i = 1, size( clhs, 2)
-        if ( clhs(2, i) == j ) then
-          r(clhs(1, i)) = r(clhs(1, i)) * clcoeff(i) * y(clhs(2, i)) ** ( clcoeff(i) - 1 )
-        else
-          r(clhs(1, i)) = r(clhs(1, i)) * y(clhs(2, i)) ** clcoeff(i)
-        end if
+    else
+      ! call routine to get reaction rates in array p. Each element of p
+      ! corresponds to a single reaction
+      !
+      ! N.B.: the Jacobian matrix below is only right if no species is
+      ! a reactant more than once, or a product more than once (see
+      ! the known issue in tests/check_jacobian.py)
+      call mechanism_rates( t, y, p )
+
+      do j = 1, size( y )
+        r(1:nr) = 0.0_DP
+        do i = 1, size( clhs, 2 )
+          if ( clhs(2, i) == j ) then
+            r(clhs(1, i)) = p(clhs(1, i))
+          end if
+        end do
+        do i = 1, size( clhs, 2)
+          if ( clhs(2, i) == j ) then
+            r(clhs(1, i)) = r(clhs(1, i)) * clcoeff(i) * y(clhs(2, i)) ** ( clcoeff(i) - 1 )
+          else
+            r(clhs(1, i)) = r(clhs(1, i)) * y(clhs(2, i)) ** clcoeff(i)
+          end if
+        end do
+        fy(clhs(2,:), j) = fy(clhs(2,:), j) - clcoeff(:) * r(clhs(1,:))
+        fy(crhs(2,:), j) = fy(crhs(2,:), j) + crcoeff(:) * r(crhs(1,:))
       end do
-      fy(clhs(2,:), j) = fy(clhs(2,:), j) - clcoeff(:) * r(clhs(1,:))
-      fy(crhs(2,:), j) = fy(crhs(2,:), j) + crcoeff(:) * r(crhs(1,:))
-    end do
+    end if
 
     ! Loop over all elements of fy, and print to jacobian.output,
     ! prefixed by t
@@ -166,6 +212,35 @@ contains
     return
   end subroutine jfy
 
+  ! ----------------------------------------------------------------- !
+  ! Calculates the nonzero elements of the analytic Jacobian matrix of
+  ! the system, for all the species, into jacValues, using proc_jac.
+  ! The solver asks for the Jacobian matrix repeatedly for the same
+  ! time and concentrations (e.g. once per linear iteration), so it is
+  ! only calculated again when these have changed.
+  subroutine analytic_jacobian( nr, t, y )
+    use types_mod
+    use reaction_structure_mod, only : jacRowIndices
+
+    integer(kind=NPI), intent(in) :: nr ! number of reactions
+    real(kind=DP), intent(in) :: t, y(:)
+    real(kind=DP) :: p(nr)
+
+    if ( allocated( jacValues ) ) then
+      if ( ( t == jacT ) .and. all( y == jacY ) ) return
+    else
+      allocate (jacValues(size( jacRowIndices )), jacY(size( y )))
+    end if
+
+    ! get values of reactions rates, and the Jacobian matrix from them
+    call mechanism_rates( t, y, p )
+    call proc_jac( p, y, jacValues )
+    jacT = t
+    jacY(:) = y(:)
+
+    return
+  end subroutine analytic_jacobian
+
   ! -----------------------------------------------------------------
   ! calculates rate constants from arrhenius information output p(:)
   ! contains the rate of each reaction
@@ -194,6 +269,7 @@ contains
     integer(kind=NPI) :: i
     character(len=maxEnvVarNameLength) :: this_env_var_name
     real(kind=DP) :: n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa
+    real(kind=DP) :: envValues(size( savedEnvValues ))
 
     ro2 = ro2sum( y )
     dummy = y(1)
@@ -256,7 +332,25 @@ contains
     !TODO: is this necessary a second time?
     ro2 = ro2sum( y )
 
-    call proc( p, q, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+    if ( associated( proc_fast ) ) then
+      ! Calculate the constant rates once, the rates that depend only
+      ! on the environment variables when these change, and the other
+      ! rates at each call
+      envValues = [ temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa ]
+      if ( .not. allocated( savedP ) ) then
+        allocate( savedP(size( p )), savedQ(size( q )) )
+        call proc_init( savedP, savedQ, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+        call proc_env( savedP, savedQ, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+        savedEnvValues = envValues
+      else if ( any( envValues /= savedEnvValues ) ) then
+        call proc_env( savedP, savedQ, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+        savedEnvValues = envValues
+      end if
+      call proc_fast( savedP, savedQ, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+      p(:) = savedP(:)
+    else
+      call proc( p, q, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+    end if
 
     return
   end subroutine mechanism_rates
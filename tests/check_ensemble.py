@@ -0,0 +1,195 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script checks how tools/ensemble/atchem2_ensemble.py decides
+# whether a variant has completed, on the tests:
+# - check_completed() must accept a run directory made of the
+#   reference files of the test (the screen output, TEST.out.cmp, and
+#   output/speciesConcentrations.output.cmp), and reject it if the
+#   screen output stops before the final statistics, or if the last
+#   output time is missing. So must check_reference() of
+#   tools/ensemble/tune_solver.py, if the last output time is missing.
+# - with --executable, the script runs an ensemble of two variants of
+#   the test: complete, with the configuration of the test, and
+#   stopped, with a species which is not in the mechanism added to
+#   speciesConstant.config, so that AtChem2 stops with exit code 0
+#   before the end of the run. complete must be marked as done and
+#   collected into the dataset, while stopped must be reported as
+#   FAILED, and neither marked as done nor collected. The mechanism of
+#   the test must have been built (configuration/mechanism.so).
+#
+# The log of each test ends with a line "-> LABEL: TEST PASSED" or
+# "-> LABEL: TEST FAILED".
+#
+# The exit code is 0 if all the tests pass, 1 if any test fails, and
+# 2 if a file cannot be read.
+#
+# ARGUMENTS:
+# - path to the directory of the tests
+# - names of the tests
+#
+# OPTIONS:
+# - --executable FILE: AtChem2 executable [default: do not run the
+#   ensemble]
+# - --mcm DIR: MCM data files directory [default: mcm/]
+# - --label LABEL: label of the tests in the log [default: ensemble
+#   test]
+# - --log FILE: append the log to FILE [default: print it]
+#
+# USAGE:
+#   python ./tests/check_ensemble.py tests/model_tests firstorder --executable ./atchem2
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ensemble_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tools', 'ensemble')
+sys.path.insert(0, ensemble_dir)
+import atchem2_ensemble
+import tune_solver
+
+ensemble_text = """complete
+stopped speciesConstant.config:NOTASPECIES=1.0e+10
+"""
+
+
+## ------------------------------------------------------------------ ##
+
+
+def _write_run_dir(run_dir, test_dir, test, log_lines=None, output_lines=None):
+    # Write a run directory made of the reference files of a test, keeping only the first log_lines lines of the screen
+    # output and the first output_lines lines of speciesConcentrations.output, if given.
+    os.makedirs(os.path.join(run_dir, 'output'))
+    shutil.copytree(os.path.join(test_dir, 'configuration'), os.path.join(run_dir, 'configuration'))
+    for source, target, count in [(test + '.out.cmp', 'atchem2.log', log_lines),
+                                  (os.path.join('output', 'speciesConcentrations.output.cmp'),
+                                   os.path.join('output', 'speciesConcentrations.output'), output_lines)]:
+        with open(os.path.join(test_dir, source), 'r') as source_file:
+            lines = source_file.readlines()
+        with open(os.path.join(run_dir, target), 'w') as target_file:
+            target_file.write(''.join(lines[:count]))
+
+
+def check_completed_runs(test_dir, test, work_dir):
+    """
+    This function checks check_completed() and check_reference() on run directories made of the reference files of a
+    test.
+
+    :returns: list of lines of the log, one for each failure
+    """
+    with open(os.path.join(test_dir, test + '.out.cmp'), 'r') as log_file:
+        statistics = [i for i, line in enumerate(log_file) if 'Final statistics' in line][0]
+    log = []
+    for name, log_lines, output_lines, completed in [('reference', None, None, True),
+                                                     ('no_statistics', statistics, None, False),
+                                                     ('no_end', None, -1, False)]:
+        run_dir = os.path.join(work_dir, name)
+        _write_run_dir(run_dir, test_dir, test, log_lines, output_lines)
+        error = atchem2_ensemble.check_completed(run_dir)
+        if (error is None) != completed:
+            log.append('  check_completed() on the ' + name + ' run: ' + (error if error is not None else
+                                                                        'completed, but it has not'))
+        if name != 'no_statistics':
+            error = tune_solver.check_reference(run_dir)
+            if (error is None) != completed:
+                log.append('  check_reference() on the ' + name + ' run: ' + (error if error is not None else
+                                                                            'covers the whole run, but it does not'))
+    return log
+
+
+def check_ensemble_run(test_dir, work_dir, executable, mcm_dir):
+    """
+    This function runs an ensemble of two variants of a test, one of which stops before the end of the run, and checks
+    that only the other one is marked as done and collected.
+
+    :returns: list of lines of the log, one for each failure
+    """
+    ensemble_filename = os.path.join(work_dir, 'ensemble.txt')
+    with open(ensemble_filename, 'w') as ensemble_file:
+        ensemble_file.write(ensemble_text)
+    command = [sys.executable, os.path.join(ensemble_dir, 'atchem2_ensemble.py'), ensemble_filename,
+               os.path.join(work_dir, 'ensemble_runs'), '--configuration', os.path.join(test_dir, 'configuration'),
+               '--constraints', os.path.join(test_dir, 'constraints'), '--mcm', mcm_dir, '--executable', executable,
+               '--jobs', '2']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    output = process.communicate()[0]
+
+    log = []
+    if process.returncode != 1 or 'stopped: FAILED' not in output or 'complete: done' not in output:
+        log.append('  the ensemble did not report the variant stopped as FAILED and complete as done:')
+        log.extend('    ' + line for line in output.splitlines())
+    for name, done in [('complete', True), ('stopped', False)]:
+        if os.path.isfile(os.path.join(work_dir, 'ensemble_runs', 'runs', name, 'done')) != done:
+            log.append('  the variant ' + name + (' is not' if done else ' is') + ' marked as done')
+    index_filename = os.path.join(work_dir, 'ensemble_runs', 'dataset', 'index.json')
+    if os.path.isfile(index_filename):
+        with open(index_filename, 'r') as index_file:
+            variants = json.load(index_file)['variants']
+        if variants != ['complete']:
+            log.append('  the dataset holds the variants ' + ' '.join(variants) + ' instead of complete')
+    else:
+        log.append('  the dataset has not been written')
+    return log
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check how tools/ensemble/atchem2_ensemble.py decides whether a '
+                                                 'variant has completed.')
+    parser.add_argument('tests_dir', help='path to the directory of the tests')
+    parser.add_argument('tests', nargs='+', help='names of the tests')
+    parser.add_argument('--executable', help='AtChem2 executable [default: do not run the ensemble]')
+    parser.add_argument('--mcm', default='./mcm/', help='MCM data files directory [default: ./mcm/]')
+    parser.add_argument('--label', default='ensemble test', help='label of the tests in the log')
+    parser.add_argument('--log', help='append the log to this file')
+    args = parser.parse_args()
+
+    results = []
+    work_dir = tempfile.mkdtemp()
+    try:
+        for test in args.tests:
+            test_dir = os.path.join(args.tests_dir, test)
+            test_work_dir = os.path.join(work_dir, test)
+            log = check_completed_runs(test_dir, test, os.path.join(test_work_dir, 'completed'))
+            if args.executable is not None:
+                os.makedirs(os.path.join(test_work_dir, 'ensemble'))
+                log.extend(check_ensemble_run(test_dir, os.path.join(test_work_dir, 'ensemble'), args.executable,
+                                              args.mcm))
+            results.append((test, not log, log))
+    except EnvironmentError as e:
+        print('Check failed: ' + str(e), file=sys.stderr)
+        sys.exit(2)
+    finally:
+        shutil.rmtree(work_dir)
+
+    log_file = open(args.log, 'a') if args.log else sys.stdout
+    try:
+        for test, passed, log in results:
+            for line in log:
+                log_file.write(line + '\n')
+            log_file.write('-> ' + args.label + ': ' + test + (' PASSED' if passed else ' FAILED') + '\n\n')
+            if args.log:
+                print('*', test)
+    finally:
+        if args.log:
+            log_file.close()
+    sys.exit(0 if all(passed for _, passed, _ in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
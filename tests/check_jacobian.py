@@ -0,0 +1,283 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script checks the analytic Jacobian matrix of the mechanism of
+# the tests (the subroutine jacobian of configuration/mechanism.f90,
+# written by build/mech_converter.py, see build/mech_jacobian.py).
+#
+# mechanism.f90 is compiled into a shared library, and the Jacobian
+# matrix is calculated with jacobian() at the concentrations of each
+# output time of speciesConcentrations.output.cmp, from the rate
+# coefficients calculated with update_p() from the
+# environmentVariables.output.cmp and photolysisRates.output.cmp
+# reference files at that time (the output times without environment
+# variables, i.e. the start of the run, are skipped). At each of these
+# times:
+# - the Jacobian matrix must be the central differences of the rate
+#   equations, calculated with reaction_rates() and production_loss()
+#   of the numpy evaluation of the mechanism (configuration/mechanism.py)
+#   with the same rate coefficients. The rates are at most quadratic in
+#   each concentration, so the central differences are exact for any
+#   step.
+# - the Jacobian matrix must be the matrix written by the model in
+#   jacobian.output.cmp at that time, if any. jfy() writes it at the
+#   concentrations of the output time (see src/atchem2.f90).
+#
+# Known issue: without the analytic Jacobian matrix, jfy() (in
+# src/solverFunctions.f90) only gets the Jacobian matrix right if no
+# species is a reactant more than once, or a product more than once,
+# in mechanism.reac and mechanism.prod. With a repeated reactant (A +
+# A) it misses the factor of the concentration and the number of times
+# the species appears (e.g. -k instead of -4*k*A in the secondorder
+# test), and when a species appears more than once, only the last of
+# its terms is kept in each column. The reference files of these tests
+# (e.g. secondorder, and the tests in tests/tests/ with MCM reactions
+# such as HO2 + HO2) hold these values, so the comparison with
+# jacobian.output.cmp is skipped for them, and only the central
+# differences are checked.
+#
+# The numbers are compared with the same tolerances as
+# tests/compare_output.py. The log of each test ends with a line
+# "-> LABEL: TEST PASSED" or "-> LABEL: TEST FAILED".
+#
+# The exit code is 0 if all the tests pass, 1 if any test fails, and
+# 2 if a file cannot be read or mechanism.f90 cannot be compiled.
+#
+# ARGUMENTS:
+# - path to the directory of the tests
+# - names of the tests
+#
+# OPTIONS:
+# - --compiler "COMMAND": command to compile mechanism.f90 into a
+#   shared library, as in the Makefile [default: gfortran
+#   -ffree-line-length-none -ffree-form -fimplicit-none -fPIC -shared]
+# - --absolute-tolerance X [default: 1.e-12]
+# - --relative-tolerance X [default: 5.0e-05]
+# - --label LABEL: label of the tests in the log [default: jacobian
+#   test]
+# - --log FILE: append the log to FILE [default: print it]
+#
+# USAGE:
+#   python ./tests/check_jacobian.py tests/model_tests firstorder static
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import ctypes
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+import numpy as np
+
+from check_numpy_mechanism import load_mechanism, read_table, different, conditions_at
+
+# Number of differences of each kind reported in the log of a test
+max_reported = 5
+
+default_compiler = 'gfortran -ffree-line-length-none -ffree-form -fimplicit-none -fPIC -shared'
+
+
+## ------------------------------------------------------------------ ##
+
+
+def compile_mechanism(filename, compiler, work_dir):
+    """
+    This function compiles mechanism.f90 into a shared library, and loads it.
+
+    :param filename: path to mechanism.f90
+    :param compiler: command to compile mechanism.f90 into a shared library
+    :param work_dir: directory of the shared library, which must be different for each mechanism
+    :returns: the shared library, as a ctypes.CDLL
+    """
+    shutil.copy(filename, os.path.join(work_dir, 'mechanism.f90'))
+    subprocess.check_output(compiler.split() + ['-o', 'mechanism.so', 'mechanism.f90'], cwd=work_dir,
+                            stderr=subprocess.STDOUT)
+    return ctypes.CDLL(os.path.join(work_dir, 'mechanism.so'))
+
+
+def read_sparsity(filename):
+    """
+    This function reads mechanism.sparsity.
+
+    :param filename: path to mechanism.sparsity
+    :returns: tuple (row indices, column indices) of the nonzero elements, counting from 0, in the order of jacobian()
+    """
+    with open(filename, 'r') as sparsity_file:
+        numbers = [int(line.split()[0]) for line in sparsity_file if line.strip() and not line.startswith('!')]
+    numberOfSpecies = numbers[0]
+    colPointers = np.array(numbers[1:numberOfSpecies + 2]) - 1
+    rows = np.array(numbers[numberOfSpecies + 2:], dtype=np.intp) - 1
+    return rows, np.repeat(np.arange(numberOfSpecies), np.diff(colPointers))
+
+
+def read_jacobian(filename, numberOfSpecies):
+    """
+    This function reads jacobian.output, as written by jfy(): the time and a row of the matrix on each row, and a
+    separator line after each matrix.
+
+    :param filename: path to jacobian.output
+    :param numberOfSpecies: the number of species
+    :returns: dictionary mapping each time to the Jacobian matrix
+    """
+    with open(filename, 'r') as jacobian_file:
+        blocks = jacobian_file.read().split('---------------')[:-1]
+    matrices = dict()
+    for block in blocks:
+        values = np.array(block.split(), dtype=float).reshape(numberOfSpecies, -1)
+        matrices[values[0, 0]] = values[:, 1:]
+    return matrices
+
+
+def pointer(x):
+    # Return a pointer to the data of the float array x, for ctypes.
+    return x.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+
+
+def check_test(tests_dir, test, compiler, absolute_tolerance, relative_tolerance):
+    """
+    This function checks the analytic Jacobian matrix of the mechanism of a test against the central differences of the
+    rate equations, and against its reference file.
+
+    :returns: tuple (True if the test passed, list of lines of the log)
+    """
+    test_dir = os.path.join(tests_dir, test)
+    configuration_dir = os.path.join(test_dir, 'configuration')
+    mechanism = load_mechanism(os.path.join(configuration_dir, 'mechanism.py'))
+    numberOfSpecies = mechanism['numberOfSpecies']
+    rows, columns = read_sparsity(os.path.join(configuration_dir, 'mechanism.sparsity'))
+    output_dir = os.path.join(test_dir, 'output')
+    concentrations = read_table(os.path.join(output_dir, 'speciesConcentrations.output.cmp'))
+    environment = read_table(os.path.join(output_dir, 'environmentVariables.output.cmp'))
+    photolysis = read_table(os.path.join(output_dir, 'photolysisRates.output.cmp'))
+    references = read_jacobian(os.path.join(output_dir, 'jacobian.output.cmp'), numberOfSpecies)
+    referenceTimes = np.array(sorted(references))
+
+    log = []
+    missing = [name for name in mechanism['speciesNames'] if name not in concentrations]
+    if missing:
+        log.append('  the concentrations of ' + ' '.join(missing) + ' are not in speciesConcentrations.output.cmp')
+        return False, log
+    # See the known issue at the top of this file
+    compare_references = (len(set(mechanism['reactantSpecies'])) == len(mechanism['reactantSpecies']) and
+                          len(set(mechanism['productSpecies'])) == len(mechanism['productSpecies']))
+    if references and not compare_references:
+        log.append('  not compared with jacobian.output.cmp: a species is a reactant or a product more than once '
+                   '(known issue of jfy())')
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        library = compile_mechanism(os.path.join(configuration_dir, 'mechanism.f90'), compiler, work_dir)
+    finally:
+        shutil.rmtree(work_dir)
+
+    failures = Counter()
+
+    def report(kind, message):
+        failures[kind] += 1
+        if failures[kind] <= max_reported:
+            log.append('  ' + message)
+
+    def compare(kind, t, matrix, expected):
+        for i, j in zip(*np.nonzero(np.abs(matrix - expected) > 0.0)):
+            if different(matrix[i, j], expected[i, j], absolute_tolerance, relative_tolerance):
+                report(kind, 'at t=%g: element (%d, %d): %.6e from jacobian(), %.6e %s' % (
+                    t, i + 1, j + 1, matrix[i, j], expected[i, j],
+                    'by central differences' if kind == 'differences' else 'in jacobian.output.cmp'))
+
+    p = np.zeros(max(mechanism['numberOfReactions'], 1))
+    q = np.zeros(max(mechanism['numberOfGenericComplex'], 1))
+    jac = np.zeros(rows.size)
+    checked = 0
+    compared = 0
+    for k, t in enumerate(concentrations['t']):
+        if not np.isclose(environment['t'], t).any():
+            continue
+        y = np.array([concentrations[name][k] for name in mechanism['speciesNames']])
+        conditions = conditions_at(environment, photolysis, t, mechanism)
+        J = np.ascontiguousarray(conditions['J'], dtype=float)
+        library.update_p(pointer(p), pointer(q), *([ctypes.byref(ctypes.c_double(conditions[name]))
+                                                    for name in mechanism['environmentArguments']] +
+                                                   [pointer(J), ctypes.byref(ctypes.c_double(conditions['RO2']))]))
+        library.jacobian(pointer(p), pointer(y), pointer(jac))
+        matrix = np.zeros((numberOfSpecies, numberOfSpecies))
+        matrix[rows, columns] = jac
+
+        # Central differences of the rate equations, one column per species
+        steps = 0.5 * np.abs(y) + 1.0
+        perturbed = np.repeat(y[:, np.newaxis], 2 * numberOfSpecies, axis=1)
+        perturbed[np.arange(numberOfSpecies), np.arange(numberOfSpecies)] += steps
+        perturbed[np.arange(numberOfSpecies), numberOfSpecies + np.arange(numberOfSpecies)] -= steps
+        production, loss = mechanism['production_loss'](mechanism['reaction_rates'](
+            p[:mechanism['numberOfReactions'], np.newaxis], perturbed))
+        dy = production - loss
+        compare('differences', t, matrix, (dy[:, :numberOfSpecies] - dy[:, numberOfSpecies:]) / (2.0 * steps))
+        checked += 1
+
+        reference = np.flatnonzero(np.isclose(referenceTimes, t))
+        if reference.size and compare_references:
+            compare('reference', t, matrix, references[referenceTimes[reference[0]]])
+            compared += 1
+
+    for kind in sorted(failures):
+        log.append('Differences found (' + kind + '): ' + str(failures[kind]))
+    log.insert(0, 'Checked ' + str(checked) + ' output times of ' + test + ', ' + str(compared) +
+               ' of them against jacobian.output.cmp')
+    return not failures, log
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the analytic Jacobian matrix of the mechanism of the tests '
+                                                 'against the central differences of the rate equations and the '
+                                                 'reference Jacobian matrices.')
+    parser.add_argument('tests_dir', help='path to the directory of the tests')
+    parser.add_argument('tests', nargs='+', help='names of the tests')
+    parser.add_argument('--compiler', default=default_compiler,
+                        help='command to compile mechanism.f90 into a shared library')
+    parser.add_argument('--absolute-tolerance', type=float, default=1.e-12)
+    parser.add_argument('--relative-tolerance', type=float, default=5.0e-05)
+    parser.add_argument('--label', default='jacobian test', help='label of the tests in the log')
+    parser.add_argument('--log', help='append the log to this file')
+    args = parser.parse_args()
+
+    results = []
+    try:
+        for test in args.tests:
+            results.append((test,) + check_test(args.tests_dir, test, args.compiler, args.absolute_tolerance,
+                                                args.relative_tolerance))
+    except EnvironmentError as e:
+        print('Check failed: ' + str(e), file=sys.stderr)
+        sys.exit(2)
+    except subprocess.CalledProcessError as e:
+        print('Check failed: the compilation of mechanism.f90 failed:\n' + e.output.decode('ascii', 'replace'),
+              file=sys.stderr)
+        sys.exit(2)
+
+    log_file = open(args.log, 'a') if args.log else sys.stdout
+    try:
+        for test, passed, log in results:
+            for line in log:
+                log_file.write(line + '\n')
+            log_file.write('-> ' + args.label + ': ' + test + (' PASSED' if passed else ' FAILED') + '\n\n')
+            if args.log:
+                print('*', test)
+    finally:
+        if args.log:
+            log_file.close()
+    sys.exit(0 if all(passed for _, passed, _ in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script checks the section "Species and reactions" of the
+# screen output of the tests (TEST.out.cmp), which says whether the
+# reaction network is read from mechanism.network or from the text
+# files mechanism.reac and mechanism.prod, against the output of the
+# code of AtChem2 that reads it.
+#
+# The modules of src/ which read the configuration files are compiled
+# with a small program, which runs readNumberOfSpeciesAndReactions()
+# and readReactions() as src/atchem2.f90 does, and prints the section.
+# It does not need CVODE, so the section can be checked (or
+# regenerated, with --update) without running the model. For each
+# test, the mechanism is converted by build/mech_converter.py into a
+# copy of the configuration directory of the test, and mechanism.network
+# is removed or truncated as in tests/run_tests.sh if requested.
+#
+# The log of each test ends with a line "-> LABEL: TEST PASSED" or
+# "-> LABEL: TEST FAILED".
+#
+# The exit code is 0 if all the tests pass, 1 if any test fails, and
+# 2 if a file cannot be read or the program cannot be compiled.
+#
+# ARGUMENTS:
+# - path to the directory of the tests
+# - names of the tests
+#
+# OPTIONS:
+# - --configuration DIR: configuration directory of each test, relative
+#   to the directory of the test [default: configuration]
+# - --text-network TEST [TEST ...]: tests of which mechanism.network is
+#   removed
+# - --truncated-network TEST [TEST ...]: tests of which mechanism.network
+#   is truncated
+# - --compiler "COMMAND": Fortran compiler and flags [default: gfortran
+#   -ffree-line-length-none -ffree-form -fimplicit-none]
+# - --mcm DIR: MCM data files directory [default: mcm/]
+# - --update: write the section to TEST.out.cmp, instead of checking it
+# - --label LABEL: label of the tests in the log [default: network
+#   output test]
+# - --log FILE: append the log to FILE [default: print it]
+#
+# USAGE:
+#   python ./tests/check_network_output.py tests/model_tests firstorder static
+#   python ./tests/check_network_output.py tests/tests short spec_yes_env_no --configuration model/configuration \
+#          --text-network short --truncated-network spec_yes_env_no
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import difflib
+import argparse
+import tempfile
+import subprocess
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'build')
+
+# The modules needed to read the reaction network, in the order of compilation
+source_files = ['dataStructures.f90', 'argparse.f90', 'interpolationFunctions.f90', 'configFunctions.f90',
+                'inputFunctions.f90']
+
+# The program which prints the section, as in src/atchem2.f90
+program_source = """program read_network
+  use directories_mod, only : configuration_dir
+  use input_functions_mod, only : readNumberOfSpeciesAndReactions, readReactions
+  implicit none
+
+  call get_command_argument( 1, configuration_dir )
+  write (*, '(A)') '-----------------------'
+  write (*, '(A)') ' Species and reactions'
+  write (*, '(A)') '-----------------------'
+  call readNumberOfSpeciesAndReactions()
+  write (*,*)
+  call readReactions()
+end program read_network
+"""
+
+default_compiler = 'gfortran -ffree-line-length-none -ffree-form -fimplicit-none'
+
+# The first and last lines of the section
+section_start = ' Species and reactions'
+section_end = ' Finished reading lhs and rhs data.'
+
+
+## ------------------------------------------------------------------ ##
+
+
+def compile_program(compiler, work_dir):
+    """
+    This function compiles the program which prints the section.
+
+    :returns: path to the executable
+    """
+    with open(os.path.join(work_dir, 'read_network.f90'), 'w') as program_file:
+        program_file.write(program_source)
+    subprocess.check_output(compiler.split() + ['-o', 'read_network'] +
+                            [os.path.join(src_dir, filename) for filename in source_files] + ['read_network.f90'],
+                            cwd=work_dir, stderr=subprocess.STDOUT)
+    return os.path.join(work_dir, 'read_network')
+
+
+def find_section(lines):
+    """
+    This function finds the section in the lines of a screen output.
+
+    :returns: tuple (index of the first line, index after the last line), or None if the section is not found
+    """
+    starts = [i for i, line in enumerate(lines) if line.rstrip('\n') == section_start]
+    ends = [i for i, line in enumerate(lines) if line.rstrip('\n') == section_end]
+    if not starts or not ends or ends[0] < starts[0]:
+        return None
+    return starts[0], ends[0] + 1
+
+
+def network_output(program, fac_file, config_dir, mcm_dir, work_dir, network=None):
+    """
+    This function converts the mechanism of a test into a copy of its configuration directory, and runs the program
+    on it.
+
+    :param network: None, 'text' to remove mechanism.network, or 'truncated' to truncate it to 100 bytes
+    :returns: the lines of the section
+    """
+    run_config_dir = os.path.join(work_dir, 'configuration')
+    shutil.copytree(config_dir, run_config_dir)
+    subprocess.check_output([sys.executable, os.path.join(build_dir, 'mech_converter.py'), fac_file,
+                             run_config_dir + os.sep, mcm_dir, '--force'], stderr=subprocess.STDOUT)
+    network_file = os.path.join(run_config_dir, 'mechanism.network')
+    if network == 'text':
+        os.remove(network_file)
+    elif network == 'truncated':
+        with open(network_file, 'rb') as input_file:
+            contents = input_file.read(100)
+        with open(network_file, 'wb') as output_file:
+            output_file.write(contents)
+    output = subprocess.check_output([program, run_config_dir], stderr=subprocess.STDOUT, universal_newlines=True)
+    lines = output.splitlines(True)
+    section = find_section(lines)
+    if section is None:
+        raise RuntimeError('The section is not in the output of the program:\n' + output)
+    return lines[section[0]:section[1]]
+
+
+def check_test(program, tests_dir, test, config_subdir, mcm_dir, work_dir, network, update):
+    """
+    This function checks (or updates) the section of the screen output of a test.
+
+    :returns: tuple (True if the test passed, list of lines of the log)
+    """
+    test_dir = os.path.join(tests_dir, test)
+    config_dir = os.path.join(test_dir, config_subdir)
+    fac_file = os.path.join(test_dir, test + '.fac')
+    if not os.path.isfile(fac_file):
+        fac_file = os.path.join(config_dir, test + '.fac')
+    expected = network_output(program, fac_file, config_dir, mcm_dir, work_dir, network)
+
+    reference_filename = os.path.join(test_dir, test + '.out.cmp')
+    with open(reference_filename, 'r') as reference_file:
+        lines = reference_file.readlines()
+    section = find_section(lines)
+    if section is None:
+        return False, ['  the section is not in ' + reference_filename]
+    if lines[section[0]:section[1]] == expected:
+        return True, []
+    if update:
+        lines[section[0]:section[1]] = expected
+        with open(reference_filename, 'w') as reference_file:
+            reference_file.write(''.join(lines))
+        return True, ['  updated ' + reference_filename]
+    return False, ['  ' + line.rstrip('\n') for line in difflib.unified_diff(lines[section[0]:section[1]], expected,
+                                                                             reference_filename, 'read_network')]
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the section "Species and reactions" of the screen output of '
+                                                 'the tests against the output of the code that reads the network.')
+    parser.add_argument('tests_dir', help='path to the directory of the tests')
+    parser.add_argument('tests', nargs='+', help='names of the tests')
+    parser.add_argument('--configuration', default='configuration',
+                        help='configuration directory of each test, relative to the directory of the test')
+    parser.add_argument('--text-network', nargs='+', default=[], help='tests of which mechanism.network is removed')
+    parser.add_argument('--truncated-network', nargs='+', default=[],
+                        help='tests of which mechanism.network is truncated')
+    parser.add_argument('--compiler', default=default_compiler, help='Fortran compiler and flags')
+    parser.add_argument('--mcm', default='./mcm/', help='MCM data files directory [default: ./mcm/]')
+    parser.add_argument('--update', action='store_true', help='write the section to TEST.out.cmp')
+    parser.add_argument('--label', default='network output test', help='label of the tests in the log')
+    parser.add_argument('--log', help='append the log to this file')
+    args = parser.parse_args()
+
+    results = []
+    work_dir = tempfile.mkdtemp()
+    try:
+        program = compile_program(args.compiler, work_dir)
+        for test in args.tests:
+            network = 'text' if test in args.text_network else 'truncated' if test in args.truncated_network else None
+            test_work_dir = os.path.join(work_dir, test)
+            os.mkdir(test_work_dir)
+            results.append((test,) + check_test(program, args.tests_dir, test, args.configuration, args.mcm,
+                                                test_work_dir, network, args.update))
+    except (EnvironmentError, RuntimeError, subprocess.CalledProcessError) as e:
+        print('Check failed: ' + str(e), file=sys.stderr)
+        if isinstance(e, subprocess.CalledProcessError):
+            print(e.output, file=sys.stderr)
+        sys.exit(2)
+    finally:
+        shutil.rmtree(work_dir)
+
+    log_file = open(args.log, 'a') if args.log else sys.stdout
+    try:
+        for test, passed, log in results:
+            for line in log:
+                log_file.write(line + '\n')
+            log_file.write('-> ' + args.label + ': ' + test + (' PASSED' if passed else ' FAILED') + '\n\n')
+            if args.log:
+                print('*', test)
+    finally:
+        if args.log:
+            log_file.close()
+    sys.exit(0 if all(passed for _, passed, _ in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script checks the numpy evaluation of the mechanism of the
+# tests (configuration/mechanism.py, written by
+# build/mech_converter.py) against the productionRates.output.cmp and
+# lossRates.output.cmp reference files of the tests.
+#
+# The rates in these files are not the rates at the output time: they
+# are those of the last evaluation of the right-hand side by the
+# solver, which happens at an internal time and state of the solver
+# (e.g. ahead of the output time, or at a perturbed state while the
+# jacobian is approximated). They cannot be recalculated from the
+# concentrations in the output, so the checks only use what does not
+# depend on that state. At each output time:
+# - the lines of each species of the reference files must be the
+#   reactions in which it is a product or a reactant in mechanism.py,
+#   i.e. productReactions/productSpecies and
+#   reactantReactions/reactantSpecies.
+# - the rate of each line is the rate of its reaction times the number
+#   of times the species appears in it, so the rate of the reaction
+#   must be the same on all the lines of the reaction.
+# - the production and loss rates of each species, from
+#   production_loss() with these reaction rates, must be the sums of
+#   the lines of the species.
+# - the reactions with the same reactants have rates in the ratio of
+#   their rate coefficients, which are calculated with
+#   rate_coefficients() from the environmentVariables.output.cmp and
+#   photolysisRates.output.cmp reference files at the output time. This
+#   assumes that the ratio does not change between the output time and
+#   the time of the evaluation by the solver, which is the case in the
+#   model tests.
+# The numbers are compared with the same tolerances as
+# tests/compare_output.py. The log of each test ends with a line
+# "-> LABEL: TEST PASSED" or "-> LABEL: TEST FAILED".
+#
+# The exit code is 0 if all the tests pass, 1 if any test fails, and
+# 2 if a file cannot be read.
+#
+# ARGUMENTS:
+# - path to the directory of the tests
+# - names of the tests
+#
+# OPTIONS:
+# - --absolute-tolerance X [default: 1.e-12]
+# - --relative-tolerance X [default: 5.0e-05]
+# - --label LABEL: label of the tests in the log [default: numpy
+#   mechanism test]
+# - --log FILE: append the log to FILE [default: print it]
+#
+# USAGE:
+#   python ./tests/check_numpy_mechanism.py tests/model_tests firstorder env_model_1
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import argparse
+from collections import Counter
+import numpy as np
+
+# Number of differences of each kind reported in the log of a test
+max_reported = 5
+
+
+## ------------------------------------------------------------------ ##
+
+
+def load_mechanism(filename):
+    """
+    This function loads the numpy evaluation of a mechanism, without importing it as a module (the mechanism.py of
+    all the tests have the same name).
+
+    :param filename: path to mechanism.py
+    :returns: dictionary of the names defined in mechanism.py
+    """
+    with open(filename, 'r') as mechanism_file:
+        source = mechanism_file.read()
+    namespace = {'__name__': 'mechanism', '__file__': filename}
+    exec(compile(source, filename, 'exec'), namespace)
+    return namespace
+
+
+def read_table(filename):
+    """
+    This function reads an output file with a header line and numerical columns.
+
+    :param filename: path to the output file
+    :returns: dictionary mapping the name of each column to its values
+    """
+    with open(filename, 'r') as table_file:
+        names = table_file.readline().split()
+        values = np.loadtxt(table_file, ndmin=2)
+    if values.size == 0:
+        values = np.zeros((0, len(names)))
+    return dict((name, values[:, i]) for i, name in enumerate(names))
+
+
+def read_rates(filename):
+    """
+    This function reads productionRates.output or lossRates.output.
+
+    :param filename: path to the output file
+    :returns: dictionary mapping each output time to the list of (speciesNumber, reactionNumber, rate) of its lines
+    """
+    rates = dict()
+    with open(filename, 'r') as rates_file:
+        rates_file.readline()
+        for line in rates_file:
+            fields = line.split()
+            if fields:
+                rates.setdefault(float(fields[0]), []).append((int(fields[1]), int(fields[3]), float(fields[4])))
+    return rates
+
+
+def different(x, y, absolute_tolerance, relative_tolerance):
+    """
+    This function compares two numbers with the numdiff tolerances, as tests/compare_output.py.
+
+    :returns: True if their absolute difference and their relative difference (with respect to the smaller of the two)
+              are both outside the tolerances
+    """
+    absolute = abs(x - y)
+    return absolute > absolute_tolerance and absolute > relative_tolerance * min(abs(x), abs(y))
+
+
+def conditions_at(environment, photolysis, t, mechanism):
+    """
+    This function returns the arguments of rate_coefficients() at an output time, from the environment variables and
+    the photolysis rates written by the model. N2 and O2 are calculated from M, as in calcAtmosphere().
+
+    :param environment: environmentVariables.output, as returned by read_table()
+    :param photolysis: photolysisRates.output, as returned by read_table()
+    :param t: output time
+    :param mechanism: dictionary of the names defined in mechanism.py
+    :returns: dictionary of the arguments of rate_coefficients()
+    """
+    i = np.flatnonzero(np.isclose(environment['t'], t))[0]
+    arguments = dict((name, environment[name][i]) for name in ['M', 'TEMP', 'RH', 'H2O', 'DEC', 'BLHEIGHT', 'DILUTE',
+                                                                'JFAC', 'ASA', 'RO2'])
+    arguments['N2'] = 0.7809 * arguments['M']
+    arguments['O2'] = 0.2095 * arguments['M']
+    arguments['ROOFOPEN'] = environment['ROOF'][i]
+    J = np.zeros(max(mechanism['maxPhotolysisNumber'], 1))
+    rows = np.flatnonzero(np.isclose(photolysis['t'], t))
+    for name in photolysis:
+        if name.startswith('J') and rows.size and int(name[1:]) <= J.size:
+            J[int(name[1:]) - 1] = photolysis[name][rows[0]]
+    arguments['J'] = J
+    return arguments
+
+
+def check_test(tests_dir, test, absolute_tolerance, relative_tolerance):
+    """
+    This function checks the numpy evaluation of the mechanism of a test against its reference files.
+
+    :returns: tuple (True if the test passed, list of lines of the log)
+    """
+    test_dir = os.path.join(tests_dir, test)
+    mechanism = load_mechanism(os.path.join(test_dir, 'configuration', 'mechanism.py'))
+    output_dir = os.path.join(test_dir, 'output')
+    environment = read_table(os.path.join(output_dir, 'environmentVariables.output.cmp'))
+    photolysis = read_table(os.path.join(output_dir, 'photolysisRates.output.cmp'))
+    frequencies = {'productionRates': Counter(zip(mechanism['productSpecies'] + 1,
+                                                  mechanism['productReactions'] + 1)),
+                   'lossRates': Counter(zip(mechanism['reactantSpecies'] + 1, mechanism['reactantReactions'] + 1))}
+    rates = dict((name, read_rates(os.path.join(output_dir, name + '.output.cmp'))) for name in frequencies)
+
+    # The reactions with the same reactants, as sorted tuples of species numbers
+    reactants = dict()
+    for k, s in zip(mechanism['reactantReactions'] + 1, mechanism['reactantSpecies'] + 1):
+        reactants.setdefault(k, []).append(s)
+    groups = dict()
+    for k in reactants:
+        groups.setdefault(tuple(sorted(reactants[k])), []).append(k)
+    groups = [sorted(group) for group in groups.values() if len(group) > 1]
+
+    log = []
+    failures = Counter()
+
+    def report(kind, message):
+        failures[kind] += 1
+        if failures[kind] <= max_reported:
+            log.append('  ' + message)
+
+    times = sorted(set(t for name in rates for t in rates[name]))
+    for t in times:
+        reactionRates = dict()
+        sums = dict()
+        for name in sorted(rates):
+            lines = rates[name].get(t, [])
+            species = set(s for lines_t in rates[name].values() for s, _, _ in lines_t)
+            expected = set(pair for pair in frequencies[name] if pair[0] in species)
+            found = set((s, k) for s, k, _ in lines)
+            for s, k in sorted(expected ^ found):
+                report('lines', '%s at t=%g: species %d, reaction %d %s' % (
+                    name, t, s, k, 'missing' if (s, k) in expected else 'not in mechanism.py'))
+            for s, k, rate in lines:
+                if (s, k) in expected:
+                    reactionRates.setdefault(k, []).append(rate / frequencies[name][(s, k)])
+                    sums[(name, s)] = sums.get((name, s), 0.0) + rate
+        r = np.zeros(mechanism['numberOfReactions'])
+        for k in sorted(reactionRates):
+            r[k - 1] = reactionRates[k][0]
+            if any(different(x, r[k - 1], absolute_tolerance, relative_tolerance) for x in reactionRates[k]):
+                report('frequencies', 'at t=%g: reaction %d has different rates on its lines: %s' % (
+                    t, k, ' '.join('%.6e' % x for x in reactionRates[k])))
+
+        production, loss = mechanism['production_loss'](r)
+        for (name, s), total in sorted(sums.items()):
+            calculated = (production if name == 'productionRates' else loss)[s - 1]
+            if different(calculated, total, absolute_tolerance, relative_tolerance):
+                report('sums', '%s at t=%g: species %d: %.6e from production_loss(), %.6e in the file' % (
+                    name, t, s, calculated, total))
+
+        _, p = mechanism['rate_coefficients'](**conditions_at(environment, photolysis, t, mechanism))
+        for group in groups:
+            group = [k for k in group if k in reactionRates]
+            if len(group) < 2:
+                continue
+            # Compare with the reaction with the largest rate coefficient
+            j = max(group, key=lambda k: abs(p[k - 1]))
+            if p[j - 1] == 0.0:
+                continue
+            for k in group:
+                expected = r[j - 1] * p[k - 1] / p[j - 1]
+                if different(expected, r[k - 1], absolute_tolerance, relative_tolerance):
+                    report('coefficients', 'at t=%g: reaction %d: rate %.6e, expected %.6e from reaction %d and '
+                           'the rate coefficients %.6e and %.6e' % (t, k, r[k - 1], expected, j, p[k - 1],
+                                                                    p[j - 1]))
+
+    for kind in sorted(failures):
+        log.append('Differences found (' + kind + '): ' + str(failures[kind]))
+    log.insert(0, 'Checked ' + str(len(times)) + ' output times of ' + test)
+    return not failures, log
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the numpy evaluation of the mechanism of the tests against '
+                                                 'the reference rates.')
+    parser.add_argument('tests_dir', help='path to the directory of the tests')
+    parser.add_argument('tests', nargs='+', help='names of the tests')
+    parser.add_argument('--absolute-tolerance', type=float, default=1.e-12)
+    parser.add_argument('--relative-tolerance', type=float, default=5.0e-05)
+    parser.add_argument('--label', default='numpy mechanism test', help='label of the tests in the log')
+    parser.add_argument('--log', help='append the log to this file')
+    args = parser.parse_args()
+
+    results = []
+    try:
+        for test in args.tests:
+            results.append((test,) + check_test(args.tests_dir, test, args.absolute_tolerance,
+                                                args.relative_tolerance))
+    except EnvironmentError as e:
+        print('Check failed: ' + str(e), file=sys.stderr)
+        sys.exit(2)
+
+    log_file = open(args.log, 'a') if args.log else sys.stdout
+    try:
+        for test, passed, log in results:
+            for line in log:
+                log_file.write(line + '\n')
+            log_file.write('-> ' + args.label + ': ' + test + (' PASSED' if passed else ' FAILED') + '\n\n')
+            if args.log:
+                print('*', test)
+    finally:
+        if args.log:
+            log_file.close()
+    sys.exit(0 if all(passed for _, passed, _ in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
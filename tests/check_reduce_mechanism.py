@@ -0,0 +1,217 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script checks build/reduce_mechanism_fac.py on the mechanism of
+# the tests, with the configuration of each test, and on the mechanism
+# of the test required_species, which is written by this script. The
+# species of outputSpecies.config, outputRates.config,
+# speciesConstrained.config and speciesConstant.config (the required
+# species) must all be in the reduced mechanism, with all the
+# reactions in which they are a reactant or a product, otherwise
+# AtChem2 stops (or writes wrong results) when it runs the reduced
+# mechanism.
+#
+# In required_species, the constant species X is only a reactant of a
+# reaction that no output depends on, the constrained species Y only
+# of a reaction that cannot take place, and the species E of
+# outputRates.config is only produced by a reaction that cannot take
+# place. The script must also stop with an error if a required species
+# is not in the mechanism.
+#
+# The log of each test ends with a line "-> LABEL: TEST PASSED" or
+# "-> LABEL: TEST FAILED".
+#
+# The exit code is 0 if all the tests pass, 1 if any test fails, and
+# 2 if a file cannot be read.
+#
+# ARGUMENTS:
+# - path to the directory of the tests
+# - names of the tests
+#
+# OPTIONS:
+# - --label LABEL: label of the tests in the log [default: reduce
+#   mechanism test]
+# - --log FILE: append the log to FILE [default: print it]
+#
+# USAGE:
+#   python ./tests/check_reduce_mechanism.py tests/model_tests firstorder env_model_1
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'build')
+sys.path.insert(0, build_dir)
+import mech_converter
+from reduce_mechanism_fac import read_species_config
+
+# The mechanism and the configuration of the test required_species
+required_species_fac = """* Generic Rate Coefficients ;
+*;
+* Complex reactions ;
+*;
+* Peroxy radicals. ;
+RO2 = ;
+*;
+* Reaction definitions. ;
+% 1.0e-3 : A = B ;
+% J<1> : X = Z ;
+% 1.0e-12 : C + Y = W ;
+% 1.0e-12 : C + D = E ;
+% 1.0e-12 : C + D = F ;
+"""
+required_species_config = {'initialConcentrations.config': 'A 1.0e+10\n',
+                           'outputSpecies.config': 'B\n',
+                           'outputRates.config': 'E\n',
+                           'speciesConstrained.config': 'Y\n',
+                           'speciesConstant.config': 'X 1.0e+10\n'}
+# The reactions which must be removed from required_species
+required_species_removed = ['% 1.0e-12 : C + D = F ;']
+
+
+## ------------------------------------------------------------------ ##
+
+
+def reduce_fac(input_file, config_dir, output_file):
+    """
+    This function runs build/reduce_mechanism_fac.py.
+
+    :returns: tuple (exit code, screen output)
+    """
+    command = [sys.executable, os.path.join(build_dir, 'reduce_mechanism_fac.py'), input_file, output_file, config_dir]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    output = process.communicate()[0]
+    return process.returncode, output
+
+
+def read_reactions(filename):
+    """
+    This function reads the reactions of a .fac file.
+
+    :returns: tuple (list of the Reaction tuples, list of the species)
+    """
+    with open(filename, 'r') as fac_file:
+        mechanism = mech_converter.parse_fac(sum(mech_converter.split_fac_sections(fac_file), []))
+    return mechanism.reactions, mechanism.species
+
+
+def check_reduction(fac_file, config_dir, work_dir, removed=()):
+    """
+    This function reduces a mechanism, and checks that the required species of the configuration, and all their
+    reactions, are in the reduced mechanism.
+
+    :param fac_file: path to the .fac file
+    :param config_dir: path to the model configuration directory
+    :param work_dir: directory of the reduced .fac file
+    :param removed: the reactions (as in the .fac file) which must be removed
+    :returns: tuple (True if the check passed, list of lines of the log)
+    """
+    reduced_file = os.path.join(work_dir, 'reduced.fac')
+    exitcode, output = reduce_fac(fac_file, config_dir, reduced_file)
+    if exitcode != 0:
+        return False, ['  the reduction failed with exit code ' + str(exitcode) + ':'] + \
+                      ['    ' + line for line in output.splitlines()]
+
+    required = set()
+    for filename in ['outputSpecies.config', 'outputRates.config', 'speciesConstrained.config',
+                     'speciesConstant.config']:
+        required.update(read_species_config(os.path.join(config_dir, filename)))
+    reactions, _ = read_reactions(fac_file)
+    keptReactions, keptSpecies = read_reactions(reduced_file)
+    keptLines = set(reaction.line.strip() for reaction in keptReactions)
+
+    log = ['  required species: ' + ' '.join(sorted(required))]
+    for x in sorted(required - set(keptSpecies)):
+        log.append('  required species ' + x + ' is not in the reduced mechanism')
+    for reaction in reactions:
+        if not required.isdisjoint(reaction.reactants + reaction.products) and reaction.line.strip() not in keptLines:
+            log.append('  reaction of a required species removed: ' + reaction.line.strip())
+    for line in removed:
+        if line in keptLines:
+            log.append('  reaction not removed: ' + line)
+    return len(log) == 1, log
+
+
+def check_required_species(work_dir):
+    """
+    This function writes the test required_species, and checks its reduction, and that the reduction stops with an
+    error when a required species is not in the mechanism.
+
+    :returns: tuple (True if the check passed, list of lines of the log)
+    """
+    config_dir = os.path.join(work_dir, 'configuration')
+    os.mkdir(config_dir)
+    fac_file = os.path.join(work_dir, 'required_species.fac')
+    with open(fac_file, 'w') as output_file:
+        output_file.write(required_species_fac)
+    for filename in required_species_config:
+        with open(os.path.join(config_dir, filename), 'w') as output_file:
+            output_file.write(required_species_config[filename])
+    passed, log = check_reduction(fac_file, config_dir, work_dir, required_species_removed)
+
+    with open(os.path.join(config_dir, 'speciesConstant.config'), 'a') as output_file:
+        output_file.write('NOTASPECIES 1.0e+10\n')
+    exitcode, output = reduce_fac(fac_file, config_dir, os.path.join(work_dir, 'failed.fac'))
+    if exitcode == 0 or 'NOTASPECIES' not in output:
+        log.append('  the reduction did not stop when a required species is not in the mechanism')
+        passed = False
+    return passed, log
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check build/reduce_mechanism_fac.py on the mechanism of the tests.')
+    parser.add_argument('tests_dir', help='path to the directory of the tests')
+    parser.add_argument('tests', nargs='+', help='names of the tests')
+    parser.add_argument('--label', default='reduce mechanism test', help='label of the tests in the log')
+    parser.add_argument('--log', help='append the log to this file')
+    args = parser.parse_args()
+
+    results = []
+    work_dir = tempfile.mkdtemp()
+    try:
+        for test in args.tests:
+            test_work_dir = os.path.join(work_dir, test)
+            os.mkdir(test_work_dir)
+            test_dir = os.path.join(args.tests_dir, test)
+            results.append((test,) + check_reduction(os.path.join(test_dir, test + '.fac'),
+                                                     os.path.join(test_dir, 'configuration'), test_work_dir))
+        test_work_dir = os.path.join(work_dir, 'required_species')
+        os.mkdir(test_work_dir)
+        results.append(('required_species',) + check_required_species(test_work_dir))
+    except EnvironmentError as e:
+        print('Check failed: ' + str(e), file=sys.stderr)
+        sys.exit(2)
+    finally:
+        shutil.rmtree(work_dir)
+
+    log_file = open(args.log, 'a') if args.log else sys.stdout
+    try:
+        for test, passed, log in results:
+            for line in log:
+                log_file.write(line + '\n')
+            log_file.write('-> ' + args.label + ': ' + test + (' PASSED' if passed else ' FAILED') + '\n\n')
+            if args.log:
+                print('*', test)
+    finally:
+        if args.log:
+            log_file.close()
+    sys.exit(0 if all(passed for _, passed, _ in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script compares the output of the tests with the reference
+# files (*.cmp), with the same tolerances as `numdiff -a 1.e-12 -r
+# 5.0e-05`: the files are split into whitespace-separated fields, and
+# two numerical fields are the same if either their absolute
+# difference or their relative difference (with respect to the
+# smaller of the two) is within the tolerance. Other fields must be
+# identical, and so must the number of lines and of fields on each
+# line. Lines containing any of the skipped words (e.g. the Runtime
+# line of the screen output) are left out of both files.
+#
+# The fields of all the files of a test are compared in one pass with
+# numpy, and the tests are compared in parallel on a pool of
+# processes. For each file with differences, the log reports the
+# worst absolute and relative deviation of each column (i.e. of the
+# n-th field of the lines, named after the header of the reference
+# file, if it has one). The log of each test ends with a line
+# "-> LABEL: TEST PASSED" or "-> LABEL: TEST FAILED", and "* TEST" is
+# printed to the screen for each test.
+#
+# The exit code is 0 if all the tests pass, 1 if any test fails, and
+# 2 if a file cannot be read.
+#
+# ARGUMENTS:
+# - path to the directory of the tests
+# - names of the tests
+#
+# OPTIONS:
+# - --files PATTERN [PATTERN ...]: reference files of each test,
+#   relative to its directory ({test} is replaced by the name of the
+#   test) [default: {test}.out.cmp output/*.output.cmp
+#   output/reactionRates/*.cmp configuration/mechanism.*.cmp]
+# - --skip WORD [WORD ...]: skip the lines containing these words
+#   [default: Runtime]
+# - --absolute-tolerance X [default: 1.e-12]
+# - --relative-tolerance X [default: 5.0e-05]
+# - --label LABEL: label of the tests in the log [default: test]
+# - --log FILE: append the log to FILE [default: print it]
+# - --jobs N: number of processes [default: the number of CPUs]
+#
+# USAGE:
+#   python ./tests/compare_output.py tests/model_tests firstorder secondorder
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import glob
+import argparse
+import multiprocessing
+import numpy as np
+
+default_files = ['{test}.out.cmp', 'output/*.output.cmp', 'output/reactionRates/*.cmp',
+                 'configuration/mechanism.*.cmp']
+
+
+## ------------------------------------------------------------------ ##
+
+
+class FileFields(object):
+    """
+    The whitespace-separated fields of a file, without the skipped lines.
+
+    :param tokens: numpy array (bytes) of all the fields, in order
+    :param counts: numpy array with the number of fields on each line
+    :param line_numbers: numpy array with the line number (from 1) of each line
+    :param header: list of the fields of the first line, if they are not numbers, otherwise None
+    """
+    def __init__(self, tokens, counts, line_numbers, header):
+        self.tokens = tokens
+        self.counts = counts
+        self.line_numbers = line_numbers
+        self.header = header
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def read_fields(filename, skip):
+    """
+    This function reads a file and splits it into fields.
+
+    :param filename: path to the file
+    :param skip: list of words: the lines containing any of them are skipped
+    :returns: FileFields of the file
+    """
+    with open(filename, 'rb') as input_file:
+        lines = input_file.read().split(b'\n')
+    if lines and not lines[-1].strip():
+        lines.pop()
+    skip = [word.encode() for word in skip]
+    kept = [(i + 1, line.split()) for i, line in enumerate(lines) if not any(word in line for word in skip)]
+    counts = np.array([len(fields) for _, fields in kept], dtype=np.int64)
+    tokens = np.array([token for _, fields in kept for token in fields], dtype=bytes)
+    if tokens.size == 0:
+        tokens = np.array([], dtype='S1')
+    header = None
+    if kept and kept[0][1] and not any(_is_number(token) for token in kept[0][1]):
+        header = [token.decode('utf-8', 'replace') for token in kept[0][1]]
+    return FileFields(tokens, counts, np.array([number for number, _ in kept], dtype=np.int64), header)
+
+
+def structure_difference(fields, reference):
+    """
+    This function checks that two files have the same number of lines, and the same number of fields on each line.
+
+    :param fields: FileFields of the output file
+    :param reference: FileFields of the reference file
+    :returns: string describing the first difference, or None if there is none
+    """
+    if len(fields.counts) != len(reference.counts):
+        return 'different number of lines: ' + str(len(fields.counts)) + ' vs ' + str(len(reference.counts))
+    different = np.flatnonzero(fields.counts != reference.counts)
+    if different.size > 0:
+        i = different[0]
+        return 'different number of fields at line ' + str(fields.line_numbers[i]) + ': ' + \
+            str(fields.counts[i]) + ' vs ' + str(reference.counts[i])
+    return None
+
+
+def _to_float(tokens):
+    # Convert an array of fields to floats. Return the values (NaN for the fields which are not numbers), and
+    # whether each field is a number.
+    try:
+        return tokens.astype(np.float64), np.ones(tokens.shape, dtype=bool)
+    except ValueError:
+        values = np.full(tokens.shape, np.nan)
+        numbers = np.zeros(tokens.shape, dtype=bool)
+        for i, token in enumerate(tokens):
+            try:
+                values[i] = float(token)
+                numbers[i] = True
+            except ValueError:
+                pass
+        return values, numbers
+
+
+def field_deviations(tokens, reference_tokens, absolute_tolerance, relative_tolerance):
+    """
+    This function compares two arrays of fields with the numdiff tolerances.
+
+    :param tokens: numpy array (bytes) of the fields of the output files
+    :param reference_tokens: numpy array (bytes) of the fields of the reference files
+    :param absolute_tolerance: absolute tolerance
+    :param relative_tolerance: relative tolerance, with respect to the smaller of the two values
+    :returns: the indices of the fields which are not identical, their absolute and relative differences (infinite
+              if either field is not a number), and whether they are outside both tolerances
+    """
+    indices = np.flatnonzero(tokens != reference_tokens)
+    x, x_numbers = _to_float(tokens[indices])
+    y, y_numbers = _to_float(reference_tokens[indices])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        absolute = np.abs(x - y)
+        relative = absolute / np.minimum(np.abs(x), np.abs(y))
+    # Identical numbers written differently (e.g. 1.0 and 1.00, or NaN and nan) are not differences
+    same = x_numbers & y_numbers & ((x == y) | (np.isnan(x) & np.isnan(y)))
+    absolute[same] = 0.0
+    relative[same] = 0.0
+    absolute[~(x_numbers & y_numbers) | np.isnan(absolute)] = np.inf
+    relative[np.isinf(absolute) | np.isnan(relative)] = np.inf
+    failed = (absolute > absolute_tolerance) & (relative > relative_tolerance)
+    return indices, absolute, relative, failed
+
+
+def column_report(fields, reference, indices, absolute, relative, failed):
+    """
+    This function reports the worst deviation of each column of a file with differences.
+
+    :param fields: FileFields of the output file
+    :param reference: FileFields of the reference file
+    :param indices: indices (in the file) of the fields which are not identical
+    :param absolute: absolute differences of these fields
+    :param relative: relative differences of these fields
+    :param failed: whether these fields are outside both tolerances
+    :returns: list of lines of the report
+    """
+    starts = np.cumsum(reference.counts) - reference.counts
+    lines = np.searchsorted(starts, indices, side='right') - 1
+    columns = indices - starts[lines]
+    report = []
+    for column in np.unique(columns):
+        in_column = columns == column
+        if reference.header is not None and column < len(reference.header):
+            name = reference.header[column]
+        else:
+            name = 'field ' + str(column + 1)
+        # The worst field is the one with the largest relative difference, among the failed ones if any
+        candidates = np.flatnonzero(in_column & failed) if failed[in_column].any() else np.flatnonzero(in_column)
+        worst = candidates[np.argmax(relative[candidates])]
+        report.append('  %-24s %6d failed  max abs %10.3e  max rel %10.3e  (line %d: %s vs %s)' % (
+            name, failed[in_column].sum(), absolute[in_column].max(), relative[in_column].max(),
+            fields.line_numbers[lines[worst]], fields.tokens[indices[worst]].decode('utf-8', 'replace'),
+            reference.tokens[indices[worst]].decode('utf-8', 'replace')))
+    return report
+
+
+def compare_test(task):
+    """
+    This function compares all the files of a test with their reference files.
+
+    :param task: tuple (test directory, test name, list of patterns, skipped words, absolute tolerance, relative
+                 tolerance)
+    :returns: tuple (test name, True if the test passed, list of lines of the log)
+    """
+    tests_dir, test, patterns, skip, absolute_tolerance, relative_tolerance = task
+    test_dir = os.path.join(tests_dir, test)
+    reference_filenames = []
+    for pattern in patterns:
+        reference_filenames += sorted(glob.glob(os.path.join(test_dir, pattern.replace('{test}', test))))
+
+    log = []
+    if not reference_filenames:
+        log.append('No reference files found in ' + test_dir)
+        return test, False, log
+    passed = True
+    pairs = []
+    for reference_filename in reference_filenames:
+        filename = reference_filename[:-len('.cmp')]
+        log.append('Checking ' + reference_filename)
+        fields = read_fields(filename, skip)
+        reference = read_fields(reference_filename, skip)
+        difference = structure_difference(fields, reference)
+        if difference is not None:
+            log.append('Differences found in ' + filename + ': ' + difference)
+            passed = False
+        else:
+            pairs.append((filename, fields, reference))
+    if not pairs:
+        return test, passed, log
+
+    # Compare the fields of all the files in one go
+    sizes = [fields.tokens.size for _, fields, _ in pairs]
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    indices, absolute, relative, failed = field_deviations(
+        np.concatenate([fields.tokens for _, fields, _ in pairs]),
+        np.concatenate([reference.tokens for _, _, reference in pairs]),
+        absolute_tolerance, relative_tolerance)
+    bounds = np.searchsorted(indices, offsets)
+    for k, (filename, fields, reference) in enumerate(pairs):
+        in_file = slice(bounds[k], bounds[k + 1])
+        if failed[in_file].any():
+            passed = False
+            log.append('Differences found in ' + filename + ': ' + str(failed[in_file].sum()) + ' fields')
+            log += column_report(fields, reference, indices[in_file] - offsets[k], absolute[in_file],
+                                 relative[in_file], failed[in_file])
+    return test, passed, log
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the output of the tests with the reference files.')
+    parser.add_argument('tests_dir', help='path to the directory of the tests')
+    parser.add_argument('tests', nargs='+', help='names of the tests')
+    parser.add_argument('--files', nargs='+', default=default_files,
+                        help='reference files of each test, relative to its directory')
+    parser.add_argument('--skip', nargs='+', default=['Runtime'], help='skip the lines containing these words')
+    parser.add_argument('--absolute-tolerance', type=float, default=1.e-12)
+    parser.add_argument('--relative-tolerance', type=float, default=5.0e-05)
+    parser.add_argument('--label', default='test', help='label of the tests in the log')
+    parser.add_argument('--log', help='append the log to this file')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of processes [default: the number of CPUs]')
+    args = parser.parse_args()
+
+    tasks = [(args.tests_dir, test, args.files, args.skip, args.absolute_tolerance, args.relative_tolerance)
+             for test in args.tests]
+    try:
+        if args.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+            try:
+                results = pool.map(compare_test, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [compare_test(task) for task in tasks]
+    except EnvironmentError as e:
+        print('Comparison failed: ' + str(e), file=sys.stderr)
+        sys.exit(2)
+
+    log_file = open(args.log, 'a') if args.log else sys.stdout
+    try:
+        for test, passed, log in results:
+            for line in log:
+                log_file.write(line + '\n')
+            log_file.write('-> ' + args.label + ': ' + test + (' PASSED' if passed else ' FAILED') + '\n\n')
+            if args.log:
+                print('*', test)
+    finally:
+        if args.log:
+            log_file.close()
+    sys.exit(0 if all(passed for _, passed, _ in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# ==================================================================== #
+
+# The basic workflow of this function is to loop over each model test in $1,
+# and for each test and each solver type (1 = SPGMR, 3 = Dense), to copy the
+# test into $WORK_DIR, build the model, and run it twice: first with the
+# Jacobian matrix calculated by the solver by finite differences
+# (analytic jacobian = 0 in solver.parameters), then with the analytic
+# Jacobian matrix of mechanism.f90 (analytic jacobian = 1), which is used
+# through FCVJTIMES() by the SPGMR solver and through FCVDJAC() by the
+# dense solver.
+#
+# The output of the first run is the reference of the second run: the
+# concentrations and the production and loss rates of the two runs are
+# compared by tests/compare_output.py. Both runs use tight solver
+# tolerances, so that they only differ by the way the Jacobian matrix is
+# obtained. Concentrations below $ABSOLUTE_TOLERANCE molecules/cm3 (e.g. of
+# species close to zero at night) are considered the same. A test also
+# fails if either run stops before the end, if the second run does not use
+# the analytic Jacobian matrix, or if the solver does not use the Jacobian
+# matrix at all (no Jacobian-vector products with SPGMR, no Jacobian
+# evaluations with the dense solver).
+#
+# $2 is used to pass CVODELIB in from Makefile, in order to be able to set DYLD_LIBRARY_PATH on macOS.
+
+export DYLD_LIBRARY_PATH=$2
+
+TESTS_DIR=tests/model_tests
+WORK_DIR=tests/jacobian_tests
+LOG_FILE=tests/jacobiantests.log
+SOLVER_TYPES="1 3"
+ABSOLUTE_TOLERANCE=1.e-3
+
+echo "Executing jacobian tests script." > $LOG_FILE
+echo "Jacobian tests to run:" $1 >> $LOG_FILE
+echo "Solver types:" $SOLVER_TYPES >> $LOG_FILE
+echo "" >> $LOG_FILE
+
+# Write solver.parameters in the directory $1, with solver type $2 and
+# analytic jacobian = $3
+write_solver_parameters() {
+  cat > $1/solver.parameters <<EOF
+1.0e-10        atol
+1.0e-10        rtol
+1.0e-04        delta main
+100            lookback
+100            maximum solver step size (seconds)
+100000         maximum number of steps in solver
+$2              solver type (1 = spgmr, 2 = spgmr + banded preconditioner, 3 = dense)
+750            banded preconditioner upper bandwidth
+750            banded preconditioner lower bandwidth
+$3              analytic jacobian (0 = no, 1 = yes)
+EOF
+}
+
+# initialise counters
+test_counter=0
+fail_counter=0
+jacobian_tests=""
+
+rm -rf $WORK_DIR
+mkdir -p $WORK_DIR
+
+# loop over each test and solver type: build the model, and run it with
+# and without the analytic Jacobian matrix
+for test in $1; do
+  for solver_type in $SOLVER_TYPES; do
+    name=${test}_solver${solver_type}
+    test_counter=$((test_counter+1))
+    jacobian_tests="$jacobian_tests $name"
+    echo "" >> $LOG_FILE
+    echo "Set up and make" $WORK_DIR/$name "from" $TESTS_DIR/$test >> $LOG_FILE
+    cp -r $TESTS_DIR/$test $WORK_DIR/$name
+    rm -rf $WORK_DIR/$name/output $WORK_DIR/$name/$test.out.cmp $WORK_DIR/$name/configuration/*.cmp
+    mkdir -p $WORK_DIR/$name/output/reactionRates $WORK_DIR/$name/output_fd/reactionRates
+    ./build/build_atchem2.sh $WORK_DIR/$name/$test.fac $WORK_DIR/$name/configuration/ mcm/ &> /dev/null
+    exitcode=$?
+    if [ $exitcode -ne 0 ]; then
+      echo "Building" $name "test failed with exit code" $exitcode >> $LOG_FILE
+      exit $exitcode
+    fi
+
+    # Run atchem2 with the finite-difference Jacobian matrix, then with the analytic Jacobian matrix
+    echo "Running" $WORK_DIR/$name "with analytic jacobian = 0 ..." >> $LOG_FILE
+    write_solver_parameters $WORK_DIR/$name/configuration $solver_type 0
+    ./atchem2 --shared_lib=$WORK_DIR/$name/configuration/mechanism.so --output=$WORK_DIR/$name/output_fd --configuration=$WORK_DIR/$name/configuration --mcm=mcm --constraints=$WORK_DIR/$name/constraints > $WORK_DIR/$name/$name.fd.out 2>&1
+    echo "Running" $WORK_DIR/$name "with analytic jacobian = 1 ..." >> $LOG_FILE
+    write_solver_parameters $WORK_DIR/$name/configuration $solver_type 1
+    ./atchem2 --shared_lib=$WORK_DIR/$name/configuration/mechanism.so --output=$WORK_DIR/$name/output --configuration=$WORK_DIR/$name/configuration --mcm=mcm --constraints=$WORK_DIR/$name/constraints > $WORK_DIR/$name/$name.out 2>&1
+
+    # The output of the first run is the reference of the second run
+    for output_file in speciesConcentrations finalModelState productionRates lossRates; do
+      cp $WORK_DIR/$name/output_fd/$output_file.output $WORK_DIR/$name/output/$output_file.output.cmp 2>> $LOG_FILE
+    done
+
+    # Check that both runs reached the end, and that the second run used the analytic Jacobian matrix
+    failed=0
+    if ! grep -q "Final statistics" $WORK_DIR/$name/$name.fd.out; then
+      echo $name": the run with analytic jacobian = 0 did not finish (see" $WORK_DIR/$name/$name.fd.out")" >> $LOG_FILE
+      failed=1
+    fi
+    if ! grep -q "Final statistics" $WORK_DIR/$name/$name.out; then
+      echo $name": the run with analytic jacobian = 1 did not finish (see" $WORK_DIR/$name/$name.out")" >> $LOG_FILE
+      failed=1
+    elif ! grep -q "Jacobian: *analytic" $WORK_DIR/$name/$name.out; then
+      echo $name": the run with analytic jacobian = 1 did not use the analytic Jacobian matrix" >> $LOG_FILE
+      failed=1
+    elif [ $solver_type -eq 3 ]; then
+      jacobian_count=$(sed -n 's/.*No. J-s = \([0-9]*\).*/\1/p' $WORK_DIR/$name/$name.out)
+      echo $name": number of Jacobian evaluations (NJE) =" $jacobian_count >> $LOG_FILE
+      if [[ "$jacobian_count" -eq 0 ]]; then
+        failed=1
+      fi
+    else
+      # NJTV is the 19th column of mainSolverParameters.output
+      jacobian_count=$(tail -n 1 $WORK_DIR/$name/output/mainSolverParameters.output | awk '{print $19}')
+      echo $name": number of Jacobian-vector products (NJTV) =" $jacobian_count >> $LOG_FILE
+      if [[ "$jacobian_count" -eq 0 ]]; then
+        failed=1
+      fi
+    fi
+    if [ $failed -ne 0 ]; then
+      echo "-> jacobian test:" $name "FAILED" >> $LOG_FILE
+      fail_counter=$((fail_counter+1))
+      # Remove the references, so that compare_output.py fails this test too
+      rm -f $WORK_DIR/$name/output/*.cmp
+    fi
+  done
+done
+
+# Compare the output of the runs with the analytic Jacobian matrix with the reference files
+echo "" >> $LOG_FILE
+python ./tests/compare_output.py $WORK_DIR $jacobian_tests --label "jacobian test" --log $LOG_FILE \
+       --absolute-tolerance $ABSOLUTE_TOLERANCE --files 'output/*.output.cmp'
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The comparison gave an error. Aborting." >> $LOG_FILE
+  cat $LOG_FILE
+  exit 1
+fi
+fail_counter=$(grep "^-> jacobian test: .* FAILED$" $LOG_FILE | sort -u | wc -l)
+
+# After all tests are run, exit with a FAIL if $fail_counter>0, otherwise PASS.
+if [[ "$fail_counter" -gt 0 ]]; then
+  echo "==> Jacobian tests FAILED [" $fail_counter/$test_counter "]"
+  jacobian_tests_passed=1
+else
+  echo "==> Jacobian tests PASSED [" $test_counter/$test_counter "]"
+  jacobian_tests_passed=0
+fi
+echo "" >> $LOG_FILE
+echo "Execution of jacobian tests script finished." >> $LOG_FILE
+
+echo "==> Jacobian tests logfile:" $LOG_FILE
+cat $LOG_FILE
+exit $jacobian_tests_passed
@@ -0,0 +1,135 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script executes the mechanism tests: the .fac files of the
+# model tests are all converted in one go by
+# build/batch_mech_converter.py, and the resulting mechanism files are
+# compared with the mechanism.*.cmp files in the configuration
+# directory of each test by tests/compare_output.py. The numpy
+# evaluation of the mechanism (mechanism.py) is checked against the
+# reference rates of each test by tests/check_numpy_mechanism.py, and
+# the analytic Jacobian matrix (the subroutine jacobian of
+# mechanism.f90) against the reference Jacobian matrices of each test
+# by tests/check_jacobian.py. The reduction of the mechanism of each
+# test by build/reduce_mechanism_fac.py is checked by
+# tests/check_reduce_mechanism.py, which also adds the test
+# required_species, and the check of the completion of the runs of
+# tools/ensemble/atchem2_ensemble.py on the reference files of each
+# test by tests/check_ensemble.py. The section "Species and reactions"
+# of the screen output of each test is checked against the output of
+# the code that reads the reaction network by
+# tests/check_network_output.py.
+#
+# $1 is the list of model tests (in tests/model_tests/).
+#
+# $2 is the command to compile mechanism.f90 into a shared library
+# (compiler and flags, as in the Makefile) [default: see
+# tests/check_jacobian.py].
+#
+# N.B.: the script MUST be run from the main directory of AtChem2.
+
+TESTS_DIR=tests/model_tests
+LOG_FILE=tests/mechanismtests.log
+MANIFEST=tests/mechanismtests.manifest
+
+echo "Executing mechanism tests script." > $LOG_FILE
+echo "Mechanism tests to run:" $1 >> $LOG_FILE
+echo "" >> $LOG_FILE
+
+# Write the manifest of all the conversions, and convert them
+rm -f $MANIFEST
+for test in $1; do
+  echo $TESTS_DIR/$test/$test.fac $TESTS_DIR/$test/configuration/ >> $MANIFEST
+done
+python ./build/batch_mech_converter.py $MANIFEST mcm/ --force >> $LOG_FILE 2>&1
+exitcode=$?
+rm -f $MANIFEST
+if [ $exitcode -ne 0 ]; then
+  echo "==> Mechanism tests FAILED: the conversion failed with exit code" $exitcode
+  echo "==> Mechanism tests logfile:" $LOG_FILE
+  cat $LOG_FILE
+  exit $exitcode
+fi
+echo "" >> $LOG_FILE
+
+# Compare the mechanism files of each test with the reference files,
+# and count the failed tests
+# (+1 for the test required_species of tests/check_reduce_mechanism.py)
+test_counter=$(( $(echo $1 | wc -w) + 1 ))
+python ./tests/compare_output.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE \
+       --files 'configuration/mechanism.*.cmp'
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The comparison gave an error. Aborting." >> $LOG_FILE
+  exit 1
+fi
+
+# Check the numpy evaluation of the mechanism of each test
+# (configuration/mechanism.py) against the reference rates
+python ./tests/check_numpy_mechanism.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The check of the numpy mechanism gave an error. Aborting." >> $LOG_FILE
+  exit 1
+fi
+
+# Check the analytic Jacobian matrix of each test against the
+# reference Jacobian matrices (output/jacobian.output.cmp)
+if [ -n "$2" ]; then
+  python ./tests/check_jacobian.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE --compiler "$2"
+else
+  python ./tests/check_jacobian.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE
+fi
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The check of the analytic Jacobian matrix gave an error. Aborting." >> $LOG_FILE
+  exit 1
+fi
+# Check the reduction of the mechanism of each test, with the
+# configuration of the test
+python ./tests/check_reduce_mechanism.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The check of the mechanism reduction gave an error. Aborting." >> $LOG_FILE
+  exit 1
+fi
+# Check the completion check of the ensemble runs on the reference
+# files of each test
+python ./tests/check_ensemble.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The check of the ensemble runs gave an error. Aborting." >> $LOG_FILE
+  exit 1
+fi
+# Check the section "Species and reactions" of the screen output of
+# each test ({test}.out.cmp)
+python ./tests/check_network_output.py $TESTS_DIR $1 --label "mechanism test" --log $LOG_FILE
+exitcode=$?
+if [ $exitcode -gt 1 ]; then
+  echo "The check of the screen output gave an error. Aborting." >> $LOG_FILE
+  exit 1
+fi
+fail_counter=$(grep "^-> mechanism test: .* FAILED$" $LOG_FILE | sort -u | wc -l)
+
+# After all tests are run, exit with a FAIL if $fail_counter>0, otherwise PASS.
+if [[ "$fail_counter" -gt 0 ]]; then
+  echo "==> Mechanism tests FAILED [" $fail_counter/$test_counter "]"
+  mechanism_tests_passed=1
+else
+  echo "==> Mechanism tests PASSED [" $test_counter/$test_counter "]"
+  mechanism_tests_passed=0
+fi
+echo "" >> $LOG_FILE
+echo "Execution of mechanism tests script finished." >> $LOG_FILE
+
+echo "==> Mechanism tests logfile:" $LOG_FILE
+exit $mechanism_tests_passed
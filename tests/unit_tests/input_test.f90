@@ -0,0 +1,136 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+module input_test
+  use fruit
+  use types_mod
+  implicit none
+
+  ! Directory of the mechanism files written by the tests, which are
+  ! deleted at the end of each test
+  character(len=*), parameter :: testDir = 'tests/unit_tests'
+
+contains
+
+  ! Write mechanism.reac and mechanism.prod of a network of 3 species
+  ! and 2 reactions, and return their sizes in bytes
+  subroutine write_text_network( reacBytes, prodBytes )
+    use types_mod
+
+    integer(kind=QI), intent(out) :: reacBytes, prodBytes
+    integer(kind=NPI) :: fileSize
+
+    open (20, file=testDir // '/mechanism.reac', status='replace')
+    write (20, '(A)') '3 2 0 numberOfSpecies numberOfReactions numberOfGenericComplex'
+    write (20, '(A)') '1 1'
+    write (20, '(A)') '2 2'
+    write (20, '(A)') '2 3'
+    close (20)
+    open (20, file=testDir // '/mechanism.prod', status='replace')
+    write (20, '(A)') '1 2'
+    write (20, '(A)') '2 1'
+    close (20)
+    inquire(file=testDir // '/mechanism.reac', size=fileSize)
+    reacBytes = int( fileSize, QI )
+    inquire(file=testDir // '/mechanism.prod', size=fileSize)
+    prodBytes = int( fileSize, QI )
+  end subroutine write_text_network
+
+  ! Write mechanism.network with the given header, and the reactants
+  ! and products of the network of write_text_network(). If truncate
+  ! is .true., the product indices are left out.
+  subroutine write_binary_network( header, truncate )
+    use types_mod
+
+    integer(kind=QI), intent(in) :: header(9)
+    logical, intent(in) :: truncate
+
+    open (20, file=testDir // '/mechanism.network', status='replace', access='stream', form='unformatted')
+    write (20) header
+    ! reaction 1: species 1 -> species 2, reaction 2: species 2 + 3 -> species 1
+    write (20) (/ 0_QI, 1_QI, 3_QI /), (/ 0_QI, 1_QI, 2_QI /)
+    write (20) (/ 0_QI, 1_QI, 2_QI /)
+    if ( .not. truncate ) write (20) (/ 1_QI, 0_QI /)
+    close (20)
+  end subroutine write_binary_network
+
+  ! Delete the files written by the tests, and the arrays filled by
+  ! readReactionsFromNetwork()
+  subroutine clean_network()
+    use reaction_structure_mod, only : clhs, crhs, clcoeff, crcoeff
+
+    open (20, file=testDir // '/mechanism.reac')
+    close (20, status='delete')
+    open (20, file=testDir // '/mechanism.prod')
+    close (20, status='delete')
+    open (20, file=testDir // '/mechanism.network')
+    close (20, status='delete')
+    if ( allocated( clhs ) ) deallocate (clhs, crhs, clcoeff, crcoeff)
+  end subroutine clean_network
+
+  subroutine test_readReactionsFromNetwork
+    use types_mod
+    use input_functions_mod, only : readReactionsFromNetwork
+    use species_mod, only : setNumberOfSpecies, setNumberOfReactions
+    use reaction_structure_mod, only : clhs, crhs
+
+    integer(kind=QI) :: header(9), reacBytes, prodBytes
+    logical :: network_read
+
+    call setNumberOfSpecies( 3_NPI )
+    call setNumberOfReactions( 2_NPI )
+    call write_text_network( reacBytes, prodBytes )
+    header = (/ 2_QI, 3_QI, 2_QI, 0_QI, 3_QI, 2_QI, 0_QI, reacBytes, prodBytes /)
+
+    ! A network that matches the text files is read
+    call write_binary_network( header, .false. )
+    call readReactionsFromNetwork( testDir, network_read )
+    call assert_true( network_read, "readReactionsFromNetwork, matching network" )
+    if ( network_read ) then
+      call assert_true( all( clhs(1,:) == (/ 1_NPI, 2_NPI, 2_NPI /) ), "readReactionsFromNetwork, reactant reactions" )
+      call assert_true( all( clhs(2,:) == (/ 1_NPI, 2_NPI, 3_NPI /) ), "readReactionsFromNetwork, reactant species" )
+      call assert_true( all( crhs(1,:) == (/ 1_NPI, 2_NPI /) ), "readReactionsFromNetwork, product reactions" )
+      call assert_true( all( crhs(2,:) == (/ 2_NPI, 1_NPI /) ), "readReactionsFromNetwork, product species" )
+    end if
+    call clean_network()
+
+    ! mechanism.reac has been changed since the network was written
+    call write_text_network( reacBytes, prodBytes )
+    call write_binary_network( header, .false. )
+    open (20, file=testDir // '/mechanism.reac', position='append')
+    write (20, '(A)') '2 1'
+    close (20)
+    call readReactionsFromNetwork( testDir, network_read )
+    call assert_false( network_read, "readReactionsFromNetwork, mechanism.reac changed" )
+    call assert_false( allocated( clhs ), "readReactionsFromNetwork, nothing allocated (mechanism.reac changed)" )
+    call clean_network()
+
+    ! The numbers of species and reactions differ from those of mechanism.reac
+    call write_text_network( reacBytes, prodBytes )
+    call write_binary_network( (/ 2_QI, 4_QI, 2_QI, 0_QI, 3_QI, 2_QI, 0_QI, reacBytes, prodBytes /), .false. )
+    call readReactionsFromNetwork( testDir, network_read )
+    call assert_false( network_read, "readReactionsFromNetwork, wrong number of species" )
+    call write_binary_network( (/ 2_QI, 3_QI, 3_QI, 0_QI, 3_QI, 2_QI, 0_QI, reacBytes, prodBytes /), .false. )
+    call readReactionsFromNetwork( testDir, network_read )
+    call assert_false( network_read, "readReactionsFromNetwork, wrong number of reactions" )
+
+    ! The file is truncated, or of an older format version
+    call write_binary_network( header, .true. )
+    call readReactionsFromNetwork( testDir, network_read )
+    call assert_false( network_read, "readReactionsFromNetwork, truncated network" )
+    call assert_false( allocated( clhs ), "readReactionsFromNetwork, nothing allocated (truncated network)" )
+    call write_binary_network( (/ 1_QI, 3_QI, 2_QI, 0_QI, 3_QI, 2_QI, 0_QI, reacBytes, prodBytes /), .false. )
+    call readReactionsFromNetwork( testDir, network_read )
+    call assert_false( network_read, "readReactionsFromNetwork, format version 1" )
+    call clean_network()
+  end subroutine test_readReactionsFromNetwork
+
+end module input_test
@@ -0,0 +1,137 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script times tools/constraints/atchem2_constraints.py on a
+# synthetic set of constraints, as from a field campaign: many species,
+# and a few environment variables and photolysis rates, all measured
+# at a high time resolution over a day. The model runs over the same
+# day, with a much longer step.
+#
+# It reports the time taken to read and check the text files, and to
+# load the same constraints from the binary table, the size of the
+# text files and of the table, and the memory needed by the model to
+# hold the constraints before and after resampling them at the steps
+# of the model. The constraints are written to a temporary directory,
+# which is deleted at the end.
+#
+# ARGUMENT(S):
+#   1. optional number of species [default: 200]
+#   2. optional time resolution of the constraints, in seconds [default: 1]
+#   3. optional step size of the model, in seconds [default: 600]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_constraints.py 200 1 600
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+import numpy as np
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(base_dir, 'tools', 'constraints'))
+import atchem2_constraints
+
+duration = 86400.0
+environment_names = ['TEMP', 'PRESS', 'RH', 'BLHEIGHT']
+photolysis_names = ['J1', 'J2', 'J3', 'J4', 'J5', 'J6', 'JFAC']
+
+# ============================================================ #
+
+def write_synthetic_constraints(constraints_dir, number_of_species, resolution, seed=0):
+    # Write synthetic constraint files to the species/, environment/
+    # and photolysis/ subdirectories of constraints_dir, covering the
+    # day with one extra point at each end. Return the number of
+    # points written.
+    rng = np.random.RandomState(seed)
+    t = np.arange(-resolution, duration + 2 * resolution, resolution)
+    names = [('species', 'S' + str(i)) for i in range(1, number_of_species + 1)] + \
+            [('environment', x) for x in environment_names] + [('photolysis', x) for x in photolysis_names]
+    for category, name in names:
+        category_dir = os.path.join(constraints_dir, category)
+        if not os.path.isdir(category_dir):
+            os.makedirs(category_dir)
+        # A diurnal cycle with measurement noise
+        y = rng.uniform(1.0e8, 1.0e11) * (1.5 + np.sin(2.0 * np.pi * t / duration)) * \
+            (1.0 + 0.05 * rng.standard_normal(t.size))
+        np.savetxt(os.path.join(category_dir, name), np.column_stack((t, y)), fmt='%.1f %.6e')
+    return len(names) * t.size
+
+def main():
+    number_of_species = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    resolution = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    step_size = float(sys.argv[3]) if len(sys.argv) > 3 else 600.0
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        constraints_dir = os.path.join(work_dir, 'constraints')
+        parameters_filename = os.path.join(work_dir, 'model.parameters')
+        with open(parameters_filename, 'w') as parameters_file:
+            parameters_file.write('\n'.join(['%d' % (duration / step_size), '%g' % step_size, '2', '2', '3600', '0',
+                                             '0', '51.51', '0.13', '21', '06', '2010', '1800']) + '\n')
+        window = atchem2_constraints.read_model_window(parameters_filename)
+
+        start = timer()
+        points = write_synthetic_constraints(constraints_dir, number_of_species, resolution)
+        print('synthetic constraints: ' + str(points) + ' points, ' + str(number_of_species) + ' species (written in ' +
+              '%.1f' % (timer() - start) + ' s)')
+
+        start = timer()
+        constraints = atchem2_constraints.read_constraints(constraints_dir)
+        read_time = timer() - start
+        text_size = sum(os.path.getsize(os.path.join(constraints_dir, c.category, c.name)) for c in constraints)
+        start = timer()
+        checked = []
+        for constraint in constraints:
+            constraint, errors, _ = atchem2_constraints.check_constraint(constraint, window)
+            assert not errors, errors
+            checked.append(constraint)
+        print('read text: ' + '%.2f' % read_time + ' s, check: ' + '%.2f' % (timer() - start) + ' s, ' +
+              '%.0f' % (text_size / 1024.0 ** 2) + ' MB')
+
+        table_dir = os.path.join(work_dir, 'table')
+        os.makedirs(table_dir)
+        start = timer()
+        atchem2_constraints.write_constraints(table_dir, checked)
+        write_time = timer() - start
+        start = timer()
+        for t, y in atchem2_constraints.load_table(table_dir).values():
+            t.sum() + y.sum()
+        load_time = timer() - start
+        print('write table: ' + '%.2f' % write_time + ' s, load table: ' + '%.3f' % load_time + ' s (' +
+              '%.0f' % (read_time / max(load_time, 1e-9)) + ' times faster than the text), ' +
+              '%.0f' % (os.path.getsize(os.path.join(table_dir, 'constraints.table')) / 1024.0 ** 2) + ' MB')
+
+        start = timer()
+        resampled = []
+        worst = 0.0
+        for constraint in checked:
+            constraint, deviation = atchem2_constraints.resample(constraint, window)
+            resampled.append(constraint)
+            worst = max(worst, deviation)
+        print('resample: ' + '%.2f' % (timer() - start) + ' s, largest relative difference ' + '%.2e' % worst)
+        resampled_dir = os.path.join(work_dir, 'resampled')
+        os.makedirs(resampled_dir)
+        resampled_size = atchem2_constraints.write_constraints(resampled_dir, resampled)
+        start = timer()
+        atchem2_constraints.read_constraints(resampled_dir)
+        print('read resampled text: ' + '%.3f' % (timer() - start) + ' s, ' +
+              '%.1f' % (resampled_size / 1024.0 ** 2) + ' MB')
+        print('model memory: ' + '%.1f' % (atchem2_constraints.fortran_memory(checked) / 1024.0 ** 2) + ' MB, ' +
+              '%.1f' % (atchem2_constraints.fortran_memory(resampled) / 1024.0 ** 2) + ' MB after resampling')
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script checks and times the analytic Jacobian matrix generated
+# by build/mech_converter.py (the subroutine jacobian in
+# mechanism.f90, see mech_jacobian.py), for a chemical mechanism file
+# in FACSIMILE format (.fac).
+#
+# mechanism.f90 is compiled with a small driver program, which
+# calculates the rates with update_p() and random concentrations, and
+# then:
+# - calculates the Jacobian matrix, and compares it with the central
+#   differences of the rate equations, as calculated by resid() in
+#   src/solverFunctions.f90. The rates are at most quadratic in each
+#   concentration, so the central differences are exact for any step:
+#   only the reactions of each species are included, and a large step
+#   is used, so that no precision is lost to cancellation;
+# - times the rate equations, the analytic Jacobian matrix, and the
+#   product of the Jacobian matrix with a vector, as done by the
+#   solver with and without the analytic Jacobian matrix (see
+#   FCVJTIMES() in src/atchem2.f90).
+#
+# The Fortran compiler is given by the environment variable FORT_COMP
+# [default: gfortran], and mechanism.f90 is compiled with the same
+# flags as in the Makefile (FSHAREDFLAGS, without -shared). The files
+# are written to a temporary directory, which is deleted at the end.
+#
+# ARGUMENT(S):
+#   1. optional path to the .fac file [default: model/mechanism.fac]
+#   2. optional number of calls [default: 1000]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_jacobian.py mcm_full.fac 100
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from benchmark_mech_converter import base_dir, mech_converter
+from benchmark_update_p import fortran_compiler, fortran_flags, arguments
+
+driver_template = """program benchmark_jacobian
+  use, intrinsic :: iso_c_binding
+  use mechanism_mod
+  implicit none
+  integer, parameter :: numberOfSpecies = {numberOfSpecies}, numberOfReactions = {numberOfReactions}
+  integer, parameter :: numberOfGenericComplex = {numberOfGenericComplex}, numberOfNonZeros = {numberOfNonZeros}
+  integer, parameter :: numberOfReactants = {numberOfReactants}, numberOfProducts = {numberOfProducts}
+  integer, parameter :: numberOfCalls = {numberOfCalls}
+  real(c_double) :: p(numberOfReactions), q(numberOfGenericComplex), j(1000), temp, m, ro2
+  real(c_double) :: y(numberOfSpecies), v(numberOfSpecies), dy(numberOfSpecies), jv(numberOfSpecies)
+  real(c_double) :: yPlus(numberOfSpecies), yMinus(numberOfSpecies), dyPlus(numberOfSpecies), dyMinus(numberOfSpecies)
+  real(c_double) :: jac(numberOfNonZeros), column(numberOfSpecies), h, error, maxError
+  integer :: reactants(2, numberOfReactants), products(2, numberOfProducts)
+  integer :: colPointers(numberOfSpecies + 1), rowIndices(numberOfNonZeros)
+  integer :: i, k, n
+  integer(kind=8) :: start, finish, rate
+
+  open (10, file='pairs.txt')
+  read (10, *) reactants, products, colPointers, rowIndices
+  close (10)
+
+  p = 0.0_c_double
+  q = 0.0_c_double
+  j = 1.0e-5_c_double
+  m = 2.46e19_c_double
+  temp = 290.0_c_double
+  ro2 = 1.0e8_c_double
+  call update_p( {arguments} )
+  call random_number( y )
+  y = 10.0_c_double ** ( 4.0_c_double + 8.0_c_double * y )
+  call random_number( v )
+
+  ! Compare the analytic Jacobian matrix with the central differences
+  ! of the rate equations, column by column
+  call jacobian( p, y, jac )
+  maxError = 0.0_c_double
+  do i = 1, numberOfSpecies
+    h = 0.5_c_double * y(i)
+    yPlus = y
+    yPlus(i) = y(i) + h
+    yMinus = y
+    yMinus(i) = y(i) - h
+    call resid( yPlus, dyPlus, i )
+    call resid( yMinus, dyMinus, i )
+    column = 0.0_c_double
+    do k = colPointers(i), colPointers(i + 1) - 1
+      column(rowIndices(k)) = jac(k)
+    end do
+    error = maxval( abs( ( dyPlus - dyMinus ) / ( 2.0_c_double * h ) - column ) / &
+                    max( abs( column ), tiny( 1.0_c_double ) ) )
+    maxError = max( maxError, error )
+  end do
+  write (*, '(ES15.6)') maxError
+
+  ! Time the rate equations. As in AtChem2, the rates which depend on
+  ! the photolysis rates or RO2 are calculated at each call
+  call system_clock( start, rate )
+  do n = 1, numberOfCalls
+    y(1) = y(1) * ( 1.0_c_double + 1.0e-12_c_double )
+    call update_fast_p( {arguments} )
+    call resid( y, dy, 0 )
+  end do
+  call system_clock( finish )
+  write (*, '(ES15.6)') real( finish - start, c_double ) / real( rate, c_double )
+
+  ! Time the analytic Jacobian matrix
+  call system_clock( start, rate )
+  do n = 1, numberOfCalls
+    y(1) = y(1) * ( 1.0_c_double + 1.0e-12_c_double )
+    call update_fast_p( {arguments} )
+    call jacobian( p, y, jac )
+  end do
+  call system_clock( finish )
+  write (*, '(ES15.6)') real( finish - start, c_double ) / real( rate, c_double )
+
+  ! Time the product of the Jacobian matrix with a vector
+  call system_clock( start, rate )
+  do n = 1, numberOfCalls
+    v(1) = v(1) * ( 1.0_c_double + 1.0e-12_c_double )
+    jv = 0.0_c_double
+    do i = 1, numberOfSpecies
+      do k = colPointers(i), colPointers(i + 1) - 1
+        jv(rowIndices(k)) = jv(rowIndices(k)) + jac(k) * v(i)
+      end do
+    end do
+  end do
+  call system_clock( finish )
+  write (*, '(ES15.6)') real( finish - start, c_double ) / real( rate, c_double )
+  write (*, '(ES15.6)') sum( dy ) + sum( jv )
+
+contains
+
+  ! Rate equations, as in resid() in src/solverFunctions.f90. If
+  ! species is not 0, only the reactions of which it is a reactant are
+  ! included.
+  subroutine resid( y, dy, species )
+    real(c_double), intent(in) :: y(:)
+    real(c_double), intent(out) :: dy(:)
+    integer, intent(in) :: species
+    real(c_double) :: r(numberOfReactions)
+    integer :: i
+
+    if ( species == 0 ) then
+      r = p
+    else
+      r = 0.0_c_double
+      do i = 1, numberOfReactants
+        if ( reactants(2, i) == species ) r(reactants(1, i)) = p(reactants(1, i))
+      end do
+    end if
+    dy = 0.0_c_double
+    do i = 1, numberOfReactants
+      r(reactants(1, i)) = r(reactants(1, i)) * y(reactants(2, i))
+    end do
+    do i = 1, numberOfReactants
+      dy(reactants(2, i)) = dy(reactants(2, i)) - r(reactants(1, i))
+    end do
+    do i = 1, numberOfProducts
+      dy(products(2, i)) = dy(products(2, i)) + r(products(1, i))
+    end do
+  end subroutine resid
+
+end program benchmark_jacobian
+"""
+
+# ============================================================ #
+
+def main():
+    fac_filename = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'model', 'mechanism.fac')
+    numberOfCalls = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    with open(fac_filename, 'r') as fac_file:
+        mechanism = mech_converter.parse_fac(fac_file)
+    speciesList, numberOfReactions, reactantPairs, productPairs = mech_converter.reaction_network(mechanism)
+    numberOfSpecies = len(speciesList)
+    columns = mech_converter.mech_jacobian.jacobian_pattern(numberOfSpecies, reactantPairs, productPairs)
+    sparsity = mech_converter.mech_jacobian.sparsity_contents(columns, list(range(numberOfSpecies)))
+    numbers = [line for line in sparsity.splitlines() if not line.startswith('!')][1:]
+    numberOfNonZeros = len(numbers) - numberOfSpecies - 1
+    print(fac_filename + ': ' + str(numberOfSpecies) + ' species, ' + str(numberOfReactions) + ' reactions, ' +
+          str(numberOfNonZeros) + ' nonzeros in the Jacobian matrix, ' + str(numberOfCalls) + ' calls')
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(work_dir, 'mechanism.f90'), 'w') as mech_f90_file:
+            mech_f90_file.write(mech_converter.emit_f90(mechanism))
+        with open(os.path.join(work_dir, 'pairs.txt'), 'w') as pairs_file:
+            for pairs in [reactantPairs, productPairs]:
+                pairs_file.write(''.join([str(x) + ' ' + str(y) + '\n' for x, y in pairs]))
+            pairs_file.write('\n'.join(numbers) + '\n')
+        with open(os.path.join(work_dir, 'driver.f90'), 'w') as driver_file:
+            driver_file.write(driver_template.format(numberOfSpecies=numberOfSpecies,
+                                                     numberOfReactions=max(numberOfReactions, 1),
+                                                     numberOfGenericComplex=max(len(mechanism.coefficients), 1),
+                                                     numberOfNonZeros=numberOfNonZeros,
+                                                     numberOfReactants=len(reactantPairs),
+                                                     numberOfProducts=len(productPairs),
+                                                     numberOfCalls=numberOfCalls,
+                                                     arguments=arguments))
+        subprocess.check_call([fortran_compiler, '-c', 'mechanism.f90'] + fortran_flags, cwd=work_dir)
+        subprocess.check_call([fortran_compiler, '-O2', '-ffree-line-length-none', '-o', 'driver', 'driver.f90',
+                               'mechanism.o'], cwd=work_dir)
+        results = [float(x) for x in subprocess.check_output([os.path.join(work_dir, 'driver')],
+                                                             cwd=work_dir).decode('ascii').split()]
+    finally:
+        shutil.rmtree(work_dir)
+
+    maxError, residTime, jacobianTime, productTime = results[:4]
+    print('largest relative difference with the central differences of the rate equations: ' + '%.2e' % maxError)
+    print('time (s): rate equations ' + '%.3f' % residTime + ', analytic Jacobian matrix ' + '%.3f' % jacobianTime +
+          ', Jacobian matrix times vector ' + '%.3f' % productTime)
+    print('dense Jacobian matrix: ' + '%.1f' % (numberOfSpecies * residTime / max(jacobianTime, 1.e-9)) +
+          ' times faster than by finite differences')
+    print('Jacobian matrix times vector: ' + '%.1f' % (residTime / max(productTime, 1.e-9)) +
+          ' times faster than by finite differences, once the Jacobian matrix is calculated')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script times tools/output/atchem2_jacobian.py on a synthetic
+# jacobian.output, written in the same format as the model (see jfy()
+# in src/solverFunctions.f90), of a mechanism with many species and a
+# sparse Jacobian matrix with a stiff spectrum.
+#
+# It reports the time taken and the peak memory used to read the
+# Jacobian matrices into sparse matrices, by parsing the file in chunks
+# and from the cache, compared with reading the whole file into dense
+# arrays, and the time taken to calculate the diagnostics of each
+# matrix. The file is written to a temporary directory, which is
+# deleted at the end. The peak memory is measured with tracemalloc
+# (Python 3 only).
+#
+# ARGUMENT(S):
+#   1. optional number of species [default: 1000]
+#   2. optional number of Jacobian matrices [default: 10]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_jacobian_output.py 1000 10
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+import numpy as np
+from scipy import sparse
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(base_dir, 'tools', 'output'))
+import atchem2_jacobian
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# ============================================================ #
+
+def synthetic_jacobian(number_of_species, rng):
+    # Return a sparse Jacobian matrix: loss rates on the diagonal,
+    # spanning several orders of magnitude, and a few products of each
+    # species, mostly close to it in the numbering.
+    loss = 10.0 ** rng.uniform(-6.0, 3.0, number_of_species)
+    rows = [np.arange(number_of_species)]
+    columns = [np.arange(number_of_species)]
+    values = [-loss]
+    for _ in range(4):
+        offsets = np.where(rng.uniform(size=number_of_species) < 0.9,
+                           rng.randint(-20, 21, number_of_species), rng.randint(-500, 501, number_of_species))
+        rows.append(np.clip(np.arange(number_of_species) + offsets, 0, number_of_species - 1))
+        columns.append(np.arange(number_of_species))
+        values.append(0.2 * loss)
+    matrix = sparse.coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                               shape=(number_of_species, number_of_species))
+    return matrix.toarray()
+
+def write_jacobian_output(filename, number_of_species, number_of_matrices, seed=0):
+    # Write the Jacobian matrices to filename, as jfy() does: the time
+    # and a dense row of the matrix on each row, 100 values per line,
+    # and a separator line after each matrix.
+    rng = np.random.RandomState(seed)
+    width = number_of_species + 1
+    row_format = ''.join('%15.7E' * min(100, width - start) + '\n' for start in range(0, width, 100))
+    with open(filename, 'w') as jacobian_file:
+        for k in range(number_of_matrices):
+            rows = np.column_stack((np.full(number_of_species, 3600.0 * k), synthetic_jacobian(number_of_species,
+                                                                                               rng)))
+            jacobian_file.write((row_format * number_of_species) % tuple(rows.ravel()))
+            jacobian_file.write(' ---------------\n')
+
+def read_dense(filename, number_of_species):
+    # Read the whole file into dense arrays, as without atchem2_jacobian.
+    with open(filename, 'r') as jacobian_file:
+        blocks = jacobian_file.read().split('---------------')[:-1]
+    return [np.array(block.split(), dtype=float).reshape(number_of_species, -1)[:, 1:] for block in blocks]
+
+def measure(function):
+    # Return the time taken by function, and its peak memory in MB (or None).
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = timer()
+    function()
+    elapsed = timer() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+        tracemalloc.stop()
+    return elapsed, peak
+
+def report(label, elapsed, peak):
+    # Print the time taken and the peak memory of a step.
+    print(label + ': ' + '%.2f' % elapsed + ' s' + ('' if peak is None else ', peak memory ' + '%.0f' % peak + ' MB'))
+
+def main():
+    number_of_species = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    number_of_matrices = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(work_dir, 'jacobian.output')
+        start = timer()
+        write_jacobian_output(filename, number_of_species, number_of_matrices)
+        print('synthetic jacobian.output: ' + str(number_of_matrices) + ' matrices of ' + str(number_of_species) +
+              ' species, ' + '%.0f' % (os.path.getsize(filename) / 1024.0 ** 2) + ' MB (written in ' +
+              '%.1f' % (timer() - start) + ' s)')
+
+        report('read dense', *measure(lambda: read_dense(filename, number_of_species)))
+        nnz = []
+        report('read sparse', *measure(lambda: nnz.extend(J.nnz for _, J in
+                                                          atchem2_jacobian.read_jacobian(filename, False))))
+        report('read sparse and write the cache', *measure(lambda: [J.nnz for _, J in
+                                                                    atchem2_jacobian.read_jacobian(filename)]))
+        report('read sparse from the cache', *measure(lambda: [J.data.sum() for _, J in
+                                                               atchem2_jacobian.read_jacobian(filename)]))
+        cache_dir = atchem2_jacobian.cache_directory(filename)
+        cache_size = sum(os.path.getsize(os.path.join(cache_dir, x)) for x in os.listdir(cache_dir))
+        print('nonzero elements: ' + str(nnz[0]) + ' per matrix, cache: ' + '%.1f' % (cache_size / 1024.0 ** 2) +
+              ' MB')
+
+        for limit, label in [(number_of_species, 'all eigenvalues'), (0, 'ARPACK estimates')]:
+            start = timer()
+            ratios = [atchem2_jacobian.diagnostics(J, dense_limit=limit)['stiffness_ratio']
+                      for _, J in atchem2_jacobian.read_jacobian(filename)]
+            print('diagnostics (' + label + '): ' + '%.3f' % ((timer() - start) / len(ratios)) +
+                  ' s per matrix, stiffness ratio ' + '%.3e' % ratios[0])
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
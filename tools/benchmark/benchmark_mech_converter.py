@@ -0,0 +1,118 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script times build/mech_converter.py on a synthetic chemical
+# mechanism file in FACSIMILE format (.fac). The synthetic mechanism
+# has roughly the proportions of a full MCM extract (about one species
+# for every three reactions), so it exposes the scaling behaviour of
+# the conversion which the small test mechanisms cannot show.
+#
+# The synthetic .fac file and the generated mechanism files are written
+# to a temporary directory, which is deleted at the end.
+#
+# ARGUMENT(S):
+#   1. optional number of reactions [default: 50000]
+#   2. optional number of repetitions [default: 1]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_mech_converter.py 50000
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import random
+from timeit import default_timer as timer
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(base_dir, 'build'))
+import mech_converter
+
+# ============================================================ #
+
+def write_synthetic_fac(filename, number_of_reactions, seed=0):
+    # Write a synthetic .fac file with number_of_reactions reactions
+    # to filename. Species are named S1, S2, ..., with about one species
+    # for every three reactions, and every tenth species is listed as
+    # an RO2. Each reaction has one or two reactants and one to three
+    # products, and uses one of a few typical MCM rate expressions.
+    rng = random.Random(seed)
+    number_of_species = max(number_of_reactions // 3, 2)
+    species = ['S' + str(i) for i in range(1, number_of_species + 1)]
+    ro2 = species[::10]
+    rates = ['KRO2NO', 'KRO2HO2*0.387', '2.3D-12*EXP(360/TEMP)', '1.2D-12',
+             'J<41>', 'KMT01', '8.8D-12*EXP(-1320/TEMP)*0.5', 'KDEC*0.5']
+
+    with open(filename, 'w') as fac_file:
+        fac_file.write('* Synthetic mechanism for benchmarking ;\n')
+        fac_file.write('*;\n* Generic Rate Coefficients ;\n*;\n')
+        fac_file.write('KRO2NO = 2.7D-12*EXP(360/TEMP) ;\n')
+        fac_file.write('KRO2HO2 = 2.91D-13*EXP(1300/TEMP) ;\n')
+        fac_file.write('KDEC = 1.00D+06 ;\n')
+        fac_file.write('*;\n* Complex reactions ;\n*;\n')
+        fac_file.write('K10 = 1.0D-31*M*(TEMP/300)@-1.6 ;\n')
+        fac_file.write('K1I = 5.0D-11*(TEMP/300)@-0.3 ;\n')
+        fac_file.write('KR1 = K10/K1I ;\n')
+        fac_file.write('FC1 = 0.85 ;\n')
+        fac_file.write('NC1 = 0.75-1.27*(LOG10(FC1)) ;\n')
+        fac_file.write('F1 = 10@(LOG10(FC1)/(1+(LOG10(KR1)/NC1)**2)) ;\n')
+        fac_file.write('KMT01 = (K10*K1I)*F1/(K10+K1I) ;\n')
+        fac_file.write('*;\n* Peroxy radicals. ;\n*;\n')
+        fac_file.write('RO2 = ' + ' + '.join(ro2) + ' ;\n')
+        fac_file.write('*;\n* Reaction definitions. ;\n*;\n')
+        for i in range(number_of_reactions):
+            # Make sure every species appears at least once
+            reactants = [species[i % number_of_species]]
+            if rng.random() < 0.4:
+                reactants.append(rng.choice(species))
+            products = rng.sample(species, rng.randint(1, 3))
+            fac_file.write('% ' + rng.choice(rates) + ' : ' + ' + '.join(reactants) +
+                           ' = ' + ' + '.join(products) + ' ;\n')
+        fac_file.write('*;\n* End of Subset. ;\n')
+    return
+
+
+def time_convert(number_of_reactions, repetitions):
+    # Generate a synthetic mechanism and time mech_converter.convert on it.
+    # The output of convert is suppressed. Returns the list of timings.
+    work_dir = tempfile.mkdtemp()
+    timings = []
+    try:
+        fac_filename = os.path.join(work_dir, 'synthetic.fac')
+        write_synthetic_fac(fac_filename, number_of_reactions)
+        shutil.copy(os.path.join(base_dir, 'model', 'configuration', 'environmentVariables.config'), work_dir)
+        stdout = sys.stdout
+        for _ in range(repetitions):
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                start = timer()
+                mech_converter.convert(fac_filename, work_dir, os.path.join(base_dir, 'mcm'), force=True)
+                timings.append(timer() - start)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+    finally:
+        shutil.rmtree(work_dir)
+    return timings
+
+# ============================================================ #
+
+def main():
+    number_of_reactions = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    timings = time_convert(number_of_reactions, repetitions)
+    print('mech_converter.convert: ' + str(number_of_reactions) + ' reactions, best of ' +
+          str(repetitions) + ': ' + '%.3f' % min(timings) + ' s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script times tools/output/atchem2_rates.py on synthetic
+# productionRates.output and lossRates.output files, written in the
+# same format as by the Fortran code (see outputRates() in
+# src/outputFunctions.f90). Each species has a few production and loss
+# reactions, and the files grow with the number of output times until
+# they reach the requested total size.
+#
+# It reports the time taken to ingest the files into the database,
+# the size of the database, and the average time taken by the top and
+# series queries for random species and times. The output files and
+# the database are written to a temporary directory, which is deleted
+# at the end.
+#
+# ARGUMENT(S):
+#   1. optional total size of the output files in MB [default: 1024]
+#   2. optional number of species [default: 2000]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_rates_store.py 1024 2000
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import random
+from timeit import default_timer as timer
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(base_dir, 'tools', 'output'))
+import atchem2_rates
+
+header = '           time speciesNumber speciesName reactionNumber           rate  reaction\n'
+reactions_per_species = 8
+number_of_queries = 100
+
+# ============================================================ #
+
+def fortran_es(x):
+    # Format x as the Fortran edit descriptor ES15.6E3 does.
+    mantissa, exponent = ('%.6E' % x).split('E')
+    return '%15s' % (mantissa + 'E' + exponent[0] + '%03d' % abs(int(exponent)))
+
+def write_synthetic_rates(output_dir, size_mb, number_of_species, seed=0):
+    # Write synthetic productionRates.output and lossRates.output to
+    # output_dir, with about size_mb MB in total. Return the number of
+    # output times and the number of rows written.
+    rng = random.Random(seed)
+    species = ['S' + str(i) for i in range(1, number_of_species + 1)]
+    # The reactions of each species, as (reaction number, reaction string)
+    pathways = []
+    for kind in range(2):
+        pathways.append([])
+        for i in range(number_of_species):
+            reactions = []
+            for _ in range(reactions_per_species):
+                other = rng.choice(species)
+                number = rng.randint(1, 3 * number_of_species)
+                reaction = species[i] + '+OH=' + other if kind == 0 else other + '+NO=' + species[i] + '+NO2'
+                reactions.append((number, reaction))
+            pathways[kind].append(reactions)
+
+    target_size = size_mb * 1024 * 1024 // 2
+    rows = 0
+    times = 0
+    files = [open(os.path.join(output_dir, x), 'w') for x in ['lossRates.output', 'productionRates.output']]
+    try:
+        for rates_file in files:
+            rates_file.write(' ' + header)
+        while files[1].tell() < target_size:
+            times += 1
+            time = fortran_es(times * 60.0)
+            for kind in range(2):
+                lines = []
+                for i in range(number_of_species):
+                    prefix = time + '%14d%52s' % (i + 1, species[i])
+                    for number, reaction in pathways[kind][i]:
+                        lines.append(prefix + '%15d' % number + fortran_es(rng.random() * 1.0e6) + '  ' + reaction + '\n')
+                files[kind].write(''.join(lines))
+                rows += len(lines)
+    finally:
+        for rates_file in files:
+            rates_file.close()
+    return times, rows
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    number_of_species = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        start = timer()
+        times, rows = write_synthetic_rates(work_dir, size_mb, number_of_species)
+        size = sum(os.path.getsize(os.path.join(work_dir, x)) for x in atchem2_rates.rate_filenames)
+        print('synthetic output: ' + '%.0f' % (size / 1024.0 ** 2) + ' MB, ' + str(rows) + ' rows, ' +
+              str(number_of_species) + ' species, ' + str(times) + ' times (written in ' + '%.1f' % (timer() - start) +
+              ' s)')
+
+        start = timer()
+        connection = atchem2_rates.open_database(work_dir)
+        print('ingest: ' + '%.1f' % (timer() - start) + ' s, database ' +
+              '%.0f' % (os.path.getsize(os.path.join(work_dir, atchem2_rates.database_filename)) / 1024.0 ** 2) + ' MB')
+
+        rng = random.Random(1)
+        queries = [('S' + str(rng.randint(1, number_of_species)), rng.randint(0, 1), rng.uniform(0, times * 60.0))
+                   for _ in range(number_of_queries)]
+        start = timer()
+        for species, kind, time in queries:
+            atchem2_rates.top_rates(connection, species, kind, atchem2_rates.nearest_time(connection, time), 10)
+        print('top query: ' + '%.2f' % ((timer() - start) / number_of_queries * 1000) + ' ms')
+        start = timer()
+        for species, kind, time in queries:
+            atchem2_rates.rate_series(connection, species, kind)
+        print('series query (total rate): ' + '%.2f' % ((timer() - start) / number_of_queries * 1000) + ' ms')
+        reactions = [atchem2_rates.top_rates(connection, species, kind, atchem2_rates.nearest_time(connection), 1)[0][0]
+                     for species, kind, _ in queries]
+        start = timer()
+        for (species, kind, _), reaction in zip(queries, reactions):
+            atchem2_rates.rate_series(connection, species, kind, reaction)
+        print('series query (one reaction): ' + '%.2f' % ((timer() - start) / number_of_queries * 1000) + ' ms')
+
+        start = timer()
+        atchem2_rates.open_database(work_dir)
+        print('reopen (up to date): ' + '%.2f' % ((timer() - start) * 1000) + ' ms')
+        connection.close()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script times the Python tools of AtChem2 on synthetic chemical
+# mechanisms of increasing size, to catch regressions in their scaling
+# which the small test mechanisms cannot show.
+#
+# The synthetic .fac files are built like an MCM extract: the header,
+# the generic rate coefficients, the complex reactions and the
+# inorganic reactions are copied from model/mechanism.fac, and the
+# organic reactions come in families, one for each RO2 species taken
+# from mcm/peroxy-radicals_v3.3.1 (with a numbered suffix once the
+# list runs out). Each family has the RO2 reactions with NO, NO3, HO2
+# and the RO2 sum, and the reactions of the hydroperoxide, nitrate,
+# alkoxy radical and carbonyl which they make, including photolysis (J)
+# terms; the carbonyl of each family makes the RO2 of another one. The
+# RO2 section spans several lines, and a few reactions are broken
+# across two lines or stacked two on a line, as in real files.
+#
+# For each size, the script times:
+# - fix_mechanism_fac.fix_fac_lines() on the .fac file
+# - mech_converter.convert() on the .fac file (see also its --profile
+#   option, whose stage timings are included in the JSON file)
+# - atchem2_output.load_output() on a synthetic
+#   speciesConcentrations.output with all the species, without and
+#   with its cache
+# - atchem2_rates.open_database() on synthetic productionRates.output
+#   and lossRates.output (see benchmark_rates_store.py)
+#
+# Each step runs in a separate Python process, so that the peak
+# resident memory reported for it is its own. The throughput is given
+# in lines, reactions or MB per second. All the files are written to a
+# temporary directory, which is deleted at the end.
+#
+# OPTIONS:
+#   --sizes N [N ...]: numbers of reactions [default: 1000 3000 10000
+#     30000 100000]
+#   --times N: number of output times of the synthetic output files
+#     [default: 100]
+#   --json FILE: also write the results to the JSON file FILE, to track
+#     them over time
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_suite.py
+#   python ./tools/benchmark/benchmark_suite.py --sizes 1000 10000 --json benchmark.json
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+from timeit import default_timer as timer
+
+base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, os.path.join(base_dir, 'build'))
+sys.path.insert(0, os.path.join(base_dir, 'tools', 'output'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mech_profile
+from benchmark_rates_store import fortran_es
+
+default_sizes = [1000, 3000, 10000, 30000, 100000]
+
+# The reactions of each family of the synthetic mechanism, with {R}
+# the stem of its RO2 species ({R}O2), and {N} the stem of the RO2
+# species of the family made by its carbonyl ({R}CHO)
+family_reactions = [
+    ('KRO2HO2*0.387', '{R}O2 + HO2', '{R}OOH'),
+    ('KRO2NO*0.9', '{R}O2 + NO', '{R}O + NO2'),
+    ('KRO2NO*0.1', '{R}O2 + NO', '{R}NO3'),
+    ('KRO2NO3', '{R}O2 + NO3', '{R}O + NO2'),
+    ('2.00D-12*0.6*RO2', '{R}O2', '{R}O'),
+    ('2.00D-12*0.2*RO2', '{R}O2', '{R}OH'),
+    ('3.6D-12*EXP(190/TEMP)', '{R}OOH + OH', '{R}O2'),
+    ('J<41>', '{R}OOH', '{R}O + OH'),
+    ('KROPRIM*O2', '{R}O', '{R}CHO + HO2'),
+    ('KDEC*0.5', '{R}O', 'NO2 + HCHO'),
+    ('1.38D-12*EXP(-1150/TEMP)', '{R}NO3 + OH', '{R}CHO + NO2'),
+    ('J<53>', '{R}NO3', '{R}O + NO2'),
+    ('1.7D-11*EXP(-400/TEMP)', '{R}OH + OH', '{R}CHO + HO2'),
+    ('5.1D-12*EXP(405/TEMP)*0.8', '{R}CHO + OH', '{N}O2'),
+    ('KNO3AL*2.4', '{R}CHO + NO3', '{N}O2 + HNO3'),
+    ('J<15>', '{R}CHO', '{N}O2 + HO2 + CO'),
+]
+
+# ============================================================ #
+
+def read_template(template_filename):
+    # Return the lines of template_filename (model/mechanism.fac) before
+    # the 'Peroxy radicals' section, and the reactions of its 'Reaction
+    # definitions' section.
+    with open(template_filename, 'r') as template_file:
+        lines = template_file.readlines()
+    peroxy = [i for i, line in enumerate(lines) if 'Peroxy radicals' in line][0]
+    reactions = [i for i, line in enumerate(lines) if 'Reaction definitions' in line][0]
+    header = lines[:peroxy - 1]
+    inorganic = [line for line in lines[reactions + 2:] if line.startswith('%')]
+    return header, inorganic
+
+def family_stems(number_of_families, ro2_reference_filename):
+    # Return the stems of the RO2 species of the families: the RO2 names
+    # from the reference list without their final O2, with a numbered
+    # suffix once the list runs out.
+    with open(ro2_reference_filename, 'r') as ro2_file:
+        stems = sorted(set(x.strip()[:-2] for x in ro2_file if x.strip().endswith('O2') and len(x.strip()) > 2))
+    return [stems[i % len(stems)] + ('' if i < len(stems) else 'X' + str(i // len(stems)))
+            for i in range(number_of_families)]
+
+def write_synthetic_fac(filename, number_of_reactions, seed=0):
+    # Write a synthetic .fac file with about number_of_reactions
+    # reactions to filename. Return the number of reactions.
+    rng = random.Random(seed)
+    header, inorganic = read_template(os.path.join(base_dir, 'model', 'mechanism.fac'))
+    number_of_families = max((number_of_reactions - len(inorganic)) // len(family_reactions), 1)
+    stems = family_stems(number_of_families, os.path.join(base_dir, 'mcm', 'peroxy-radicals_v3.3.1'))
+
+    lines = []
+    for stem in stems:
+        other = stems[rng.randrange(number_of_families)]
+        for rate, reactants, products in family_reactions:
+            lines.append('% ' + rate + ' : ' + reactants.format(R=stem) + ' = ' + products.format(R=stem, N=other) + ' ;')
+    # Break a few reactions across two lines after the =, and stack a few others two on a line. Going backwards,
+    # lines[i - 1] is always a single reaction, but lines[i] may have been broken or stacked already
+    for i in range(len(lines) - 1, 0, -1):
+        if lines[i].count(';') > 1 or '\n' in lines[i]:
+            continue
+        x = rng.random()
+        if x < 0.01:
+            left, right = lines[i].split(' = ')
+            lines[i] = left + ' =\n    ' + right
+        elif x < 0.015:
+            lines[i - 1] += ' ' + lines.pop(i)
+
+    ro2 = [stem + 'O2' for stem in stems]
+    with open(filename, 'w') as fac_file:
+        fac_file.writelines(header)
+        fac_file.write('* Peroxy radicals. ;\n*;\n')
+        for i in range(0, len(ro2), 10):
+            fac_file.write(('RO2 = ' if i == 0 else '') + ' + '.join(ro2[i:i + 10]) +
+                           (' ;\n' if i + 10 >= len(ro2) else ' + \n'))
+        fac_file.write('*;\n* Reaction definitions. ;\n*;\n')
+        fac_file.writelines(inorganic)
+        for line in lines:
+            fac_file.write(line + '\n')
+        fac_file.write('*;\n* End of Subset.  No. of Species = ' + str(6 * number_of_families) + ', No. of Reactions = ' +
+                       str(len(inorganic) + len(family_reactions) * number_of_families) + ' ;\n')
+    return len(inorganic) + len(family_reactions) * number_of_families
+
+def write_species_concentrations(filename, species, number_of_times, seed=0):
+    # Write a synthetic speciesConcentrations.output, in the format of
+    # the Fortran code, with all the species and number_of_times rows.
+    rng = random.Random(seed)
+    with open(filename, 'w') as output_file:
+        output_file.write(''.join('%15s' % x for x in ['t'] + species) + '\n')
+        for i in range(number_of_times):
+            output_file.write(fortran_es(i * 60.0) + ''.join(fortran_es(rng.random() * 1.0e9) for _ in species) + '\n')
+
+# ============================================================ #
+
+def run_step(step, work_dir):
+    # Run a step of the benchmark in this process, and print its
+    # results as JSON: the wall time, the peak resident memory and the
+    # number of items processed, with any extra information.
+    stdout = sys.stdout
+    result = dict()
+    fac_filename = os.path.join(work_dir, 'synthetic.fac')
+    try:
+        sys.stdout = open(os.devnull, 'w')
+        if step == 'fix_mechanism_fac':
+            import fix_mechanism_fac
+            start = timer()
+            with open(fac_filename, 'r') as fac_file:
+                result['items'] = len(list(fix_mechanism_fac.fix_fac_lines(fac_file)))
+            result['time'] = timer() - start
+        elif step == 'convert':
+            import mech_converter
+            profiler = mech_profile.StageProfiler()
+            start = timer()
+            mech_converter.convert(fac_filename, work_dir, os.path.join(base_dir, 'mcm'), force=True, profiler=profiler)
+            result['time'] = timer() - start
+            result['items'] = profiler.metrics['numberOfReactions']
+            result['stages'] = dict((x['name'], x['time']) for x in profiler.stages)
+        elif step in ['load_output', 'load_output_cached']:
+            import atchem2_output
+            output_filename = os.path.join(work_dir, 'speciesConcentrations.output')
+            start = timer()
+            table = atchem2_output.load_output(output_filename)
+            result['time'] = timer() - start
+            result['items'] = os.path.getsize(output_filename) / 1024.0 ** 2
+            result['columns'] = len(table.names)
+        elif step == 'rates_ingest':
+            import atchem2_rates
+            start = timer()
+            atchem2_rates.open_database(work_dir, force=True).close()
+            result['time'] = timer() - start
+            result['items'] = sum(os.path.getsize(os.path.join(work_dir, x))
+                                  for x in atchem2_rates.rate_filenames) / 1024.0 ** 2
+        else:
+            raise RuntimeError('Unknown step: ' + step)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    result['maxResidentMemory'] = mech_profile.max_resident_memory()
+    print(json.dumps(result))
+
+def time_step(step, work_dir):
+    # Run a step of the benchmark in a new Python process, and return
+    # its results.
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--step', step, work_dir])
+    return json.loads(output.decode().strip().split('\n')[-1])
+
+# The steps of the benchmark, with the unit of their throughput
+steps = [('fix_mechanism_fac', 'lines'), ('convert', 'reactions'), ('load_output', 'MB'),
+         ('load_output_cached', 'MB'), ('rates_ingest', 'MB')]
+
+def benchmark_size(number_of_reactions, number_of_times):
+    # Generate the synthetic files for number_of_reactions reactions in
+    # a temporary directory, and run all the steps on them. Return the
+    # results of each step.
+    import benchmark_rates_store
+    work_dir = tempfile.mkdtemp()
+    try:
+        fac_filename = os.path.join(work_dir, 'synthetic.fac')
+        number_of_reactions = write_synthetic_fac(fac_filename, number_of_reactions)
+        shutil.copy(os.path.join(base_dir, 'model', 'configuration', 'environmentVariables.config'), work_dir)
+        results = dict()
+        for step, unit in steps:
+            results[step] = time_step(step, work_dir)
+            results[step]['unit'] = unit
+            if step == 'convert':
+                # Write the synthetic output files, with the species of the converted mechanism, and with 1 MB
+                # of production and loss rates for every 1000 reactions
+                with open(os.path.join(work_dir, 'mechanism.species'), 'r') as species_file:
+                    species = [line.split()[1] for line in species_file if line.strip()]
+                write_species_concentrations(os.path.join(work_dir, 'speciesConcentrations.output'), species,
+                                             number_of_times)
+                benchmark_rates_store.write_synthetic_rates(work_dir, max(number_of_reactions // 1000, 1),
+                                                            len(species))
+    finally:
+        shutil.rmtree(work_dir)
+    return number_of_reactions, results
+
+# ============================================================ #
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the Python tools of AtChem2 on synthetic mechanisms.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='numbers of reactions')
+    parser.add_argument('--times', type=int, default=100, help='number of output times of the synthetic output files')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('--step', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Run a single step in this process, on behalf of time_step()
+    if args.step is not None:
+        run_step(*args.step)
+        return
+
+    print('%10s  %-20s %10s %16s %14s' % ('reactions', 'step', 'time (s)', 'throughput (/s)', 'max RSS (MB)'))
+    all_results = []
+    for size in args.sizes:
+        number_of_reactions, results = benchmark_size(size, args.times)
+        for step, unit in steps:
+            result = results[step]
+            print('%10d  %-20s %10.3f %16s %14.1f' % (
+                number_of_reactions, step, result['time'],
+                '%.4g' % (result['items'] / max(result['time'], 1.0e-9)) + ' ' + unit,
+                result['maxResidentMemory'] / 1024.0 ** 2))
+        all_results.append({'numberOfReactions': number_of_reactions, 'steps': results})
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'python': platform.python_version(), 'numberOfTimes': args.times, 'sizes': all_results},
+                      json_file, indent=2, sort_keys=True)
+            json_file.write('\n')
+
+if __name__ == '__main__':
+    main()
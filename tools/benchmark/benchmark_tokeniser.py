@@ -0,0 +1,95 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script times mech_converter.tokenise_and_process() on all the
+# rate expressions of a chemical mechanism file in FACSIMILE format
+# (.fac): the Generic Rate Coefficients, the Complex reactions and the
+# rates in the Reaction definitions.
+#
+# The rate expressions are collected by running mech_converter.convert
+# once on a copy of the .fac file, and recording every call to
+# tokenise_and_process together with its arguments. The recorded calls
+# are then repeated on their own. If no .fac file is given, a synthetic
+# mechanism is generated (see benchmark_mech_converter.py).
+#
+# ARGUMENT(S):
+#   1. optional path to the .fac file (e.g. a full MCM extract)
+#   2. optional number of repetitions [default: 5]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_tokeniser.py mcm_full.fac
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+from timeit import default_timer as timer
+
+import benchmark_mech_converter
+from benchmark_mech_converter import base_dir, mech_converter
+
+# ============================================================ #
+
+def record_rate_expressions(fac_filename):
+    # Run mech_converter.convert on a copy of fac_filename, and return
+    # the list of (input_string, variablesDict) arguments passed to
+    # tokenise_and_process. variablesDict is copied at each call, as
+    # convert keeps adding to it.
+    work_dir = tempfile.mkdtemp()
+    calls = []
+    tokenise_and_process = mech_converter.tokenise_and_process
+
+    def recorder(input_string, variablesDict):
+        calls.append((input_string, dict(variablesDict)))
+        return tokenise_and_process(input_string, variablesDict)
+
+    stdout = sys.stdout
+    try:
+        if fac_filename is None:
+            fac_filename = os.path.join(work_dir, 'synthetic.fac')
+            benchmark_mech_converter.write_synthetic_fac(fac_filename, 50000)
+        else:
+            shutil.copy(fac_filename, work_dir)
+            fac_filename = os.path.join(work_dir, os.path.basename(fac_filename))
+        shutil.copy(os.path.join(base_dir, 'model', 'configuration', 'environmentVariables.config'), work_dir)
+        mech_converter.tokenise_and_process = recorder
+        sys.stdout = open(os.devnull, 'w')
+        mech_converter.convert(fac_filename, work_dir, os.path.join(base_dir, 'mcm'))
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        mech_converter.tokenise_and_process = tokenise_and_process
+        shutil.rmtree(work_dir)
+    return calls
+
+# ============================================================ #
+
+def main():
+    fac_filename = sys.argv[1] if len(sys.argv) > 1 else None
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    calls = record_rate_expressions(fac_filename)
+
+    timings = []
+    for _ in range(repetitions):
+        start = timer()
+        for input_string, variablesDict in calls:
+            mech_converter.tokenise_and_process(input_string, variablesDict)
+        timings.append(timer() - start)
+
+    best = min(timings)
+    print('tokenise_and_process: ' + str(len(calls)) + ' rate expressions, best of ' + str(repetitions) + ': ' +
+          '%.3f' % best + ' s (' + '%.2f' % (1.e6 * best / max(len(calls), 1)) + ' us per expression)')
+
+if __name__ == '__main__':
+    main()
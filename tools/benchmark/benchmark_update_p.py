@@ -0,0 +1,182 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script compares the mechanism.f90 generated by
+# build/mech_converter.py with and without optimisation (see
+# optimise_rates() in mech_converter.py), for a chemical mechanism
+# file in FACSIMILE format (.fac).
+#
+# For each version, it reports the size of the generated code and the
+# number of assignments, arithmetic operations and function calls in
+# update_p(). It then compiles each version with a small driver program
+# which calls update_p() many times, as the solver does, and reports
+# the time taken and whether the versions compute the same rates. The
+# optimised version is timed twice: calling update_p(), and calling
+# init_p() once, update_env_p() when the environment variables change
+# and update_fast_p() at each call, as AtChem2 does.
+#
+# The Fortran compiler is given by the environment variable FORT_COMP
+# [default: gfortran], and mechanism.f90 is compiled with the same
+# flags as in the Makefile (FSHAREDFLAGS, without -shared). The files
+# are written to a temporary directory, which is deleted at the end.
+#
+# ARGUMENT(S):
+#   1. optional path to the .fac file [default: model/mechanism.fac]
+#   2. optional number of calls to update_p [default: 100000]
+#
+# USAGE:
+#   python ./tools/benchmark/benchmark_update_p.py mcm_full.fac 1000
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from benchmark_mech_converter import base_dir, mech_converter
+
+fortran_compiler = os.environ.get('FORT_COMP', 'gfortran')
+fortran_flags = ['-ffree-line-length-none', '-ffree-form', '-fimplicit-none', '-fcheck=all', '-fPIC']
+
+# An assignment to an element of p or q in update_p, without its comment
+assignment_regex = re.compile(r'^\s*([pq])\(([0-9]+)\)\s*=([^!]*)')
+number_regex = re.compile(r'[0-9]*\.?[0-9]+([eEdD][+-]?[0-9]+)?(_DP)?')
+function_regex = re.compile(r'\b([A-Za-z][A-Za-z0-9_]*)\(')
+
+driver_template = """program benchmark_update_p
+  use, intrinsic :: iso_c_binding
+  use mechanism_mod
+  implicit none
+  integer, parameter :: numberOfReactions = {numberOfReactions}, numberOfGenericComplex = {numberOfGenericComplex}
+  integer, parameter :: numberOfCalls = {numberOfCalls}
+  real(c_double) :: p(numberOfReactions), q(numberOfGenericComplex), j(1000), temp, lastTemp, m, ro2
+  integer :: i
+  integer(kind=8) :: start, finish, rate
+
+  p = 0.0_c_double
+  q = 0.0_c_double
+  j = 1.0e-5_c_double
+  m = 2.46e19_c_double
+  lastTemp = -1.0_c_double
+  call system_clock( start, rate )
+  do i = 1, numberOfCalls
+    ! The environment variables change every 100 calls, while RO2 changes at each call
+    temp = 280.0_c_double + 0.01_c_double * real( ( i - 1 ) / 100, c_double )
+    ro2 = 1.0e8_c_double * ( 1.0_c_double + 1.0e-6_c_double * real( i, c_double ) )
+{calls}
+  end do
+  call system_clock( finish )
+  write (*, '(ES15.6)') real( finish - start, c_double ) / real( rate, c_double )
+  open (10, file='p.output')
+  write (10, '(ES26.17)') p
+  close (10)
+end program benchmark_update_p
+"""
+
+arguments = """p, q, temp, 0.7809_c_double * m, 0.2095_c_double * m, m, 50.0_c_double, 3.9e17_c_double, &
+                   1000.0_c_double, 0.4_c_double, 1.0_c_double, 1.0e-5_c_double, 1.0_c_double, 1.0e-4_c_double, j, ro2"""
+
+# Call update_p at each call, as for a mechanism.f90 generated with --no-optimise
+update_p_calls = """    call update_p( """ + arguments + """ )"""
+
+# Call init_p once, update_env_p when the environment variables change, and update_fast_p at each call
+split_calls = """    if ( i == 1 ) then
+      call init_p( """ + arguments + """ )
+    end if
+    if ( temp /= lastTemp ) then
+      call update_env_p( """ + arguments + """ )
+      lastTemp = temp
+    end if
+    call update_fast_p( """ + arguments + """ )"""
+
+# ============================================================ #
+
+def f90_statistics(mech_f90_contents):
+    # Return a dictionary holding the size of mechanism.f90 (bytes,
+    # lines), and the number of assignments to q and p, of copies
+    # (p(k) = p(i)), of arithmetic operations and of function calls in
+    # update_p.
+    statistics = dict.fromkeys(['q assignments', 'p assignments', 'p copies', 'operations', 'function calls'], 0)
+    statistics['bytes'] = len(mech_f90_contents)
+    statistics['lines'] = mech_f90_contents.count('\n')
+    for line in mech_f90_contents.splitlines():
+        match = assignment_regex.match(line)
+        if match is None:
+            continue
+        rhs = match.group(3).strip()
+        statistics[match.group(1) + ' assignments'] += 1
+        if re.match(r'^p\([0-9]+\)$', rhs):
+            statistics['p copies'] += 1
+        statistics['function calls'] += len([name for name in function_regex.findall(rhs) if name not in ['p', 'q', 'J']])
+        # Remove the numbers first, so that the signs of their exponents are not counted as operations
+        rhs = number_regex.sub('0', rhs)
+        statistics['operations'] += rhs.count('**')
+        rhs = rhs.replace('**', '')
+        statistics['operations'] += sum([rhs.count(operator) for operator in '+-*/'])
+    return statistics
+
+
+def time_update_p(work_dir, mech_f90_contents, numberOfReactions, numberOfGenericComplex, numberOfCalls, calls):
+    # Compile mech_f90_contents with the driver program in work_dir, using
+    # calls in the loop, run it, and return the time taken and the values
+    # of p after the last call.
+    with open(os.path.join(work_dir, 'mechanism.f90'), 'w') as mech_f90_file:
+        mech_f90_file.write(mech_f90_contents)
+    with open(os.path.join(work_dir, 'driver.f90'), 'w') as driver_file:
+        driver_file.write(driver_template.format(numberOfReactions=max(numberOfReactions, 1),
+                                                 numberOfGenericComplex=max(numberOfGenericComplex, 1),
+                                                 numberOfCalls=numberOfCalls, calls=calls))
+    subprocess.check_call([fortran_compiler, '-c', 'mechanism.f90'] + fortran_flags, cwd=work_dir)
+    subprocess.check_call([fortran_compiler, '-O2', '-o', 'driver', 'driver.f90', 'mechanism.o'], cwd=work_dir)
+    elapsed = float(subprocess.check_output([os.path.join(work_dir, 'driver')], cwd=work_dir).decode('ascii'))
+    with open(os.path.join(work_dir, 'p.output'), 'r') as p_file:
+        p = p_file.read()
+    return elapsed, p
+
+# ============================================================ #
+
+def main():
+    fac_filename = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'model', 'mechanism.fac')
+    numberOfCalls = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    with open(fac_filename, 'r') as fac_file:
+        mechanism = mech_converter.parse_fac(fac_file)
+    numberOfReactions = len(mechanism.reactions)
+    numberOfGenericComplex = len(mechanism.coefficients)
+    print(fac_filename + ': ' + str(numberOfReactions) + ' reactions, ' + str(numberOfGenericComplex) +
+          ' rate coefficients, ' + str(numberOfCalls) + ' calls to update_p')
+
+    work_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        for optimise, calls in [(False, update_p_calls), (True, update_p_calls), (True, split_calls)]:
+            mech_f90_contents = mech_converter.emit_f90(mechanism, optimise=optimise)
+            statistics = f90_statistics(mech_f90_contents)
+            elapsed, p = time_update_p(work_dir, mech_f90_contents, numberOfReactions, numberOfGenericComplex,
+                                       numberOfCalls, calls)
+            results.append((statistics, elapsed, p))
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('%-16s %14s %14s' % ('', 'plain', 'optimised'))
+    for key in ['bytes', 'lines', 'q assignments', 'p assignments', 'p copies', 'operations', 'function calls']:
+        print('%-16s %14d %14d' % (key, results[0][0][key], results[1][0][key]))
+    print('time (s): update_p ' + '%.3f' % results[0][1] + ', optimised update_p ' + '%.3f' % results[1][1] +
+          ', optimised init_p/update_env_p/update_fast_p ' + '%.3f' % results[2][1])
+    print('speed-up: ' + '%.2f' % (results[0][1] / max(results[1][1], 1.e-9)) + ' and ' +
+          '%.2f' % (results[0][1] / max(results[2][1], 1.e-9)) + ', identical rates: ' +
+          str(results[0][2] == results[1][2] == results[2][2]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script checks and preprocesses the constraint files of a model
+# (the species/, environment/ and photolysis/ subdirectories of the
+# constraints directory) in bulk [requires numpy].
+#
+# All the files of the three subdirectories are read and checked: the
+# times of each file must increase, and they must cover the model run,
+# from the model start time to the end of the last step, as given in
+# model.parameters. A file with times out of order is an error, unless
+# the option --sort is used, and so is a file with repeated times with
+# different values; repeated lines are dropped.
+#
+# With the option --output, the checked constraints are written to a
+# new constraints directory, which can be used by the model instead of
+# the original one (with the option --constraints of the atchem2
+# executable). Each file is written sorted by time and, with the
+# option --resample, resampled at the start and at the end of each
+# step of the model, and one step after the end of the model run (the
+# solver can go past the end of the last step, and the Fortran code
+# reports an interpolation error for each time outside of the
+# constraint): the value at each of these times is interpolated
+# in the same way as done by the Fortran code (see
+# getConstrainedQuantAtT() in src/interpolationFunctions.f90), with
+# the species interpolation method of model.parameters for species/,
+# and the conditions interpolation method for environment/ and
+# photolysis/. Resampling data taken e.g. every second to a model step
+# of a few minutes reduces the time taken by the model to read the
+# files, and the memory that it needs to hold them, which is the
+# number of variables times the largest number of points in the
+# subdirectory. It also changes the constraints between the steps of
+# the model, so the largest difference between the original and the
+# resampled constraints, relative to the largest value of each
+# variable, is reported.
+#
+# The output directory also holds all the constraints in binary form:
+# - constraints.table: little-endian 64-bit floats: for each variable
+#   in the order of the index, its times, followed by its values.
+# - constraints.index: a text file with one line for each variable,
+#   sorted by subdirectory and name, after a header: the subdirectory,
+#   the name, the number of points, the offset (in number of floats)
+#   of its times in constraints.table, and its first and last times.
+# The table can be loaded from Python with load_table(), which maps it
+# into memory instead of parsing text files.
+#
+# The exit code is 1 if any file has errors, in which case nothing is
+# written.
+#
+# ARGUMENT:
+# - path to the constraints directory [default: model/constraints/]
+#
+# OPTIONS:
+# - --model-parameters FILE [default: model/configuration/model.parameters]
+# - --output DIR: write the checked constraints to DIR
+# - --resample: resample the constraints at the steps of the model
+# - --sort: sort the files with times out of order, instead of
+#   reporting them as errors
+#
+# USAGE:
+#   python ./tools/constraints/atchem2_constraints.py model/constraints/ --output model/constraints_1s/ --resample
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import argparse
+from collections import namedtuple, OrderedDict
+from timeit import default_timer as timer
+import numpy as np
+
+table_format_version = 1
+
+# The subdirectories of the constraints directory, and the interpolation method used for each of them
+categories = ['species', 'environment', 'photolysis']
+interpolation_keys = {'species': 'speciesInterpolation', 'environment': 'conditionsInterpolation',
+                      'photolysis': 'conditionsInterpolation'}
+
+index_header = 'category name numberOfPoints offset startTime endTime'
+
+# A constraint file: its subdirectory, its name, and the arrays of its times and values
+Constraint = namedtuple('Constraint', ['category', 'name', 't', 'y'])
+
+
+## ------------------------------------------------------------------ ##
+
+
+def read_model_window(filename):
+    """
+    This function reads the time window of the model run and the interpolation methods from model.parameters.
+
+    :param filename: string containing a relative or absolute reference to model.parameters.
+    :returns: dictionary with the keys 'numberOfSteps', 'stepSize', 'startTime', 'endTime' (the end of the last step),
+      'speciesInterpolation' and 'conditionsInterpolation' (1 for piecewise constant, 2 for piecewise linear).
+    """
+    with open(filename, 'r') as parameters_file:
+        values = [line.split()[0] for line in parameters_file if line.split()]
+    window = {'numberOfSteps': int(values[0]), 'stepSize': float(values[1]), 'speciesInterpolation': int(values[2]),
+              'conditionsInterpolation': int(values[3]), 'startTime': float(values[5])}
+    window['endTime'] = window['startTime'] + window['numberOfSteps'] * window['stepSize']
+    return window
+
+
+def parse_constraint(contents):
+    """
+    This function parses the contents of a constraint file: the first two fields of each line are the time and the
+    value, as read by the Fortran code.
+
+    :param contents: the contents of the file, as a string.
+    :returns (t, y): the arrays of the times and of the values, in the order of the file.
+    """
+    lines = [line for line in contents.splitlines() if line.strip()]
+    tokens = contents.split()
+    if len(tokens) != 2 * len(lines):
+        # Some lines have more than two fields: keep the first two of each line
+        tokens = [field for line in lines for field in line.split()[:2]]
+    values = np.array(tokens, dtype=float).reshape((-1, 2))
+    return values[:, 0].copy(), values[:, 1].copy()
+
+
+def read_constraints(constraints_dir):
+    """
+    This function reads all the constraint files of a constraints directory, i.e. all the files, except the hidden
+    ones, in its species/, environment/ and photolysis/ subdirectories.
+
+    :param constraints_dir: string containing a relative or absolute reference to the constraints directory.
+    :returns: list of Constraint, sorted by subdirectory (in the order of categories) and name.
+    """
+    constraints = []
+    for category in categories:
+        category_dir = os.path.join(constraints_dir, category)
+        if not os.path.isdir(category_dir):
+            continue
+        for name in sorted(os.listdir(category_dir)):
+            filename = os.path.join(category_dir, name)
+            if name.startswith('.') or not os.path.isfile(filename):
+                continue
+            with open(filename, 'r') as constraint_file:
+                t, y = parse_constraint(constraint_file.read())
+            constraints.append(Constraint(category, name, t, y))
+    return constraints
+
+
+def check_constraint(constraint, window, sort=False):
+    """
+    This function checks the times of a constraint: they must increase, and cover the model run.
+
+    :param constraint: a Constraint.
+    :param window: the model window, as returned by read_model_window().
+    :param sort: if True, points out of order are sorted by time (with a warning) instead of being an error.
+    :returns (constraint, errors, warnings): the constraint, sorted and without repeated points, and the lists of the
+      errors and of the warnings, as strings.
+    """
+    t, y = constraint.t, constraint.y
+    errors = []
+    warnings = []
+    if t.size == 0:
+        return constraint, ['no data points'], warnings
+    if not (np.isfinite(t).all() and np.isfinite(y).all()):
+        errors.append('values which are not numbers at lines ' +
+                      ', '.join(str(i + 1) for i in np.flatnonzero(~(np.isfinite(t) & np.isfinite(y)))[:5]))
+    decreasing = np.flatnonzero(np.diff(t) < 0)
+    if decreasing.size:
+        if sort:
+            order = np.argsort(t, kind='mergesort')
+            t, y = t[order], y[order]
+            warnings.append('sorted ' + str(decreasing.size) + ' points out of order')
+        else:
+            errors.append('the time decreases at line ' + str(decreasing[0] + 2) + ' (' +
+                          repr(float(t[decreasing[0]])) + ' to ' + repr(float(t[decreasing[0] + 1])) + ')')
+    repeated = np.flatnonzero(np.diff(t) == 0)
+    if repeated.size:
+        conflicting = repeated[y[repeated] != y[repeated + 1]]
+        if conflicting.size:
+            errors.append('different values at the same time ' + repr(float(t[conflicting[0]])))
+        else:
+            keep = np.ones(t.size, dtype=bool)
+            keep[repeated + 1] = False
+            t, y = t[keep], y[keep]
+            warnings.append('dropped ' + str(repeated.size) + ' repeated points')
+    if t[0] > window['startTime']:
+        errors.append('starts at ' + repr(float(t[0])) + ', after the start of the model run (' +
+                      repr(window['startTime']) + ')')
+    if t[-1] < window['endTime']:
+        errors.append('ends at ' + repr(float(t[-1])) + ', before the end of the model run (' +
+                      repr(window['endTime']) + ')')
+    return Constraint(constraint.category, constraint.name, t, y), errors, warnings
+
+
+def interpolate(t, y, x, method):
+    """
+    This function interpolates a constraint as the Fortran code does (see getConstrainedQuantAtT() in
+    src/interpolationFunctions.f90): outside the times of the constraint, the last value is used.
+
+    :param t: array of the times of the constraint, in increasing order.
+    :param y: array of the values of the constraint.
+    :param x: array of the times at which the constraint is interpolated.
+    :param method: 1 for left-sided piecewise constant interpolation, 2 for piecewise linear interpolation.
+    :returns: array of the interpolated values.
+    """
+    if method == 1:
+        before = np.searchsorted(t, x, side='right') - 1
+        values = y[np.clip(before, 0, t.size - 1)]
+        values[(before < 0) | (x >= t[-1])] = y[-1]
+        return values
+    return np.interp(x, t, y, left=y[-1], right=y[-1])
+
+
+def resample(constraint, window):
+    """
+    This function resamples a constraint at the start and at the end of each step of the model, and one step after the
+    end of the model run.
+
+    :param constraint: a Constraint, which covers the model run.
+    :param window: the model window, as returned by read_model_window().
+    :returns (constraint, deviation): the resampled Constraint, and the largest difference between the original and
+      the resampled constraint at the original times within the model run, relative to the largest absolute value of
+      the original constraint within the model run.
+    """
+    method = window[interpolation_keys[constraint.category]]
+    grid = window['startTime'] + window['stepSize'] * np.arange(window['numberOfSteps'] + 2)
+    values = interpolate(constraint.t, constraint.y, grid, method)
+    inside = (constraint.t >= window['startTime']) & (constraint.t <= window['endTime'])
+    deviation = 0.0
+    if inside.any():
+        original = constraint.y[inside]
+        difference = np.abs(interpolate(grid, values, constraint.t[inside], method) - original).max()
+        scale = np.abs(original).max()
+        deviation = difference / scale if scale > 0.0 else difference
+    return Constraint(constraint.category, constraint.name, grid, values), deviation
+
+
+def fortran_memory(constraints):
+    """
+    This function returns the memory needed by the Fortran code to hold the constraints, in bytes: for each
+    subdirectory, two arrays (times and values) of 64-bit floats of the number of variables times the largest number
+    of points.
+    """
+    total = 0
+    for category in categories:
+        sizes = [c.t.size for c in constraints if c.category == category]
+        if sizes:
+            total += 2 * 8 * len(sizes) * max(sizes)
+    return total
+
+
+def _float_array(values):
+    # Return values as an array of 64-bit floats, in little-endian byte order.
+    return np.ascontiguousarray(values, dtype='<f8')
+
+
+def write_constraints(output_dir, constraints):
+    """
+    This function writes constraints to a new constraints directory: one text file for each constraint in its
+    subdirectory, readable by the Fortran code, and all the constraints in binary form in constraints.table, with its
+    index in constraints.index.
+
+    :param output_dir: string containing a relative or absolute reference to the output directory.
+    :param constraints: list of Constraint.
+    :returns: the total size of the text files, in bytes.
+    """
+    text_size = 0
+    offset = 0
+    index_lines = ['# constraints.table format version ' + str(table_format_version) + '\n', index_header + '\n']
+    with open(os.path.join(output_dir, 'constraints.table'), 'wb') as table_file:
+        for constraint in sorted(constraints, key=lambda c: (categories.index(c.category), c.name)):
+            category_dir = os.path.join(output_dir, constraint.category)
+            if not os.path.isdir(category_dir):
+                os.makedirs(category_dir)
+            contents = ''.join('%r %r\n' % (ti, yi) for ti, yi in zip(constraint.t.tolist(), constraint.y.tolist()))
+            with open(os.path.join(category_dir, constraint.name), 'w') as constraint_file:
+                constraint_file.write(contents)
+            text_size += len(contents)
+            table_file.write(_float_array(constraint.t).tobytes())
+            table_file.write(_float_array(constraint.y).tobytes())
+            index_lines.append('%s %s %d %d %r %r\n' % (constraint.category, constraint.name, constraint.t.size,
+                                                         offset, float(constraint.t[0]), float(constraint.t[-1])))
+            offset += 2 * constraint.t.size
+    with open(os.path.join(output_dir, 'constraints.index'), 'w') as index_file:
+        index_file.write(''.join(index_lines))
+    return text_size
+
+
+def load_table(directory):
+    """
+    This function loads the constraints written by write_constraints() in binary form, without parsing them: the
+    arrays are views of constraints.table mapped into memory.
+
+    :param directory: string containing a relative or absolute reference to the directory holding constraints.table
+      and constraints.index.
+    :returns: OrderedDict mapping (category, name) to the tuple (t, y) of the arrays of the times and of the values,
+      in the order of the index.
+    """
+    with open(os.path.join(directory, 'constraints.index'), 'r') as index_file:
+        version = index_file.readline().split()[-1]
+        if int(version) != table_format_version:
+            raise RuntimeError('constraints.index has format version ' + version + ', expected ' +
+                               str(table_format_version) + '.')
+        index_file.readline()
+        entries = [line.split() for line in index_file if line.split()]
+    table = OrderedDict()
+    if not entries:
+        return table
+    data = np.memmap(os.path.join(directory, 'constraints.table'), dtype='<f8', mode='r')
+    for category, name, numberOfPoints, offset, _, _ in entries:
+        numberOfPoints, offset = int(numberOfPoints), int(offset)
+        table[(category, name)] = (data[offset:offset + numberOfPoints],
+                                   data[offset + numberOfPoints:offset + 2 * numberOfPoints])
+    return table
+
+
+def _megabytes(x):
+    return '%.1f MB' % (x / 1024.0 ** 2)
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and preprocess the constraint files of a model.')
+    parser.add_argument('constraints_dir', nargs='?', default='model/constraints/',
+                        help='path to the constraints directory [default: model/constraints/]')
+    parser.add_argument('--model-parameters', default='model/configuration/model.parameters',
+                        help='path to model.parameters [default: model/configuration/model.parameters]')
+    parser.add_argument('--output', help='write the checked constraints to this directory')
+    parser.add_argument('--resample', action='store_true', help='resample the constraints at the steps of the model')
+    parser.add_argument('--sort', action='store_true',
+                        help='sort the files with times out of order, instead of reporting them as errors')
+    args = parser.parse_args()
+
+    window = read_model_window(args.model_parameters)
+    print('Model run: from %r to %r seconds, %d steps of %r seconds' % (window['startTime'], window['endTime'],
+                                                                       window['numberOfSteps'], window['stepSize']))
+    start = timer()
+    constraints = read_constraints(args.constraints_dir)
+    read_time = timer() - start
+    text_size = sum(os.path.getsize(os.path.join(args.constraints_dir, c.category, c.name)) for c in constraints)
+    for category in categories:
+        sizes = [c.t.size for c in constraints if c.category == category]
+        print('%-12s %5d files, %10d points' % (category, len(sizes), sum(sizes)))
+    print('Read %s of text in %.3f s' % (_megabytes(text_size), read_time))
+
+    checked = []
+    failed = False
+    for constraint in constraints:
+        constraint, errors, warnings = check_constraint(constraint, window, args.sort)
+        for message in errors:
+            print('Error: ' + constraint.category + '/' + constraint.name + ': ' + message)
+        for message in warnings:
+            print('Warning: ' + constraint.category + '/' + constraint.name + ': ' + message)
+        failed = failed or bool(errors)
+        checked.append(constraint)
+    if failed:
+        print('The constraints have errors: nothing has been written.')
+        sys.exit(1)
+    print('All the constraints cover the model run.')
+    if not args.output:
+        return
+
+    if args.resample:
+        resampled = []
+        worst = (-1.0, '')
+        for constraint in checked:
+            constraint, deviation = resample(constraint, window)
+            resampled.append(constraint)
+            worst = max(worst, (deviation, constraint.category + '/' + constraint.name))
+        if resampled:
+            print('Largest relative difference made by the resampling: %.3e (%s)' % worst)
+        print('Memory needed by the model to hold the constraints: %s before resampling, %s after' % (
+            _megabytes(fortran_memory(checked)), _megabytes(fortran_memory(resampled))))
+        checked = resampled
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    output_size = write_constraints(args.output, checked)
+    print('Wrote %s of text and %s of table to %s' % (
+        _megabytes(output_size), _megabytes(os.path.getsize(os.path.join(args.output, 'constraints.table'))),
+        args.output))
+    # Time the loading of the table, reading all of it as the text files were
+    start = timer()
+    for t, y in load_table(args.output).values():
+        t.sum() + y.sum()
+    load_time = timer() - start
+    print('Loaded the table in %.3f s, against %.3f s to read the original text files' % (load_time, read_time))
+
+
+if __name__ == '__main__':
+    main()
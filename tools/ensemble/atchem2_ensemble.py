@@ -0,0 +1,433 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script runs an ensemble of AtChem2 models, which share the same
+# chemical mechanism (and so the same shared library, mechanism.so)
+# and differ only in the settings of some configuration files, e.g.
+# initialConcentrations.config, environmentVariables.config or
+# model.parameters [requires numpy].
+#
+# The ensemble file lists one variant on each line: the name of the
+# variant, followed by the settings that differ from the base model
+# configuration, separated by whitespace. Each setting has the form
+# FILE:KEY=VALUE:
+# - for model.parameters and solver.parameters, KEY is the line number
+#   (from 1) of the parameter, e.g. model.parameters:1=96
+# - for the other configuration files, KEY is the name of the species
+#   or variable, e.g. initialConcentrations.config:O3=7.5e11 or
+#   environmentVariables.config:TEMP=290. A species which is not in
+#   initialConcentrations.config or speciesConstant.config is added.
+# Empty lines and lines starting with # are ignored.
+#
+# Each variant runs in its own directory, runs/NAME/ in the work
+# directory, which holds its configuration files (copied from the base
+# model configuration directory and modified), links to the mechanism
+# files, the shared library, the constraints and the MCM data files,
+# its output/ directory and the screen output of the model
+# (atchem2.log). The variants are run in parallel by a pool of worker
+# threads, each of which waits for one atchem2 process at a time.
+#
+# A variant which has completed successfully is marked by the file
+# runs/NAME/done, which holds its settings: when the script is run
+# again, e.g. after a crash, these variants are skipped, unless their
+# settings have changed. The other variants are run again from the
+# start. The exit code of the executable is not enough to tell whether
+# a variant has completed, because AtChem2 exits with 0 when it stops
+# on a solver or configuration error: a variant has completed only if
+# its screen output ends with the final statistics, and the last time
+# in its speciesConcentrations.output is the end of the run set by
+# model.parameters.
+#
+# At the end, the output files of all the completed variants are
+# collected into one dataset, in the dataset/ directory of the work
+# directory: for each output file, e.g. speciesConcentrations.output,
+# a .npy file holding an array of shape (columns, variants, times), in
+# which each column is contiguous, and index.json, which lists the
+# variants and the names of the columns. If the variants have
+# different numbers of output times, the missing values are NaN. The
+# dataset can be loaded with load_dataset().
+#
+# ARGUMENTS:
+# - path to the ensemble file
+# - path to the work directory
+#
+# OPTIONS:
+# - --configuration DIR: base model configuration directory, with the
+#   mechanism files [default: model/configuration/]
+# - --constraints DIR: model constraints directory [default: model/constraints/]
+# - --shared-lib FILE: shared library [default: mechanism.so in the
+#   configuration directory]
+# - --mcm DIR: MCM data files directory [default: mcm/]
+# - --executable FILE: AtChem2 executable [default: ./atchem2]
+# - --jobs N: number of models run at the same time [default: the number of CPUs]
+# - --collect FILE [FILE ...]: output files to collect into the dataset
+#   [default: speciesConcentrations.output environmentVariables.output]
+#
+# USAGE:
+#   python ./tools/ensemble/atchem2_ensemble.py ensemble.txt ensemble_runs/ --jobs 8
+#   python ./tools/ensemble/atchem2_ensemble.py ensemble.txt ensemble_runs/ \
+#          --configuration tests/model_tests/firstorder/configuration/ \
+#          --constraints tests/model_tests/firstorder/constraints/
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import re
+import json
+import shutil
+import argparse
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer as timer
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output'))
+import atchem2_output
+
+# The mechanism files read by the executable from the configuration directory (see src/inputFunctions.f90)
+mechanism_files = ['mechanism.species', 'mechanism.reac', 'mechanism.prod', 'mechanism.ro2', 'mechanism.network',
+                   'mechanism.sparsity']
+
+# The configuration files to which a species, which is not already listed, can be added
+extendable_files = ['initialConcentrations.config', 'speciesConstant.config']
+
+default_collect = ['speciesConcentrations.output', 'environmentVariables.output']
+
+# A variant name is used as a directory name, so it is restricted to these characters
+variant_name_regex = re.compile(r'^[A-Za-z0-9_.+-]+$')
+setting_regex = re.compile(r'^(?P<file>[^:=]+):(?P<key>[^=]+)=(?P<value>\S+)$')
+
+
+## ------------------------------------------------------------------ ##
+
+
+def read_ensemble(ensemble_filename):
+    """
+    This function reads an ensemble file.
+
+    :param ensemble_filename: string containing a relative or absolute reference to the ensemble file.
+    :returns: list of (name, settings) tuples, where settings is a list of (file, key, value) tuples.
+    """
+    variants = []
+    names = set()
+    with open(ensemble_filename, 'r') as ensemble_file:
+        for line_number, line in enumerate(ensemble_file, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            name = fields[0]
+            if variant_name_regex.match(name) is None or name in names:
+                raise RuntimeError('Error in ' + ensemble_filename + ', line ' + str(line_number) +
+                                   ': the variant name ' + name + ' is not valid, or is repeated.')
+            settings = []
+            for field in fields[1:]:
+                match = setting_regex.match(field)
+                if match is None:
+                    raise RuntimeError('Error in ' + ensemble_filename + ', line ' + str(line_number) +
+                                       ': the setting ' + field + ' is not of the form FILE:KEY=VALUE.')
+                settings.append((match.group('file'), match.group('key'), match.group('value')))
+            names.add(name)
+            variants.append((name, settings))
+    return variants
+
+
+def apply_setting(lines, filename, key, value):
+    """
+    This function changes one setting in the lines of a configuration file.
+
+    :param lines: list of the lines of the file, without newline characters; it is modified in place.
+    :param filename: name of the file, e.g. model.parameters.
+    :param key: line number (for the .parameters files), or name of the species or variable.
+    :param value: the new value, as a string.
+    """
+    if filename.endswith('.parameters'):
+        index = int(key) - 1 if key.isdigit() else -1
+        if not 0 <= index < len(lines) or not lines[index].split():
+            raise RuntimeError('There is no parameter on line ' + key + ' of ' + filename + '.')
+        # Keep the description of the parameter, after the value
+        lines[index] = value + '  ' + lines[index].split(None, 1)[1] if len(lines[index].split()) > 1 else value
+        return
+    for i, line in enumerate(lines):
+        fields = line.split()
+        if key in fields[:-1]:
+            position = fields.index(key)
+            fields[position + 1] = value
+            lines[i] = '  '.join(fields)
+            return
+    if filename not in extendable_files:
+        raise RuntimeError(key + ' is not in ' + filename + '.')
+    lines.append(key + ' ' + value)
+
+
+def materialise_variant(run_dir, settings, config_dir, constraints_dir, shared_lib, mcm_dir):
+    """
+    This function creates the directory of a variant: its configuration files are copied from config_dir and
+    modified, while the mechanism files, the shared library, the constraints and the MCM data files are linked, so
+    that all the variants share them. The paths passed to the executable are all relative to the variant directory,
+    so that they are short enough for the Fortran code.
+
+    :param run_dir: the directory of the variant, which is emptied first if it exists.
+    :param settings: list of (file, key, value) tuples, as returned by read_ensemble().
+    """
+    if os.path.isdir(run_dir):
+        shutil.rmtree(run_dir)
+    run_config_dir = os.path.join(run_dir, 'configuration')
+    os.makedirs(run_config_dir)
+    os.makedirs(os.path.join(run_dir, 'output', 'reactionRates'))
+
+    contents = dict()
+    for filename in sorted(os.listdir(config_dir)):
+        source = os.path.abspath(os.path.join(config_dir, filename))
+        if filename.endswith('.config') or filename.endswith('.parameters'):
+            with open(source, 'r') as config_file:
+                contents[filename] = config_file.read().splitlines()
+        elif filename in mechanism_files:
+            os.symlink(source, os.path.join(run_config_dir, filename))
+    os.symlink(os.path.abspath(shared_lib), os.path.join(run_config_dir, 'mechanism.so'))
+    # A model without constraints may have no constraints directory, as the model tests
+    if os.path.isdir(constraints_dir):
+        os.symlink(os.path.abspath(constraints_dir), os.path.join(run_dir, 'constraints'))
+    os.symlink(os.path.abspath(mcm_dir), os.path.join(run_dir, 'mcm'))
+
+    for filename, key, value in settings:
+        if filename not in contents:
+            raise RuntimeError(filename + ' is not in ' + config_dir + '.')
+        apply_setting(contents[filename], filename, key, value)
+    for filename, lines in contents.items():
+        with open(os.path.join(run_config_dir, filename), 'w') as config_file:
+            config_file.write(''.join(line + '\n' for line in lines))
+
+
+def _settings_text(settings):
+    # Return the settings of a variant as written to its done file.
+    return ''.join(filename + ':' + key + '=' + value + '\n' for filename, key, value in settings)
+
+
+def is_done(run_dir, settings):
+    """
+    This function checks whether a variant has already completed successfully with the same settings.
+    """
+    try:
+        with open(os.path.join(run_dir, 'done'), 'r') as done_file:
+            return done_file.read() == _settings_text(settings)
+    except (IOError, OSError):
+        return False
+
+
+def run_end_time(config_dir):
+    """
+    This function calculates the time of the end of the run, from model.parameters: the model start time (line 6),
+    plus the number of steps (line 1) times the step size (line 2).
+
+    :param config_dir: string containing a relative or absolute reference to the model configuration directory.
+    :returns: the time of the end of the run, in seconds.
+    """
+    with open(os.path.join(config_dir, 'model.parameters'), 'r') as parameters_file:
+        values = [float(line.split()[0]) for line in parameters_file if line.split()]
+    return values[5] + values[0] * values[1]
+
+
+def _last_output_time(filename):
+    # Return the time of the last line of an output file, or None if it has no line after the header.
+    last = None
+    with open(filename, 'r') as output_file:
+        output_file.readline()
+        for line in output_file:
+            if line.strip():
+                last = line
+    return float(last.split()[0]) if last is not None else None
+
+
+def check_completed(run_dir):
+    """
+    This function checks whether the executable has run a variant to the end: the screen output (atchem2.log) must
+    hold the final statistics, which are written after the last step, and the last time in
+    speciesConcentrations.output must be the end of the run (the times are written with 7 significant digits).
+
+    :param run_dir: the directory of the variant.
+    :returns: None if the run has completed, otherwise the error message.
+    """
+    with open(os.path.join(run_dir, 'atchem2.log'), 'r') as log_file:
+        if not any('Final statistics' in line for line in log_file):
+            return 'the model has stopped before the end of the run (see ' + os.path.join(run_dir, 'atchem2.log') + \
+              ')'
+    endTime = run_end_time(os.path.join(run_dir, 'configuration'))
+    lastTime = _last_output_time(os.path.join(run_dir, 'output', 'speciesConcentrations.output'))
+    if lastTime is None or abs(lastTime - endTime) > 1.e-6 * max(abs(endTime), 1.0):
+        return 'the last time in speciesConcentrations.output is ' + str(lastTime) + ' instead of ' + str(endTime) + \
+          ' (see ' + os.path.join(run_dir, 'atchem2.log') + ')'
+    return None
+
+
+def run_variant(task):
+    """
+    This function materialises a variant, and runs the executable on it. The done file is written only once the
+    executable has completed successfully, and has run the variant to the end (see check_completed()).
+
+    :param task: tuple (name, settings, work_dir, options), where options is a dictionary holding the configuration
+      directory, constraints directory, shared library, MCM directory and executable.
+    :returns: tuple (name, error message or None, time taken in seconds).
+    """
+    name, settings, work_dir, options = task
+    run_dir = os.path.join(work_dir, 'runs', name)
+    start = timer()
+    try:
+        materialise_variant(run_dir, settings, options['configuration'], options['constraints'],
+                            options['shared_lib'], options['mcm'])
+        with open(os.path.join(run_dir, 'atchem2.log'), 'w') as log_file:
+            returncode = subprocess.call([os.path.abspath(options['executable']), '--configuration=configuration',
+                                          '--output=output', '--constraints=constraints', '--mcm=mcm',
+                                          '--shared_lib=configuration/mechanism.so'],
+                                         cwd=run_dir, stdout=log_file, stderr=subprocess.STDOUT)
+        if returncode != 0:
+            return name, 'exit code ' + str(returncode) + ' (see ' + os.path.join(run_dir, 'atchem2.log') + ')', \
+              timer() - start
+        error = check_completed(run_dir)
+        if error is not None:
+            return name, error, timer() - start
+        with open(os.path.join(run_dir, 'done.tmp'), 'w') as done_file:
+            done_file.write(_settings_text(settings))
+        os.rename(os.path.join(run_dir, 'done.tmp'), os.path.join(run_dir, 'done'))
+    except (RuntimeError, IOError, OSError, ValueError) as e:
+        return name, str(e), timer() - start
+    return name, None, timer() - start
+
+
+def collect_outputs(work_dir, names, output_filenames):
+    """
+    This function collects the output files of the given variants into the dataset/ directory of the work directory.
+    Each array is written through a memory map, one variant at a time, so that the whole dataset is never held in
+    memory.
+
+    :param work_dir: string containing a relative or absolute reference to the work directory.
+    :param names: list of the names of the completed variants.
+    :param output_filenames: list of the output files to collect, e.g. speciesConcentrations.output.
+    """
+    dataset_dir = os.path.join(work_dir, 'dataset')
+    if not os.path.isdir(dataset_dir):
+        os.makedirs(dataset_dir)
+    index = {'variants': names, 'files': dict()}
+    for output_filename in output_filenames:
+        tables = [atchem2_output.load_output(os.path.join(work_dir, 'runs', name, 'output', output_filename))
+                  for name in names]
+        if not tables:
+            continue
+        columns = tables[0].numeric_names
+        numberOfTimes = max(len(table) for table in tables)
+        dataset = np.lib.format.open_memmap(os.path.join(dataset_dir, output_filename + '.npy'), mode='w+',
+                                            shape=(len(columns), len(names), numberOfTimes))
+        dataset[...] = np.nan
+        for j, table in enumerate(tables):
+            if table.numeric_names != columns:
+                raise RuntimeError('The columns of ' + output_filename + ' differ between the variants ' + names[0] +
+                                   ' and ' + names[j] + '.')
+            dataset[:, j, :len(table)] = table.values.T
+        dataset.flush()
+        del dataset
+        index['files'][output_filename] = columns
+    with open(os.path.join(dataset_dir, 'index.json'), 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+
+
+def load_dataset(work_dir):
+    """
+    This function loads the dataset collected by collect_outputs().
+
+    :param work_dir: string containing a relative or absolute reference to the work directory.
+    :returns (variants, arrays): variants is the list of the variant names, while arrays maps the name of each output
+      file to a tuple (columns, array), where array is the memory-mapped array of shape (columns, variants, times).
+    """
+    dataset_dir = os.path.join(work_dir, 'dataset')
+    with open(os.path.join(dataset_dir, 'index.json'), 'r') as index_file:
+        index = json.load(index_file)
+    arrays = dict((output_filename, (columns, np.load(os.path.join(dataset_dir, output_filename + '.npy'),
+                                                      mmap_mode='r')))
+                  for output_filename, columns in index['files'].items())
+    return index['variants'], arrays
+
+
+def run_ensemble(ensemble_filename, work_dir, options, jobs=1, collect=None):
+    """
+    This function runs all the variants of an ensemble file which have not completed yet, and then collects the
+    outputs of all the completed variants. The result of each variant is printed as soon as it is known.
+
+    :returns: the number of variants which have failed.
+    """
+    variants = read_ensemble(ensemble_filename)
+    pending = [(name, settings, work_dir, options) for name, settings in variants
+               if not is_done(os.path.join(work_dir, 'runs', name), settings)]
+    print('Variants: ' + str(len(variants)) + ', already done: ' + str(len(variants) - len(pending)) + ', to run: ' +
+          str(len(pending)))
+
+    failures = 0
+    if pending:
+        pool = ThreadPool(min(jobs, len(pending)))
+        try:
+            for name, error, elapsed in pool.imap_unordered(run_variant, pending):
+                if error is None:
+                    print(name + ': done (' + '%.1f' % elapsed + ' s)')
+                else:
+                    failures += 1
+                    print(name + ': FAILED, ' + error)
+                sys.stdout.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+    done = [name for name, settings in variants if is_done(os.path.join(work_dir, 'runs', name), settings)]
+    collect_outputs(work_dir, done, collect if collect is not None else default_collect)
+    print('Collected the outputs of ' + str(len(done)) + ' variants in ' + os.path.join(work_dir, 'dataset'))
+    return failures
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an ensemble of AtChem2 models which share the same mechanism.')
+    parser.add_argument('ensemble_filename', help='path to the ensemble file')
+    parser.add_argument('work_dir', help='path to the work directory')
+    parser.add_argument('--configuration', default='./model/configuration/',
+                        help='base model configuration directory, with the mechanism files [default: ./model/configuration/]')
+    parser.add_argument('--constraints', default='./model/constraints/',
+                        help='model constraints directory [default: ./model/constraints/]')
+    parser.add_argument('--shared-lib', dest='shared_lib',
+                        help='shared library [default: mechanism.so in the configuration directory]')
+    parser.add_argument('--mcm', default='./mcm/', help='MCM data files directory [default: ./mcm/]')
+    parser.add_argument('--executable', default='./atchem2', help='AtChem2 executable [default: ./atchem2]')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of models run at the same time [default: the number of CPUs]')
+    parser.add_argument('--collect', nargs='+', help='output files to collect into the dataset [default: ' +
+                        ' '.join(default_collect) + ']')
+    args = parser.parse_args()
+
+    options = {'configuration': args.configuration, 'constraints': args.constraints, 'mcm': args.mcm,
+               'shared_lib': args.shared_lib if args.shared_lib is not None else
+               os.path.join(args.configuration, 'mechanism.so'),
+               'executable': args.executable}
+    for path in [args.ensemble_filename, options['shared_lib'], options['executable']]:
+        assert os.path.isfile(path), 'Failed to find file ' + path
+    for path in [args.configuration, args.mcm]:
+        assert os.path.isdir(path), 'Failed to find directory ' + path
+
+    failures = run_ensemble(args.ensemble_filename, args.work_dir, options, jobs=max(args.jobs, 1),
+                            collect=args.collect)
+    if failures:
+        print(str(failures) + ' variants FAILED: run the script again to retry them.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print(str(e))
+        sys.exit(os.EX_DATAERR)
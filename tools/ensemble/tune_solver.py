@@ -0,0 +1,469 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script tunes the solver parameters of a model (solver.parameters)
+# by running it with different settings, and writes back the fastest
+# settings which give the same results as a reference run
+# [requires numpy].
+#
+# The reference run uses the settings of the model, with atol and
+# rtol divided by the reference factor. The search then starts from
+# the settings of the model and goes through the parameters one at a
+# time, in rounds:
+# - solver type: 1 (spgmr), 2 (spgmr + banded preconditioner, with the
+#   bandwidths of the model and those of the Jacobian matrix, from the
+#   header of mechanism.sparsity), 3 (dense)
+# - analytic jacobian: 0 or 1
+# - maximum solver step size: 10 and 100 times that of the model
+# - rtol and atol: 10 and 100 times those of the model
+# The candidates of each round run in parallel, and the best of them,
+# if it is faster than the current best by more than the minimum
+# improvement, becomes the starting point of the next rounds. The
+# rounds are repeated until none of them improves on the best settings,
+# or until the maximum number of runs is reached.
+#
+# The reference run must cover the whole run: its
+# speciesConcentrations.output must have one line at the model start
+# time and one after each step, up to the end of the run set by
+# model.parameters. Otherwise, e.g. if the solver has failed, the
+# script stops before the search, because AtChem2 exits with 0 when it
+# stops on an error.
+#
+# A candidate is accepted only if the model completes successfully and
+# every value of speciesConcentrations.output is within the acceptance
+# tolerances of the reference run: |x - reference| <= accept_atol +
+# accept_rtol * |reference|. The accepted candidates are scored either
+# by their wall time, or by the number of evaluations of the right-hand
+# side and of the Jacobian (or of the preconditioner), read from the
+# last line of mainSolverParameters.output: NFE + NFELS + NJTV + NPE
+# for the solver types 1 and 2, NFE + NFELS + NJE for the solver type
+# 3. The number of evaluations does not depend on the load of the
+# machine, while the wall time of concurrent runs does.
+#
+# Each run has its own directory in the work directory, as in
+# atchem2_ensemble.py: runs/reference/, runs/base/ (the settings of the
+# model), runs/c001/ etc. At the end, a table of all the runs is
+# printed, and the best accepted settings are written to
+# solver.parameters in the configuration directory (the original file
+# is kept as solver.parameters.orig), unless --dry-run is given.
+#
+# ARGUMENTS:
+# - path to the work directory
+#
+# OPTIONS:
+# - --configuration DIR: model configuration directory, with the
+#   mechanism files [default: model/configuration/]
+# - --constraints DIR: model constraints directory [default: model/constraints/]
+# - --shared-lib FILE: shared library [default: mechanism.so in the
+#   configuration directory]
+# - --mcm DIR: MCM data files directory [default: mcm/]
+# - --executable FILE: AtChem2 executable [default: ./atchem2]
+# - --jobs N: number of models run at the same time [default: the number of CPUs]
+# - --max-runs N: maximum number of runs, without the reference run [default: 40]
+# - --score time|evaluations: how to compare the candidates [default: time]
+# - --min-improvement X: minimum relative improvement of the score to
+#   accept new settings [default: 0.05]
+# - --reference-factor X: atol and rtol of the reference run are those
+#   of the model divided by X [default: 100]
+# - --accept-rtol X: relative acceptance tolerance [default: 1.0e-03]
+# - --accept-atol X: absolute acceptance tolerance [default: 1.0e+02]
+# - --json FILE: write the results of all the runs to FILE
+# - --dry-run: do not change solver.parameters
+#
+# USAGE:
+#   python ./tools/ensemble/tune_solver.py tuning_runs/ --jobs 4
+#   python ./tools/ensemble/tune_solver.py tuning_runs/ --score evaluations --dry-run \
+#          --configuration tests/model_tests/firstorder/configuration/ \
+#          --constraints tests/model_tests/firstorder/constraints/
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import argparse
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output'))
+import atchem2_output
+import atchem2_ensemble
+
+# Line numbers (from 1) of the tuned parameters in solver.parameters
+parameter_lines = [('atol', '1'), ('rtol', '2'), ('maximum step size', '5'), ('solver type', '7'),
+                   ('upper bandwidth', '8'), ('lower bandwidth', '9'), ('analytic jacobian', '10')]
+line_of = dict(parameter_lines)
+column_titles = ['atol', 'rtol', 'maxStep', 'solverType', 'upperBand', 'lowerBand', 'analyticJac']
+
+# Counters of mainSolverParameters.output which count the evaluations of the right-hand side, of the Jacobian
+# (solver type 3) and of the Jacobian-vector products and the preconditioner (solver types 1 and 2)
+evaluation_counters = ['NFE', 'NFELS', 'NJTV', 'NPE', 'NJE']
+
+
+## ------------------------------------------------------------------ ##
+
+
+def read_solver_parameters(filename):
+    """
+    This function reads the values of the tuned parameters from solver.parameters.
+
+    :param filename: string containing a relative or absolute reference to solver.parameters.
+    :returns: dictionary mapping the name of each parameter in parameter_lines to its value, as a string. The
+      analytic jacobian is optional, and is missing if the file does not set it.
+    """
+    with open(filename, 'r') as parameters_file:
+        values = [line.split()[0] if line.split() else '' for line in parameters_file]
+    parameters = dict()
+    for name, line in parameter_lines:
+        if int(line) <= len(values) and values[int(line) - 1]:
+            parameters[name] = values[int(line) - 1]
+        elif name != 'analytic jacobian':
+            raise RuntimeError('There is no ' + name + ' on line ' + line + ' of ' + filename + '.')
+    return parameters
+
+
+def scale(value, factor):
+    """Return the parameter value multiplied by factor, as a string."""
+    return '%.1e' % (float(value) * factor)
+
+
+def solver_settings(parameters):
+    # Return the parameters as a list of settings of solver.parameters, as in atchem2_ensemble.py.
+    return [('solver.parameters', line_of[name], parameters[name]) for name, _ in parameter_lines if name in parameters]
+
+
+def _key(parameters):
+    # Return a hashable key of a set of parameters, to avoid running the same settings twice.
+    return tuple((name, parameters[name]) for name, _ in parameter_lines if name in parameters)
+
+
+def read_evaluations(filename):
+    """
+    This function reads the numbers of evaluations from the last line of mainSolverParameters.output.
+
+    :returns (rhs, jacobian): the number of evaluations of the right-hand side (NFE + NFELS), and of the Jacobian, of
+      the Jacobian-vector products and of the preconditioner (NJE, or NJTV + NPE), or None if the file has no lines.
+    """
+    table = atchem2_output.load_output(filename, use_cache=False)
+    if len(table) == 0:
+        return None
+    counts = dict((name, int(table[name][-1])) for name in evaluation_counters if name in table)
+    return counts.get('NFE', 0) + counts.get('NFELS', 0), \
+        counts.get('NJE', 0) + counts.get('NJTV', 0) + counts.get('NPE', 0)
+
+
+def compare_concentrations(filename, reference_filename, accept_atol, accept_rtol):
+    """
+    This function compares speciesConcentrations.output with that of the reference run.
+
+    :returns (passed, deviation): whether all the values are within the acceptance tolerances, and the largest
+      deviation relative to the tolerance, i.e. max(|x - reference| / (accept_atol + accept_rtol * |reference|)).
+    """
+    table = atchem2_output.load_output(filename, use_cache=False)
+    reference = atchem2_output.load_output(reference_filename, use_cache=False)
+    if table.numeric_names != reference.numeric_names or table.values.shape != reference.values.shape:
+        return False, np.inf
+    if table.values.size == 0:
+        return True, 0.0
+    with np.errstate(invalid='ignore'):
+        deviation = np.abs(table.values - reference.values) / (accept_atol + accept_rtol * np.abs(reference.values))
+    deviation[np.isnan(deviation)] = np.inf
+    worst = float(deviation.max())
+    return worst <= 1.0, worst
+
+
+def check_reference(run_dir):
+    """
+    This function checks that the reference run covers the whole run, so that the candidates can be compared with it:
+    the times of its speciesConcentrations.output must be the model start time, and the time after each step up to
+    the end of the run, from model.parameters (the times are written with 7 significant digits).
+
+    :param run_dir: the directory of the reference run.
+    :returns: None if the reference run covers the whole run, otherwise the error message.
+    """
+    with open(os.path.join(run_dir, 'configuration', 'model.parameters'), 'r') as parameters_file:
+        values = [float(line.split()[0]) for line in parameters_file if line.split()]
+    numberOfSteps, stepSize, startTime = int(round(values[0])), values[1], values[5]
+    expected = startTime + stepSize * np.arange(numberOfSteps + 1)
+    filename = os.path.join(run_dir, 'output', 'speciesConcentrations.output')
+    times = atchem2_output.load_output(filename, use_cache=False)['t']
+    if len(times) != len(expected) or \
+      np.any(np.abs(times - expected) > 1.e-6 * np.maximum(np.abs(expected), 1.0)):
+        covered = ('from ' + str(times[0]) + ' to ' + str(times[-1])) if len(times) else 'no time'
+        return 'the reference run has ' + str(len(times)) + ' output times (' + covered + ') instead of ' + \
+          str(len(expected)) + ' (from ' + str(expected[0]) + ' to ' + str(expected[-1]) + '), see ' + filename
+    return None
+
+
+def run_candidate(task):
+    """
+    This function runs the model with one set of solver parameters, and compares its results with the reference run.
+
+    :param task: tuple (name, parameters, work_dir, options), where options is the dictionary of run_variant(), with
+      the acceptance tolerances 'accept_atol' and 'accept_rtol' (not needed for the reference run).
+    :returns: dictionary holding the name, the parameters, the error message (None if the run completed), the wall
+      time, the numbers of evaluations, and whether the results are accepted, with their largest deviation.
+    """
+    name, parameters, work_dir, options = task
+    _, error, elapsed = atchem2_ensemble.run_variant((name, solver_settings(parameters), work_dir, options))
+    result = {'name': name, 'parameters': parameters, 'error': error, 'time': elapsed, 'rhsEvaluations': None,
+              'jacobianEvaluations': None, 'accepted': False, 'deviation': None}
+    if error is not None:
+        return result
+    output_dir = os.path.join(work_dir, 'runs', name, 'output')
+    try:
+        evaluations = read_evaluations(os.path.join(output_dir, 'mainSolverParameters.output'))
+        if evaluations is not None:
+            result['rhsEvaluations'], result['jacobianEvaluations'] = evaluations
+        if name != 'reference':
+            result['accepted'], result['deviation'] = compare_concentrations(
+                os.path.join(output_dir, 'speciesConcentrations.output'),
+                os.path.join(work_dir, 'runs', 'reference', 'output', 'speciesConcentrations.output'),
+                options['accept_atol'], options['accept_rtol'])
+    except (IOError, OSError, ValueError) as e:
+        result['error'] = str(e)
+    return result
+
+
+def score(result, by):
+    """
+    This function returns the score of an accepted run (lower is better): its wall time, or its total number of
+    evaluations. The score of a run which has not been accepted is infinite.
+    """
+    if not result['accepted'] or result['error'] is not None:
+        return float('inf')
+    if by == 'evaluations':
+        if result['rhsEvaluations'] is None:
+            return float('inf')
+        return result['rhsEvaluations'] + result['jacobianEvaluations']
+    return result['time']
+
+
+## ------------------------------------------------------------------ ##
+
+
+def search_rounds(base, bandwidths):
+    """
+    This function returns the rounds of the search: a list of (name of the round, function), where the function takes
+    the current best parameters and returns the list of candidate parameters of the round.
+
+    :param base: dictionary holding the parameters of the model: the tolerances and the maximum step size of the
+      candidates are 10 and 100 times those of the model, so that the search is bounded.
+    :param bandwidths: (lower, upper) bandwidths of the Jacobian matrix, or None if they are not known.
+    """
+    def with_changes(parameters, changes):
+        candidate = dict(parameters)
+        candidate.update(changes)
+        return candidate
+
+    def solver_types(parameters):
+        candidates = [with_changes(parameters, {'solver type': solver_type}) for solver_type in ['1', '3', '2']]
+        if bandwidths is not None:
+            lower, upper = bandwidths
+            candidates.append(with_changes(parameters, {'solver type': '2', 'upper bandwidth': str(upper),
+                                                        'lower bandwidth': str(lower)}))
+        return candidates
+
+    def analytic_jacobian(parameters):
+        if 'analytic jacobian' not in parameters:
+            return []
+        return [with_changes(parameters, {'analytic jacobian': '0' if parameters['analytic jacobian'] == '1' else '1'})]
+
+    def larger(name):
+        return lambda parameters: [with_changes(parameters, {name: scale(base[name], factor)})
+                                   for factor in [10.0, 100.0]]
+
+    return [('solver type', solver_types), ('analytic jacobian', analytic_jacobian),
+            ('maximum step size', larger('maximum step size')), ('rtol', larger('rtol')), ('atol', larger('atol'))]
+
+
+def tune(base, work_dir, options, bandwidths, jobs=1, max_runs=40, by='time', min_improvement=0.05,
+         reference_factor=100.0):
+    """
+    This function runs the reference run and the search, printing the result of each run as soon as it is known.
+
+    :param base: dictionary holding the parameters of the model, as returned by read_solver_parameters().
+    :returns (best, results): the result of the best accepted run (None if no run has been accepted), and the list of
+      the results of all the runs, as returned by run_candidate().
+    """
+    def report(result):
+        if result['error'] is not None:
+            status = 'FAILED, ' + result['error']
+        elif result['name'] == 'reference':
+            status = 'reference'
+        else:
+            status = ('accepted' if result['accepted'] else 'rejected') + ', deviation ' + \
+              '%.3g' % result['deviation']
+        print(result['name'] + ': ' + '%.2f' % result['time'] + ' s, ' + str(result['rhsEvaluations']) + ' + ' +
+              str(result['jacobianEvaluations']) + ' evaluations, ' + status)
+        sys.stdout.flush()
+
+    reference = dict(base, atol=scale(base['atol'], 1.0 / reference_factor),
+                     rtol=scale(base['rtol'], 1.0 / reference_factor))
+    results = [run_candidate(('reference', reference, work_dir, options))]
+    if results[0]['error'] is None:
+        results[0]['error'] = check_reference(os.path.join(work_dir, 'runs', 'reference'))
+    report(results[0])
+    if results[0]['error'] is not None:
+        raise RuntimeError('The reference run has failed: ' + results[0]['error'])
+
+    tried = set()
+    pool = ThreadPool(max(jobs, 1))
+    best = None
+    try:
+        # The settings of the model are run first, on their own, to have a score to improve on
+        tried.add(_key(base))
+        results.append(run_candidate(('base', base, work_dir, options)))
+        report(results[-1])
+        if results[-1]['accepted']:
+            best = results[-1]
+        rounds = search_rounds(base, bandwidths)
+        improved = True
+        while improved and len(results) - 1 < max_runs:
+            improved = False
+            for round_name, candidates in rounds:
+                current = best['parameters'] if best is not None else base
+                pending = []
+                for parameters in candidates(current):
+                    if _key(parameters) not in tried and len(results) - 1 + len(pending) < max_runs:
+                        tried.add(_key(parameters))
+                        pending.append(('c%03d' % (len(results) + len(pending) - 1), parameters, work_dir, options))
+                if not pending:
+                    continue
+                print('Round: ' + round_name + ' (' + str(len(pending)) + ' runs)')
+                round_results = pool.map(run_candidate, pending)
+                for result in round_results:
+                    report(result)
+                results += round_results
+                winner = min(round_results, key=lambda result: score(result, by))
+                if score(winner, by) < float('inf') and \
+                  (best is None or score(winner, by) < (1.0 - min_improvement) * score(best, by)):
+                    best = winner
+                    improved = True
+    finally:
+        pool.close()
+        pool.join()
+    return best, results
+
+
+def write_parameters(config_dir, parameters, base):
+    """
+    This function writes the parameters which differ from those of the model to solver.parameters in the
+    configuration directory, keeping the description of each parameter. The original file is kept as
+    solver.parameters.orig.
+    """
+    filename = os.path.join(config_dir, 'solver.parameters')
+    with open(filename, 'r') as parameters_file:
+        lines = parameters_file.read().splitlines()
+    for name, key in parameter_lines:
+        if parameters.get(name) != base.get(name):
+            atchem2_ensemble.apply_setting(lines, 'solver.parameters', key, parameters[name])
+    shutil.copyfile(filename, filename + '.orig')
+    with open(filename, 'w') as parameters_file:
+        parameters_file.write(''.join(line + '\n' for line in lines))
+
+
+def results_lines(results):
+    # Return the results of all the runs as a table, as a list of lines of text.
+    names = [name for name, _ in parameter_lines]
+    lines = ['%-10s' % 'run' + ''.join('%12s' % title for title in column_titles) +
+             '%10s %12s %12s %10s  %s' % ('time (s)', 'RHS evals', 'Jac evals', 'deviation', 'status')]
+    for result in results:
+        if result['error'] is not None:
+            status = 'failed'
+        elif result['name'] == 'reference':
+            status = 'reference'
+        else:
+            status = 'accepted' if result['accepted'] else 'rejected'
+        lines.append('%-10s' % result['name'] +
+                     ''.join('%12s' % result['parameters'].get(name, '-') for name in names) +
+                     '%10.2f %12s %12s %10s  %s' % (result['time'], result['rhsEvaluations'],
+                                                    result['jacobianEvaluations'],
+                                                    '-' if result['deviation'] is None else
+                                                    '%.3g' % result['deviation'], status))
+    return lines
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the solver parameters of an AtChem2 model.')
+    parser.add_argument('work_dir', help='path to the work directory')
+    parser.add_argument('--configuration', default='./model/configuration/',
+                        help='model configuration directory, with the mechanism files [default: ./model/configuration/]')
+    parser.add_argument('--constraints', default='./model/constraints/',
+                        help='model constraints directory [default: ./model/constraints/]')
+    parser.add_argument('--shared-lib', dest='shared_lib',
+                        help='shared library [default: mechanism.so in the configuration directory]')
+    parser.add_argument('--mcm', default='./mcm/', help='MCM data files directory [default: ./mcm/]')
+    parser.add_argument('--executable', default='./atchem2', help='AtChem2 executable [default: ./atchem2]')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of models run at the same time [default: the number of CPUs]')
+    parser.add_argument('--max-runs', type=int, default=40,
+                        help='maximum number of runs, without the reference run [default: 40]')
+    parser.add_argument('--score', choices=['time', 'evaluations'], default='time',
+                        help='how to compare the candidates [default: time]')
+    parser.add_argument('--min-improvement', type=float, default=0.05,
+                        help='minimum relative improvement of the score to accept new settings [default: 0.05]')
+    parser.add_argument('--reference-factor', type=float, default=100.0,
+                        help='atol and rtol of the reference run are divided by this factor [default: 100]')
+    parser.add_argument('--accept-rtol', type=float, default=1.0e-03,
+                        help='relative acceptance tolerance [default: 1.0e-03]')
+    parser.add_argument('--accept-atol', type=float, default=1.0e+02,
+                        help='absolute acceptance tolerance [default: 1.0e+02]')
+    parser.add_argument('--json', help='write the results of all the runs to this file')
+    parser.add_argument('--dry-run', action='store_true', help='do not change solver.parameters')
+    args = parser.parse_args()
+
+    options = {'configuration': args.configuration, 'constraints': args.constraints, 'mcm': args.mcm,
+               'shared_lib': args.shared_lib if args.shared_lib is not None else
+               os.path.join(args.configuration, 'mechanism.so'),
+               'executable': args.executable, 'accept_atol': args.accept_atol, 'accept_rtol': args.accept_rtol}
+    for path in [options['shared_lib'], options['executable']]:
+        assert os.path.isfile(path), 'Failed to find file ' + path
+    for path in [args.configuration, args.mcm]:
+        assert os.path.isdir(path), 'Failed to find directory ' + path
+
+    base = read_solver_parameters(os.path.join(args.configuration, 'solver.parameters'))
+    bandwidths = atchem2_output.read_bandwidths(os.path.join(args.configuration, 'mechanism.sparsity'))
+    best, results = tune(base, args.work_dir, options, bandwidths, jobs=args.jobs, max_runs=args.max_runs,
+                         by=args.score, min_improvement=args.min_improvement,
+                         reference_factor=args.reference_factor)
+
+    print()
+    for line in results_lines(results):
+        print(line)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'score': args.score, 'best': best['name'] if best is not None else None, 'runs': results},
+                      json_file, indent=1, sort_keys=True)
+    print()
+    if best is None:
+        print('No run has been accepted: solver.parameters is not changed.')
+        sys.exit(1)
+    print('Best settings: ' + best['name'] + ' (' + args.score + ': ' + '%.6g' % score(best, args.score) + ')')
+    if best['parameters'] == base:
+        print('The settings of the model are already the best: solver.parameters is not changed.')
+    elif args.dry_run:
+        print('Dry run: solver.parameters is not changed.')
+    else:
+        write_parameters(args.configuration, best['parameters'], base)
+        print('Written to ' + os.path.join(args.configuration, 'solver.parameters') + ' (the original file is ' +
+              'solver.parameters.orig)')
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        print(str(e))
+        sys.exit(os.EX_DATAERR)
@@ -0,0 +1,531 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This module reads the Jacobian matrices written by the model to
+# jacobian.output (see jacobian output step size in model.parameters)
+# into sparse matrices, and calculates diagnostics of their structure
+# and of their stiffness, to help choose the solver type and the
+# bandwidths of the banded preconditioner in solver.parameters
+# [requires numpy and scipy].
+#
+# In jacobian.output, each Jacobian matrix is written as a block of
+# dense rows, one for each species, in which the time is followed by
+# the derivatives of the rate of change of the species with respect to
+# the concentration of every species, i.e. row i of the block at time t
+# is: t, J(i, 1), ..., J(i, n). The rows are written with the format
+# (100 (1P e15.7)), so the rows of mechanisms with more than 99 species
+# are wrapped over several lines, and the blocks are separated by a
+# line " ---------------".
+#
+# The file is read in chunks, and each chunk is reduced to the nonzero
+# elements of its rows before the next one is read, so that neither the
+# file nor a whole dense block is held in memory. The Jacobian matrices
+# are returned one at a time, in Compressed Sparse Row format
+# (scipy.sparse.csr_matrix). As in atchem2_output.py, whose cache
+# functions are used here, the nonzero elements are written in binary
+# form to a cache directory next to the file (e.g.
+# model/output/.jacobian.output.cache/) while it is read, and the next
+# time the matrices are memory-mapped from the cache, unless the size
+# or the modification time of the file have changed. A block at the
+# end of the file without the separator line (e.g. of a model that is
+# still running) is ignored.
+#
+# The diagnostics of each Jacobian matrix J are:
+# - nnz: number of nonzero elements, and density (nnz / n^2).
+# - lower, upper: the largest distances below and above the diagonal
+#   of the nonzero elements, i.e. the bandwidths of the banded
+#   preconditioner that covers all of them (cf. mechanism.sparsity,
+#   which gives the bandwidths of the elements that can be nonzero).
+# - gershgorin: bound of the spectral radius of J from the Gershgorin
+#   circles (largest sum of the absolute values of a row).
+# - shortest lifetime: 1 / max(-J(i, i)), and the species with the
+#   shortest lifetime (the fastest species).
+# - dominant eigenvalue: the eigenvalue of J with the largest modulus.
+# - max real part: the largest real part of the eigenvalues of J
+#   (positive for growing modes).
+# - stiffness ratio: max |Re(l)| / min |Re(l)| over the eigenvalues l
+#   of J with a negative real part. The eigenvalues that are zero to
+#   within the precision of the calculation (e.g. those of conserved
+#   quantities or of constrained species) are left out.
+# The eigenvalues of matrices with up to dense_limit species are all
+# calculated, with numpy.linalg.eigvals. For larger matrices, only a
+# few eigenvalues with the largest modulus, and a few eigenvalues
+# closest to zero (shift-invert mode), are calculated with ARPACK
+# (scipy.sparse.linalg.eigs), so the dominant eigenvalue and the
+# stiffness ratio are estimates.
+#
+# The suggested solver settings (suggest_solver()) are based on the
+# diagnostics of all the matrices: the dense solver (solver type 3) for
+# small mechanisms, or when the banded preconditioner would be almost
+# as large as the whole matrix; GMRES with the banded preconditioner
+# (solver type 2) with the bandwidths of the nonzero elements, if the
+# mechanism is stiff; GMRES without preconditioner (solver type 1)
+# otherwise. These are starting points for
+# tools/ensemble/tune_solver.py.
+#
+# Usage from Python:
+#   sys.path.insert(0, 'tools/output')
+#   import atchem2_jacobian
+#   for t, J in atchem2_jacobian.read_jacobian('model/output/jacobian.output'):
+#       print(t, J.nnz, atchem2_jacobian.diagnostics(J)['stiffness_ratio'])
+#
+# ARGUMENT:
+# - path to jacobian.output
+#
+# OPTIONS:
+# - --configuration DIR: model configuration directory, from which the
+#   names of the species (mechanism.species) and the bandwidths of
+#   the sparsity pattern (mechanism.sparsity) are read, if they exist
+# - --every N: calculate the diagnostics of one matrix every N [default: 1]
+# - --dense-limit N: number of species up to which all the eigenvalues
+#   are calculated [default: 200]
+# - --json FILE: write the diagnostics and the suggested solver
+#   settings to FILE
+# - --no-cache: always parse jacobian.output, and do not write the cache
+#
+# USAGE:
+#   python ./tools/output/atchem2_jacobian.py model/output/jacobian.output --configuration model/configuration
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import warnings
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+from atchem2_output import (cache_directory, source_stamp, read_cache_index, cache_work_directory, replace_cache,
+                            read_bandwidths)
+
+cache_format_version = 1
+separator = b'---------------'
+values_per_line = 100
+chunk_size = 16 * 1024 ** 2
+dense_limit = 200
+number_of_eigenvalues = 6
+stiff_ratio = 1.0e3
+
+# Exponents with 3 digits are written by Fortran without the E, e.g. 1.0000000-100
+_short_exponent = re.compile(br'(\d)([+-]\d)')
+
+
+## ------------------------------------------------------------------ ##
+
+
+def _parse_numbers(contents):
+    # Return the numbers in contents (bytes), as written by the Fortran code.
+    if not contents.strip():
+        return np.zeros(0)
+    if _short_exponent.search(contents):
+        contents = _short_exponent.sub(br'\1E\2', contents)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return np.fromstring(contents.decode('ascii'), sep=' ')
+
+
+def row_width(filename):
+    """
+    This function works out the number of values of each row of jacobian.output (the time and one value for each
+    species) from the lengths of the lines of its first block, without reading the rest of the file.
+
+    :param filename: string containing a relative or absolute reference to jacobian.output.
+    :returns: the number of values of each row, or None if the file has no rows.
+    """
+    full_lines = 0
+    with open(filename, 'rb') as jacobian_file:
+        for line in jacobian_file:
+            if separator in line:
+                break
+            length = len(line.split())
+            if length == 0:
+                continue
+            if length < values_per_line:
+                return values_per_line * full_lines + length
+            full_lines += 1
+    if full_lines == 0:
+        return None
+    # All the lines are full, so the block has n * (n + 1) values
+    total = values_per_line * full_lines
+    n = int(round((np.sqrt(1.0 + 4.0 * total) - 1.0) / 2.0))
+    if n * (n + 1) != total:
+        raise ValueError('atchem2_jacobian: the first block of ' + filename + ' has ' + str(total) +
+                         ' values, which is not n * (n + 1)')
+    return n + 1
+
+
+class _BlockReader(object):
+    # Collect the nonzero elements of the rows of a block, as they are parsed, into a csr_matrix.
+
+    def __init__(self, width):
+        self.width = width
+        self.n = width - 1
+        self._start()
+
+    def _start(self):
+        self.t = None
+        self.numberOfRows = 0
+        self.pending = np.zeros(0)
+        self.columns = []
+        self.data = []
+        self.counts = []
+
+    def add(self, values):
+        if self.pending.size:
+            values = np.concatenate((self.pending, values))
+        m = values.size // self.width
+        rows = values[:m * self.width].reshape(m, self.width)
+        self.pending = values[m * self.width:]
+        if m == 0:
+            return
+        if self.t is None:
+            self.t = rows[0, 0]
+        if self.numberOfRows + m > self.n or np.any(rows[:, 0] != self.t):
+            raise ValueError('atchem2_jacobian: the rows of the block' + self._at() + ' do not all have ' +
+                             str(self.width) + ' values')
+        r, c = np.nonzero(rows[:, 1:])
+        self.columns.append(c.astype(np.int32))
+        self.data.append(rows[:, 1:][r, c])
+        self.counts.append(np.bincount(r, minlength=m))
+        self.numberOfRows += m
+
+    def _at(self):
+        return '' if self.t is None else ' at t=' + repr(float(self.t))
+
+    def finish(self):
+        if self.pending.size or self.numberOfRows != self.n:
+            raise ValueError('atchem2_jacobian: the block' + self._at() + ' has ' +
+                             str(self.numberOfRows * self.width + self.pending.size) + ' values instead of ' +
+                             str(self.n * self.width))
+        indptr = np.zeros(self.n + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(self.counts), out=indptr[1:])
+        matrix = sparse.csr_matrix((np.concatenate(self.data), np.concatenate(self.columns), indptr),
+                                   shape=(self.n, self.n))
+        t = float(self.t)
+        self._start()
+        return t, matrix
+
+
+def _parse_jacobian(filename, chunk=chunk_size):
+    # Yield (t, csr_matrix) for each complete block of the file, reading it in chunks.
+    width = row_width(filename)
+    if width is None:
+        return
+    block = _BlockReader(width)
+    rest = b''
+    with open(filename, 'rb') as jacobian_file:
+        while True:
+            contents = jacobian_file.read(chunk)
+            if not contents:
+                break
+            contents = rest + contents
+            end = contents.rfind(b'\n') + 1
+            rest = contents[end:]
+            pieces = contents[:end].split(separator)
+            for piece in pieces[:-1]:
+                block.add(_parse_numbers(piece))
+                yield block.finish()
+            block.add(_parse_numbers(pieces[-1]))
+    if separator in rest:
+        block.add(_parse_numbers(rest.split(separator)[0]))
+        yield block.finish()
+
+
+def _map(filename, dtype):
+    # Memory-map a binary file of the cache (mmap cannot map an empty file).
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r')
+
+
+def _read_cache(cache_dir, stamp):
+    # Return (n, times, offsets, data, indices, indptr) memory-mapped from the cache directory, or None if the cache
+    # is missing or out of date.
+    index = read_cache_index(cache_dir, stamp, cache_format_version)
+    if index is None:
+        return None
+    n = index['numberOfSpecies']
+    return (n, np.load(os.path.join(cache_dir, 'times.npy')), np.load(os.path.join(cache_dir, 'offsets.npy')),
+            _map(os.path.join(cache_dir, 'data.bin'), '<f8'), _map(os.path.join(cache_dir, 'indices.bin'), '<i4'),
+            _map(os.path.join(cache_dir, 'indptr.bin'), '<i8').reshape(-1, n + 1))
+
+
+def _cached_matrix(cache, k):
+    # Return the k-th matrix of the cache, as a csr_matrix of memory-mapped arrays.
+    n, times, offsets, data, indices, indptr = cache
+    start, end = offsets[k], offsets[k + 1]
+    return sparse.csr_matrix((data[start:end], indices[start:end], indptr[k]), shape=(n, n), copy=False)
+
+
+def _parse_and_cache(filename, cache_dir, stamp):
+    # Yield (t, csr_matrix) as _parse_jacobian(), and write the cache to a temporary directory at the same time. The
+    # temporary directory replaces the cache directory only if the whole file has been read, and has not changed while
+    # being read (e.g. by a running model).
+    try:
+        work_dir = cache_work_directory(cache_dir)
+    except (IOError, OSError) as e:
+        print('atchem2_jacobian: cannot write the cache of ' + filename + ': ' + str(e), file=sys.stderr)
+        for t, matrix in _parse_jacobian(filename):
+            yield t, matrix
+        return
+    try:
+        times = []
+        offsets = [0]
+        n = 0
+        with open(os.path.join(work_dir, 'data.bin'), 'wb') as data_file, \
+                open(os.path.join(work_dir, 'indices.bin'), 'wb') as indices_file, \
+                open(os.path.join(work_dir, 'indptr.bin'), 'wb') as indptr_file:
+            for t, matrix in _parse_jacobian(filename):
+                n = matrix.shape[0]
+                matrix.data.astype('<f8').tofile(data_file)
+                matrix.indices.astype('<i4').tofile(indices_file)
+                matrix.indptr.astype('<i8').tofile(indptr_file)
+                times.append(t)
+                offsets.append(offsets[-1] + matrix.nnz)
+                yield t, matrix
+        if source_stamp(filename) == stamp:
+            np.save(os.path.join(work_dir, 'times.npy'), np.array(times, dtype=float))
+            np.save(os.path.join(work_dir, 'offsets.npy'), np.array(offsets, dtype=np.int64))
+            replace_cache(work_dir, cache_dir, stamp, {'numberOfSpecies': n}, cache_format_version)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def read_jacobian(filename, use_cache=True):
+    """
+    This function reads the Jacobian matrices of jacobian.output, one at a time. The matrices are memory-mapped from
+    the cache if it is up to date; otherwise, the file is parsed in chunks, and the cache is written (if possible) for
+    the next time.
+
+    :param filename: string containing a relative or absolute reference to jacobian.output.
+    :param use_cache: if False, always parse the file, and do not write the cache.
+    :returns: a generator of (t, J), where J is the Jacobian matrix at time t as a scipy.sparse.csr_matrix, and
+      J[i, j] is the derivative of the rate of change of species i + 1 with respect to the concentration of species
+      j + 1.
+    """
+    if not use_cache:
+        for t, matrix in _parse_jacobian(filename):
+            yield t, matrix
+        return
+    cache_dir = cache_directory(filename)
+    stamp = source_stamp(filename)
+    cache = _read_cache(cache_dir, stamp)
+    if cache is None:
+        for t, matrix in _parse_and_cache(filename, cache_dir, stamp):
+            yield t, matrix
+        return
+    for k, t in enumerate(cache[1]):
+        yield float(t), _cached_matrix(cache, k)
+
+
+def jacobian_at(filename, time, use_cache=True):
+    """
+    This function returns the Jacobian matrix of jacobian.output nearest to a given time. If the cache is up to date,
+    only that matrix is read from the disk.
+
+    :param filename: string containing a relative or absolute reference to jacobian.output.
+    :param time: time in seconds.
+    :param use_cache: as in read_jacobian().
+    :returns (t, J): the time of the matrix and the matrix, or None if the file has no matrices.
+    """
+    if use_cache:
+        cache = _read_cache(cache_directory(filename), source_stamp(filename))
+        if cache is not None and cache[1].size:
+            k = int(np.argmin(np.abs(cache[1] - time)))
+            return float(cache[1][k]), _cached_matrix(cache, k)
+    nearest = None
+    for t, matrix in read_jacobian(filename, use_cache):
+        if nearest is None or abs(t - time) < abs(nearest[0] - time):
+            nearest = (t, matrix)
+    return nearest
+
+
+## ------------------------------------------------------------------ ##
+
+
+def _eigenvalues(matrix, dense_limit, k):
+    # Return all the eigenvalues of the matrix, or estimates of the k with the largest modulus and of the k closest to
+    # zero if it is larger than dense_limit, and the threshold below which they are considered to be zero.
+    n = matrix.shape[0]
+    if n <= max(dense_limit, k + 2):
+        eigenvalues = np.linalg.eigvals(matrix.toarray())
+        radius = np.max(np.abs(eigenvalues)) if n else 0.0
+        return eigenvalues, n * np.finfo(float).eps * radius
+    try:
+        largest = sparse_linalg.eigs(matrix, k=k, which='LM', return_eigenvectors=False)
+    except sparse_linalg.ArpackNoConvergence as e:
+        largest = e.eigenvalues
+    radius = np.max(np.abs(largest)) if largest.size else 0.0
+    threshold = n * np.finfo(float).eps * radius
+    # Shift slightly away from zero, as the matrix is often singular
+    try:
+        smallest = sparse_linalg.eigs(matrix.tocsc(), k=k, sigma=-threshold, which='LM', return_eigenvectors=False)
+    except sparse_linalg.ArpackNoConvergence as e:
+        smallest = e.eigenvalues
+    except RuntimeError:
+        smallest = np.zeros(0, dtype=complex)
+    return np.concatenate((largest, smallest)), threshold
+
+
+def diagnostics(matrix, dense_limit=dense_limit, k=number_of_eigenvalues):
+    """
+    This function calculates the diagnostics of a Jacobian matrix (see the top of this file).
+
+    :param matrix: the Jacobian matrix, as a scipy.sparse matrix.
+    :param dense_limit: number of species up to which all the eigenvalues are calculated.
+    :param k: number of eigenvalues calculated at each end of the spectrum of larger matrices.
+    :returns: dictionary of the diagnostics. The species numbers count from 1, and the diagnostics that cannot be
+      calculated (e.g. the stiffness ratio of a matrix without negative eigenvalues) are None.
+    """
+    matrix = sparse.csr_matrix(matrix, copy=True)
+    matrix.eliminate_zeros()
+    n = matrix.shape[0]
+    coo = matrix.tocoo()
+    distance = coo.row.astype(np.int64) - coo.col
+    result = {'numberOfSpecies': n,
+              'nnz': int(matrix.nnz),
+              'density': matrix.nnz / float(n * n) if n else 0.0,
+              'lower': int(max(distance.max(), 0)) if distance.size else 0,
+              'upper': int(max(-distance.min(), 0)) if distance.size else 0,
+              'gershgorin': float(np.max(np.asarray(abs(matrix).sum(axis=1)))) if n else 0.0}
+
+    loss = -matrix.diagonal()
+    i = int(np.argmax(loss)) if n else 0
+    if n and loss[i] > 0.0:
+        result['shortest_lifetime'] = 1.0 / float(loss[i])
+        result['fastest_species'] = i + 1
+    else:
+        result['shortest_lifetime'] = result['fastest_species'] = None
+
+    eigenvalues, threshold = _eigenvalues(matrix, dense_limit, k) if n else (np.zeros(0, dtype=complex), 0.0)
+    result['dominant_real'] = result['dominant_imag'] = result['max_real'] = result['stiffness_ratio'] = None
+    if eigenvalues.size:
+        dominant = eigenvalues[np.argmax(np.abs(eigenvalues))]
+        result['dominant_real'] = float(dominant.real)
+        result['dominant_imag'] = float(dominant.imag)
+        result['max_real'] = float(np.max(eigenvalues.real))
+        decaying = -eigenvalues.real[eigenvalues.real < -threshold]
+        if decaying.size:
+            result['stiffness_ratio'] = float(decaying.max() / decaying.min())
+    return result
+
+
+def suggest_solver(results, numberOfSpecies):
+    """
+    This function suggests the solver type and the bandwidths of the banded preconditioner in solver.parameters, from
+    the diagnostics of the Jacobian matrices (see the top of this file).
+
+    :param results: list of the dictionaries returned by diagnostics().
+    :param numberOfSpecies: number of species of the mechanism.
+    :returns: dictionary with the solver type, the upper and lower bandwidths, and the reason for the choice.
+    """
+    lower = max([r['lower'] for r in results] + [0])
+    upper = max([r['upper'] for r in results] + [0])
+    ratios = [r['stiffness_ratio'] for r in results if r['stiffness_ratio'] is not None]
+    stiffness = max(ratios) if ratios else None
+    if numberOfSpecies <= dense_limit:
+        solverType, reason = 3, 'small mechanism (' + str(numberOfSpecies) + ' species)'
+    elif 2 * (lower + upper + 1) >= numberOfSpecies:
+        solverType, reason = 3, 'the band of the nonzero elements covers most of the matrix'
+    elif stiffness is not None and stiffness >= stiff_ratio:
+        solverType, reason = 2, 'stiff (stiffness ratio up to %.3g)' % stiffness
+    else:
+        solverType, reason = 1, 'not stiff (stiffness ratio up to %s)' % ('%.3g' % stiffness if stiffness else 'n/a')
+    return {'solver type': solverType, 'upper bandwidth': upper, 'lower bandwidth': lower, 'reason': reason}
+
+
+def read_species(species_filename):
+    """
+    This function reads the names of the species from mechanism.species.
+
+    :returns: list of the names of the species, in the order of their numbers, or None if the file does not exist.
+    """
+    try:
+        with open(species_filename, 'r') as species_file:
+            return [line.split()[1] for line in species_file if line.strip()]
+    except (IOError, OSError):
+        return None
+
+
+## ------------------------------------------------------------------ ##
+
+
+def _format(x, fmt='%.3e'):
+    # Format a diagnostic that may be None.
+    return 'n/a' if x is None else fmt % x
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read jacobian.output into sparse matrices, and print their '
+                                                 'structure and stiffness diagnostics.')
+    parser.add_argument('filename', help='path to jacobian.output')
+    parser.add_argument('--configuration', help='model configuration directory (mechanism.species and '
+                                                'mechanism.sparsity)')
+    parser.add_argument('--every', type=int, default=1, help='calculate the diagnostics of one matrix every N')
+    parser.add_argument('--dense-limit', type=int, default=dense_limit,
+                        help='number of species up to which all the eigenvalues are calculated')
+    parser.add_argument('--json', help='write the diagnostics and the suggested solver settings to this file')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the file, and do not write the cache')
+    args = parser.parse_args()
+
+    species = None
+    sparsity = None
+    if args.configuration:
+        species = read_species(os.path.join(args.configuration, 'mechanism.species'))
+        sparsity = read_bandwidths(os.path.join(args.configuration, 'mechanism.sparsity'))
+
+    results = []
+    numberOfSpecies = 0
+    print('%14s %9s %9s %6s %6s %11s %11s %11s %11s %11s  %s' % (
+        't', 'nnz', 'density', 'lower', 'upper', 'gershgorin', 'dominant', 'max real', 'stiffness', 'lifetime',
+        'fastest'))
+    try:
+        for k, (t, matrix) in enumerate(read_jacobian(args.filename, not args.no_cache)):
+            numberOfSpecies = matrix.shape[0]
+            if k % args.every:
+                continue
+            result = diagnostics(matrix, args.dense_limit)
+            result['t'] = t
+            results.append(result)
+            fastest = result['fastest_species']
+            if fastest is not None and species is not None and fastest <= len(species):
+                fastest = species[fastest - 1]
+            print('%14.7e %9d %9.3e %6d %6d %11.3e %11s %11s %11s %11s  %s' % (
+                t, result['nnz'], result['density'], result['lower'], result['upper'], result['gershgorin'],
+                _format(result['dominant_real']), _format(result['max_real']), _format(result['stiffness_ratio']),
+                _format(result['shortest_lifetime']), 'n/a' if fastest is None else fastest))
+    except (IOError, OSError, ValueError) as e:
+        print('atchem2_jacobian: ' + str(e), file=sys.stderr)
+        sys.exit(1)
+    if not results:
+        print('atchem2_jacobian: no Jacobian matrices in ' + args.filename, file=sys.stderr)
+        sys.exit(1)
+
+    suggestion = suggest_solver(results, numberOfSpecies)
+    print('')
+    print(str(len(results)) + ' Jacobian matrices of ' + str(numberOfSpecies) + ' species')
+    print('lower and upper bandwidths of the nonzero elements: ' + str(suggestion['lower bandwidth']) + ' ' +
+          str(suggestion['upper bandwidth']))
+    if sparsity is not None:
+        print('lower and upper bandwidths in mechanism.sparsity: ' + str(sparsity[0]) + ' ' + str(sparsity[1]))
+    print('suggested solver settings (' + suggestion['reason'] + '):')
+    print('%-14d solver type (1 = spgmr, 2 = spgmr + banded preconditioner, 3 = dense)' % suggestion['solver type'])
+    print('%-14d banded preconditioner upper bandwidth' % suggestion['upper bandwidth'])
+    print('%-14d banded preconditioner lower bandwidth' % suggestion['lower bandwidth'])
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'diagnostics': results, 'suggestion': suggestion, 'sparsity': sparsity}, json_file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
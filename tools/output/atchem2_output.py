@@ -0,0 +1,436 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This module loads the AtChem2 model output files with a header line
+# (speciesConcentrations.output, environmentVariables.output,
+# photolysisRates.output, photolysisRatesParameters.output,
+# mainSolverParameters.output, productionRates.output, lossRates.output
+# and the files in reactionRates/) into columns of numpy arrays
+# [requires numpy].
+#
+# The first time that a file is loaded, it is parsed, and its columns
+# are written in binary form (.npy files) to a cache directory next to
+# it: e.g. model/output/.speciesConcentrations.output.cache/. The
+# next time, the columns are memory-mapped from the cache, so that
+# only the parts that are used are read from the disk. The cache is
+# parsed again whenever the size or the modification time of the file
+# have changed, e.g. if the model has been run again. If the cache
+# directory cannot be written, the file is parsed every time.
+#
+# In the cache, the numerical columns are stored in a single array in
+# column-major order, so that each column is contiguous, and the text
+# columns (speciesName and reaction in productionRates.output and
+# lossRates.output) are stored as integer codes into a sorted array of
+# their distinct values.
+#
+# The files written by a running model can be followed with
+# OutputFollower, which parses only the rows appended since it last
+# read the file (see the watch mode of tools/plot/plot-atchem2.py).
+#
+# The functions which identify and replace a cache directory
+# (cache_directory(), source_stamp(), read_cache_index(),
+# cache_work_directory() and replace_cache()) are also used by
+# atchem2_jacobian.py for the cache of jacobian.output, and
+# read_bandwidths() reads the bandwidths of the Jacobian matrix from
+# mechanism.sparsity for atchem2_jacobian.py and
+# tools/ensemble/tune_solver.py.
+#
+# Usage from Python:
+#   sys.path.insert(0, 'tools/output')
+#   import atchem2_output
+#   output = atchem2_output.load_output('model/output/speciesConcentrations.output')
+#   plt.plot(output['t'], output['O3'])
+#
+# ARGUMENT:
+# - directory with the model output: the cache of each output file is
+#   created or updated, and the number of rows and columns of each file
+#   is printed
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import tempfile
+import warnings
+from timeit import default_timer as timer
+import numpy as np
+
+cache_format_version = 1
+
+# The output files loaded by main(), in the model output directory
+output_filenames = ['speciesConcentrations.output', 'environmentVariables.output', 'photolysisRates.output',
+                    'photolysisRatesParameters.output', 'mainSolverParameters.output', 'productionRates.output',
+                    'lossRates.output']
+
+
+## ------------------------------------------------------------------ ##
+
+
+class OutputTable(object):
+    """
+    This class holds the columns of an output file, as returned by load_output().
+
+    - names: list of the column names, in the order of the file.
+    - values: 2D array of the numerical columns, with one row per line of the file (memory-mapped if loaded from the
+      cache). The integer columns (e.g. speciesNumber) are stored as floating point numbers as well.
+    - numeric_names: list of the names of the columns of values.
+    - text: dictionary mapping the name of each text column to a tuple (codes, categories), where categories is the
+      sorted array of the distinct strings in the column, and codes is the array of the indices into categories of
+      each row.
+
+    output[name] returns the column as a 1D array: a view of values for the numerical columns, or an array of strings
+    for the text columns.
+    """
+
+    def __init__(self, names, values, numeric_names, text):
+        self.names = names
+        self.values = values
+        self.numeric_names = numeric_names
+        self.text = text
+        self._numeric_index = dict((name, i) for i, name in enumerate(numeric_names))
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __contains__(self, name):
+        return name in self._numeric_index or name in self.text
+
+    def __getitem__(self, name):
+        if name in self._numeric_index:
+            return self.values[:, self._numeric_index[name]]
+        codes, categories = self.text[name]
+        return categories.astype(str)[codes]
+
+    def to_dataframe(self):
+        """Return the columns as a pandas DataFrame, in the order of the file [requires pandas]."""
+        import pandas as pd
+        return pd.DataFrame(dict((name, self[name]) for name in self.names), columns=self.names)
+
+    def __repr__(self):
+        return '<OutputTable: ' + str(len(self)) + ' rows, ' + str(len(self.names)) + ' columns>'
+
+
+def _is_number(token):
+    # Return True if token (bytes) is a number, as written by the Fortran code.
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_output(contents):
+    """
+    This function parses the contents of an output file with a header line, i.e. the column names, followed by one
+    line of whitespace-separated values for each row. The columns of which the first value is not a number are text
+    columns; the last text column takes the rest of the line.
+
+    :param contents: the contents of the output file, as bytes.
+    :returns: an OutputTable, held in memory.
+    """
+    header, _, body = contents.partition(b'\n')
+    names = header.decode('ascii').split()
+    numberOfColumns = len(names)
+    lines = body.split(b'\n')
+    while lines and not lines[-1].strip():
+        lines.pop()
+    first = lines[0].split(None, numberOfColumns - 1) if lines else [b'0'] * numberOfColumns
+    isNumeric = [_is_number(x) for x in first]
+    numeric_names = [name for name, numeric in zip(names, isNumeric) if numeric]
+
+    values = None
+    if all(isNumeric):
+        # Fast path: parse all the numbers in one go, and check that none is missing
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            flat = np.fromstring(body.decode('ascii'), sep=' ')
+        if flat.size == len(lines) * numberOfColumns:
+            values = np.asfortranarray(flat.reshape(len(lines), numberOfColumns))
+    text = dict()
+    if values is None:
+        tokens = body.split()
+        if len(tokens) != len(lines) * numberOfColumns:
+            # Some line has a different number of values, e.g. a reaction with spaces in it: split the lines one by
+            # one, with the rest of each line in the last column
+            tokens = []
+            for line in lines:
+                fields = line.split(None, numberOfColumns - 1)
+                if len(fields) != numberOfColumns:
+                    raise ValueError('atchem2_output: expected ' + str(numberOfColumns) + ' values in line: ' +
+                                     line.decode('ascii'))
+                tokens.extend(fields)
+        values = np.empty((len(lines), len(numeric_names)), order='F')
+        j = 0
+        for i, name in enumerate(names):
+            column = np.array(tokens[i::numberOfColumns])
+            if isNumeric[i]:
+                values[:, j] = column.astype(float)
+                j += 1
+            else:
+                categories, codes = np.unique(column, return_inverse=True)
+                text[name] = (codes.astype(np.int32), categories)
+    return OutputTable(names, values, numeric_names, text)
+
+
+def cache_directory(filename):
+    """
+    This function returns the path to the cache directory of an output file.
+
+    :param filename: string containing a relative or absolute reference to the output file.
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, '.' + basename + '.cache')
+
+
+def source_stamp(filename):
+    """
+    This function returns the size and the modification time of a file, which identify its contents in its cache.
+
+    :param filename: string containing a relative or absolute reference to the file.
+    :returns: list [size, modification time], as stored in the index of the cache.
+    """
+    status = os.stat(filename)
+    return [status.st_size, getattr(status, 'st_mtime_ns', status.st_mtime)]
+
+
+def read_cache_index(cache_dir, stamp, version=cache_format_version):
+    """
+    This function reads the index of a cache directory (index.json).
+
+    :param cache_dir: path to the cache directory, as returned by cache_directory().
+    :param stamp: the current stamp of the cached file, as returned by source_stamp().
+    :param version: the current format version of the cache.
+    :returns: dictionary of the index, or None if the cache is missing, of another format version, or out of date.
+    """
+    try:
+        with open(os.path.join(cache_dir, 'index.json'), 'r') as index_file:
+            index = json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get('version') != version or index.get('source') != stamp:
+        return None
+    return index
+
+
+def cache_work_directory(cache_dir):
+    """
+    This function creates a temporary directory next to a cache directory, in which the files of the cache are written
+    before replace_cache() moves it to the cache directory.
+
+    :param cache_dir: path to the cache directory, as returned by cache_directory().
+    :returns: path to the temporary directory.
+    """
+    return tempfile.mkdtemp(prefix=os.path.basename(cache_dir), dir=os.path.dirname(cache_dir))
+
+
+def replace_cache(work_dir, cache_dir, stamp, index, version=cache_format_version):
+    """
+    This function writes the index of a cache (index.json) to the temporary directory in which its files have been
+    written, which then replaces the cache directory, so that a cache is never seen half-written.
+
+    :param work_dir: path to the temporary directory, as returned by cache_work_directory().
+    :param cache_dir: path to the cache directory.
+    :param stamp: the stamp of the cached file when it was read, as returned by source_stamp().
+    :param index: dictionary of the other entries of the index.
+    :param version: the format version of the cache.
+    """
+    contents = dict(index)
+    contents.update({'version': version, 'source': stamp})
+    with open(os.path.join(work_dir, 'index.json'), 'w') as index_file:
+        json.dump(contents, index_file)
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(work_dir, cache_dir)
+
+
+def _read_cache(cache_dir, stamp):
+    # Return the OutputTable memory-mapped from the cache directory, or None if the cache is missing or out of date.
+    index = read_cache_index(cache_dir, stamp)
+    if index is None:
+        return None
+    values = np.load(os.path.join(cache_dir, 'values.npy'), mmap_mode='r')
+    text = dict()
+    for i, name in enumerate(index['text_names']):
+        text[name] = (np.load(os.path.join(cache_dir, 'codes' + str(i) + '.npy'), mmap_mode='r'),
+                      np.load(os.path.join(cache_dir, 'categories' + str(i) + '.npy')))
+    return OutputTable(index['names'], values, index['numeric_names'], text)
+
+
+def _write_cache(cache_dir, stamp, table):
+    # Write the OutputTable to the cache directory (see replace_cache()).
+    work_dir = cache_work_directory(cache_dir)
+    try:
+        np.save(os.path.join(work_dir, 'values.npy'), table.values)
+        text_names = sorted(table.text)
+        for i, name in enumerate(text_names):
+            codes, categories = table.text[name]
+            np.save(os.path.join(work_dir, 'codes' + str(i) + '.npy'), codes)
+            np.save(os.path.join(work_dir, 'categories' + str(i) + '.npy'), categories)
+        replace_cache(work_dir, cache_dir, stamp, {'names': table.names, 'numeric_names': table.numeric_names,
+                                                   'text_names': text_names})
+    except (IOError, OSError):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+
+def load_output(filename, use_cache=True):
+    """
+    This function loads an output file with a header line. The columns are memory-mapped from the cache if it is up
+    to date; otherwise, the file is parsed, and the cache is written (if possible) for the next time.
+
+    :param filename: string containing a relative or absolute reference to the output file.
+    :param use_cache: if False, always parse the file, and do not write the cache.
+    :returns: an OutputTable.
+    """
+    if not use_cache:
+        with open(filename, 'rb') as output_file:
+            return parse_output(output_file.read())
+
+    cache_dir = cache_directory(filename)
+    stamp = source_stamp(filename)
+    table = _read_cache(cache_dir, stamp)
+    if table is not None:
+        return table
+    with open(filename, 'rb') as output_file:
+        table = parse_output(output_file.read())
+    # Only write the cache if the file has not changed while being read, e.g. by a running model
+    if source_stamp(filename) == stamp:
+        try:
+            _write_cache(cache_dir, stamp, table)
+        except (IOError, OSError) as e:
+            print('atchem2_output: cannot write the cache of ' + filename + ': ' + str(e), file=sys.stderr)
+    return table
+
+
+def read_bandwidths(sparsity_filename):
+    """
+    This function reads the lower and upper bandwidths of the Jacobian matrix from the header of mechanism.sparsity.
+
+    :returns (lower, upper): the bandwidths, or None if the file does not exist or has no bandwidths.
+    """
+    try:
+        with open(sparsity_filename, 'r') as sparsity_file:
+            for line in sparsity_file:
+                if not line.startswith('!'):
+                    break
+                if line.startswith('! Lower and upper bandwidths:'):
+                    lower, upper = line.split(':')[1].split()
+                    return int(lower), int(upper)
+    except (IOError, OSError):
+        pass
+    return None
+
+
+class OutputFollower(object):
+    """
+    This class follows an output file with only numerical columns (e.g. speciesConcentrations.output) while it is
+    written by a running model: each call to read_new_rows() parses only the rows appended since the previous call.
+
+    The model writes the files in blocks, which can end in the middle of a line: the file offset after the last
+    complete line is kept, and an incomplete line is parsed at a later call, once it is complete. If the file is
+    replaced or becomes shorter than the offset (e.g. the model has been started again), it is followed again from
+    the start.
+
+    - filename: the output file.
+    - names: list of the column names, or None until the header line has been written.
+    - offset: file offset after the last line parsed.
+
+    :param filename: string containing a relative or absolute reference to the output file.
+    :param max_bytes: largest number of bytes read by each call to read_new_rows() [default: 64 MB], so that the
+      memory used is bounded even when the file has grown a lot since the previous call.
+    """
+
+    def __init__(self, filename, max_bytes=64 * 1024 ** 2):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.names = None
+        self.offset = 0
+        self._identity = None
+
+    def read_new_rows(self):
+        """
+        Return the rows appended since the previous call, as a tuple (restarted, rows): restarted is True if the file
+        has been replaced or truncated since the previous call, in which case rows holds the rows from its start, and
+        rows is a 2D array with one row per line (with no rows if there is no new complete line).
+        """
+        restarted = False
+        try:
+            status = os.stat(self.filename)
+        except OSError:
+            return restarted, self._no_rows()
+        identity = (status.st_dev, status.st_ino)
+        if (self._identity is not None and identity != self._identity) or status.st_size < self.offset:
+            self.names = None
+            self.offset = 0
+            restarted = True
+        self._identity = identity
+        if status.st_size == self.offset:
+            return restarted, self._no_rows()
+
+        with open(self.filename, 'rb') as output_file:
+            output_file.seek(self.offset)
+            contents = output_file.read(min(status.st_size - self.offset, self.max_bytes))
+        end = contents.rfind(b'\n')
+        if end < 0:
+            # Not even one complete line yet
+            return restarted, self._no_rows()
+        contents = contents[:end + 1]
+        self.offset += end + 1
+        if self.names is None:
+            header, _, contents = contents.partition(b'\n')
+            self.names = header.decode('ascii').split()
+        return restarted, self._parse_rows(contents)
+
+    def _no_rows(self):
+        return np.empty((0, len(self.names) if self.names is not None else 0))
+
+    def _parse_rows(self, contents):
+        # Parse complete lines of values into a 2D array.
+        numberOfColumns = len(self.names)
+        lines = [line for line in contents.split(b'\n') if line.strip()]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            flat = np.fromstring(contents.decode('ascii'), sep=' ')
+        if flat.size != len(lines) * numberOfColumns:
+            # Some values are not read by np.fromstring (e.g. NaN), or some line has a different number of values
+            tokens = contents.split()
+            if len(tokens) != len(lines) * numberOfColumns:
+                raise ValueError('atchem2_output: expected ' + str(numberOfColumns) + ' values in each new line of ' +
+                                 self.filename)
+            flat = np.array([float(token) for token in tokens])
+        return flat.reshape((len(lines), numberOfColumns))
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("[!] Please provide the model output directory as an argument.")
+        sys.exit(1)
+    output_dir = sys.argv[1]
+    filenames = [os.path.join(output_dir, x) for x in output_filenames]
+    reaction_rates_dir = os.path.join(output_dir, 'reactionRates')
+    if os.path.isdir(reaction_rates_dir):
+        filenames.extend(sorted(os.path.join(reaction_rates_dir, x) for x in os.listdir(reaction_rates_dir)
+                                if not x.startswith('.')))
+    for filename in filenames:
+        if not os.path.isfile(filename):
+            continue
+        start = timer()
+        table = load_output(filename)
+        print(filename + ': ' + str(len(table)) + ' rows, ' + str(len(table.names)) + ' columns (' +
+              '%.3f' % (timer() - start) + ' s)')
+
+
+if __name__ == '__main__':
+    main()
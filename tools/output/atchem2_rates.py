@@ -0,0 +1,309 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script stores the production and loss rates of the AtChem2
+# model output (productionRates.output, lossRates.output and the files
+# in reactionRates/) in an SQLite database, and queries them. The
+# database is written to the model output directory
+# (atchem2_rates.sqlite), and it is updated automatically whenever the
+# size or the modification time of the output files have changed.
+#
+# In the database, the species names and the reaction strings are
+# stored only once, in the tables species and reactions, and the rates
+# are stored by number in the following tables, with indices by
+# species and time, and by reaction and time:
+# - rates: time, species, reaction, kind (0 = loss, 1 = production), rate
+# - reaction_rates: time, reaction, rate (from reactionRates/)
+# - times: the times of the rows of rates
+#
+# ARGUMENTS:
+# - command: one of
+#   - ingest: create or update the database
+#   - top: print the largest production or loss rates of a species at
+#     a given time [default: the last time]
+#   - series: print the time series of the total production or loss
+#     rate of a species, or of the rate of one of its reactions
+# - directory with the model output
+# - name of the species (top and series only)
+#
+# OPTIONS:
+# - --production, --loss: query the production or the loss rates [default: loss]
+# - --time T: time of the top query (the nearest output time is used)
+# - -n N: number of rates of the top query [default: 10]
+# - --reaction N: number of the reaction of the series query
+# - --database FILE: path to the database [default: atchem2_rates.sqlite
+#   in the model output directory]
+# - --force: ingest the output files even if they have not changed
+#
+# USAGE:
+#   python ./tools/output/atchem2_rates.py top ./model/output/ OH --loss --time 43200 -n 10
+#   python ./tools/output/atchem2_rates.py series ./model/output/ O3 --production --reaction 12
+# ---------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import argparse
+import sqlite3
+
+database_filename = 'atchem2_rates.sqlite'
+rate_filenames = ['lossRates.output', 'productionRates.output']
+loss, production = 0, 1
+
+schema = """
+CREATE TABLE IF NOT EXISTS sources (filename TEXT PRIMARY KEY, size INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS species (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS reactions (id INTEGER PRIMARY KEY, reaction TEXT);
+CREATE TABLE IF NOT EXISTS times (time REAL PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS rates (time REAL, species INTEGER, reaction INTEGER, kind INTEGER, rate REAL);
+CREATE TABLE IF NOT EXISTS reaction_rates (time REAL, reaction INTEGER, rate REAL);
+"""
+
+indices = """
+CREATE INDEX IF NOT EXISTS rates_by_species ON rates (species, kind, time);
+CREATE INDEX IF NOT EXISTS rates_by_reaction ON rates (species, kind, reaction, time);
+CREATE INDEX IF NOT EXISTS reaction_rates_by_time ON reaction_rates (time);
+CREATE INDEX IF NOT EXISTS reaction_rates_by_reaction ON reaction_rates (reaction, time);
+"""
+
+
+## ------------------------------------------------------------------ ##
+
+
+def _source_files(output_dir):
+    # Return the list of the output files stored in the database, relative to output_dir.
+    filenames = [x for x in rate_filenames if os.path.isfile(os.path.join(output_dir, x))]
+    reaction_rates_dir = os.path.join(output_dir, 'reactionRates')
+    if os.path.isdir(reaction_rates_dir):
+        filenames.extend(sorted(os.path.join('reactionRates', x) for x in os.listdir(reaction_rates_dir)
+                                if not x.startswith('.')))
+    return filenames
+
+
+def _source_stamps(output_dir):
+    # Return the set of (filename, size, modification time) of the output files.
+    stamps = set()
+    for filename in _source_files(output_dir):
+        status = os.stat(os.path.join(output_dir, filename))
+        stamps.add((filename, status.st_size, status.st_mtime))
+    return stamps
+
+
+def is_up_to_date(connection, output_dir):
+    """
+    This function checks whether the database holds the current contents of the output files.
+
+    :param connection: sqlite3 connection to the database.
+    :param output_dir: string containing a relative or absolute reference to the model output directory.
+    :returns: True if none of the output files has been added, removed or changed since they were stored.
+    """
+    try:
+        stored = set(connection.execute('SELECT filename, size, mtime FROM sources'))
+    except sqlite3.OperationalError:
+        return False
+    return stored == _source_stamps(output_dir)
+
+
+def _read_rates(filename, kind, species, reactions, times):
+    # Yield the rows of the rates table from productionRates.output or lossRates.output, adding the species names and
+    # reaction strings to the dictionaries species and reactions, and the times to the set times.
+    with open(filename, 'r') as rates_file:
+        next(rates_file, None)
+        for line in rates_file:
+            fields = line.split(None, 5)
+            if not fields:
+                continue
+            time = float(fields[0])
+            speciesNumber = int(fields[1])
+            reactionNumber = int(fields[3])
+            if speciesNumber not in species:
+                species[speciesNumber] = fields[2]
+            if reactionNumber not in reactions:
+                reactions[reactionNumber] = fields[5].strip() if len(fields) > 5 else ''
+            times.add(time)
+            yield (time, speciesNumber, reactionNumber, kind, float(fields[4]))
+
+
+def _read_reaction_rates(filename, time):
+    # Yield the rows of the reaction_rates table from a file in reactionRates/.
+    with open(filename, 'r') as rates_file:
+        next(rates_file, None)
+        for line in rates_file:
+            fields = line.split()
+            if fields:
+                yield (time, int(fields[0]), float(fields[1]))
+
+
+def ingest(connection, output_dir):
+    """
+    This function stores the production and loss rates of the output files in the database, replacing anything that
+    it held before. The indices are built after all the rows have been inserted, which is much faster than keeping
+    them up to date row by row.
+
+    :param connection: sqlite3 connection to the database.
+    :param output_dir: string containing a relative or absolute reference to the model output directory.
+    """
+    stamps = _source_stamps(output_dir)
+    connection.execute('PRAGMA journal_mode = OFF')
+    connection.execute('PRAGMA synchronous = OFF')
+    for table in ['sources', 'species', 'reactions', 'times', 'rates', 'reaction_rates']:
+        connection.execute('DROP TABLE IF EXISTS ' + table)
+    connection.executescript(schema)
+
+    species = dict()
+    reactions = dict()
+    times = set()
+    for kind, filename in [(loss, 'lossRates.output'), (production, 'productionRates.output')]:
+        if os.path.isfile(os.path.join(output_dir, filename)):
+            rows = _read_rates(os.path.join(output_dir, filename), kind, species, reactions, times)
+            connection.executemany('INSERT INTO rates VALUES (?, ?, ?, ?, ?)', rows)
+    for filename in _source_files(output_dir):
+        if filename.startswith('reactionRates'):
+            rows = _read_reaction_rates(os.path.join(output_dir, filename), float(os.path.basename(filename)))
+            connection.executemany('INSERT INTO reaction_rates VALUES (?, ?, ?)', rows)
+
+    connection.executemany('INSERT INTO species VALUES (?, ?)', sorted(species.items()))
+    connection.executemany('INSERT INTO reactions VALUES (?, ?)', sorted(reactions.items()))
+    connection.executemany('INSERT INTO times VALUES (?)', [(x,) for x in sorted(times)])
+    connection.executescript(indices)
+    connection.executemany('INSERT INTO sources VALUES (?, ?, ?)', sorted(stamps))
+    connection.commit()
+
+
+def open_database(output_dir, database=None, force=False):
+    """
+    This function opens the database of the model output directory, and ingests the output files first if the
+    database is missing or out of date.
+
+    :param output_dir: string containing a relative or absolute reference to the model output directory.
+    :param database: path to the database [default: atchem2_rates.sqlite in output_dir].
+    :param force: if True, ingest the output files even if the database is up to date.
+    :returns: sqlite3 connection to the database.
+    """
+    if database is None:
+        database = os.path.join(output_dir, database_filename)
+    connection = sqlite3.connect(database)
+    if force or not is_up_to_date(connection, output_dir):
+        ingest(connection, output_dir)
+    return connection
+
+
+def species_number(connection, name):
+    """
+    This function returns the number of a species from its name, or raises a ValueError if it is not in the database.
+    """
+    row = connection.execute('SELECT id FROM species WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        raise ValueError('Species ' + name + ' is not in the production and loss rates.')
+    return row[0]
+
+
+def nearest_time(connection, time=None):
+    """
+    This function returns the output time that is nearest to time, or the last output time if time is None.
+    """
+    if time is None:
+        return connection.execute('SELECT max(time) FROM times').fetchone()[0]
+    # The two candidates are the times on either side of time: both are found with the primary key
+    candidates = [row[0] for row in connection.execute(
+        'SELECT * FROM (SELECT time FROM times WHERE time <= ? ORDER BY time DESC LIMIT 1) '
+        'UNION ALL SELECT * FROM (SELECT time FROM times WHERE time >= ? ORDER BY time LIMIT 1)', (time, time))]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda x: abs(x - time))
+
+
+def top_rates(connection, species, kind, time, n=10):
+    """
+    This function returns the largest production or loss rates of a species at a given time.
+
+    :param connection: sqlite3 connection to the database.
+    :param species: name of the species.
+    :param kind: loss (0) or production (1).
+    :param time: one of the output times (see nearest_time()).
+    :param n: number of rates.
+    :returns: list of (reactionNumber, rate, reaction string) tuples, largest rate first.
+    """
+    return connection.execute(
+        'SELECT rates.reaction, rates.rate, reactions.reaction FROM rates JOIN reactions ON reactions.id = rates.reaction '
+        'WHERE rates.species = ? AND rates.kind = ? AND rates.time = ? ORDER BY abs(rates.rate) DESC LIMIT ?',
+        (species_number(connection, species), kind, time, n)).fetchall()
+
+
+def rate_series(connection, species, kind, reaction=None):
+    """
+    This function returns the time series of the total production or loss rate of a species, or of the rate of one of
+    its reactions.
+
+    :param connection: sqlite3 connection to the database.
+    :param species: name of the species.
+    :param kind: loss (0) or production (1).
+    :param reaction: number of the reaction [default: None, i.e. the sum of all the reactions].
+    :returns: list of (time, rate) tuples, in order of time.
+    """
+    number = species_number(connection, species)
+    if reaction is None:
+        return connection.execute('SELECT time, sum(rate) FROM rates WHERE species = ? AND kind = ? '
+                                  'GROUP BY time ORDER BY time', (number, kind)).fetchall()
+    return connection.execute('SELECT time, rate FROM rates WHERE species = ? AND kind = ? AND reaction = ? '
+                              'ORDER BY time', (number, kind, reaction)).fetchall()
+
+
+## ------------------------------------------------------------------ ##
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store and query the production and loss rates of the AtChem2 model output.')
+    parser.add_argument('command', choices=['ingest', 'top', 'series'], help='what to do')
+    parser.add_argument('output_dir', help='directory with the model output')
+    parser.add_argument('species', nargs='?', help='name of the species (top and series only)')
+    parser.add_argument('--production', dest='kind', action='store_const', const=production, default=loss,
+                        help='query the production rates')
+    parser.add_argument('--loss', dest='kind', action='store_const', const=loss,
+                        help='query the loss rates [default]')
+    parser.add_argument('--time', type=float, help='time of the top query [default: the last time]')
+    parser.add_argument('-n', type=int, default=10, help='number of rates of the top query [default: 10]')
+    parser.add_argument('--reaction', type=int, help='number of the reaction of the series query [default: all]')
+    parser.add_argument('--database', help='path to the database [default: atchem2_rates.sqlite in output_dir]')
+    parser.add_argument('--force', action='store_true', help='ingest the output files even if they have not changed')
+    args = parser.parse_args()
+
+    assert os.path.isdir(args.output_dir), 'Failed to find directory ' + args.output_dir
+    assert args.command == 'ingest' or args.species is not None, 'Please enter the name of the species.'
+    connection = open_database(args.output_dir, args.database, force=args.force)
+    kind_name = 'production' if args.kind == production else 'loss'
+
+    try:
+        if args.command == 'ingest':
+            counts = [connection.execute('SELECT count(*) FROM ' + table).fetchone()[0]
+                      for table in ['species', 'reactions', 'times', 'rates', 'reaction_rates']]
+            print('Stored ' + str(counts[3]) + ' production and loss rates of ' + str(counts[0]) + ' species in ' +
+                  str(counts[1]) + ' reactions at ' + str(counts[2]) + ' times, and ' + str(counts[4]) +
+                  ' reaction rates')
+        elif args.command == 'top':
+            time = nearest_time(connection, args.time)
+            rows = top_rates(connection, args.species, args.kind, time, args.n)
+            print('Largest ' + kind_name + ' rates of ' + args.species + ' at t = ' + str(time) + ':')
+            for reactionNumber, rate, reaction in rows:
+                print('%8d %15.6E  %s' % (reactionNumber, rate, reaction))
+        else:
+            rows = rate_series(connection, args.species, args.kind, args.reaction)
+            print('%15s %15s' % ('time', kind_name))
+            for time, rate in rows:
+                print('%15.6E %15.6E' % (time, rate))
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
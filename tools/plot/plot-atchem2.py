@@ -0,0 +1,359 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+## Plotting tool for the AtChem2 model output
+## --> version for Python [requires numpy & matplotlib]
+##
+## Acknowledgements: M. Panagi, M. Fabre'
+##
+## The output files are loaded with tools/output/atchem2_output.py,
+## which caches them in binary form for the next time. Each page of
+## atchem2_output.pdf holds up to 9 plots. With more than one process,
+## the pages are split into chunks, which are rendered in parallel to
+## separate files and then merged into atchem2_output.pdf: this
+## requires either the Python package pypdf, or one of the commands
+## pdfunite or qpdf; otherwise, the pages are rendered in one process.
+##
+## With the option --watch, the output of a running model is followed
+## instead: speciesConcentrations.output, environmentVariables.output
+## and mainSolverParameters.output are read every few seconds, and
+## only the rows appended since the previous time are parsed. The
+## chosen panels (columns of any of these files) are drawn to
+## atchem2_watch.png, which is replaced whenever there are new rows,
+## until the model stops writing or Ctrl-C is pressed. To bound the
+## memory and the time taken to draw the panels, however long the
+## model runs, at most a fixed number of rows of each file is kept,
+## evenly spread over the run, plus the last row.
+##
+## ARGUMENT:
+## - directory with the model output
+##
+## OPTIONS:
+## - --jobs N: number of processes [default: the number of CPUs]
+## - --species NAME [NAME ...]: plot only these species from
+##   speciesConcentrations.output [default: all the species]
+## - --species-file FILE: plot only the species listed in FILE, one
+##   per line (e.g. outputSpecies.config)
+## - --watch: follow the output of a running model
+## - --panels NAME [NAME ...]: columns drawn in watch mode [default:
+##   the species given with --species or --species-file, or the first
+##   6 species, and currentStepSize, NFE and NETF]
+## - --interval SECONDS: time between two reads in watch mode
+##   [default: 10]
+## - --max-points N: rows of each file kept in watch mode
+##   [default: 2000]
+## - --idle-timeout SECONDS: stop watching when the files have not
+##   grown for this long [default: never]
+##
+## USAGE:
+##   python ./tools/plot/plot-atchem2.py ./model/output/
+##   python ./tools/plot/plot-atchem2.py ./model/output/ --jobs 8 --species O3 NO2 OH
+##   python ./tools/plot/plot-atchem2.py ./model/output/ --watch --panels O3 OH TEMP currentStepSize
+## ---------------------------------------------- ##
+from __future__ import print_function
+import os
+import sys
+import time
+import argparse
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output'))
+import atchem2_output
+
+input_files = ['speciesConcentrations.output', 'environmentVariables.output',
+               'photolysisRates.output', 'photolysisRatesParameters.output']
+output_file = 'atchem2_output.pdf'
+rows, columns = 3, 3
+
+watch_files = ['speciesConcentrations.output', 'environmentVariables.output', 'mainSolverParameters.output']
+watch_output_file = 'atchem2_watch.png'
+default_watch_panels = ['currentStepSize', 'NFE', 'NETF']
+
+## ---------------------------- ##
+
+def list_pages(output_dir, species=None):
+    # Return the pages of atchem2_output.pdf, as a list of tuples
+    # (input_file, column names), with up to rows*columns columns on
+    # each page. The first column (time) of each input file is on the
+    # x-axis of all its plots. If species is not None, only these
+    # columns of speciesConcentrations.output are plotted.
+    pages = []
+    for input_file in input_files:
+        names = atchem2_output.load_output(os.path.join(output_dir, input_file)).names[1:]
+        if species is not None and input_file == 'speciesConcentrations.output':
+            missing = [x for x in species if x not in names]
+            if missing:
+                print("[!] Species not in " + input_file + ": " + ' '.join(missing))
+            names = [x for x in names if x in set(species)]
+        for i in range(0, len(names), rows * columns):
+            pages.append((input_file, names[i:i + rows * columns]))
+    return pages
+
+def render_pages(output_dir, pages, pdf_filename):
+    # Render the pages to pdf_filename. Each input file is loaded
+    # (memory-mapped from its cache) only once, and the layout of each
+    # page is computed once all its plots are drawn.
+    tables = dict()
+    with PdfPages(pdf_filename) as pdf:
+        for input_file, names in pages:
+            if input_file not in tables:
+                tables[input_file] = atchem2_output.load_output(os.path.join(output_dir, input_file))
+            table = tables[input_file]
+            time = table.values[:, 0]
+            fig, axs = plt.subplots(nrows=rows, ncols=columns, figsize=(11, 7))
+            axs = axs.ravel()
+            for ax, name in zip(axs, names):
+                ax.plot(time, table[name], linestyle='-', color='black')
+                ax.set(title=name, xlabel='seconds', ylabel='')
+                ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: '%.1e' % x))
+            for ax in axs[len(names):]:
+                ax.axis('off')
+            fig.tight_layout()
+            pdf.savefig(fig)
+            plt.close(fig)
+
+def _render_chunk(task):
+    # Render a chunk of pages in a process of the pool.
+    output_dir, pages, pdf_filename = task
+    render_pages(output_dir, pages, pdf_filename)
+    return pdf_filename
+
+def _find_command(command):
+    # Return True if command is an executable file in the PATH.
+    return any(os.access(os.path.join(path, command), os.X_OK)
+               for path in os.environ.get('PATH', '').split(os.pathsep))
+
+def pdf_merger():
+    # Return a function which merges a list of PDF files into one,
+    # using pypdf, pdfunite or qpdf, or None if none is available.
+    try:
+        from pypdf import PdfWriter
+        def merge(pdf_filenames, merged_filename):
+            writer = PdfWriter()
+            for pdf_filename in pdf_filenames:
+                writer.append(pdf_filename)
+            with open(merged_filename, 'wb') as merged_file:
+                writer.write(merged_file)
+        return merge
+    except ImportError:
+        pass
+    if _find_command('pdfunite'):
+        return lambda pdf_filenames, merged_filename: \
+            subprocess.check_call(['pdfunite'] + pdf_filenames + [merged_filename])
+    if _find_command('qpdf'):
+        return lambda pdf_filenames, merged_filename: \
+            subprocess.check_call(['qpdf', '--empty', '--pages'] + pdf_filenames + ['--', merged_filename])
+    return None
+
+def plot_output(output_dir, jobs=1, species=None):
+    # Write atchem2_output.pdf in output_dir, using jobs processes.
+    pages = list_pages(output_dir, species)
+    pdf_filename = os.path.join(output_dir, output_file)
+    merge = pdf_merger() if jobs > 1 and len(pages) > 1 else None
+    if merge is None:
+        if jobs > 1 and len(pages) > 1:
+            print("[!] pypdf, pdfunite or qpdf are needed to merge the pages rendered in parallel: using one process.")
+        render_pages(output_dir, pages, pdf_filename)
+        return
+
+    # Split the pages into a few chunks for each process, so that the
+    # processes which finish early can take on another chunk
+    chunk_size = max(1, -(-len(pages) // (4 * jobs)))
+    work_dir = tempfile.mkdtemp(dir=output_dir)
+    try:
+        tasks = [(output_dir, pages[i:i + chunk_size], os.path.join(work_dir, '%06d.pdf' % i))
+                 for i in range(0, len(pages), chunk_size)]
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        try:
+            chunk_filenames = pool.map(_render_chunk, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        merge(chunk_filenames, pdf_filename)
+    finally:
+        shutil.rmtree(work_dir)
+
+## ---------------------------- ##
+
+class WatchedFile(object):
+    # An output file followed while the model is running, of which
+    # only the time and the columns of the panels are kept. At most
+    # max_points rows are kept: when there are more, every other row
+    # is dropped, and from then on only one new row in twice as many
+    # is kept, so that the rows are evenly spread over the run. The
+    # last row read is kept apart, so that the panels always go up to
+    # the latest time.
+
+    def __init__(self, filename, max_points):
+        self.follower = atchem2_output.OutputFollower(filename)
+        self.max_points = max_points
+        self.columns = None
+        self.clear()
+
+    def clear(self):
+        self.rows = None
+        self.last = None
+        self.stride = 1
+        self.count = 0
+
+    def update(self, panels):
+        # Read the new rows, and return True if there were any.
+        restarted, rows = self.follower.read_new_rows()
+        if restarted:
+            self.columns = None
+            self.clear()
+        names = self.follower.names
+        if names is None or len(rows) == 0:
+            return restarted
+        if self.columns is None:
+            self.columns = [x for x in panels if x in names[1:]]
+            self.indices = [0] + [names.index(x) for x in self.columns]
+            self.rows = np.empty((0, len(self.indices)))
+        rows = rows[:, self.indices]
+        self.last = rows[-1]
+        kept = rows[(self.count + np.arange(len(rows))) % self.stride == 0]
+        self.count += len(rows)
+        self.rows = np.concatenate((self.rows, kept))
+        while len(self.rows) > self.max_points:
+            self.rows = self.rows[::2]
+            self.stride *= 2
+        return True
+
+    def series(self, name):
+        # Return the time and the values of a column, up to the last row.
+        rows = self.rows
+        if len(rows) == 0 or rows[-1, 0] != self.last[0]:
+            rows = np.concatenate((rows, self.last[np.newaxis]))
+        i = self.columns.index(name) + 1
+        return rows[:, 0], rows[:, i]
+
+def draw_watch(fig, axs, files, panels, filename):
+    # Draw each panel from the first file which has its column, and
+    # replace filename with the figure.
+    latest = None
+    for ax, name in zip(axs, panels):
+        ax.clear()
+        ax.set(title=name, xlabel='seconds', ylabel='')
+        for watched in files:
+            if watched.columns is not None and name in watched.columns:
+                x, y = watched.series(name)
+                ax.plot(x, y, linestyle='-', color='black')
+                ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda v, _: '%.1e' % v))
+                latest = x[-1] if latest is None else max(latest, x[-1])
+                break
+    fig.suptitle('model output up to t = %g s' % latest if latest is not None else 'waiting for the model output')
+    fig.tight_layout(rect=(0, 0, 1, 0.95))
+    # Write to a temporary file first, so that the image is never seen half-written
+    root, extension = os.path.splitext(filename)
+    fig.savefig(root + '.tmp' + extension)
+    os.rename(root + '.tmp' + extension, filename)
+
+def read_header(filename):
+    # Return the column names of an output file, or None if its header
+    # line has not been written yet.
+    try:
+        with open(filename, 'r') as output_file:
+            line = output_file.readline()
+    except (IOError, OSError):
+        return None
+    return line.split() if line.endswith('\n') else None
+
+def watch_output(output_dir, panels=None, species=None, interval=10.0, max_points=2000, idle_timeout=None):
+    # Follow the output files of a running model, and draw the panels
+    # to atchem2_watch.png in output_dir whenever they have new rows.
+    files = [WatchedFile(os.path.join(output_dir, x), max_points) for x in watch_files]
+    filename = os.path.join(output_dir, watch_output_file)
+    fig = None
+    last_change = time.time()
+    try:
+        if panels is None:
+            # The default panels are the species, or the first species of speciesConcentrations.output
+            if not species:
+                header = read_header(files[0].follower.filename)
+                while header is None:
+                    time.sleep(interval)
+                    header = read_header(files[0].follower.filename)
+                species = header[1:7]
+            panels = species + default_watch_panels
+        ncols = min(len(panels), columns)
+        nrows = -(-len(panels) // ncols)
+        fig, axs = plt.subplots(nrows=nrows, ncols=ncols, figsize=(11, 2.5 * nrows + 1), squeeze=False)
+        axs = axs.ravel()
+        for ax in axs[len(panels):]:
+            ax.axis('off')
+        first = True
+        while True:
+            changed = [watched.update(panels) for watched in files]
+            if first or any(changed):
+                first = False
+                draw_watch(fig, axs, files, panels, filename)
+                rows = ', '.join('%s %d' % (os.path.basename(w.follower.filename), w.count) for w in files)
+                print('[' + time.strftime('%H:%M:%S') + '] rows read: ' + rows)
+            if any(changed):
+                last_change = time.time()
+            elif idle_timeout is not None and time.time() - last_change > idle_timeout:
+                print('No new rows for ' + '%g' % idle_timeout + ' s: stopped watching.')
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if fig is not None:
+            plt.close(fig)
+    missing = [x for x in panels or [] if not any(w.columns is not None and x in w.columns for w in files)]
+    if missing:
+        print("[!] Not in the output files: " + ' '.join(missing))
+
+## ---------------------------- ##
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot the AtChem2 model output to atchem2_output.pdf.')
+    parser.add_argument('output_dir', help='directory with the model output')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                        help='number of processes [default: the number of CPUs]')
+    parser.add_argument('--species', nargs='+',
+                        help='plot only these species from speciesConcentrations.output [default: all the species]')
+    parser.add_argument('--species-file',
+                        help='plot only the species listed in this file, one per line (e.g. outputSpecies.config)')
+    parser.add_argument('--watch', action='store_true', help='follow the output of a running model')
+    parser.add_argument('--panels', nargs='+',
+                        help='columns drawn in watch mode [default: the species, and ' +
+                        ', '.join(default_watch_panels) + ']')
+    parser.add_argument('--interval', type=float, default=10.0,
+                        help='time between two reads in watch mode, in seconds [default: 10]')
+    parser.add_argument('--max-points', type=int, default=2000,
+                        help='rows of each file kept in watch mode [default: 2000]')
+    parser.add_argument('--idle-timeout', type=float,
+                        help='stop watching when the files have not grown for this long, in seconds [default: never]')
+    args = parser.parse_args()
+
+    species = args.species
+    if args.species_file is not None:
+        with open(args.species_file, 'r') as species_file:
+            species = (species or []) + [line.split()[0] for line in species_file if line.strip()]
+
+    if args.watch:
+        watch_output(args.output_dir, panels=args.panels, species=species, interval=args.interval,
+                     max_points=max(args.max_points, 2), idle_timeout=args.idle_timeout)
+        return
+
+    plot_output(args.output_dir, jobs=max(args.jobs, 1), species=species)
+    print("\n==> " + output_file + " created in directory:", args.output_dir, "\n")
+
+if __name__ == '__main__':
+    main()